@@ -1,7 +1,17 @@
+import ntpath
+import os
 import subprocess
-from typing import Dict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
 
+from change_plan import PlannedChange, item_id, parse_module_arguments, print_plan
+from checkpoint import get_checkpoint
 from config_service import setup_logging, read_config_file, logging
+from metrics import instrument
+from path_patterns import is_pattern, pattern_options, walk_patterns
+from powershell_host import PowerShellRunner, register_read_only_command, run_powershell
+from reconcile import Allowlist, log_reconcile, reconcile_sets
+from registry_backend import HKEY_LOCAL_MACHINE, RegistryBackend, get_default_registry
+from undo_journal import get_journal
 
 CONFIG_FILE = "config.json"
 
@@ -19,32 +29,243 @@ CHECK_CMDLETS = {
     "Process": "Get-MpPreference | Select-Object -ExpandProperty ExclusionProcess"
 }
 
+# The registry keys Defender stores the exclusions of every type under.
+EXCLUSION_KEYS = {
+    "Folder": r"SOFTWARE\Microsoft\Windows Defender\Exclusions\Paths",
+    "File": r"SOFTWARE\Microsoft\Windows Defender\Exclusions\Paths",
+    "FileType": r"SOFTWARE\Microsoft\Windows Defender\Exclusions\Extensions",
+    "Process": r"SOFTWARE\Microsoft\Windows Defender\Exclusions\Processes"
+}
+
+PREFERENCE_PROPERTIES = {
+    "Folder": "ExclusionPath",
+    "File": "ExclusionPath",
+    "FileType": "ExclusionExtension",
+    "Process": "ExclusionProcess"
+}
+
+# The exclusion types whose wildcard entries are expanded by walking the file system, with whether they match
+# directories and files.
+PATTERN_TYPES = {
+    "Folder": {"include_directories": True, "include_files": False},
+    "File": {"include_directories": False, "include_files": True}
+}
+
+SNAPSHOT_CMDLET = (
+    "$p = Get-MpPreference; "
+    "foreach ($n in 'ExclusionPath','ExclusionExtension','ExclusionProcess') "
+    "{ foreach ($v in $p.$n) { $n + [char]9 + $v } }"
+)
+
+for read_only_command in [SNAPSHOT_CMDLET, *CHECK_CMDLETS.values()]:
+    register_read_only_command(read_only_command)
+
+
+def describe_error(error: subprocess.SubprocessError) -> str:
+    """
+    Extracts a readable message from a failed or timed-out PowerShell command.
+
+    Parameters:
+    - error (subprocess.SubprocessError): The error raised by the command runner.
+
+    Returns:
+    - str: The error output of the command, or the error itself when no output was captured.
+    """
+    return (getattr(error, "stderr", None) or str(error)).strip()
+
+
+def quote_powershell_literal(value: str) -> str:
+    """
+    Quotes a value as a PowerShell single-quoted string literal, doubling any embedded single quotes.
+
+    Parameters:
+    - value (str): The value to quote.
+
+    Returns:
+    - str: The quoted literal.
+    """
+    return "'" + value.replace("'", "''") + "'"
+
+
+def normalize_exclusion(property_name: str, value: str) -> str:
+    """
+    Converts an exclusion to the form Defender compares it in, so the same exclusion written differently is recognized
+    as one: paths are expanded, get Windows separators and lose '.' segments and trailing separators, extensions lose
+    a leading '*' or '.', and everything is lower-cased.
+
+    Parameters:
+    - property_name (str): The preference property, e.g. 'ExclusionPath'.
+    - value (str): The path, extension or process as configured or reported by 'Get-MpPreference'.
+
+    Returns:
+    - str: The normalized value.
+    """
+    value = value.strip()
+    if property_name == "ExclusionExtension":
+        return value.lstrip("*.").lower()
+    if property_name == "ExclusionPath" or "\\" in value or "/" in value:
+        return ntpath.normpath(os.path.expandvars(value)).lower()
+    return value.lower()
+
+
+def read_exclusion_state(runner: PowerShellRunner = run_powershell) -> Dict[str, Dict[str, str]]:
+    """
+    Reads every Windows Defender exclusion (paths, extensions and processes) with a single 'Get-MpPreference' call.
+
+    Parameters:
+    - runner (PowerShellRunner): The callable used to execute the PowerShell command.
+
+    Returns:
+    - Dict[str, Dict[str, str]]: A mapping of 'ExclusionPath', 'ExclusionExtension' and 'ExclusionProcess' to the
+      values currently excluded, as Defender reports them, keyed by their normalized form.
+    """
+    state: Dict[str, Dict[str, str]] = {name: {} for name in set(PREFERENCE_PROPERTIES.values())}
+    with instrument("defender.snapshot"):
+        output = runner(SNAPSHOT_CMDLET)
+    for line in output.splitlines():
+        name, separator, value = line.partition("\t")
+        if separator and name in state and value.strip():
+            state[name].setdefault(normalize_exclusion(name, value), value.strip())
+    return state
+
 
-def is_excluded(exclusion_type: str, path: str) -> bool:
+def read_exclusion_snapshot(runner: PowerShellRunner = run_powershell) -> Dict[str, Set[str]]:
+    """
+    Reads every Windows Defender exclusion (paths, extensions and processes) with a single 'Get-MpPreference' call and
+    returns them as sets of normalized values keyed by the preference property name.
+
+    Parameters:
+    - runner (PowerShellRunner): The callable used to execute the PowerShell command.
+
+    Returns:
+    - Dict[str, Set[str]]: A mapping of 'ExclusionPath', 'ExclusionExtension' and 'ExclusionProcess' to the values
+      currently excluded, as returned by `normalize_exclusion`.
+    """
+    return {name: set(values) for name, values in read_exclusion_state(runner).items()}
+
+
+def expand_exclusions(exclusions: List[Dict[str, str]],
+                      options: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, str]]:
+    """
+    Lazily yields the configured exclusions with wildcard 'Folder' and 'File' entries replaced by one entry per
+    matching path. Literal entries are yielded first, unchanged; the wildcard entries of each type are then walked in
+    parallel and their matches yielded as soon as they are found.
+
+    Parameters:
+    - exclusions (List[Dict[str, str]]): The configured exclusions, each with a 'type' and a 'path' key.
+    - options (Optional[Dict[str, Any]]): The pattern settings of the section, as returned by `pattern_options`.
+
+    Returns:
+    - Iterator[Dict[str, str]]: The exclusions with the wildcard entries expanded.
+    """
+    patterns: Dict[str, List[str]] = {}
+    for exclusion in exclusions:
+        exclusion_type = exclusion.get('type')
+        path = exclusion.get('path') or ''
+        if exclusion_type in PATTERN_TYPES and is_pattern(path, (options or {}).get("brackets", False)):
+            patterns.setdefault(exclusion_type, []).append(path)
+        else:
+            yield exclusion
+    for exclusion_type, type_patterns in patterns.items():
+        for path in walk_patterns(type_patterns, **PATTERN_TYPES[exclusion_type], **(options or {})):
+            yield {'type': exclusion_type, 'path': path}
+
+
+def compute_missing_exclusions(exclusions: List[Dict[str, str]], snapshot: Dict[str, Set[str]],
+                               options: Optional[Dict[str, Any]] = None) -> Dict[str, List[str]]:
+    """
+    Compares the configured exclusions against a snapshot of the current Defender preferences and returns the ones that
+    still have to be added, grouped by preference property. Unknown exclusion types are logged and ignored, and
+    duplicate entries are collapsed while preserving their configuration order. Wildcard 'Folder' and 'File' entries
+    are expanded by walking the file system, and each match is compared as it is found.
+
+    Parameters:
+    - exclusions (List[Dict[str, str]]): The configured exclusions, each with a 'type' and a 'path' key.
+    - snapshot (Dict[str, Set[str]]): The current exclusions as returned by `read_exclusion_snapshot`.
+    - options (Optional[Dict[str, Any]]): The pattern settings of the section, as returned by `pattern_options`.
+
+    Returns:
+    - Dict[str, List[str]]: A mapping of preference property names to the values that are not excluded yet.
+    """
+    missing = {}
+    pending_keys: Dict[str, Set[str]] = {}
+    for exclusion in expand_exclusions(exclusions, options):
+        exclusion_type = exclusion.get('type')
+        path = exclusion.get('path')
+        property_name = PREFERENCE_PROPERTIES.get(exclusion_type)
+        if property_name is None:
+            logging.error(f"Invalid exclusion type '{exclusion_type}' for exclusion: {path}. Skipping...")
+            continue
+        key = normalize_exclusion(property_name, path)
+        if key in snapshot.get(property_name, set()):
+            logging.info(f"{exclusion_type} exclusion is already present: {path}")
+            continue
+        keys = pending_keys.setdefault(property_name, set())
+        if key not in keys:
+            keys.add(key)
+            missing.setdefault(property_name, []).append(path)
+    return missing
+
+
+def apply_missing_exclusions(missing: Dict[str, List[str]], runner: PowerShellRunner = run_powershell) -> bool:
+    """
+    Adds the pending exclusions to Windows Defender with one batched 'Add-MpPreference' call per preference property.
+    Logs the outcome of every batch, including any errors reported by PowerShell.
+
+    Parameters:
+    - missing (Dict[str, List[str]]): The pending exclusions as returned by `compute_missing_exclusions`.
+    - runner (PowerShellRunner): The callable used to execute the PowerShell commands.
+
+    Returns:
+    - bool: True if every batch succeeded.
+    """
+    succeeded = True
+    for property_name, values in missing.items():
+        if not values:
+            continue
+        cmd = f"Add-MpPreference -{property_name} " + ",".join(quote_powershell_literal(value) for value in values)
+        journal = get_journal()
+        for value in values:
+            journal.record("defender", property=property_name, value=value)
+        journal.commit()
+        try:
+            with instrument("defender.add", property_name):
+                runner(cmd)
+            for value in values:
+                logging.info(f"Successfully added {property_name} exclusion: {value}")
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            logging.error(
+                f"Failed to add {property_name} exclusions: {', '.join(values)}. Error: {describe_error(e)}")
+            succeeded = False
+    return succeeded
+
+
+def is_excluded(exclusion_type: str, path: str, runner: PowerShellRunner = run_powershell) -> bool:
     """
     Checks if the specified exclusion (file, folder, file type, or process) is already excluded in Windows Defender.
     This determination is made by invoking PowerShell commands to query the current exclusions within Windows Defender
-    and checking if the specified path or identifier matches any of the existing exclusions.
+    and checking if the specified path or identifier equals one of the existing exclusions once both are normalized,
+    so 'C:\\Dev' does not count as excluded when only 'C:\\Dev2' is.
 
     Parameters:
     - exclusion_type (str): The type of exclusion to check (e.g., "File", "Folder", "FileType", "Process").
     - path (str): The path, extension, or process name to check for exclusion.
+    - runner (PowerShellRunner): The callable used to execute the PowerShell command.
     """
     check_cmdlet = CHECK_CMDLETS[exclusion_type]
     cmd = f"{check_cmdlet}"
+    property_name = PREFERENCE_PROPERTIES[exclusion_type]
     try:
-        result = subprocess.run(["powershell", "-Command", cmd], check=True, capture_output=True, text=True)
-        if path.lower() in result.stdout.lower():
-            return True
-        else:
-            return False
-    except subprocess.CalledProcessError as e:
+        output = runner(cmd)
+        key = normalize_exclusion(property_name, path)
+        return any(normalize_exclusion(property_name, line) == key for line in output.splitlines() if line.strip())
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
         logging.error(
-            f"Failed to check if {exclusion_type} exclusion is already present: {path}. Error: {e.stderr.strip()}")
+            f"Failed to check if {exclusion_type} exclusion is already present: {path}. Error: {describe_error(e)}")
         return False
 
 
-def add_exclusion(exclusion: Dict[str, str]) -> None:
+def add_exclusion(exclusion: Dict[str, str], runner: PowerShellRunner = run_powershell) -> None:
     """
     Adds an exclusion to Windows Defender, using the appropriate PowerShell cmdlet based on the type of exclusion
     (file, folder, file type, or process). Before attempting to add the exclusion, it checks if the exclusion already
@@ -56,45 +277,297 @@ def add_exclusion(exclusion: Dict[str, str]) -> None:
     - exclusion (Dict[str, str]): A dictionary containing the type and path of the exclusion. The 'type' key
       specifies the exclusion type (e.g., "File", "Folder", "FileType", "Process"), and the 'path' key specifies
       the path, extension, or process name to exclude.
+    - runner (PowerShellRunner): The callable used to execute the PowerShell commands.
     """
-    if is_excluded(exclusion['type'], exclusion['path']):
+    if is_excluded(exclusion['type'], exclusion['path'], runner):
         logging.info(f"{exclusion['type']} exclusion is already present: {exclusion['path']}")
         return
 
     cmdlet = CMDLETS[exclusion['type']]
     path = exclusion['path']
-    cmd = f"{cmdlet} '{path}'"
+    cmd = f"{cmdlet} {quote_powershell_literal(path)}"
     try:
-        subprocess.run(["powershell", "-Command", cmd], check=True, capture_output=True, text=True)
+        runner(cmd)
         logging.info(f"Successfully added {exclusion['type']} exclusion: {path}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to add {exclusion['type']} exclusion: {path}. Error: {e.stderr.strip()}")
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logging.error(f"Failed to add {exclusion['type']} exclusion: {path}. Error: {describe_error(e)}")
 
 
-def process_exclusions(exclusions_config: Dict[str, any]) -> None:
+def process_exclusions(exclusions_config: Dict[str, any], runner: PowerShellRunner = run_powershell) -> None:
     """
     Processes a configuration dictionary containing exclusion settings for Windows Defender. If exclusions are enabled
-    in the configuration, iterates through each specified exclusion and attempts to add it using the `add_exclusion`
-    function. Logs an informational message if exclusions are disabled in the configuration.
+    in the configuration, reads the current Defender preferences once, computes which of the specified exclusions are
+    missing and adds them with one batched call per exclusion property. The exclusions of a property are marked as
+    completed in the run's checkpoint once its batch succeeded. Logs an informational message if exclusions are
+    disabled in the configuration.
 
     Parameters:
     - exclusions_config (Dict[str, any]): The configuration for exclusions, including an 'enabled' key that indicates
       whether exclusions should be processed, and an 'exclusions' key containing a list of exclusions to add.
+    - runner (PowerShellRunner): The callable used to execute the PowerShell commands.
+    """
+    if not exclusions_config.get('enabled', False):
+        logging.info("Exclusions are disabled in configuration.")
+        return
+
+    try:
+        snapshot = read_exclusion_snapshot(runner)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logging.error(f"Failed to read the current Defender exclusions. Error: {describe_error(e)}")
+        return
+
+    exclusions = exclusions_config.get('exclusions', [])
+    missing = compute_missing_exclusions(exclusions, snapshot, pattern_options(exclusions_config))
+    ids: Dict[Optional[str], List[str]] = {}
+    for exclusion in exclusions:
+        ids.setdefault(PREFERENCE_PROPERTIES.get(exclusion.get('type')), []).append(item_id(exclusion))
+    checkpoint = get_checkpoint()
+    # Entries of unknown types and properties without missing values are done once the comparison is.
+    checkpoint.complete("add_defender_exclusions",
+                        [key for property_name, keys in ids.items() if property_name not in missing for key in keys],
+                        "excluded")
+    for property_name, values in missing.items():
+        if apply_missing_exclusions({property_name: values}, runner):
+            checkpoint.complete("add_defender_exclusions", ids.get(property_name, []), "excluded")
+
+
+def compute_exclusion_changes(exclusions: List[Dict[str, str]], state: Dict[str, Dict[str, str]],
+                              allowlist: Sequence[str] = (), options: Optional[Dict[str, Any]] = None
+                              ) -> Tuple[Dict[str, List[str]], Dict[str, List[str]], int]:
+    """
+    Compares the configured exclusions with every exclusion Defender currently has, per preference property, as set
+    differences of their normalized forms. Wildcard 'Folder' and 'File' entries are expanded first, and the allowlist
+    is matched against the normalized values of every property.
+
+    Parameters:
+    - exclusions (List[Dict[str, str]]): The configured exclusions, each with a 'type' and a 'path' key.
+    - state (Dict[str, Dict[str, str]]): The current exclusions as returned by `read_exclusion_state`.
+    - allowlist (Sequence[str]): Paths, extensions and processes that are never removed; wildcards are allowed.
+    - options (Optional[Dict[str, Any]]): The pattern settings of the section, as returned by `pattern_options`.
+
+    Returns:
+    - Tuple[Dict[str, List[str]], Dict[str, List[str]], int]: The values to add and the values to remove, keyed by
+      preference property, and the number of unconfigured values kept because of the allowlist.
+    """
+    desired: Dict[str, Dict[str, str]] = {name: {} for name in state}
+    for exclusion in expand_exclusions(exclusions, options):
+        exclusion_type = exclusion.get('type')
+        path = exclusion.get('path')
+        property_name = PREFERENCE_PROPERTIES.get(exclusion_type)
+        if property_name is None:
+            logging.error(f"Invalid exclusion type '{exclusion_type}' for exclusion: {path}. Skipping...")
+            continue
+        if not path:
+            logging.error(f"Received an empty {exclusion_type} exclusion. Skipping...")
+            continue
+        desired.setdefault(property_name, {}).setdefault(normalize_exclusion(property_name, path), path)
+
+    missing, removed, kept = {}, {}, 0
+    for property_name, values in desired.items():
+        property_allowlist = Allowlist(allowlist, lambda entry: normalize_exclusion(property_name, entry))
+        missing[property_name], removed[property_name], property_kept = \
+            reconcile_sets(values, state.get(property_name, {}), property_allowlist)
+        kept += len(property_kept)
+    return missing, removed, kept
+
+
+def remove_exclusions(removed: Dict[str, List[str]], runner: PowerShellRunner = run_powershell) -> None:
+    """
+    Removes exclusions from Windows Defender with one batched 'Remove-MpPreference' call per preference property. Every
+    removed value is recorded in the undo journal first, so a rollback adds it back.
+
+    Parameters:
+    - removed (Dict[str, List[str]]): The values to remove, as reported by 'Get-MpPreference', keyed by property.
+    - runner (PowerShellRunner): The callable used to execute the PowerShell commands.
+    """
+    for property_name, values in removed.items():
+        if not values:
+            continue
+        cmd = f"Remove-MpPreference -{property_name} " + ",".join(quote_powershell_literal(value) for value in values)
+        journal = get_journal()
+        for value in values:
+            journal.record("defender_removed", property=property_name, value=value)
+        journal.commit()
+        try:
+            with instrument("defender.remove", property_name):
+                runner(cmd)
+            for value in values:
+                logging.info(f"Removed unmanaged {property_name} exclusion: {value}")
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            logging.error(
+                f"Failed to remove {property_name} exclusions: {', '.join(values)}. Error: {describe_error(e)}")
+
+
+def reconcile_exclusions(exclusions_config: Dict[str, Any], runner: PowerShellRunner = run_powershell) -> None:
+    """
+    Makes the Defender exclusions match the configuration exactly: reads every current exclusion once, adds the
+    configured ones that are missing and removes the ones the configuration does not list, except those on the
+    section's 'allowlist'. Both additions and removals are batched into one call per preference property, so the cost
+    grows linearly with the number of exclusions. Nothing is changed if the section is disabled.
+
+    Parameters:
+    - exclusions_config (Dict[str, Any]): The 'excludeFromDefender' section of the configuration.
+    - runner (PowerShellRunner): The callable used to execute the PowerShell commands.
     """
     if not exclusions_config.get('enabled', False):
         logging.info("Exclusions are disabled in configuration.")
         return
 
-    for exclusion in exclusions_config.get('exclusions', []):
-        add_exclusion(exclusion)
+    try:
+        state = read_exclusion_state(runner)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logging.error(f"Failed to read the current Defender exclusions. Error: {describe_error(e)}")
+        return
+
+    missing, removed, kept = compute_exclusion_changes(exclusions_config.get('exclusions', []), state,
+                                                       exclusions_config.get('allowlist', []),
+                                                       pattern_options(exclusions_config))
+    log_reconcile("Defender exclusions", sum(map(len, missing.values())), sum(map(len, removed.values())), kept)
+    remove_exclusions(removed, runner)
+    apply_missing_exclusions(missing, runner)
+
+
+def plan_step(section: Dict[str, Any], runner: PowerShellRunner = run_powershell) -> List[PlannedChange]:
+    """
+    Determines, from a single read of the Defender preferences and without adding anything, which of the configured
+    exclusions are missing. A wildcard entry is reported once, with the number of matching paths not excluded yet.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'excludeFromDefender' section of the configuration.
+    - runner (PowerShellRunner): The callable used to execute the PowerShell command.
+
+    Returns:
+    - List[PlannedChange]: One 'add_exclusion' change per missing exclusion.
+    """
+    snapshot = read_exclusion_snapshot(runner)
+    changes = []
+    for exclusion in section["exclusions"]:
+        if exclusion.get('type') in PATTERN_TYPES and is_pattern(exclusion.get('path') or '',
+                                                                 section.get("matchBrackets", False)):
+            missing = compute_missing_exclusions([exclusion], snapshot, pattern_options(section))
+            count = sum(len(values) for values in missing.values())
+            if count:
+                changes.append(PlannedChange("add_defender_exclusions", item_id(exclusion), "add_exclusion",
+                                             f"{count} absent", "present"))
+            continue
+        property_name = PREFERENCE_PROPERTIES.get(exclusion.get('type'))
+        if property_name is not None and \
+                normalize_exclusion(property_name, exclusion.get('path', '')) not in snapshot[property_name]:
+            changes.append(PlannedChange("add_defender_exclusions", item_id(exclusion), "add_exclusion", "absent",
+                                         "present"))
+    return changes
+
+
+def state_validator(exclusion_id: str, registry: Optional[RegistryBackend] = None) -> Optional[str]:
+    """
+    Returns a cheap validator for the state cache: the last write time of the registry key Defender keeps the
+    exclusions of the entry's type under, which changes whenever one of them is added or removed, without starting
+    PowerShell.
+
+    Parameters:
+    - exclusion_id (str): The identifier of the exclusion, 'Type:path'.
+    - registry (Optional[RegistryBackend]): The registry backend to use, by default the Windows registry.
+
+    Returns:
+    - Optional[str]: The validator value, 'missing' if the key does not exist, or None if it cannot be read, e.g.
+      because tamper protection denies access, leaving the TTL as the only expiry.
+    """
+    key_path = EXCLUSION_KEYS.get(exclusion_id.partition(":")[0])
+    if key_path is None:
+        return None
+    try:
+        return str((registry or get_default_registry()).key_last_write(HKEY_LOCAL_MACHINE, key_path))
+    except FileNotFoundError:
+        return "missing"
+    except (OSError, ImportError):
+        return None
+
+
+def inventory_step(section: Dict[str, Any], runner: PowerShellRunner = run_powershell) -> Dict[str, str]:
+    """
+    Captures, from a single read of the Defender preferences, whether each configured exclusion is present. A wildcard
+    entry is captured as 'present' if every matching path is excluded, and as the number of absent matches otherwise.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'excludeFromDefender' section of the configuration.
+    - runner (PowerShellRunner): The callable used to execute the PowerShell command.
+
+    Returns:
+    - Dict[str, str]: 'present', 'absent' or 'N absent', keyed by exclusion identifier.
+    """
+    snapshot = read_exclusion_snapshot(runner)
+    states = {}
+    for exclusion in section["exclusions"]:
+        property_name = PREFERENCE_PROPERTIES.get(exclusion.get('type'))
+        if property_name is None:
+            continue
+        if exclusion.get('type') in PATTERN_TYPES and is_pattern(exclusion.get('path') or '',
+                                                                 section.get("matchBrackets", False)):
+            missing = compute_missing_exclusions([exclusion], snapshot, pattern_options(section))
+            count = sum(len(values) for values in missing.values())
+            states[item_id(exclusion)] = f"{count} absent" if count else "present"
+            continue
+        states[item_id(exclusion)] = "present" \
+            if normalize_exclusion(property_name, exclusion.get('path', '')) in snapshot[property_name] else "absent"
+    return states
+
+
+def desired_step(section: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Returns the state `inventory_step` reports for each exclusion of a known type once it is applied.
+    """
+    return {item_id(exclusion): "present" for exclusion in section["exclusions"]
+            if exclusion.get('type') in PREFERENCE_PROPERTIES}
+
+
+def plan_reconcile_step(section: Dict[str, Any], runner: PowerShellRunner = run_powershell) -> List[PlannedChange]:
+    """
+    Determines, from a single read of the Defender preferences and without changing anything, which exclusions
+    reconcile mode would remove, in addition to the missing ones `plan_step` reports.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'excludeFromDefender' section of the configuration.
+    - runner (PowerShellRunner): The callable used to execute the PowerShell command.
+
+    Returns:
+    - List[PlannedChange]: One 'remove_exclusion' change per unmanaged exclusion.
+    """
+    _, removed, _ = compute_exclusion_changes(section["exclusions"], read_exclusion_state(runner),
+                                              section.get("allowlist", []), pattern_options(section))
+    return [PlannedChange("add_defender_exclusions", f"{property_name}:{value}", "remove_exclusion", "present",
+                          "absent")
+            for property_name, values in removed.items() for value in values]
+
+
+def reconcile_step(section: Dict[str, Any]) -> None:
+    """
+    Runs this module as a step of the unified setup runner in reconcile mode, adding the configured Defender
+    exclusions and removing every other one that is not on the allowlist.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'excludeFromDefender' section of the configuration.
+    """
+    reconcile_exclusions(section)
+
+
+def run_step(section: Dict[str, Any]) -> None:
+    """
+    Runs this module as a step of the unified setup runner, adding the configured Defender exclusions from the already
+    validated 'excludeFromDefender' section.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'excludeFromDefender' section of the configuration.
+    """
+    process_exclusions(section)
 
 
 def main() -> None:
     """
     Executes the main functionality of the script which includes setting up logging, reading the configuration file,
     validating the 'excludeFromDefender' configuration section, and conditionally adding exclusions based on the
-    configuration.
+    configuration. With '--plan', only prints the changes it would make.
     """
+    args = parse_module_arguments("Applies the 'excludeFromDefender' section of the configuration.")
     setup_logging()
     config_data = read_config_file(CONFIG_FILE)
 
@@ -103,6 +576,9 @@ def main() -> None:
         return
 
     exclusions_config = config_data.get("excludeFromDefender", {})
+    if args.plan:
+        print_plan(exclusions_config, plan_step)
+        return
     process_exclusions(exclusions_config)
 
 
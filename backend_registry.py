@@ -0,0 +1,106 @@
+import importlib
+import threading
+from typing import Any, Callable, Dict, List, Optional, Union
+
+# Creates a backend: a callable, or a 'module:attribute' string naming one, so the module is imported on first use.
+BackendFactory = Union[str, Callable[[], Any]]
+
+_factories: Dict[str, Dict[str, BackendFactory]] = {}
+_selected: Dict[str, str] = {}
+_instances: Dict[str, Any] = {}
+_lock = threading.RLock()
+
+
+def register_backend(kind: str, name: str, factory: BackendFactory, default: bool = False) -> None:
+    """
+    Registers a factory for one implementation of a kind of backend, e.g. the 'windows' implementation of the
+    'registry' backend. Nothing is imported or created until the backend is first used.
+
+    Parameters:
+    - kind (str): The kind of backend: 'registry', 'attributes', 'services' or 'powershell'.
+    - name (str): The name of the implementation.
+    - factory (BackendFactory): Creates the backend; a 'module:attribute' string is imported on first use.
+    - default (bool): Whether this implementation is used unless another one is selected.
+    """
+    with _lock:
+        _factories.setdefault(kind, {})[name] = factory
+        if default or kind not in _selected:
+            _selected[kind] = name
+
+
+def backend_names(kind: str) -> List[str]:
+    """
+    Returns the names of the registered implementations of a kind of backend.
+    """
+    with _lock:
+        return sorted(_factories.get(kind, {}))
+
+
+def select_backend(kind: str, name: str) -> Optional[Any]:
+    """
+    Selects the implementation created on the next use of a kind of backend.
+
+    Parameters:
+    - kind (str): The kind of backend.
+    - name (str): The name of a registered implementation.
+
+    Returns:
+    - Optional[Any]: The backend created so far, which is no longer used and may need to be closed by the caller.
+
+    Raises:
+    - ValueError: If no implementation of that name is registered.
+    """
+    with _lock:
+        if name not in _factories.get(kind, {}):
+            raise ValueError(f"Unknown {kind} backend '{name}'. Known backends: {', '.join(backend_names(kind))}.")
+        _selected[kind] = name
+        return _instances.pop(kind, None)
+
+
+def resolve_factory(factory: BackendFactory) -> Callable[[], Any]:
+    """
+    Returns the callable a factory stands for, importing its module if it is given as a 'module:attribute' string.
+    """
+    if callable(factory):
+        return factory
+    module_name, _, attribute = factory.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def get_backend(kind: str) -> Any:
+    """
+    Returns the backend of a kind, creating the selected implementation on first use.
+
+    Raises:
+    - KeyError: If no implementation of that kind is registered.
+    """
+    with _lock:
+        if kind not in _instances:
+            _instances[kind] = resolve_factory(_factories[kind][_selected[kind]])()
+        return _instances[kind]
+
+
+def peek_backend(kind: str) -> Optional[Any]:
+    """
+    Returns the backend of a kind if it has been created, without creating it.
+    """
+    with _lock:
+        return _instances.get(kind)
+
+
+def set_backend(kind: str, backend: Optional[Any]) -> Optional[Any]:
+    """
+    Replaces the backend of a kind, for example with an in-memory implementation to run the steps on Linux.
+
+    Parameters:
+    - kind (str): The kind of backend.
+    - backend (Optional[Any]): The new backend, or None to create the selected implementation on next use.
+
+    Returns:
+    - Optional[Any]: The replaced backend, which may need to be closed by the caller.
+    """
+    with _lock:
+        previous = _instances.pop(kind, None)
+        if backend is not None:
+            _instances[kind] = backend
+        return previous
@@ -0,0 +1,76 @@
+"""
+A stand-in for 'powershell -NoProfile -NonInteractive -Command -' that speaks the framing protocol used by
+powershell_host.PowerShellSession and emulates the Defender preference cmdlets on an in-memory store. It lets the
+PowerShell-backed steps run on machines without PowerShell or Defender.
+
+Supported commands: the Get-MpPreference snapshot, Add-MpPreference and Remove-MpPreference with array arguments,
+'Start-Sleep -Seconds N', 'throw <message>', 'Stop-Process -Id $PID', which ends the interpreter in the middle of a
+command like a crash, and 'exit'. Every other command succeeds without output. Set FAKE_POWERSHELL_LATENCY to add a
+fixed delay in seconds to every command.
+"""
+import os
+import re
+import sys
+import time
+
+FRAME = re.compile(r"^\$global:__wssStatus = 0; "
+                   r"try \{ \. \(\[ScriptBlock\]::Create\('(?P<command>(?:[^']|'')*)'\)\) \} "
+                   r"catch .*Write-Output \('(?P<token>\S+)END '")
+PREFERENCE = re.compile(r"^(?P<verb>Add|Remove)-MpPreference -(?P<name>Exclusion\w+) (?P<values>.*)$")
+LITERAL = re.compile(r"'((?:[^']|'')*)'")
+SLEEP = re.compile(r"^Start-Sleep -Seconds (?P<seconds>[\d.]+)$")
+
+preferences = {"ExclusionPath": [], "ExclusionExtension": [], "ExclusionProcess": []}
+
+
+def execute(command: str) -> list:
+    """
+    Executes one emulated command and returns its output lines.
+    """
+    if command.startswith("$p = Get-MpPreference"):
+        return [f"{name}\t{value}" for name, values in preferences.items() for value in values]
+    match = PREFERENCE.match(command)
+    if match:
+        values = [value.replace("''", "'") for value in LITERAL.findall(match.group("values"))]
+        current = preferences.setdefault(match.group("name"), [])
+        for value in values:
+            present = value.lower() in (existing.lower() for existing in current)
+            if match.group("verb") == "Add" and not present:
+                current.append(value)
+            elif match.group("verb") == "Remove" and present:
+                current[:] = [existing for existing in current if existing.lower() != value.lower()]
+        return []
+    match = SLEEP.match(command)
+    if match:
+        time.sleep(float(match.group("seconds")))
+        return []
+    if command == "Stop-Process -Id $PID":
+        os._exit(1)
+    if command.startswith("throw "):
+        raise RuntimeError(command[6:].strip("'\""))
+    return []
+
+
+def main() -> None:
+    latency = float(os.environ.get("FAKE_POWERSHELL_LATENCY", "0"))
+    for line in sys.stdin:
+        line = line.rstrip("\r\n")
+        if line.strip() == "exit":
+            break
+        match = FRAME.match(line)
+        if not match:
+            continue
+        token = match.group("token")
+        time.sleep(latency)
+        status = 0
+        try:
+            for output in execute(match.group("command").replace("''", "'")):
+                print(output)
+        except Exception as e:
+            print(f"{token}ERR {e}")
+            status = 1
+        print(f"{token}END {status}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Installs latency-configurable stand-ins for every Windows backend, so the setup steps run unchanged on Linux: an
+in-memory registry, a dictionary of file attributes on top of the real file system, a simulated Service Control
+Manager and the fake_powershell.py interpreter for the Defender cmdlets. Each fake is seeded from a configuration so
+that about half of its items already have their desired value.
+"""
+import os
+import sys
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fs_engine  # noqa: E402
+import powershell_host  # noqa: E402
+import registry_backend  # noqa: E402
+import set_services  # noqa: E402
+from registry_backend import HKEY_CURRENT_USER, REG_SZ, MemoryRegistry  # noqa: E402
+from service_control import SimulatedService, SimulatedServiceController  # noqa: E402
+from set_locales import KEY_PATH  # noqa: E402
+from set_registry_tweaks import parse_tweak  # noqa: E402
+
+FAKE_POWERSHELL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_powershell.py")
+SC_STARTUP_TYPES = set_services.SC_STARTUP_TYPES
+SERVICE_DEPENDENCY_EVERY = 10
+# Services depend on the service four places earlier, which has the same desired startup type and status.
+SERVICE_DEPENDENCY_OFFSET = 4
+
+
+@dataclass
+class Latency:
+    """
+    The simulated cost, in seconds, of one call to each backend.
+    """
+    registry: float = 0.0005
+    attributes: float = 0.0001
+    service_query: float = 0.001
+    service_transition: float = 0.005
+    powershell: float = 0.005
+
+    @classmethod
+    def parse(cls, text: str) -> "Latency":
+        """
+        Parses overrides written as 'name=seconds,name=seconds', e.g. 'registry=0.001,powershell=0.05'.
+        """
+        latency = cls()
+        for assignment in filter(None, text.split(",")):
+            name, _, value = assignment.partition("=")
+            if not hasattr(latency, name.strip()):
+                raise ValueError(f"Unknown latency '{name.strip()}'.")
+            setattr(latency, name.strip(), float(value))
+        return latency
+
+
+@dataclass
+class Fakes:
+    """
+    The fakes installed for one benchmark run.
+    """
+    registry: MemoryRegistry
+    attributes: fs_engine.MemoryAttributeBackend
+    services: SimulatedServiceController
+    powershell: powershell_host.PowerShellSession
+
+    def calls(self) -> Dict[str, int]:
+        """
+        Returns the number of backend calls made so far, per backend.
+        """
+        return {
+            "registry": self.registry.opens,
+            "attributes": self.attributes.reads + self.attributes.writes,
+            "services": sum(self.services.calls.values()),
+            "powershell": self.powershell.commands,
+        }
+
+
+def seed_registry(config: Dict[str, Any], latency: Latency) -> MemoryRegistry:
+    values = {}
+    for index, (name, setting) in enumerate(config["localeSettings"]["formatOptions"].items()):
+        values[name] = (setting["value"] if index % 2 == 0 else f"old-{setting['value']}", REG_SZ)
+    keys = {(HKEY_CURRENT_USER, KEY_PATH): values}
+    for index, tweak in enumerate(config["registryTweaks"]["tweaks"]):
+        key, name, value = parse_tweak(tweak)
+        # About one key in five is missing and has to be created; in the others, every other value already matches.
+        if zlib.crc32(key[1].encode()) % 5 != 0:
+            keys.setdefault(key, {})[name] = value if index % 2 == 0 else (None, value[1])
+    return MemoryRegistry(keys, latency=latency.registry)
+
+
+def seed_services(config: Dict[str, Any], latency: Latency) -> SimulatedServiceController:
+    services = {}
+    names = [service["name"] for service in config["servicesSettings"]["services"]]
+    for index, service in enumerate(config["servicesSettings"]["services"]):
+        desired_type = SC_STARTUP_TYPES[service["startupType"]]
+        desired_status = "running" if service["serviceStatus"] == "Start" else "stopped"
+        opposite_status = "stopped" if desired_status == "running" else "running"
+        dependencies = []
+        if index >= SERVICE_DEPENDENCY_OFFSET and index % SERVICE_DEPENDENCY_EVERY == 0:
+            dependencies.append(names[index - SERVICE_DEPENDENCY_OFFSET])
+        services[service["name"]] = SimulatedService(
+            startup_type=desired_type if index % 2 == 0 else ("demand" if desired_type != "demand" else "auto"),
+            status=desired_status if index % 4 < 2 else opposite_status,
+            dependencies=dependencies)
+    return SimulatedServiceController(services, start_latency=latency.service_transition,
+                                      stop_latency=latency.service_transition, query_latency=latency.service_query)
+
+
+def install_fakes(config: Dict[str, Any], latency: Latency) -> Fakes:
+    """
+    Creates the fakes for a configuration and makes them the default backends of every step module.
+
+    Parameters:
+    - config (Dict[str, Any]): The configuration the steps will run with.
+    - latency (Latency): The simulated cost of the backend calls.
+
+    Returns:
+    - Fakes: The installed fakes, whose call counters can be inspected after a run.
+    """
+    os.environ["FAKE_POWERSHELL_LATENCY"] = str(latency.powershell)
+    fakes = Fakes(registry=seed_registry(config, latency),
+                  attributes=fs_engine.MemoryAttributeBackend(latency=latency.attributes),
+                  services=seed_services(config, latency),
+                  powershell=powershell_host.PowerShellSession([sys.executable, FAKE_POWERSHELL]))
+    registry_backend.set_default_registry(fakes.registry)
+    fs_engine.set_attribute_backend(fakes.attributes)
+    set_services.set_default_controller(fakes.services)
+    powershell_host.set_session(fakes.powershell)
+    return fakes
+
+
+def uninstall_fakes() -> None:
+    """
+    Restores the real default backends and stops the fake PowerShell interpreter.
+    """
+    registry_backend.set_default_registry(None)
+    fs_engine.set_attribute_backend(None)
+    set_services.set_default_controller(None)
+    powershell_host.set_session(None)
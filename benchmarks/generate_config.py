@@ -0,0 +1,97 @@
+"""
+Generates synthetic configuration files for the benchmarks, with a chosen number of items in every section. Folder
+paths point below a scratch root so the folder steps can run against a real file system; locale settings and services
+use generated names that the simulated backends are seeded with (see fakes.py).
+
+Usage: python benchmarks/generate_config.py --items 1000 --root /tmp/wss-bench --output bench-config.json
+"""
+import argparse
+import json
+import os
+from typing import Any, Dict
+
+STARTUP_TYPES = ["Automatic", "Manual", "Disabled", "Automatic (Delayed Start)"]
+SERVICE_STATES = ["Start", "Stop"]
+FOLDERS_PER_GROUP = 32
+VALUES_PER_KEY = 20
+TWEAK_TYPES = ["DWORD", "QWORD", "SZ", "MULTI_SZ", "BINARY"]
+
+
+def folder_path(root: str, index: int) -> str:
+    return os.path.join(root, f"group{index // FOLDERS_PER_GROUP:04d}", f"folder{index:05d}")
+
+
+def locale_name(index: int) -> str:
+    return f"sSynthetic{index:05d}"
+
+
+def service_name(index: int) -> str:
+    return f"SyntheticSvc{index:05d}"
+
+
+def service_entry(index: int) -> Dict[str, Any]:
+    startup_type = STARTUP_TYPES[index % len(STARTUP_TYPES)]
+    status = "Stop" if startup_type == "Disabled" else SERVICE_STATES[index % len(SERVICE_STATES)]
+    return {"enabled": True, "name": service_name(index), "startupType": startup_type, "serviceStatus": status}
+
+
+def tweak_entry(index: int) -> Dict[str, Any]:
+    value_type = TWEAK_TYPES[index % len(TWEAK_TYPES)]
+    value = {"DWORD": index, "QWORD": index << 32, "SZ": f"value{index}", "MULTI_SZ": [f"a{index}", f"b{index}"],
+             "BINARY": f"{index % 256:02x} ff 00"}[value_type]
+    key_index = index // VALUES_PER_KEY
+    return {"enabled": True, "hive": "HKLM" if key_index % 2 else "HKCU",
+            "key": f"Software\\Synthetic\\Key{key_index:04d}", "name": f"Value{index:05d}", "type": value_type,
+            "value": value}
+
+
+def generate_config(items: int, root: str) -> Dict[str, Any]:
+    """
+    Builds a configuration with `items` entries in every section.
+
+    Parameters:
+    - items (int): The number of entries per section.
+    - root (str): The scratch directory the folder entries are placed under.
+
+    Returns:
+    - Dict[str, Any]: The configuration, in the format of config.json.
+    """
+    folders = [folder_path(root, index) for index in range(items)]
+    return {
+        "createFolders": {"enabled": True, "paths": folders},
+        "hideFolders": {"enabled": True, "paths": folders},
+        "excludeFromDefender": {
+            "enabled": True,
+            "exclusions": [{"type": "Folder", "path": path} if index % 2 == 0
+                           else {"type": "FileType", "path": f".ext{index:05d}"}
+                           for index, path in enumerate(folders)]
+        },
+        "localeSettings": {
+            "enabled": True,
+            "formatOptions": {locale_name(index): {"enabled": True, "value": f"value{index}"} for index in range(items)}
+        },
+        "servicesSettings": {
+            "enabled": True,
+            "services": [service_entry(index) for index in range(items)]
+        },
+        "registryTweaks": {
+            "enabled": True,
+            "tweaks": [tweak_entry(index) for index in range(items)]
+        }
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic configuration file for the benchmarks.")
+    parser.add_argument("--items", type=int, default=100, help="The number of entries per section (10 to 10000).")
+    parser.add_argument("--root", default=os.path.join(os.getcwd(), "bench-scratch"),
+                        help="The scratch directory the folder entries are placed under.")
+    parser.add_argument("--output", default="bench-config.json", help="The configuration file to write.")
+    args = parser.parse_args()
+
+    with open(args.output, "w") as file:
+        json.dump(generate_config(args.items, args.root), file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
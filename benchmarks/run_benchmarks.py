@@ -0,0 +1,203 @@
+"""
+Runs every setup step against the simulated Windows backends for synthetic configurations of increasing size and
+reports, per step, the wall time, the number of processes launched, the number of backend calls and the peak Python
+memory, along with the cold-start import time of every entry point. Results are written as JSON, and two result files
+can be compared with a regression threshold.
+
+Usage:
+  python benchmarks/run_benchmarks.py --sizes 10,100,1000 --output results.json
+  python benchmarks/run_benchmarks.py --compare baseline.json results.json --threshold 0.2
+"""
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+# Importing fakes puts the repository root on the module search path.
+from fakes import Latency, install_fakes, uninstall_fakes
+from generate_config import generate_config
+
+import metrics
+import profiling
+from config_service import setup_logging
+from setup_runner import STEPS
+
+RESULTS_VERSION = 1
+DEFAULT_SIZES = "10,100,1000"
+DEFAULT_THRESHOLD = 0.2
+# Wall time differences below this many seconds are treated as noise when comparing runs.
+NOISE_FLOOR = 0.005
+
+
+def run_step_measured(step, section: Dict[str, Any], fakes, track_memory: bool) -> Dict[str, Any]:
+    """
+    Runs one step and measures it.
+    """
+    run_step = step.load("run_step")
+    calls_before = fakes.calls()
+    if track_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with metrics.instrument("benchmark.step", step.name):
+        run_step(section)
+    wall_time = time.perf_counter() - started
+    peak_memory = tracemalloc.get_traced_memory()[1] if track_memory else None
+    if track_memory:
+        tracemalloc.stop()
+    calls_after = fakes.calls()
+    step_record = next(record for record in reversed(metrics.records())
+                       if record["operation"] == "benchmark.step" and record["item"] == step.name)
+    return {
+        "step": step.name,
+        "wall_time": round(wall_time, 6),
+        "subprocesses": step_record["subprocesses"],
+        "backend_calls": {name: calls_after[name] - calls_before[name] for name in calls_after
+                          if calls_after[name] != calls_before[name]},
+        "peak_memory": peak_memory,
+    }
+
+
+def run_size(items: int, latency: Latency, track_memory: bool) -> List[Dict[str, Any]]:
+    """
+    Runs every step once for a synthetic configuration with `items` entries per section, in a fresh scratch directory
+    and with freshly seeded fakes.
+    """
+    scratch = tempfile.mkdtemp(prefix="wss-bench-")
+    try:
+        config = generate_config(items, scratch)
+        fakes = install_fakes(config, latency)
+        metrics.enable()
+        try:
+            results = []
+            for step in STEPS:
+                result = run_step_measured(step, config[step.section], fakes, track_memory)
+                result["size"] = items
+                results.append(result)
+                print(f"{items:>6} items  {step.name:<24} {result['wall_time'] * 1000:10.1f} ms  "
+                      f"{result['subprocesses']:>3} procs  peak {result['peak_memory'] or 0:>10} B")
+            return results
+        finally:
+            metrics.disable()
+            uninstall_fakes()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def run_benchmarks(sizes: List[int], latency: Latency, track_memory: bool = True,
+                   startup: bool = True) -> Dict[str, Any]:
+    """
+    Runs the benchmarks for every size.
+
+    Parameters:
+    - sizes (List[int]): The numbers of entries per section to benchmark.
+    - latency (Latency): The simulated cost of the backend calls.
+    - track_memory (bool): Whether to measure the peak Python memory with tracemalloc, which slows the steps down.
+    - startup (bool): Whether to measure the cold start of the entry points in fresh interpreters.
+
+    Returns:
+    - Dict[str, Any]: The results document.
+    """
+    results = []
+    for items in sizes:
+        results.extend(run_size(items, latency, track_memory))
+    return {
+        "version": RESULTS_VERSION,
+        "created": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency": vars(latency),
+        "track_memory": track_memory,
+        "results": results,
+        "startup": profiling.measure_startup() if startup else {},
+    }
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Compares two results documents step by step and size by size. A regression is a wall time or peak memory more than
+    `threshold` (a fraction) above the baseline, ignoring wall time differences below the noise floor, or any increase
+    in the number of processes launched. The import time of every entry point is held to the same threshold.
+
+    Parameters:
+    - baseline (Dict[str, Any]): The reference results.
+    - current (Dict[str, Any]): The results to check.
+    - threshold (float): The allowed relative increase, e.g. 0.2 for 20 %.
+
+    Returns:
+    - List[str]: One line per regression; empty if there is none.
+    """
+    reference = {(result["size"], result["step"]): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        base = reference.get((result["size"], result["step"]))
+        if base is None:
+            continue
+        label = f"{result['step']} @ {result['size']} items"
+        if (result["wall_time"] > base["wall_time"] * (1 + threshold)
+                and result["wall_time"] - base["wall_time"] > NOISE_FLOOR):
+            regressions.append(f"{label}: wall time {base['wall_time'] * 1000:.1f} ms -> "
+                               f"{result['wall_time'] * 1000:.1f} ms")
+        if result["subprocesses"] > base["subprocesses"]:
+            regressions.append(f"{label}: processes {base['subprocesses']} -> {result['subprocesses']}")
+        if base.get("peak_memory") and result.get("peak_memory") and \
+                result["peak_memory"] > base["peak_memory"] * (1 + threshold):
+            regressions.append(f"{label}: peak memory {base['peak_memory']} B -> {result['peak_memory']} B")
+    for module, times in current.get("startup", {}).items():
+        base = baseline.get("startup", {}).get(module)
+        if base and times["import_time"] > base["import_time"] * (1 + threshold) \
+                and times["import_time"] - base["import_time"] > NOISE_FLOOR:
+            regressions.append(f"import {module}: {base['import_time'] * 1000:.1f} ms -> "
+                               f"{times['import_time'] * 1000:.1f} ms")
+    return regressions
+
+
+def read_results(file_path: str) -> Dict[str, Any]:
+    with open(file_path, "r") as file:
+        data = json.load(file)
+    if data.get("version") != RESULTS_VERSION:
+        raise ValueError(f"Unsupported results version in '{file_path}'.")
+    return data
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the setup steps against simulated Windows backends.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="Comma-separated numbers of entries per section, e.g. 10,100,1000,10000.")
+    parser.add_argument("--latency", default="",
+                        help="Backend latency overrides in seconds, e.g. 'registry=0.001,powershell=0.05'.")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Do not measure peak memory, which avoids the tracemalloc overhead.")
+    parser.add_argument("--no-startup", action="store_true",
+                        help="Do not measure the cold start of the entry points.")
+    parser.add_argument("--output", help="The JSON file to write the results to.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Compare two result files instead of running the benchmarks.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="The allowed relative increase when comparing, e.g. 0.2 for 20%%.")
+    args = parser.parse_args(argv)
+    setup_logging("WARNING")
+
+    if args.compare:
+        regressions = compare_results(read_results(args.compare[0]), read_results(args.compare[1]), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if not regressions:
+            print("No regressions.")
+        return 1 if regressions else 0
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    document = run_benchmarks(sizes, Latency.parse(args.latency), track_memory=not args.no_memory,
+                              startup=not args.no_startup)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
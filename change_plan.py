@@ -0,0 +1,166 @@
+import argparse
+import json
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional, Set
+
+PLAN_VERSION = 1
+
+# The key holding the list (or mapping) of items in every configuration section.
+SECTION_ITEMS = {
+    "createFolders": "paths",
+    "hideFolders": "paths",
+    "localeSettings": "formatOptions",
+    "servicesSettings": "services",
+    "excludeFromDefender": "exclusions",
+    "registryTweaks": "tweaks",
+}
+
+
+@dataclass(frozen=True)
+class PlannedChange:
+    """
+    A single change a step would make: the configuration item it concerns, what would be done to it, and the current
+    and desired state observed by the read-only probe.
+    """
+    step: str
+    item: str
+    action: str
+    current: Any
+    desired: Any
+
+
+def item_id(item: Any) -> str:
+    """
+    Returns the identifier of a configuration item as used in plans: a path for folder entries, the service name for
+    services, 'Type:path' for Defender exclusions and 'hive\\key\\name' for registry tweaks.
+
+    Parameters:
+    - item (Any): The configuration item.
+
+    Returns:
+    - str: The identifier of the item.
+    """
+    if isinstance(item, dict):
+        if "hive" in item and "key" in item:
+            return f"{item.get('hive')}\\{item.get('key')}\\{item.get('name')}"
+        if "name" in item:
+            return str(item["name"])
+        if "type" in item:
+            return f"{item.get('type')}:{item.get('path')}"
+    return str(item)
+
+
+def section_items(section_name: str, section: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the items of a configuration section keyed by their identifiers.
+
+    Parameters:
+    - section_name (str): The name of the section, e.g. 'createFolders'.
+    - section (Dict[str, Any]): The configuration section.
+
+    Returns:
+    - Dict[str, Any]: The items of the section keyed by `item_id`, or by name for mapping sections.
+    """
+    container = section.get(SECTION_ITEMS[section_name], [])
+    if isinstance(container, dict):
+        return dict(container)
+    return {item_id(item): item for item in container}
+
+
+def restrict_section(section_name: str, section: Dict[str, Any], items: Set[str]) -> Dict[str, Any]:
+    """
+    Returns a copy of a configuration section that only contains the given items, keeping their configured order.
+
+    Parameters:
+    - section_name (str): The name of the section, e.g. 'createFolders'.
+    - section (Dict[str, Any]): The configuration section.
+    - items (Set[str]): The identifiers of the items to keep.
+
+    Returns:
+    - Dict[str, Any]: The restricted section.
+    """
+    key = SECTION_ITEMS[section_name]
+    container = section.get(key, [])
+    if isinstance(container, dict):
+        restricted = {name: value for name, value in container.items() if name in items}
+    else:
+        restricted = [item for item in container if item_id(item) in items]
+    return {**section, key: restricted}
+
+
+def format_changes(changes: List[PlannedChange]) -> str:
+    """
+    Formats planned changes as a human-readable table, one line per change.
+
+    Parameters:
+    - changes (List[PlannedChange]): The planned changes.
+
+    Returns:
+    - str: The formatted table, or a note that nothing would change.
+    """
+    if not changes:
+        return "No changes pending."
+    lines = [f"{len(changes)} change(s) pending:"]
+    for change in changes:
+        lines.append(f"  [{change.step}] {change.action} {change.item}: {change.current!r} -> {change.desired!r}")
+    return "\n".join(lines)
+
+
+def parse_module_arguments(description: str, argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parses the command line of a standalone step script, which accepts '--plan' like the setup runner.
+
+    Parameters:
+    - description (str): The description shown by '--help'.
+    - argv (Optional[List[str]]): The arguments, by default those of the process.
+
+    Returns:
+    - argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--plan", action="store_true",
+                        help="Print the changes the step would make without applying them.")
+    return parser.parse_args(argv)
+
+
+def print_plan(section: Dict[str, Any], plan_step: Callable[[Dict[str, Any]], List[PlannedChange]]) -> None:
+    """
+    Prints the changes a step would make to its configuration section; a disabled section makes none.
+
+    Parameters:
+    - section (Dict[str, Any]): The validated configuration section.
+    - plan_step (Callable): The `plan_step` function of the step module.
+    """
+    print(format_changes(plan_step(section) if section.get("enabled") else []))
+
+
+def write_plan(file_path: str, changes: List[PlannedChange]) -> None:
+    """
+    Writes planned changes to a JSON file that can later be passed to `--apply-plan`.
+
+    Parameters:
+    - file_path (str): The path of the plan file.
+    - changes (List[PlannedChange]): The planned changes.
+    """
+    with open(file_path, "w") as file:
+        json.dump({"version": PLAN_VERSION, "changes": [asdict(change) for change in changes]}, file, indent=2)
+
+
+def read_plan(file_path: str) -> List[PlannedChange]:
+    """
+    Reads planned changes from a JSON file written by `write_plan`.
+
+    Parameters:
+    - file_path (str): The path of the plan file.
+
+    Returns:
+    - List[PlannedChange]: The planned changes.
+
+    Raises:
+    - ValueError: If the file is not a plan of a supported version.
+    """
+    with open(file_path, "r") as file:
+        data = json.load(file)
+    if not isinstance(data, dict) or data.get("version") != PLAN_VERSION:
+        raise ValueError(f"'{file_path}' is not a version {PLAN_VERSION} plan file.")
+    return [PlannedChange(**change) for change in data.get("changes", [])]
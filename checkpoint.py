@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Set
+
+from config_service import logging
+from state_cache import write_json_atomically
+
+CHECKPOINT_FILE = ".setup_checkpoint.json"
+CHECKPOINT_VERSION = 1
+# Completed items are written at the latest this many seconds after they were marked.
+FLUSH_INTERVAL = 0.5
+
+
+class Checkpoint:
+    """
+    The items a run has completed, per step, together with the fingerprint of the configuration they were completed
+    for, so a run interrupted by a reboot, a hung command or a logoff can be resumed where it stopped. Marking an item
+    only adds it to a dictionary; the checkpoint file is rewritten atomically at most every FLUSH_INTERVAL seconds and
+    at the end of every step, so a crash can at worst lose the markers of the last fraction of a second, whose items
+    are then simply applied again.
+
+    Parameters:
+    - file_path (str): The checkpoint file.
+    - config_hash (str): The fingerprint of the configuration the run applies.
+    - completed (Optional[Dict[str, Iterable[str]]]): The items completed by the interrupted run, keyed by step name.
+    """
+
+    def __init__(self, file_path: str, config_hash: str, completed: Optional[Dict[str, Iterable[str]]] = None) -> None:
+        self.file_path = file_path
+        self.config_hash = config_hash
+        self._completed: Dict[str, Dict[str, None]] = {step: dict.fromkeys(items)
+                                                       for step, items in (completed or {}).items()}
+        # The state observed for the items this run completed; kept in memory for the state cache, never written.
+        self._observed: Dict[str, Dict[str, Any]] = {}
+        # A new checkpoint replaces the file of an earlier run on its first write, even if nothing was marked yet.
+        self._dirty = True
+        self._written = time.monotonic()
+        self._warned = False
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def completed(self, step: str) -> Set[str]:
+        """
+        Returns the identifiers of the items of a step that are marked as completed.
+        """
+        with self._lock:
+            return set(self._completed.get(step, ()))
+
+    def observed(self, step: str) -> Dict[str, Any]:
+        """
+        Returns the items of a step completed by this run, not by the interrupted one, with the actual state the step
+        observed for them when it applied them.
+        """
+        with self._lock:
+            return dict(self._observed.get(step, {}))
+
+    def complete(self, step: str, items: Iterable[str], observed: Any = None) -> None:
+        """
+        Marks items as completed, writing the checkpoint if the last write is older than FLUSH_INTERVAL.
+
+        Parameters:
+        - step (str): The name of the step, e.g. 'create_folders'.
+        - items (Iterable[str]): The identifiers of the completed items, as returned by `item_id`.
+        - observed (Any): The actual state the step observed for every one of the items after applying them.
+        """
+        items = list(items)
+        with self._lock:
+            self._completed.setdefault(step, {}).update(dict.fromkeys(items))
+            self._observed.setdefault(step, {}).update(dict.fromkeys(items, observed))
+            self._dirty = True
+            due = time.monotonic() - self._written >= FLUSH_INTERVAL
+        if due:
+            self.flush(blocking=False)
+
+    def flush(self, blocking: bool = True) -> None:
+        """
+        Writes the markers to a temporary file and renames it over the checkpoint file, if anything was marked since
+        the last write. Failures are logged once and never interrupt the run.
+
+        Parameters:
+        - blocking (bool): Whether to wait for a write already in progress in another thread; if False, the markers
+          are left to that thread's next write.
+        """
+        if not self._write_lock.acquire(blocking):
+            return
+        try:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = {"version": CHECKPOINT_VERSION, "config": self.config_hash, "updated": time.time(),
+                        "completed": {step: list(items) for step, items in self._completed.items()}}
+                self._dirty = False
+                self._written = time.monotonic()
+            try:
+                write_json_atomically(self.file_path, data)
+            except OSError as e:
+                if not self._warned:
+                    logging.warning(f"Failed to write the checkpoint '{self.file_path}': {str(e)}")
+                    self._warned = True
+        finally:
+            self._write_lock.release()
+
+    def close(self) -> None:
+        """
+        Writes the remaining markers.
+        """
+        self.flush()
+
+    def discard(self) -> None:
+        """
+        Removes the checkpoint file once the run completed every item, so a later --resume does not skip items that
+        drifted since. Nothing is written afterwards.
+        """
+        with self._write_lock:
+            with self._lock:
+                self._dirty = False
+            try:
+                os.remove(self.file_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"Failed to remove the checkpoint '{self.file_path}': {str(e)}")
+
+
+def load_checkpoint(file_path: str, config_hash: str) -> Optional[Checkpoint]:
+    """
+    Loads the checkpoint of an interrupted run. A checkpoint written for a different configuration is ignored, since
+    its markers may not describe the items the configuration now lists.
+
+    Parameters:
+    - file_path (str): The checkpoint file.
+    - config_hash (str): The fingerprint of the current configuration.
+
+    Returns:
+    - Optional[Checkpoint]: The checkpoint with the markers of the interrupted run, or None if there is no usable one.
+    """
+    try:
+        with open(file_path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        logging.info(f"No checkpoint found at '{file_path}'. Starting from the beginning.")
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Failed to read the checkpoint '{file_path}': {str(e)}. Starting from the beginning.")
+        return None
+    if not isinstance(data, dict) or data.get("version") != CHECKPOINT_VERSION or \
+            not isinstance(data.get("completed"), dict):
+        logging.warning(f"The checkpoint '{file_path}' has an unsupported format. Starting from the beginning.")
+        return None
+    if data.get("config") != config_hash:
+        logging.warning(f"The configuration changed since the checkpoint '{file_path}' was written. "
+                        f"Starting from the beginning.")
+        return None
+    completed = data["completed"]
+    logging.info(f"Resuming from the checkpoint '{file_path}' with "
+                 f"{sum(len(items) for items in completed.values())} completed item(s).")
+    return Checkpoint(file_path, config_hash, completed)
+
+
+class _NullCheckpoint:
+    """
+    The checkpoint in effect while checkpointing is disabled; markers are discarded.
+    """
+    file_path = None
+
+    def completed(self, step: str) -> Set[str]:
+        return set()
+
+    def observed(self, step: str) -> Dict[str, Any]:
+        return {}
+
+    def complete(self, step: str, items: Iterable[str], observed: Any = None) -> None:
+        pass
+
+    def flush(self, blocking: bool = True) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def discard(self) -> None:
+        pass
+
+
+_NULL_CHECKPOINT = _NullCheckpoint()
+_checkpoint = _NULL_CHECKPOINT
+
+
+def get_checkpoint():
+    """
+    Returns the checkpoint the steps mark their completed items in: the one passed to `set_checkpoint`, or a checkpoint
+    that discards every marker.
+    """
+    return _checkpoint
+
+
+def set_checkpoint(checkpoint: Optional[Checkpoint]) -> None:
+    """
+    Replaces the active checkpoint, writing the remaining markers of the previous one.
+
+    Parameters:
+    - checkpoint (Optional[Checkpoint]): The new checkpoint, or None to stop checkpointing.
+    """
+    global _checkpoint
+    previous, _checkpoint = _checkpoint, checkpoint or _NULL_CHECKPOINT
+    if previous is not _checkpoint:
+        previous.close()
@@ -0,0 +1,314 @@
+import os
+import random
+import subprocess
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from config_service import logging
+from metrics import count_subprocess
+
+if TYPE_CHECKING:
+    import asyncio
+
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_GLOBAL_LIMIT = 8
+DEFAULT_TOOL_LIMITS = {"sc": 4}
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.2
+
+
+@dataclass(frozen=True)
+class CommandResult:
+    """
+    The outcome of one command: its exit status and output, and the number of processes launched to obtain it (zero
+    for a memoized result, more than one if it was retried).
+    """
+    returncode: int
+    stdout: str
+    stderr: str
+    launches: int
+
+
+def tool_name(argv: List[str]) -> str:
+    """
+    Returns the name a command is limited and memoized under: the lower-cased executable name without extension.
+    """
+    return os.path.splitext(os.path.basename(argv[0]))[0].lower()
+
+
+class ResultCache:
+    """
+    Memoizes the results of read-only commands for the duration of a run, keyed by tool and command. Running a command
+    that is not read-only drops the memoized results of its tool, since it may have changed what they describe.
+    """
+
+    def __init__(self) -> None:
+        self._results: Dict[Tuple[str, Tuple[str, ...]], object] = {}
+        self._lock = threading.Lock()
+
+    def get(self, tool: str, command: Tuple[str, ...]) -> Optional[object]:
+        with self._lock:
+            return self._results.get((tool, command))
+
+    def put(self, tool: str, command: Tuple[str, ...], result: object) -> None:
+        with self._lock:
+            self._results[(tool, command)] = result
+
+    def invalidate(self, tool: Optional[str] = None) -> None:
+        """
+        Drops the memoized results of one tool, or of every tool if `tool` is None.
+        """
+        with self._lock:
+            if tool is None:
+                self._results.clear()
+            else:
+                for key in [key for key in self._results if key[0] == tool]:
+                    del self._results[key]
+
+
+class CommandRunner:
+    """
+    Runs external commands with asyncio.create_subprocess_exec on an event loop owned by a background thread, which is
+    started on first use; asyncio itself is only imported then, since it dominates the import time of the runner.
+    Commands are limited by a global and a per-tool concurrency cap, killed when they exceed their timeout, and retried
+    with exponential backoff and random jitter when they time out or exit with a status the caller marks as transient.
+    Identical read-only commands are run once per run and their result is shared, including between callers waiting
+    for the same command at the same time. Synchronous code calls `run`, which blocks until the command completes;
+    coroutines can await `run_async` directly on the runner's loop.
+
+    Parameters:
+    - global_limit (int): The maximum number of commands running at the same time.
+    - tool_limits (Optional[Dict[str, int]]): Per-tool caps keyed by executable name, e.g. {'sc': 4}.
+    - timeout (float): The default per-call timeout in seconds.
+    - retries (int): The default number of retries after a transient failure.
+    - backoff (float): The delay before the first retry in seconds; it doubles with every further retry.
+    """
+
+    def __init__(self, global_limit: int = DEFAULT_GLOBAL_LIMIT, tool_limits: Optional[Dict[str, int]] = None,
+                 timeout: float = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                 backoff: float = DEFAULT_BACKOFF) -> None:
+        self.global_limit = global_limit
+        self.tool_limits = dict(DEFAULT_TOOL_LIMITS if tool_limits is None else tool_limits)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = ResultCache()
+        self._loop: "Optional[asyncio.AbstractEventLoop]" = None
+        self._thread: Optional[threading.Thread] = None
+        self._global_semaphore: "Optional[asyncio.Semaphore]" = None
+        self._tool_semaphores: "Dict[str, asyncio.Semaphore]" = {}
+        self._pending: Dict[Tuple[str, Tuple[str, ...]], "asyncio.Future[CommandResult]"] = {}
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> "asyncio.AbstractEventLoop":
+        """
+        Starts the event loop thread on first use.
+        """
+        import asyncio
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name="command-runner", daemon=True)
+                self._thread.start()
+                self._loop = loop
+            return self._loop
+
+    def _tool_semaphore(self, tool: str) -> "Optional[asyncio.Semaphore]":
+        import asyncio
+        if tool not in self.tool_limits:
+            return None
+        if tool not in self._tool_semaphores:
+            self._tool_semaphores[tool] = asyncio.Semaphore(self.tool_limits[tool])
+        return self._tool_semaphores[tool]
+
+    async def _launch(self, argv: List[str], timeout: float) -> Tuple[int, str, str]:
+        """
+        Launches one process under the concurrency caps and waits for it, killing it when the timeout expires.
+
+        Raises:
+        - subprocess.TimeoutExpired: If the process did not finish in time.
+        """
+        import asyncio
+        if self._global_semaphore is None:
+            self._global_semaphore = asyncio.Semaphore(self.global_limit)
+        tool_semaphore = self._tool_semaphore(tool_name(argv))
+        async with self._global_semaphore:
+            if tool_semaphore is not None:
+                await tool_semaphore.acquire()
+            try:
+                process = await asyncio.create_subprocess_exec(*argv, stdin=asyncio.subprocess.DEVNULL,
+                                                               stdout=asyncio.subprocess.PIPE,
+                                                               stderr=asyncio.subprocess.PIPE)
+                try:
+                    stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+                    raise subprocess.TimeoutExpired(argv, timeout)
+            finally:
+                if tool_semaphore is not None:
+                    tool_semaphore.release()
+        return process.returncode, stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+    async def _execute(self, argv: List[str], timeout: float, retries: int,
+                       transient_codes: FrozenSet[int]) -> CommandResult:
+        """
+        Runs a command, retrying it after timeouts and transient exit statuses.
+        """
+        import asyncio
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                returncode, stdout, stderr = await self._launch(argv, timeout)
+                if returncode not in transient_codes or attempt > retries:
+                    return CommandResult(returncode, stdout, stderr, attempt)
+                reason = f"exit status {returncode}"
+            except subprocess.TimeoutExpired as e:
+                if attempt > retries:
+                    e.launches = attempt
+                    raise
+                reason = f"timeout after {timeout:g} s"
+            delay = self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            logging.warning(f"Command '{' '.join(argv)}' failed ({reason}). Retrying in {delay:.2f} s...")
+            await asyncio.sleep(delay)
+
+    async def run_async(self, argv: List[str], timeout: Optional[float] = None, read_only: bool = False,
+                        retries: Optional[int] = None, transient_codes: Iterable[int] = (),
+                        memoize: bool = True) -> CommandResult:
+        """
+        Runs a command on the runner's event loop. See `run` for the parameters.
+        """
+        import asyncio
+        tool = tool_name(argv)
+        key = (tool, tuple(argv))
+        memoize = read_only and memoize
+        if not read_only:
+            self.cache.invalidate(tool)
+        elif memoize:
+            cached = self.cache.get(*key)
+            if cached is not None:
+                return CommandResult(cached.returncode, cached.stdout, cached.stderr, 0)
+            if key in self._pending:
+                result = await asyncio.shield(self._pending[key])
+                return CommandResult(result.returncode, result.stdout, result.stderr, 0)
+            pending = self._pending[key] = asyncio.get_running_loop().create_future()
+            # Mark a failure as retrieved even if no other caller was waiting for this command.
+            pending.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+        try:
+            result = await self._execute(argv, self.timeout if timeout is None else timeout,
+                                         self.retries if retries is None else retries, frozenset(transient_codes))
+        except BaseException as e:
+            if memoize:
+                self._pending.pop(key).set_exception(e)
+            raise
+        if memoize:
+            if result.returncode == 0:
+                self.cache.put(tool, tuple(argv), result)
+            self._pending.pop(key).set_result(result)
+        return result
+
+    def run(self, argv: List[str], timeout: Optional[float] = None, read_only: bool = False,
+            retries: Optional[int] = None, transient_codes: Iterable[int] = (), memoize: bool = True) -> CommandResult:
+        """
+        Runs a command and blocks until it completes. Can be called from any thread except the runner's own.
+
+        Parameters:
+        - argv (List[str]): The command line.
+        - timeout (Optional[float]): The timeout of a single attempt in seconds, by default the runner's timeout.
+        - read_only (bool): Whether the command only reads state; successful read-only results are memoized for the
+          rest of the run. Any other command drops the memoized results of its tool.
+        - retries (Optional[int]): The number of retries after a transient failure, by default the runner's setting.
+          Commands that change state should only be retried if re-sending them is harmless.
+        - transient_codes (Iterable[int]): Exit statuses that indicate a transient failure worth retrying.
+        - memoize (bool): Whether a read-only result is memoized; False for reads of state that changes on its own,
+          such as the status of a service, which still leave the memoized results of the tool in place.
+
+        Returns:
+        - CommandResult: The exit status and output of the command.
+
+        Raises:
+        - subprocess.TimeoutExpired: If every attempt timed out.
+        - OSError: If the executable could not be started.
+        """
+        import asyncio
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(
+            self.run_async(argv, timeout, read_only, retries, transient_codes, memoize), loop)
+        try:
+            result = future.result()
+        except subprocess.TimeoutExpired as e:
+            count_subprocess(getattr(e, "launches", 1))
+            raise
+        count_subprocess(result.launches)
+        return result
+
+    def close(self) -> None:
+        """
+        Stops the event loop thread.
+        """
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            if self._thread is not None:
+                self._thread.join()
+            loop.close()
+
+
+_runner: Optional[CommandRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_runner() -> CommandRunner:
+    """
+    Returns the command runner shared by all steps, creating it on first use.
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = CommandRunner()
+        return _runner
+
+
+def set_runner(runner: Optional[CommandRunner]) -> None:
+    """
+    Replaces the shared command runner, closing the previous one.
+
+    Parameters:
+    - runner (Optional[CommandRunner]): The new shared runner, or None to create a default one on next use.
+    """
+    global _runner
+    with _runner_lock:
+        previous, _runner = _runner, runner
+    if previous is not None and previous is not runner:
+        previous.close()
+
+
+def run_command(argv: List[str], timeout: Optional[float] = None, read_only: bool = False,
+                retries: Optional[int] = None, transient_codes: Iterable[int] = (), memoize: bool = True) -> str:
+    """
+    Runs a command through the shared runner and returns its standard output, the synchronous counterpart of
+    `subprocess.check_output`.
+
+    Parameters:
+    - argv (List[str]): The command line.
+    - timeout (Optional[float]): The timeout of a single attempt in seconds.
+    - read_only (bool): Whether the result may be memoized for the rest of the run.
+    - retries (Optional[int]): The number of retries after a transient failure.
+    - transient_codes (Iterable[int]): Exit statuses worth retrying.
+    - memoize (bool): Whether a read-only result is memoized.
+
+    Returns:
+    - str: The standard output of the command.
+
+    Raises:
+    - subprocess.CalledProcessError: If the command exits with a non-zero status.
+    - subprocess.TimeoutExpired: If every attempt timed out.
+    """
+    result = get_runner().run(argv, timeout, read_only, retries, transient_codes, memoize)
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, argv, result.stdout, result.stderr)
+    return result.stdout
@@ -0,0 +1,533 @@
+import hashlib
+import json
+import os
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field, fields, is_dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config_service import logging
+from state_cache import write_bytes_atomically
+
+CONFIG_CACHE_FILE = ".setup_config_cache.json"
+# Bump whenever the schema or the records change, so caches written by an older version are ignored.
+SCHEMA_VERSION = 3
+
+INVALID = object()
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# A compiled validator: takes a value and its JSON path, appends any errors and returns the converted value or INVALID.
+Validator = Callable[[Any, str, List[str]], Any]
+
+
+@dataclass(frozen=True)
+class FolderSection:
+    enabled: bool
+    paths: Tuple[str, ...]
+    exclude: Tuple[str, ...] = ()
+    max_depth: Optional[int] = None
+    match_brackets: bool = False
+    allowlist: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class LocaleSetting:
+    name: str
+    value: str
+    enabled: bool = False
+
+
+@dataclass(frozen=True)
+class LocaleSection:
+    enabled: bool
+    format_options: Tuple[LocaleSetting, ...]
+
+
+@dataclass(frozen=True)
+class ServiceEntry:
+    name: str
+    startup_type: str
+    service_status: str
+    enabled: bool = True
+
+
+@dataclass(frozen=True)
+class ServiceSection:
+    enabled: bool
+    services: Tuple[ServiceEntry, ...]
+    allowlist: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class DefenderExclusion:
+    type: str
+    path: str
+
+
+@dataclass(frozen=True)
+class DefenderSection:
+    enabled: bool
+    exclusions: Tuple[DefenderExclusion, ...]
+    exclude: Tuple[str, ...] = ()
+    max_depth: Optional[int] = None
+    match_brackets: bool = False
+    allowlist: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class RegistryTweak:
+    hive: str
+    key: str
+    name: str
+    value: Any
+    value_type: int
+    enabled: bool = True
+
+
+@dataclass(frozen=True)
+class RegistryTweakSection:
+    enabled: bool
+    tweaks: Tuple[RegistryTweak, ...]
+
+
+def child_path(path: str, key: Any) -> str:
+    """
+    Appends an object key or a list index to a JSON path, e.g. '$.services[3]' or "$.formatOptions['s Date']".
+    """
+    if isinstance(key, int):
+        return f"{path}[{key}]"
+    return f"{path}.{key}" if IDENTIFIER.match(key) else f"{path}[{key!r}]"
+
+
+class Node(ABC):
+    """
+    A schema node. `compile` turns it into a validator function once, so validating a configuration is a chain of
+    plain function calls without any schema interpretation.
+    """
+
+    @abstractmethod
+    def compile(self) -> Validator:
+        """
+        Builds the validator function of this node.
+        """
+
+
+class Scalar(Node):
+    """
+    A value of one of the given JSON types, optionally restricted to a set of choices, to a minimum, or expanded with
+    os.path.expandvars. Choices are matched exactly, since the steps look the configured spelling up as is; with
+    `ignore_case`, for values the steps normalize themselves, they are matched case-insensitively and converted to the
+    canonical spelling.
+    """
+
+    def __init__(self, types: Tuple[type, ...], description: str, choices: Optional[List[str]] = None,
+                 minimum: Optional[int] = None, expand: bool = False, ignore_case: bool = False) -> None:
+        self.types = types
+        self.description = description
+        self.choices = choices
+        self.minimum = minimum
+        self.expand = expand
+        self.ignore_case = ignore_case
+
+    def compile(self) -> Validator:
+        types, description, minimum, expand = self.types, self.description, self.minimum, self.expand
+        fold = str.lower if self.ignore_case else str
+        choices = {fold(choice): choice for choice in self.choices} if self.choices else None
+        rejects_bool = bool not in types
+
+        def validate(value: Any, path: str, errors: List[str]) -> Any:
+            if not isinstance(value, types) or (rejects_bool and isinstance(value, bool)):
+                errors.append(f"{path}: expected {description}, got {type(value).__name__} {value!r}")
+                return INVALID
+            if choices is not None:
+                canonical = choices.get(fold(value))
+                if canonical is None:
+                    errors.append(f"{path}: expected one of {', '.join(choices.values())}, got {value!r}")
+                    return INVALID
+                return canonical
+            if minimum is not None and value < minimum:
+                errors.append(f"{path}: expected at least {minimum}, got {value!r}")
+                return INVALID
+            return os.path.expandvars(value) if expand else value
+        return validate
+
+
+class AnyValue(Node):
+    """
+    Any JSON value, checked by the enclosing record.
+    """
+
+    def compile(self) -> Validator:
+        return lambda value, path, errors: value
+
+
+class ListOf(Node):
+    """
+    A list whose entries all match one node, converted to a tuple.
+    """
+
+    def __init__(self, item: Node) -> None:
+        self.item = item
+
+    def compile(self) -> Validator:
+        validate_item = self.item.compile()
+
+        def validate(value: Any, path: str, errors: List[str]) -> Any:
+            if not isinstance(value, list):
+                errors.append(f"{path}: expected a list, got {type(value).__name__}")
+                return INVALID
+            items = tuple(validate_item(entry, f"{path}[{index}]", errors) for index, entry in enumerate(value))
+            return INVALID if any(item is INVALID for item in items) else items
+        return validate
+
+
+@dataclass
+class Field:
+    """
+    A member of a record: the JSON key, the record attribute it fills, its node and whether it is required.
+    """
+    key: str
+    attribute: str
+    node: Node
+    required: bool = True
+
+
+class Record(Node):
+    """
+    A JSON object converted to an immutable record. Every field is validated, missing required fields are reported,
+    and the optional `check` may convert the collected attributes or report an error that concerns several fields.
+    Inside a `MapOf`, the mapping key is passed in as an extra attribute.
+    """
+
+    def __init__(self, factory: Callable[..., Any], fields: List[Field],
+                 check: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None) -> None:
+        self.factory = factory
+        self.fields = fields
+        self.check = check
+
+    def compile(self) -> Validator:
+        compiled = [(item.key, item.attribute, item.node.compile(), item.required) for item in self.fields]
+        factory, check = self.factory, self.check
+
+        def validate(value: Any, path: str, errors: List[str], extra: Optional[Dict[str, Any]] = None) -> Any:
+            if not isinstance(value, dict):
+                errors.append(f"{path}: expected an object, got {type(value).__name__}")
+                return INVALID
+            attributes = dict(extra or {})
+            valid = True
+            for key, attribute, validate_field, required in compiled:
+                if key not in value:
+                    if required:
+                        errors.append(f"{path}: missing required key '{key}'")
+                        valid = False
+                    continue
+                converted = validate_field(value[key], child_path(path, key), errors)
+                if converted is INVALID:
+                    valid = False
+                else:
+                    attributes[attribute] = converted
+            if not valid:
+                return INVALID
+            if check is not None:
+                error = check(attributes)
+                if error:
+                    errors.append(f"{path}: {error}")
+                    return INVALID
+            return factory(**attributes)
+        return validate
+
+
+class MapOf(Node):
+    """
+    A JSON object whose values are records; each key fills the record's `key_attribute`. Converted to a tuple of
+    records in the configured order.
+    """
+
+    def __init__(self, record: Record, key_attribute: str) -> None:
+        self.record = record
+        self.key_attribute = key_attribute
+
+    def compile(self) -> Validator:
+        validate_record = self.record.compile()
+        key_attribute = self.key_attribute
+
+        def validate(value: Any, path: str, errors: List[str]) -> Any:
+            if not isinstance(value, dict):
+                errors.append(f"{path}: expected an object, got {type(value).__name__}")
+                return INVALID
+            items = tuple(validate_record(entry, child_path(path, key), errors, {key_attribute: key})
+                          for key, entry in value.items())
+            return INVALID if any(item is INVALID for item in items) else items
+        return validate
+
+
+def check_tweak(attributes: Dict[str, Any]) -> Optional[str]:
+    """
+    Converts a tweak's hive, key path and value with the registry step's own parser, reporting a value that does not
+    fit its type.
+    """
+    from set_registry_tweaks import parse_tweak
+    try:
+        (hive, key_path), name, (value, value_type) = parse_tweak(attributes)
+    except ValueError as e:
+        return str(e)
+    attributes.update(hive=hive, key=key_path, name=name, value=value, value_type=value_type)
+    del attributes["type"]
+    return None
+
+
+def check_exclusion(attributes: Dict[str, Any]) -> Optional[str]:
+    """
+    Expands environment variables in the paths of folder and file exclusions.
+    """
+    if attributes["type"] in ("Folder", "File"):
+        attributes["path"] = os.path.expandvars(attributes["path"])
+    return None
+
+
+def build_schema() -> Dict[str, Record]:
+    """
+    Declares the schema of every configuration section. The choices are taken from the step modules, so the schema
+    accepts exactly what the steps can apply.
+    """
+    from add_defender_exclusions import CMDLETS
+    from set_registry_tweaks import HIVES, VALUE_TYPES
+    from set_services import SC_STARTUP_TYPES
+    from service_control import CONTROL_TARGET_STATUS
+
+    boolean = Scalar((bool,), "a boolean")
+    string = Scalar((str,), "a string")
+    path = Scalar((str,), "a path", expand=True)
+    depth = Scalar((int,), "an integer", minimum=0)
+    pattern_fields = [Field("exclude", "exclude", ListOf(string), required=False),
+                      Field("maxDepth", "max_depth", depth, required=False),
+                      Field("matchBrackets", "match_brackets", boolean, required=False)]
+    # Entries reconcile mode never removes although the configuration does not list them.
+    allowlist = Field("allowlist", "allowlist", ListOf(string), required=False)
+    folders = Record(FolderSection, [Field("enabled", "enabled", boolean),
+                                     Field("paths", "paths", ListOf(path))])
+    return {
+        "createFolders": folders,
+        "hideFolders": Record(FolderSection, folders.fields + pattern_fields + [allowlist]),
+        "localeSettings": Record(LocaleSection, [
+            Field("enabled", "enabled", boolean),
+            Field("formatOptions", "format_options", MapOf(Record(LocaleSetting, [
+                Field("enabled", "enabled", boolean, required=False),
+                Field("value", "value", string),
+            ]), "name")),
+        ]),
+        "servicesSettings": Record(ServiceSection, [
+            Field("enabled", "enabled", boolean),
+            Field("services", "services", ListOf(Record(ServiceEntry, [
+                Field("enabled", "enabled", boolean, required=False),
+                Field("name", "name", string),
+                Field("startupType", "startup_type", Scalar((str,), "a startup type", list(SC_STARTUP_TYPES))),
+                Field("serviceStatus", "service_status",
+                      Scalar((str,), "a service status", [action.capitalize() for action in CONTROL_TARGET_STATUS],
+                             ignore_case=True)),
+            ]))),
+            allowlist,
+        ]),
+        "excludeFromDefender": Record(DefenderSection, [
+            Field("enabled", "enabled", boolean),
+            Field("exclusions", "exclusions", ListOf(Record(DefenderExclusion, [
+                Field("type", "type", Scalar((str,), "an exclusion type", list(CMDLETS))),
+                Field("path", "path", string),
+            ], check_exclusion))),
+        ] + pattern_fields + [allowlist]),
+        "registryTweaks": Record(RegistryTweakSection, [
+            Field("enabled", "enabled", boolean),
+            Field("tweaks", "tweaks", ListOf(Record(RegistryTweak, [
+                Field("enabled", "enabled", boolean, required=False),
+                Field("hive", "hive", Scalar((str,), "a hive", list(HIVES), ignore_case=True)),
+                Field("key", "key", string),
+                Field("name", "name", string),
+                Field("type", "type", Scalar((str,), "a value type", list(VALUE_TYPES) + [
+                    f"REG_{name}" for name in VALUE_TYPES], ignore_case=True)),
+                Field("value", "value", AnyValue()),
+            ], check_tweak))),
+        ]),
+    }
+
+
+_validators: Optional[Dict[str, Validator]] = None
+
+
+def section_validators() -> Dict[str, Validator]:
+    """
+    Returns the compiled validator of every section, compiling the schema on first use.
+    """
+    global _validators
+    if _validators is None:
+        _validators = {name: record.compile() for name, record in build_schema().items()}
+    return _validators
+
+
+@dataclass(frozen=True)
+class CompiledConfig:
+    """
+    A parsed and validated configuration: the JSON data as read, which the steps consume, the typed records of every
+    valid section, with environment variables in paths expanded, and the errors of every invalid section, each
+    prefixed with its JSON path.
+    """
+    data: Dict[str, Any]
+    sections: Dict[str, Any]
+    errors: Dict[str, List[str]] = field(default_factory=dict)
+
+
+def compile_config(data: Dict[str, Any]) -> CompiledConfig:
+    """
+    Validates every section of a parsed configuration and converts the valid ones to records. Every error is
+    collected instead of stopping at the first one.
+
+    Parameters:
+    - data (Dict[str, Any]): The parsed configuration file.
+
+    Returns:
+    - CompiledConfig: The records and the errors per section.
+    """
+    sections: Dict[str, Any] = {}
+    errors: Dict[str, List[str]] = {}
+    for name, validate in section_validators().items():
+        path = child_path("$", name)
+        if name not in data:
+            errors[name] = [f"{path}: missing section"]
+            continue
+        section_errors: List[str] = []
+        record = validate(data[name], path, section_errors)
+        if section_errors:
+            errors[name] = section_errors
+        else:
+            sections[name] = record
+    return CompiledConfig(data, sections, errors)
+
+
+RECORD_TYPES = {record_type.__name__: record_type for record_type in (
+    FolderSection, LocaleSetting, LocaleSection, ServiceEntry, ServiceSection, DefenderExclusion, DefenderSection,
+    RegistryTweak, RegistryTweakSection)}
+
+
+def encode_records(value: Any) -> Any:
+    """
+    Converts records to plain JSON values for the configuration cache. Records become objects tagged with their type,
+    and tuples and bytes are tagged so `decode_records` restores them exactly.
+    """
+    if is_dataclass(value):
+        encoded = {item.name: encode_records(getattr(value, item.name)) for item in fields(value)}
+        return {"record": type(value).__name__, "fields": encoded}
+    if isinstance(value, tuple):
+        return {"tuple": [encode_records(entry) for entry in value]}
+    if isinstance(value, bytes):
+        return {"bytes": value.hex()}
+    if isinstance(value, list):
+        return [encode_records(entry) for entry in value]
+    if isinstance(value, dict):
+        return {"dict": {key: encode_records(entry) for key, entry in value.items()}}
+    return value
+
+
+def decode_records(value: Any) -> Any:
+    """
+    Restores the records encoded by `encode_records`. Only the record types of this schema are created, so a cache
+    file cannot make the loader build arbitrary objects.
+
+    Raises:
+    - ValueError: If the value names an unknown record type or is not an encoded value.
+    """
+    if isinstance(value, list):
+        return [decode_records(entry) for entry in value]
+    if not isinstance(value, dict):
+        return value
+    if "record" in value:
+        record_type = RECORD_TYPES.get(value["record"])
+        if record_type is None:
+            raise ValueError(f"unknown record type {value['record']!r}")
+        return record_type(**{name: decode_records(entry) for name, entry in value["fields"].items()})
+    if "tuple" in value:
+        return tuple(decode_records(entry) for entry in value["tuple"])
+    if "bytes" in value:
+        return bytes.fromhex(value["bytes"])
+    if "dict" in value:
+        return {key: decode_records(entry) for key, entry in value["dict"].items()}
+    raise ValueError(f"unexpected cached value {value!r}")
+
+
+def cache_key(content: bytes) -> str:
+    """
+    Derives the cache key of a configuration from the file content and the environment, since paths in the records
+    have environment variables expanded.
+    """
+    digest = hashlib.sha256(content)
+    digest.update(repr(sorted(os.environ.items())).encode("utf-8"))
+    return f"{SCHEMA_VERSION}:{digest.hexdigest()}"
+
+
+def load_config(file_path: str, cache_file: Optional[str] = CONFIG_CACHE_FILE) -> Optional[CompiledConfig]:
+    """
+    Reads, parses and validates a configuration file. The records and errors are cached as JSON in `cache_file` under
+    a key derived from the file's hash, so a later run with an unchanged file and environment skips validation. The
+    steps always receive the data parsed from the file itself, never data taken from the cache.
+
+    Parameters:
+    - file_path (str): The configuration file.
+    - cache_file (Optional[str]): The file the compiled configuration is cached in, or None to disable the cache.
+
+    Returns:
+    - Optional[CompiledConfig]: The compiled configuration, or None if the file cannot be read or parsed.
+    """
+    try:
+        with open(file_path, "rb") as file:
+            content = file.read()
+    except OSError as e:
+        logging.error(f"Configuration file '{file_path}' cannot be read: {str(e)}")
+        return None
+
+    try:
+        data = json.loads(content)
+    except ValueError:
+        logging.error(f"Invalid JSON in the configuration file '{file_path}'.")
+        return None
+    if not isinstance(data, dict):
+        logging.error(f"The configuration file '{file_path}' must contain a JSON object.")
+        return None
+
+    key = cache_key(content)
+    if cache_file:
+        try:
+            with open(cache_file, "r", encoding="utf-8") as file:
+                cached = json.load(file)
+            if cached.get("key") == key:
+                logging.debug(f"Using the compiled configuration cached in '{cache_file}'.")
+                return CompiledConfig(data, decode_records(cached["sections"]), cached["errors"])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.debug(f"Ignoring the configuration cache '{cache_file}': {str(e)}")
+
+    compiled = compile_config(data)
+    if cache_file:
+        cached = {"key": key, "sections": encode_records(compiled.sections), "errors": compiled.errors}
+        try:
+            write_bytes_atomically(cache_file, json.dumps(cached).encode("utf-8"))
+        except OSError as e:
+            logging.warning(f"Failed to write the configuration cache '{cache_file}': {str(e)}")
+    return compiled
+
+
+def report_errors(compiled: CompiledConfig, sections: List[str]) -> bool:
+    """
+    Logs every error of the given sections.
+
+    Parameters:
+    - compiled (CompiledConfig): The compiled configuration.
+    - sections (List[str]): The names of the sections that will be used.
+
+    Returns:
+    - bool: True if any of the sections has errors.
+    """
+    found = False
+    for name in sections:
+        for error in compiled.errors.get(name, []):
+            logging.error(f"Invalid configuration: {error}")
+            found = True
+    return found
@@ -1,23 +1,149 @@
+import atexit
 import json
 import logging
-from typing import Any, Dict, List
+import logging.handlers
+import queue
+import re
+from typing import Any, Dict, List, Optional
 
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+# Number of records the file sink buffers before writing them, unless an error forces an earlier flush.
+LOG_FILE_BUFFER = 512
+# Informational messages reporting that nothing had to be done; with aggregation they are counted instead of printed.
+REPETITIVE_MESSAGE = re.compile(r"\balready\b|Skipping\.\.\.$")
+# Values elided from aggregated messages: quoted strings, bytes, lists and numbers.
+MESSAGE_VALUE = re.compile(r"b?'[^']*'|\[[^\]]*\]|\b\d+\b")
 
-def setup_logging(level: str = "INFO") -> None:
+_listener: Optional[logging.handlers.QueueListener] = None
+_counter: Optional["RepetitionCounter"] = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats every record as one JSON object with its time, level, module, thread and message.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, LOG_DATE_FORMAT),
+            "level": record.levelname,
+            "module": record.module,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class RepetitionCounter(logging.Filter):
+    """
+    A filter for the console sink that drops informational messages matching `REPETITIVE_MESSAGE`, such as "already
+    set" and "Skipping..." notices, and counts them per module and message template (the message with its values,
+    such as quoted paths and numbers, replaced by '*'), so a summary can replace thousands of nearly identical lines.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.counts: Dict[tuple, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.INFO or getattr(record, "summary", False):
+            return True
+        message = record.getMessage()
+        if not REPETITIVE_MESSAGE.search(message):
+            return True
+        key = (record.module, MESSAGE_VALUE.sub("*", message))
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return False
+
+
+def setup_logging(level: str = "INFO", file_path: Optional[str] = None, file_level: Optional[str] = None,
+                  json_lines: bool = False, aggregate: bool = False) -> None:
     """
     Configures the logging system to use a specified log level. This function removes any existing handlers from the
-    root logger before setting up a new handler to ensure that logs are not duplicated. It uses a standard logging
-    format that includes the timestamp, log level, and message.
+    root logger before setting up new ones to ensure that logs are not duplicated. Logging calls only put the record
+    on a queue; a background listener thread formats it and writes it to the console, using a standard format that
+    includes the timestamp, log level, and message, and optionally to a rotating log file that is written in buffered
+    batches. The pipeline is flushed and stopped by `shutdown_logging`, which also runs when the interpreter exits.
 
     Parameters:
-    - level (str): A string representing the logging level ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL').
+    - level (str): A string representing the console logging level ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL').
+    - file_path (Optional[str]): The log file, rotated when it grows beyond `LOG_FILE_MAX_BYTES`, or None for no file.
+    - file_level (Optional[str]): The logging level of the log file, by default the console level.
+    - json_lines (bool): Whether the log file is written as one JSON object per line instead of plain text.
+    - aggregate (bool): Whether repetitive informational messages are counted instead of printed on the console; the
+      counts are logged as a summary by `shutdown_logging`. The log file always receives every message.
     """
+    global _listener, _counter
     numeric_level = getattr(logging, level.upper(), None)
     if numeric_level is None:
         raise ValueError(f"Invalid logging level: {level}")
-    logging.root.handlers = []  # Remove any existing handlers
-    logging.basicConfig(level=numeric_level, format='%(asctime)s - %(levelname)s - %(message)s',
-                        datefmt='%Y-%m-%d %H:%M:%S')
+    numeric_file_level = getattr(logging, (file_level or level).upper(), None)
+    if numeric_file_level is None:
+        raise ValueError(f"Invalid logging level: {file_level}")
+    shutdown_logging()
+
+    console = logging.StreamHandler()
+    console.setLevel(numeric_level)
+    console.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+    _counter = RepetitionCounter() if aggregate else None
+    if _counter is not None:
+        console.addFilter(_counter)
+    sinks: List[logging.Handler] = [console]
+
+    root_level = numeric_level
+    if file_path:
+        file_handler = logging.handlers.RotatingFileHandler(file_path, maxBytes=LOG_FILE_MAX_BYTES,
+                                                            backupCount=LOG_FILE_BACKUPS, encoding="utf-8",
+                                                            delay=True)
+        file_handler.setFormatter(JsonLinesFormatter() if json_lines
+                                  else logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+        buffered = logging.handlers.MemoryHandler(LOG_FILE_BUFFER, flushLevel=logging.ERROR, target=file_handler)
+        buffered.setLevel(numeric_file_level)
+        sinks.append(buffered)
+        root_level = min(root_level, numeric_file_level)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    logging.root.handlers = [logging.handlers.QueueHandler(log_queue)]  # Remove any existing handlers
+    logging.root.setLevel(root_level)
+    _listener = logging.handlers.QueueListener(log_queue, *sinks, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """
+    Logs the summary of the aggregated repetitive messages, waits until every queued record has been written, flushes
+    and closes the sinks and restores a plain console handler for anything logged afterwards.
+    """
+    global _listener, _counter
+    if _listener is None:
+        return
+    listener, counter, _listener, _counter = _listener, _counter, None, None
+    listener.stop()
+    if counter is not None and counter.counts:
+        lines = ["Repetitive messages not shown:"]
+        lines += [f"  {module}: {count} x {template}" for (module, template), count in sorted(counter.counts.items())]
+        for line in lines:
+            record = logging.root.makeRecord("root", logging.INFO, __file__, 0, line, None, None,
+                                             extra={"summary": True})
+            for handler in listener.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+    for handler in listener.handlers:
+        # MemoryHandler.close() flushes to the target and then detaches it, so the target is captured beforehand.
+        target = handler.target if isinstance(handler, logging.handlers.MemoryHandler) else None
+        handler.close()
+        if target is not None:
+            target.close()
+    logging.root.handlers = []
+    logging.basicConfig(level=logging.root.level, format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+
+atexit.register(shutdown_logging)
 
 
 def read_config_file(file_path: str) -> Dict[str, Any]:
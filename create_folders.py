@@ -1,49 +1,116 @@
 import os
-from typing import List
+from typing import Any, Dict, List, Optional
 
+from change_plan import PlannedChange, parse_module_arguments, print_plan
+from checkpoint import get_checkpoint
 from config_service import setup_logging, read_config_file, validate_config_section, logging
+from fs_engine import DEFAULT_WORKERS, create_directories, normalize_path, spellings_by_path
 
 CONFIG_FILE = "config.json"
 
 
-def create_folders(folders_list: List[str], enabled: bool) -> None:
+def create_folders(folders_list: List[str], enabled: bool, workers: int = DEFAULT_WORKERS) -> Dict[str, str]:
     """
     Creates directories specified in `folders_list` if `enabled` is True. Each folder is created only if it does not
     already exist. The function logs the outcome of each attempt to create a directory, including cases where the
     directory already exists, where the creation is successful, and where an error occurs during creation. Paths in
-    `folders_list` can include environment variables, which are expanded to their values.
+    `folders_list` can include environment variables, which are expanded to their values. The work is done by the
+    filesystem engine, which expands and deduplicates the paths once, creates shared parent directories only once and
+    processes independent directory trees in parallel. Every folder that exists afterwards is marked as completed in
+    the run's checkpoint.
 
     Parameters:
     - folders_list (List[str]): A list of directory paths to create.
     - enabled (bool): If False, directory creation is skipped, and a log entry is made indicating it's disabled.
+    - workers (int): The maximum number of independent directory trees processed at the same time.
+
+    Returns:
+    - Dict[str, str]: The outcome ('exists', 'created' or 'failed') keyed by expanded path.
     """
     if not enabled:
         logging.info("Directory creation is skipped as it's disabled by configuration.")
-        return
+        return {}
+
+    checkpoint = get_checkpoint()
+    spellings = spellings_by_path(folders_list)
+
+    def complete(path: str) -> None:
+        checkpoint.complete("create_folders", spellings[normalize_path(path)], "directory")
+
+    return create_directories(folders_list, workers, complete)
+
+
+def plan_step(section: Dict[str, Any]) -> List[PlannedChange]:
+    """
+    Determines, without creating anything, which of the directories in the 'createFolders' section do not exist yet.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'createFolders' section of the configuration.
 
-    for folder_path in folders_list:
-        if not folder_path:
-            logging.error("Received an empty string as a folder path. Skipping...")
-            continue
+    Returns:
+    - List[PlannedChange]: One 'create' change per missing directory.
+    """
+    return [PlannedChange("create_folders", folder_path, "create", "missing", "present")
+            for folder_path in dict.fromkeys(section["paths"])
+            if folder_path and not os.path.isdir(os.path.expandvars(folder_path))]
 
-        folder_path = os.path.expandvars(folder_path)
 
-        if os.path.exists(folder_path):
-            logging.info(f"Directory '{folder_path}' already exists.")
-        else:
-            try:
-                os.makedirs(folder_path)
-                logging.info(f"Directory '{folder_path}' created successfully.")
-            except Exception as e:
-                logging.error(f"Failed to create directory '{folder_path}': {str(e)}")
+def state_validator(folder_path: str) -> Optional[str]:
+    """
+    Returns a cheap validator for the state cache: the modification time of the directory, or 'missing' if it does not
+    exist, so a deleted directory invalidates its cached record.
+
+    Parameters:
+    - folder_path (str): The directory path as written in the configuration.
+
+    Returns:
+    - Optional[str]: The validator value.
+    """
+    try:
+        return str(os.stat(os.path.expandvars(folder_path)).st_mtime_ns)
+    except OSError:
+        return "missing"
+
+
+def inventory_step(section: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Captures whether each directory in the 'createFolders' section exists, without creating anything.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'createFolders' section of the configuration.
+
+    Returns:
+    - Dict[str, str]: 'present' or 'missing', keyed by the configured path.
+    """
+    return {folder_path: "present" if os.path.isdir(os.path.expandvars(folder_path)) else "missing"
+            for folder_path in section["paths"] if folder_path}
+
+
+def desired_step(section: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Returns the state `inventory_step` reports for each directory of the 'createFolders' section once it is applied.
+    """
+    return {folder_path: "present" for folder_path in section["paths"] if folder_path}
+
+
+def run_step(section: Dict[str, Any]) -> None:
+    """
+    Runs this module as a step of the unified setup runner, creating the configured directories from the already
+    validated 'createFolders' section.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'createFolders' section of the configuration.
+    """
+    create_folders(section["paths"], section["enabled"])
 
 
 def main() -> None:
     """
     Executes the main functionality of the script which includes setting up logging, reading the configuration file,
     validating the 'createFolders' configuration section, and conditionally creating directories based on the
-    configuration.
+    configuration. With '--plan', only prints the changes it would make.
     """
+    args = parse_module_arguments("Applies the 'createFolders' section of the configuration.")
     setup_logging()
     config_data = read_config_file(CONFIG_FILE)
 
@@ -59,6 +126,10 @@ def main() -> None:
         logging.error("The 'createFolders' section in the configuration is invalid.")
         return
 
+    if args.plan:
+        print_plan(config_data["createFolders"], plan_step)
+        return
+
     create_folders(config_data["createFolders"]["paths"], config_data["createFolders"]["enabled"])
 
 
@@ -0,0 +1,408 @@
+import os
+import stat
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from backend_registry import get_backend, register_backend, set_backend
+from config_service import logging
+from metrics import instrument
+from undo_journal import get_journal
+
+FILE_ATTRIBUTE_READONLY = 0x0001
+FILE_ATTRIBUTE_HIDDEN = 0x0002
+FILE_ATTRIBUTE_SYSTEM = 0x0004
+FILE_ATTRIBUTE_DIRECTORY = 0x0010
+FILE_ATTRIBUTE_ARCHIVE = 0x0020
+FILE_ATTRIBUTE_NORMAL = 0x0080
+FILE_ATTRIBUTE_TEMPORARY = 0x0100
+FILE_ATTRIBUTE_OFFLINE = 0x1000
+FILE_ATTRIBUTE_NOT_CONTENT_INDEXED = 0x2000
+INVALID_FILE_ATTRIBUTES = 0xFFFFFFFF
+
+# The attribute bits SetFileAttributesW accepts; the others are managed by the file system.
+SETTABLE_ATTRIBUTES = (FILE_ATTRIBUTE_READONLY | FILE_ATTRIBUTE_HIDDEN | FILE_ATTRIBUTE_SYSTEM | FILE_ATTRIBUTE_ARCHIVE
+                       | FILE_ATTRIBUTE_NORMAL | FILE_ATTRIBUTE_TEMPORARY | FILE_ATTRIBUTE_OFFLINE
+                       | FILE_ATTRIBUTE_NOT_CONTENT_INDEXED)
+
+DEFAULT_WORKERS = 8
+
+
+class AttributeBackend(ABC):
+    """
+    The interface used to read and write Windows file attributes. `get_attributes` doubles as the existence check, so
+    each path needs a single call.
+    """
+
+    @abstractmethod
+    def get_attributes(self, path: str) -> int:
+        """
+        Returns the attribute bits of a path.
+
+        Raises:
+        - FileNotFoundError: If the path does not exist.
+        - OSError: If the attributes cannot be read.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_attributes(self, path: str, attributes: int) -> None:
+        """
+        Replaces the settable attribute bits of a path.
+
+        Raises:
+        - OSError: If the attributes cannot be written.
+        """
+        raise NotImplementedError
+
+
+class Win32AttributeBackend(AttributeBackend):
+    """
+    Reads and writes attributes with GetFileAttributesW and SetFileAttributesW.
+    """
+
+    def __init__(self) -> None:
+        import ctypes
+        from ctypes import wintypes
+        self._ctypes = ctypes
+        self._kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        self._kernel32.GetFileAttributesW.argtypes = [wintypes.LPCWSTR]
+        self._kernel32.GetFileAttributesW.restype = wintypes.DWORD
+        self._kernel32.SetFileAttributesW.argtypes = [wintypes.LPCWSTR, wintypes.DWORD]
+        self._kernel32.SetFileAttributesW.restype = wintypes.BOOL
+
+    def get_attributes(self, path: str) -> int:
+        attributes = self._kernel32.GetFileAttributesW(path)
+        if attributes == INVALID_FILE_ATTRIBUTES:
+            error = self._ctypes.get_last_error()
+            raise self._ctypes.WinError(error)
+        return attributes
+
+    def set_attributes(self, path: str, attributes: int) -> None:
+        if not self._kernel32.SetFileAttributesW(path, attributes & SETTABLE_ATTRIBUTES):
+            raise self._ctypes.WinError(self._ctypes.get_last_error())
+
+
+class MemoryAttributeBackend(AttributeBackend):
+    """
+    An attribute backend for running the folder steps without Windows. Existence comes from a single os.stat of the
+    real path, so it works with temporary directories, while the attribute bits are kept in a dictionary. Reads and
+    writes are counted, and an optional latency is added to every call to model the cost of the real API.
+
+    Parameters:
+    - attributes (Optional[Dict[str, int]]): Initial attribute bits keyed by normalized path.
+    - latency (float): Seconds added to every read and write.
+    """
+
+    def __init__(self, attributes: Optional[Dict[str, int]] = None, latency: float = 0.0) -> None:
+        self.attributes = {normalize_path(path): value for path, value in (attributes or {}).items()}
+        self.latency = latency
+        self.reads = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def get_attributes(self, path: str) -> int:
+        if self.latency:
+            time.sleep(self.latency)
+        stat_result = os.stat(path)
+        with self._lock:
+            self.reads += 1
+            default = FILE_ATTRIBUTE_DIRECTORY if stat.S_ISDIR(stat_result.st_mode) else FILE_ATTRIBUTE_ARCHIVE
+            return self.attributes.get(normalize_path(path), default)
+
+    def set_attributes(self, path: str, attributes: int) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        os.stat(path)
+        with self._lock:
+            self.writes += 1
+            current = self.attributes.get(normalize_path(path), 0)
+            current &= ~SETTABLE_ATTRIBUTES
+            self.attributes[normalize_path(path)] = current | (attributes & SETTABLE_ATTRIBUTES)
+
+
+register_backend("attributes", "windows", Win32AttributeBackend, default=True)
+register_backend("attributes", "memory", MemoryAttributeBackend)
+
+
+def get_attribute_backend() -> AttributeBackend:
+    """
+    Returns the attribute backend used when none is given explicitly, creating the selected backend, by default the
+    Win32 API, on first use.
+    """
+    return get_backend("attributes")
+
+
+def set_attribute_backend(backend: Optional[AttributeBackend]) -> None:
+    """
+    Replaces the default attribute backend, for example with a `MemoryAttributeBackend` to run the folder steps on
+    Linux.
+
+    Parameters:
+    - backend (Optional[AttributeBackend]): The new default backend, or None to use the selected backend again.
+    """
+    set_backend("attributes", backend)
+
+
+def normalize_path(path: str) -> str:
+    """
+    Normalizes a path for comparisons: separators, '..' segments and, on Windows, letter case.
+    """
+    return os.path.normcase(os.path.normpath(path))
+
+
+def expand_paths(paths: Iterable[str]) -> List[str]:
+    """
+    Expands environment variables in every path once and removes duplicates, keeping the first spelling and the
+    configured order. Empty entries are logged and dropped.
+
+    Parameters:
+    - paths (Iterable[str]): The paths as written in the configuration.
+
+    Returns:
+    - List[str]: The unique expanded paths.
+    """
+    seen: Set[str] = set()
+    expanded = []
+    for path in paths:
+        if not path:
+            logging.error("Received an empty string as a folder path. Skipping...")
+            continue
+        expanded_path = os.path.expandvars(path)
+        key = normalize_path(expanded_path)
+        if key not in seen:
+            seen.add(key)
+            expanded.append(expanded_path)
+    return expanded
+
+
+def spellings_by_path(paths: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    Groups the configured paths by the normalized expanded path `expand_paths` reduces them to, so the outcome of an
+    expanded path can be traced back to the configuration entries it came from.
+
+    Parameters:
+    - paths (Iterable[str]): The paths as written in the configuration.
+
+    Returns:
+    - Dict[str, List[str]]: The configured spellings keyed by normalized expanded path.
+    """
+    spellings: Dict[str, List[str]] = {}
+    for path in paths:
+        if path:
+            spellings.setdefault(normalize_path(os.path.expandvars(path)), []).append(path)
+    return spellings
+
+
+def group_by_root(paths: List[str]) -> List[List[str]]:
+    """
+    Splits paths into independent subtrees that can be processed in parallel. Per drive, the paths are keyed by their
+    first component below the directory all of them share, so for example every folder under the user profile gets its
+    own group; a path that is the shared directory itself joins the first group. Paths inside a group are ordered
+    parents first, so shared ancestors are handled before their children.
+
+    Parameters:
+    - paths (List[str]): The expanded paths.
+
+    Returns:
+    - List[List[str]]: The groups of paths.
+    """
+    by_drive: Dict[str, List[str]] = {}
+    for path in paths:
+        by_drive.setdefault(os.path.splitdrive(normalize_path(os.path.abspath(path)))[0], []).append(path)
+
+    groups: List[List[str]] = []
+    for drive, drive_paths in by_drive.items():
+        absolute_paths = [normalize_path(os.path.abspath(path)) for path in drive_paths]
+        common = os.path.commonpath(absolute_paths) if len(absolute_paths) > 1 else os.path.dirname(absolute_paths[0])
+        drive_groups: Dict[str, List[str]] = {}
+        at_common = []
+        for path, absolute_path in zip(drive_paths, absolute_paths):
+            relative = os.path.relpath(absolute_path, common)
+            if relative == os.curdir:
+                at_common.append(path)
+            else:
+                drive_groups.setdefault(os.path.join(common, relative.split(os.sep)[0]), []).append(path)
+        drive_lists = list(drive_groups.values()) or [[]]
+        # The shared directory itself joins the first group rather than forming one that runs alongside its children.
+        drive_lists[0] = at_common + drive_lists[0]
+        groups.extend(drive_lists)
+    return [sorted(group, key=lambda path: normalize_path(path).count(os.sep)) for group in groups]
+
+
+def run_groups(groups: List[List[str]], handle_group, workers: int) -> None:
+    """
+    Runs `handle_group` for every group, concurrently when there is more than one group.
+    """
+    if len(groups) <= 1 or workers <= 1:
+        for group in groups:
+            handle_group(group)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(handle_group, groups))
+
+
+def create_directories(paths: Iterable[str], workers: int = DEFAULT_WORKERS,
+                       on_done: Optional[Callable[[str], None]] = None) -> Dict[str, str]:
+    """
+    Creates every directory that does not exist yet. Paths are expanded and deduplicated once and grouped into
+    independent subtrees that are processed in parallel. Within a subtree, directories known to exist are remembered,
+    so each path and each shared ancestor is checked with at most one stat call and created at most once. The outcome
+    of every path is logged.
+
+    Parameters:
+    - paths (Iterable[str]): The directory paths as written in the configuration.
+    - workers (int): The maximum number of subtrees processed at the same time.
+    - on_done (Optional[Callable[[str], None]]): Called with every expanded path that exists afterwards.
+
+    Returns:
+    - Dict[str, str]: The outcome ('exists', 'created' or 'failed') keyed by expanded path.
+    """
+    outcomes: Dict[str, str] = {}
+
+    def handle_group(group: List[str]) -> None:
+        known: Set[str] = set()
+        for folder_path in group:
+            outcomes[folder_path] = create_directory(folder_path, known)
+            if on_done is not None and outcomes[folder_path] != "failed":
+                on_done(folder_path)
+        get_journal().commit()
+
+    run_groups(group_by_root(expand_paths(paths)), handle_group, workers)
+    return outcomes
+
+
+def create_directory(folder_path: str, known: Set[str]) -> str:
+    """
+    Creates one directory and any missing ancestors, consulting and updating the set of directories known to exist.
+    """
+    key = normalize_path(os.path.abspath(folder_path))
+    if key in known:
+        logging.info(f"Directory '{folder_path}' already exists.")
+        return "exists"
+    with instrument("fs.stat", folder_path):
+        exists = os.path.isdir(folder_path)
+    if exists:
+        known.add(key)
+        logging.info(f"Directory '{folder_path}' already exists.")
+        return "exists"
+
+    missing = [folder_path]
+    parent = os.path.dirname(os.path.abspath(folder_path))
+    while parent and normalize_path(parent) not in known and not os.path.isdir(parent):
+        missing.append(parent)
+        if os.path.dirname(parent) == parent:
+            break
+        parent = os.path.dirname(parent)
+    known.add(normalize_path(parent))
+
+    with instrument("fs.mkdir", folder_path) as span:
+        try:
+            for directory in reversed(missing):
+                try:
+                    os.mkdir(directory)
+                    get_journal().record("directory", path=os.path.abspath(directory))
+                except FileExistsError:
+                    if not os.path.isdir(directory):
+                        raise
+                known.add(normalize_path(os.path.abspath(directory)))
+        except Exception as e:
+            span.outcome = "error"
+            logging.error(f"Failed to create directory '{folder_path}': {str(e)}")
+            return "failed"
+    logging.info(f"Directory '{folder_path}' created successfully.")
+    return "created"
+
+
+def hide_directories(paths: Iterable[str], backend: Optional[AttributeBackend] = None, workers: int = DEFAULT_WORKERS,
+                     on_done: Optional[Callable[[str], None]] = None) -> Dict[str, str]:
+    """
+    Sets the hidden attribute on every directory that is not hidden yet. Paths are expanded and deduplicated once and
+    processed in parallel per independent subtree. Each path costs one attribute read, which also tells whether it
+    exists, and at most one write that adds the hidden bit to the existing attributes instead of replacing them. The
+    outcome of every path is logged.
+
+    Parameters:
+    - paths (Iterable[str]): The directory paths as written in the configuration.
+    - backend (Optional[AttributeBackend]): The attribute backend, by default the Win32 API.
+    - workers (int): The maximum number of subtrees processed at the same time.
+    - on_done (Optional[Callable[[str], None]]): Called with every expanded path that is hidden afterwards.
+
+    Returns:
+    - Dict[str, str]: The outcome ('missing', 'hidden', 'already-hidden' or 'failed') keyed by expanded path.
+    """
+    backend = backend or get_attribute_backend()
+    outcomes: Dict[str, str] = {}
+
+    def handle_group(group: List[str]) -> None:
+        for folder_path in group:
+            outcomes[folder_path] = hide_directory(folder_path, backend)
+            if on_done is not None and outcomes[folder_path] in ("hidden", "already-hidden"):
+                on_done(folder_path)
+        get_journal().commit()
+
+    run_groups(group_by_root(expand_paths(paths)), handle_group, workers)
+    return outcomes
+
+
+def hide_directory(folder_path: str, backend: AttributeBackend) -> str:
+    """
+    Hides one directory, preserving its other attribute bits.
+    """
+    try:
+        with instrument("fs.get_attributes", folder_path):
+            attributes = backend.get_attributes(folder_path)
+    except FileNotFoundError:
+        logging.error(f"Directory '{folder_path}' does not exist. Skipping...")
+        return "missing"
+    except OSError as e:
+        logging.error(f"Failed to hide directory '{folder_path}': {str(e)}")
+        return "failed"
+
+    if attributes & FILE_ATTRIBUTE_HIDDEN:
+        logging.info(f"Directory '{folder_path}' is already hidden.")
+        return "already-hidden"
+
+    get_journal().record("attributes", path=os.path.abspath(folder_path), previous=attributes)
+    with instrument("fs.set_attributes", folder_path) as span:
+        try:
+            backend.set_attributes(folder_path, attributes | FILE_ATTRIBUTE_HIDDEN)
+        except OSError as e:
+            span.outcome = "error"
+            logging.error(f"Failed to hide directory '{folder_path}': {str(e)}")
+            return "failed"
+    logging.info(f"Directory '{folder_path}' is now hidden.")
+    return "hidden"
+
+
+def unhide_directory(folder_path: str, backend: AttributeBackend) -> str:
+    """
+    Removes the hidden attribute from one directory, preserving its other attribute bits. The change is recorded as
+    'pruned', so the directory is no longer treated as hidden by this tool.
+    """
+    try:
+        with instrument("fs.get_attributes", folder_path):
+            attributes = backend.get_attributes(folder_path)
+    except FileNotFoundError:
+        logging.info(f"Directory '{folder_path}' no longer exists. Skipping...")
+        return "missing"
+    except OSError as e:
+        logging.error(f"Failed to unhide directory '{folder_path}': {str(e)}")
+        return "failed"
+
+    if not attributes & FILE_ATTRIBUTE_HIDDEN:
+        logging.info(f"Directory '{folder_path}' is already visible.")
+        return "already-visible"
+
+    get_journal().record("attributes", path=os.path.abspath(folder_path), previous=attributes, pruned=True)
+    with instrument("fs.set_attributes", folder_path) as span:
+        try:
+            backend.set_attributes(folder_path, attributes & ~FILE_ATTRIBUTE_HIDDEN)
+        except OSError as e:
+            span.outcome = "error"
+            logging.error(f"Failed to unhide directory '{folder_path}': {str(e)}")
+            return "failed"
+    logging.info(f"Directory '{folder_path}' is no longer hidden.")
+    return "unhidden"
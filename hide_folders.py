@@ -1,80 +1,339 @@
 import os
-import ctypes
-from typing import List
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
+from change_plan import PlannedChange, parse_module_arguments, print_plan
+from checkpoint import get_checkpoint
 from config_service import setup_logging, read_config_file, validate_config_section, logging
+from fs_engine import (DEFAULT_WORKERS, FILE_ATTRIBUTE_HIDDEN, AttributeBackend, expand_paths, get_attribute_backend,
+                       hide_directories, hide_directory, normalize_path, spellings_by_path, unhide_directory)
+from path_patterns import is_pattern, pattern_fingerprint, pattern_options, walk_pattern, walk_patterns
+from reconcile import Allowlist, log_reconcile, managed_items, reconcile_sets
+from undo_journal import get_journal, read_active_records
 
 CONFIG_FILE = "config.json"
 
-FILE_ATTRIBUTE_HIDDEN = 0x02
 
-
-def is_folder_hidden(folder_path: str) -> bool:
+def is_folder_hidden(folder_path: str, backend: Optional[AttributeBackend] = None) -> bool:
     """
     Checks if the hidden attribute is set for the folder.
 
     Parameters:
     - folder_path (str): The path of the folder to check.
+    - backend (Optional[AttributeBackend]): The attribute backend, by default the Win32 API.
 
     Returns:
     - bool: True if the folder is hidden, False otherwise.
     """
-    attributes = ctypes.windll.kernel32.GetFileAttributesW(folder_path)
-    if attributes == -1:
-        raise ctypes.WinError()
-    return bool(attributes & FILE_ATTRIBUTE_HIDDEN)
+    backend = backend or get_attribute_backend()
+    return bool(backend.get_attributes(folder_path) & FILE_ATTRIBUTE_HIDDEN)
 
 
-def set_hidden_attribute(folder_path: str) -> None:
+def set_hidden_attribute(folder_path: str, backend: Optional[AttributeBackend] = None) -> None:
     """
-    Sets the hidden attribute to a folder in Windows.
-    Uses the SetFileAttributesW function from the Windows API through ctypes.
+    Adds the hidden attribute to a folder in Windows, keeping the attributes it already has (such as read-only or
+    system).
 
     Parameters:
     - folder_path (str): The path of the folder to hide.
+    - backend (Optional[AttributeBackend]): The attribute backend, by default the Win32 API.
     """
-    if not ctypes.windll.kernel32.SetFileAttributesW(folder_path, FILE_ATTRIBUTE_HIDDEN):
-        raise ctypes.WinError()
+    backend = backend or get_attribute_backend()
+    attributes = backend.get_attributes(folder_path)
+    journal = get_journal()
+    journal.record("attributes", path=os.path.abspath(folder_path), previous=attributes)
+    journal.commit()
+    backend.set_attributes(folder_path, attributes | FILE_ATTRIBUTE_HIDDEN)
 
 
-def hide_folders(folders_list: List[str], enabled: bool) -> None:
+def hide_folders(folders_list: List[str], enabled: bool, backend: Optional[AttributeBackend] = None,
+                 workers: int = DEFAULT_WORKERS, exclude: Sequence[str] = (),
+                 max_depth: Optional[int] = None, brackets: bool = False) -> Dict[str, str]:
     """
     Hides directories specified in `folders_list` if `enabled` is True. Each folder is hidden only if it is not already
     hidden. The function logs the outcome of each attempt to hide a directory, including cases where the directory is
     already hidden, where the hiding is successful, and where an error occurs during hiding. Paths in `folders_list` can
-    include environment variables, which are expanded to their values.
+    include environment variables, which are expanded to their values. The work is done by the filesystem engine, which
+    reads the attributes of every directory once and adds the hidden bit without clearing the others. Entries with
+    wildcards, such as '%USERPROFILE%\\source\\**\\node_modules', are expanded by a streaming walker, and every matching
+    directory is hidden as soon as it is found. Every literal folder that is hidden afterwards is marked as completed in
+    the run's checkpoint, and the wildcard entries once all of their matches are hidden.
 
     Parameters:
     - folders_list (List[str]): A list of directory paths to hide.
     - enabled (bool): If False, directory hiding is skipped, and a log entry is made indicating it's disabled.
+    - backend (Optional[AttributeBackend]): The attribute backend, by default the Win32 API.
+    - workers (int): The maximum number of independent directory trees processed at the same time.
+    - exclude (Sequence[str]): Patterns of directories the wildcard entries must not descend into.
+    - max_depth (Optional[int]): The maximum number of levels the wildcard entries descend below their literal root.
+    - brackets (bool): Whether '[...]' in the paths is a character class rather than literal text.
+
+    Returns:
+    - Dict[str, str]: The outcome ('missing', 'hidden', 'already-hidden' or 'failed') keyed by expanded path.
     """
     if not enabled:
         logging.info("Directory hiding is skipped as it's disabled by configuration.")
-        return
+        return {}
+
+    checkpoint = get_checkpoint()
+    literals = [path for path in folders_list if not is_pattern(path, brackets)]
+    spellings = spellings_by_path(literals)
+
+    def complete(path: str) -> None:
+        checkpoint.complete("hide_folders", spellings[normalize_path(path)], "hidden")
+
+    outcomes = hide_directories(literals, backend, workers, complete)
+
+    patterns = [path for path in folders_list if path and is_pattern(path, brackets)]
+    if patterns:
+        backend = backend or get_attribute_backend()
+        failed = False
+        for folder_path in walk_patterns(patterns, max_depth, exclude, brackets=brackets, workers=workers):
+            outcomes[folder_path] = hide_directory(folder_path, backend)
+            failed = failed or outcomes[folder_path] == "failed"
+        get_journal().commit()
+        if not failed:
+            checkpoint.complete("hide_folders", patterns, "hidden")
+    return outcomes
+
+
+def folder_key(path: str) -> str:
+    """
+    Normalizes a directory path for the reconcile sets: expanded, absolute and, on Windows, lower-cased.
+    """
+    return normalize_path(os.path.abspath(os.path.expandvars(path)))
 
-    for folder_path in folders_list:
-        folder_path = os.path.expandvars(folder_path)
 
-        if not os.path.exists(folder_path):
-            logging.error(f"Directory '{folder_path}' does not exist. Skipping...")
+def unmanaged_folders(desired_paths: Iterable[str], allowlist: Sequence[str],
+                      journal_path: Optional[str]) -> Tuple[List[str], int]:
+    """
+    Finds the directories earlier runs hid, according to the undo journal, that are no longer configured. The
+    journal is the only record of which hidden directories belong to this tool, so nothing is found without one.
+
+    Parameters:
+    - desired_paths (Iterable[str]): The configured directories, with wildcard entries expanded.
+    - allowlist (Sequence[str]): Directories that are never unhidden; wildcards are allowed.
+    - journal_path (Optional[str]): The undo journal file.
+
+    Returns:
+    - Tuple[List[str], int]: The directories to unhide, and the number kept because of the allowlist.
+
+    Raises:
+    - OSError: If the journal cannot be read.
+    """
+    records = read_active_records(journal_path, {"attributes"})
+    managed = {key: record["path"]
+               for key, record in managed_items(records, lambda record: folder_key(record["path"])).items()}
+    _, removed, kept = reconcile_sets({folder_key(path): path for path in desired_paths}, managed,
+                                      Allowlist(allowlist, folder_key))
+    return removed, len(kept)
+
+
+def reconcile_folders(folders_list: List[str], enabled: bool, allowlist: Sequence[str] = (),
+                      backend: Optional[AttributeBackend] = None, workers: int = DEFAULT_WORKERS,
+                      exclude: Sequence[str] = (), max_depth: Optional[int] = None,
+                      brackets: bool = False) -> Dict[str, str]:
+    """
+    Makes the hidden directories match the configuration: hides the configured directories like `hide_folders`, then
+    unhides the directories earlier runs hid that the configuration no longer lists, except those on the allowlist.
+    Only the hidden bit is cleared, and every directory costs one attribute read and at most one write.
+
+    Parameters:
+    - folders_list (List[str]): A list of directory paths to hide.
+    - enabled (bool): If False, nothing is hidden or unhidden.
+    - allowlist (Sequence[str]): Directories that are never unhidden; wildcards are allowed.
+    - backend (Optional[AttributeBackend]): The attribute backend, by default the Win32 API.
+    - workers (int): The maximum number of independent directory trees processed at the same time.
+    - exclude (Sequence[str]): Patterns of directories the wildcard entries must not descend into.
+    - max_depth (Optional[int]): The maximum number of levels the wildcard entries descend below their literal root.
+    - brackets (bool): Whether '[...]' in the paths is a character class rather than literal text.
+
+    Returns:
+    - Dict[str, str]: The outcome of every configured and every unhidden directory, keyed by expanded path.
+    """
+    if not enabled:
+        logging.info("Directory hiding is skipped as it's disabled by configuration.")
+        return {}
+
+    outcomes = hide_folders(folders_list, True, backend, workers, exclude, max_depth, brackets)
+    journal_path = get_journal().file_path
+    if not journal_path:
+        logging.warning("Unhiding folders that are no longer configured needs the undo journal. Skipping...")
+        return outcomes
+    try:
+        removed, kept = unmanaged_folders(list(outcomes), allowlist, journal_path)
+    except OSError as e:
+        logging.error(f"Failed to read the journal '{journal_path}': {str(e)}")
+        return outcomes
+
+    log_reconcile("hidden folders", sum(1 for outcome in outcomes.values() if outcome == "hidden"), len(removed), kept)
+    backend = backend or get_attribute_backend()
+    for folder_path in removed:
+        outcomes[folder_path] = unhide_directory(folder_path, backend)
+    get_journal().commit()
+    return outcomes
+
+
+def plan_step(section: Dict[str, Any], backend: Optional[AttributeBackend] = None) -> List[PlannedChange]:
+    """
+    Determines, without changing any attribute, which of the directories in the 'hideFolders' section are not hidden
+    yet. Directories that do not exist are reported as well, since an earlier step may create them. A wildcard entry
+    is reported once, with the number of matching directories that are not hidden.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'hideFolders' section of the configuration.
+    - backend (Optional[AttributeBackend]): The attribute backend, by default the Win32 API.
+
+    Returns:
+    - List[PlannedChange]: One 'hide' change per directory that is not hidden.
+    """
+    backend = backend or get_attribute_backend()
+    options = pattern_options(section)
+    changes = []
+    for folder_path in dict.fromkeys(section["paths"]):
+        if is_pattern(folder_path, options["brackets"]):
+            visible = sum(1 for path in walk_pattern(folder_path, **options)
+                          if not is_folder_hidden(path, backend))
+            if visible:
+                changes.append(PlannedChange("hide_folders", folder_path, "hide", f"{visible} visible", "hidden"))
             continue
+        try:
+            hidden = is_folder_hidden(os.path.expandvars(folder_path), backend)
+        except FileNotFoundError:
+            changes.append(PlannedChange("hide_folders", folder_path, "hide", "missing", "hidden"))
+            continue
+        if not hidden:
+            changes.append(PlannedChange("hide_folders", folder_path, "hide", "visible", "hidden"))
+    return changes
+
 
-        if is_folder_hidden(folder_path):
-            logging.info(f"Directory '{folder_path}' is already hidden.")
+def validator_options(section: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the keyword arguments the setup runner passes to `state_validator`: the pattern settings of the section.
+    """
+    return pattern_options(section)
+
+
+def state_validator(folder_path: str, exclude: Sequence[str] = (), max_depth: Optional[int] = None,
+                    brackets: bool = False) -> Optional[str]:
+    """
+    Returns a cheap validator for the state cache: the modification time and file attributes of the directory from a
+    single stat call, or 'missing' if it does not exist, so an unhidden or deleted directory invalidates its record.
+    Wildcard entries get the `pattern_fingerprint` of their walk, which changes when a match appears, disappears or
+    is unhidden; it costs the walk, but none of the attribute reads of `plan_step`.
+
+    Parameters:
+    - folder_path (str): The directory path as written in the configuration.
+    - exclude (Sequence[str]): Patterns of directories the wildcard entries must not descend into.
+    - max_depth (Optional[int]): The maximum number of levels the wildcard entries descend below their literal root.
+    - brackets (bool): Whether '[...]' in the path is a character class rather than literal text.
+
+    Returns:
+    - Optional[str]: The validator value.
+    """
+    if is_pattern(folder_path, brackets):
+        return f"pattern:{pattern_fingerprint(folder_path, max_depth, exclude, brackets=brackets)}"
+    try:
+        stat_result = os.stat(os.path.expandvars(folder_path))
+    except OSError:
+        return "missing"
+    return f"{stat_result.st_mtime_ns}:{getattr(stat_result, 'st_file_attributes', 0)}"
+
+
+def inventory_step(section: Dict[str, Any], backend: Optional[AttributeBackend] = None) -> Dict[str, str]:
+    """
+    Captures the hidden state of each directory in the 'hideFolders' section, without changing any attribute. A
+    wildcard entry is captured as 'hidden' if every matching directory is hidden, and as the number of visible
+    matches otherwise.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'hideFolders' section of the configuration.
+    - backend (Optional[AttributeBackend]): The attribute backend, by default the Win32 API.
+
+    Returns:
+    - Dict[str, str]: 'hidden', 'visible', 'missing' or 'N visible', keyed by the configured path.
+    """
+    backend = backend or get_attribute_backend()
+    options = pattern_options(section)
+    states = {}
+    for folder_path in dict.fromkeys(section["paths"]):
+        if not folder_path:
+            continue
+        if is_pattern(folder_path, options["brackets"]):
+            visible = sum(1 for path in walk_pattern(folder_path, **options)
+                          if not is_folder_hidden(path, backend))
+            states[folder_path] = f"{visible} visible" if visible else "hidden"
             continue
+        try:
+            states[folder_path] = "hidden" if is_folder_hidden(os.path.expandvars(folder_path), backend) else "visible"
+        except FileNotFoundError:
+            states[folder_path] = "missing"
+    return states
+
+
+def desired_step(section: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Returns the state `inventory_step` reports for each directory of the 'hideFolders' section once it is applied.
+    """
+    return {folder_path: "hidden" for folder_path in section["paths"] if folder_path}
 
+
+def plan_reconcile_step(section: Dict[str, Any], backend: Optional[AttributeBackend] = None) -> List[PlannedChange]:
+    """
+    Determines, without changing any attribute, which directories reconcile mode would unhide: those earlier runs hid
+    that are still hidden but no longer configured.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'hideFolders' section of the configuration.
+    - backend (Optional[AttributeBackend]): The attribute backend, by default the Win32 API.
+
+    Returns:
+    - List[PlannedChange]: One 'unhide' change per directory.
+    """
+    backend = backend or get_attribute_backend()
+    paths = section["paths"]
+    options = pattern_options(section)
+    desired = expand_paths(path for path in paths if path and not is_pattern(path, options["brackets"]))
+    desired += walk_patterns([path for path in paths if path and is_pattern(path, options["brackets"])], **options)
+    removed, _ = unmanaged_folders(desired, section.get("allowlist", []), get_journal().file_path)
+    changes = []
+    for folder_path in removed:
         try:
-            set_hidden_attribute(folder_path)
-            logging.info(f"Directory '{folder_path}' is now hidden.")
-        except Exception as e:
-            logging.error(f"Failed to hide directory '{folder_path}': {str(e)}")
+            if is_folder_hidden(folder_path, backend):
+                changes.append(PlannedChange("hide_folders", folder_path, "unhide", "hidden", "visible"))
+        except FileNotFoundError:
+            continue
+    return changes
+
+
+def reconcile_step(section: Dict[str, Any]) -> None:
+    """
+    Runs this module as a step of the unified setup runner in reconcile mode, hiding the configured directories and
+    unhiding the ones earlier runs hid that are no longer configured.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'hideFolders' section of the configuration.
+    """
+    reconcile_folders(section["paths"], section["enabled"], section.get("allowlist", []), **pattern_options(section))
+
+
+def run_step(section: Dict[str, Any]) -> None:
+    """
+    Runs this module as a step of the unified setup runner, hiding the configured directories from the already
+    validated 'hideFolders' section.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'hideFolders' section of the configuration.
+    """
+    hide_folders(section["paths"], section["enabled"], **pattern_options(section))
 
 
 def main() -> None:
     """
     Executes the main functionality of the script which includes setting up logging, reading the configuration file,
     validating the 'hideFolders' configuration section, and conditionally hiding directories based on the configuration.
+    With '--plan', only prints the changes it would make.
     """
+    args = parse_module_arguments("Applies the 'hideFolders' section of the configuration.")
     setup_logging()
     config_data = read_config_file(CONFIG_FILE)
 
@@ -90,7 +349,12 @@ def main() -> None:
         logging.error("The 'hideFolders' section in the configuration is invalid.")
         return
 
-    hide_folders(config_data["hideFolders"]["paths"], config_data["hideFolders"]["enabled"])
+    if args.plan:
+        print_plan(config_data["hideFolders"], plan_step)
+        return
+
+    hide_folders(config_data["hideFolders"]["paths"], config_data["hideFolders"]["enabled"],
+                 **pattern_options(config_data["hideFolders"]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,209 @@
+import json
+import operator
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from config_service import logging
+from state_cache import write_bytes_atomically
+
+SNAPSHOT_VERSION = 1
+DEFAULT_WORKERS = 4
+
+# One captured item: the step name, the item identifier and its state. Snapshots hold them sorted by (step, item).
+SnapshotRecord = Tuple[str, str, Any]
+_END = object()
+
+
+@dataclass(frozen=True)
+class Difference:
+    """
+    An item whose state differs between two inventories.
+
+    Attributes:
+    - step (str): The step the item belongs to.
+    - item (str): The item identifier.
+    - change (str): 'removed' if only the left side has the item, 'added' if only the right side has it, otherwise
+      'changed'.
+    - left (Any): The state on the left side, or None.
+    - right (Any): The state on the right side, or None.
+    """
+    step: str
+    item: str
+    change: str
+    left: Any
+    right: Any
+
+
+def capture_inventory(plan: List[Any], config_data: Dict[str, Any],
+                      workers: int = DEFAULT_WORKERS) -> List[SnapshotRecord]:
+    """
+    Captures the actual state of every configured item of the planned steps in one pass, probing the steps
+    concurrently with their read-only `inventory_step` functions. A step whose probe fails is logged and left out.
+
+    Parameters:
+    - plan (List[Any]): The steps to capture.
+    - config_data (Dict[str, Any]): The parsed configuration file.
+    - workers (int): The maximum number of steps probed at the same time.
+
+    Returns:
+    - List[SnapshotRecord]: The captured records, sorted by step and item.
+    """
+    def probe(step: Any) -> List[SnapshotRecord]:
+        try:
+            states = step.load("inventory_step")(config_data[step.section])
+        except Exception as e:
+            logging.error(f"Failed to capture step '{step.name}': {str(e)}")
+            return []
+        return [(step.name, item, state) for item, state in states.items()]
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return sorted(record for records in executor.map(probe, plan) for record in records)
+
+
+def desired_records(plan: List[Any], config_data: Dict[str, Any]) -> List[SnapshotRecord]:
+    """
+    Returns the state every configured item of the planned steps has once it is applied, in the same form and order
+    as a captured snapshot.
+    """
+    return sorted((step.name, item, state) for step in plan
+                  for item, state in step.load("desired_step")(config_data[step.section]).items())
+
+
+def write_snapshot(file_path: str, records: List[SnapshotRecord]) -> None:
+    """
+    Writes a snapshot as JSON lines: a header with the format version, the host name, the capture time and the number
+    of records, followed by one compact [step, item, state] array per line in sorted order. The file is replaced
+    atomically.
+
+    Parameters:
+    - file_path (str): The snapshot file.
+    - records (List[SnapshotRecord]): The records, sorted by step and item.
+    """
+    header = {"version": SNAPSHOT_VERSION, "host": socket.gethostname(),
+              "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "records": len(records)}
+    lines = [json.dumps(header, separators=(",", ":"))]
+    lines += [json.dumps(list(record), separators=(",", ":"), default=str) for record in records]
+    write_bytes_atomically(file_path, ("\n".join(lines) + "\n").encode("utf-8"))
+
+
+def read_snapshot(file_path: str, steps: Optional[Set[str]] = None) -> Iterator[SnapshotRecord]:
+    """
+    Lazily reads the records of a snapshot, one line at a time, so a snapshot never has to fit in memory.
+
+    Parameters:
+    - file_path (str): The snapshot file.
+    - steps (Optional[Set[str]]): The steps to read, or None for all steps.
+
+    Returns:
+    - Iterator[SnapshotRecord]: The records in file order.
+
+    Raises:
+    - ValueError: If the file is not a snapshot of a supported version or its records are not sorted.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        try:
+            header = json.loads(file.readline())
+        except json.JSONDecodeError:
+            header = None
+        if not isinstance(header, dict) or header.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"'{file_path}' is not a version {SNAPSHOT_VERSION} snapshot.")
+        previous: Optional[Tuple[str, str]] = None
+        for line_number, line in enumerate(file, start=2):
+            try:
+                step, item, state = json.loads(line)
+            except (json.JSONDecodeError, TypeError, ValueError):
+                raise ValueError(f"Invalid record on line {line_number} of '{file_path}'.")
+            if previous is not None and (step, item) <= previous:
+                raise ValueError(f"The records of '{file_path}' are not sorted at line {line_number}.")
+            previous = step, item
+            if steps is None or step in steps:
+                yield step, item, state
+
+
+def satisfies(actual: Any, desired: Any) -> bool:
+    """
+    Checks whether a captured state meets a desired state; for states with several settings, such as a service's
+    startup type and status, only the desired settings are compared.
+    """
+    if isinstance(actual, dict) and isinstance(desired, dict):
+        return all(actual.get(name) == value for name, value in desired.items())
+    return actual == desired
+
+
+def diff_records(left: Iterable[SnapshotRecord], right: Iterable[SnapshotRecord],
+                 matches: Callable[[Any, Any], bool] = operator.eq) -> Iterator[Difference]:
+    """
+    Compares two sorted record streams in a single merge pass, in time linear in their length and with constant
+    memory.
+
+    Parameters:
+    - left (Iterable[SnapshotRecord]): The left records, sorted by step and item.
+    - right (Iterable[SnapshotRecord]): The right records, sorted by step and item.
+    - matches (Callable[[Any, Any], bool]): Whether a left state matches a right state, by default equality.
+
+    Returns:
+    - Iterator[Difference]: The differing items in sorted order.
+    """
+    left_records, right_records = iter(left), iter(right)
+    left_record, right_record = next(left_records, _END), next(right_records, _END)
+    while left_record is not _END or right_record is not _END:
+        if right_record is _END or (left_record is not _END and left_record[:2] < right_record[:2]):
+            yield Difference(left_record[0], left_record[1], "removed", left_record[2], None)
+            left_record = next(left_records, _END)
+        elif left_record is _END or right_record[:2] < left_record[:2]:
+            yield Difference(right_record[0], right_record[1], "added", None, right_record[2])
+            right_record = next(right_records, _END)
+        else:
+            if not matches(left_record[2], right_record[2]):
+                yield Difference(left_record[0], left_record[1], "changed", left_record[2], right_record[2])
+            left_record, right_record = next(left_records, _END), next(right_records, _END)
+
+
+def print_differences(title: str, differences: Iterable[Difference]) -> int:
+    """
+    Prints the differences of one comparison as they are found, one line per item, followed by their count.
+
+    Returns:
+    - int: The number of differences.
+    """
+    print(f"{title}:")
+    count = 0
+    for difference in differences:
+        count += 1
+        print(f"  [{difference.step}] {difference.change} {difference.item}: "
+              f"{difference.left!r} -> {difference.right!r}")
+    print(f"  {count} difference(s).")
+    return count
+
+
+def diff_snapshots(snapshots: List[str], baseline: Optional[str] = None,
+                   desired: Optional[List[SnapshotRecord]] = None) -> int:
+    """
+    Compares every snapshot either with a baseline snapshot, streaming both files, or with the desired state derived
+    from the configuration. Files that cannot be read are logged and skipped, so one bad file does not stop a batch.
+
+    Parameters:
+    - snapshots (List[str]): The snapshot files to compare.
+    - baseline (Optional[str]): The baseline snapshot, shown on the left of every comparison.
+    - desired (Optional[List[SnapshotRecord]]): The desired records, used when no baseline is given; only the steps
+      present in them are compared.
+
+    Returns:
+    - int: The total number of differences.
+    """
+    steps = None if baseline else {record[0] for record in desired or []}
+    total = 0
+    for snapshot in snapshots:
+        try:
+            if baseline:
+                total += print_differences(f"{baseline} -> {snapshot}",
+                                           diff_records(read_snapshot(baseline), read_snapshot(snapshot)))
+            else:
+                total += print_differences(f"{snapshot} -> configuration",
+                                           diff_records(read_snapshot(snapshot, steps), desired or [], satisfies))
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to compare '{snapshot}': {str(e).rstrip('.')}. Skipping...")
+    return total
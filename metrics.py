@@ -0,0 +1,274 @@
+import functools
+import heapq
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from config_service import logging
+
+# The number of most recent records kept in memory; the summary covers every record and the JSON-lines file gets all.
+MAX_RECORDS = 10000
+# The number of durations sampled per operation type for the percentiles; they are exact up to this count.
+SAMPLE_SIZE = 1024
+# The number of slowest records kept for the summary.
+SLOWEST_KEPT = 20
+
+_enabled = False
+_records: Deque[Dict[str, Any]] = deque(maxlen=MAX_RECORDS)
+_sink = None
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class _Span:
+    """
+    The measurement of one running operation. Code inside the operation may set `outcome` and `item`.
+    """
+    __slots__ = ("operation", "item", "outcome", "subprocesses")
+
+    def __init__(self, operation: str, item: Optional[str]) -> None:
+        self.operation = operation
+        self.item = item
+        self.outcome = "ok"
+        self.subprocesses = 0
+
+
+class _NullSpan:
+    """
+    The span handed out while instrumentation is disabled; attribute writes are ignored.
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _NullContext:
+    __slots__ = ()
+
+    def __enter__(self) -> _NullSpan:
+        return _NULL_SPAN
+
+    def __exit__(self, *exc_info: Any) -> bool:
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class _OperationStats:
+    """
+    Running totals of one operation type, with a uniform sample of its durations (reservoir sampling) for the
+    percentiles.
+    """
+    __slots__ = ("count", "total", "subprocesses", "errors", "sample")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.subprocesses = 0
+        self.errors = 0
+        self.sample: List[float] = []
+
+    def add(self, record: Dict[str, Any]) -> None:
+        self.count += 1
+        self.total += record["duration"]
+        self.subprocesses += record["subprocesses"]
+        self.errors += record["outcome"].startswith("error")
+        if len(self.sample) < SAMPLE_SIZE:
+            self.sample.append(record["duration"])
+        else:
+            index = random.randrange(self.count)
+            if index < SAMPLE_SIZE:
+                self.sample[index] = record["duration"]
+
+
+_stats: Dict[str, _OperationStats] = {}
+# A min-heap of (duration, sequence number, record) holding the slowest records.
+_slowest: List[Tuple[float, int, Dict[str, Any]]] = []
+_sequence = itertools.count()
+
+
+def enable(file_path: Optional[str] = None) -> None:
+    """
+    Turns instrumentation on and optionally streams every record to a JSON-lines file.
+
+    Parameters:
+    - file_path (Optional[str]): The JSON-lines file to append records to, or None to keep them in memory only.
+    """
+    global _enabled, _sink
+    with _lock:
+        _records.clear()
+        _stats.clear()
+        _slowest.clear()
+        _sink = open(file_path, "a", buffering=64 * 1024) if file_path else None
+        _enabled = True
+
+
+def disable() -> None:
+    """
+    Turns instrumentation off and closes the JSON-lines file, if any. Collected records stay available.
+    """
+    global _enabled, _sink
+    with _lock:
+        _enabled = False
+        if _sink is not None:
+            _sink.close()
+            _sink = None
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def records() -> List[Dict[str, Any]]:
+    """
+    Returns a copy of the most recent records collected since instrumentation was enabled, at most `MAX_RECORDS`.
+    """
+    with _lock:
+        return list(_records)
+
+
+def count_subprocess(count: int = 1) -> None:
+    """
+    Attributes process launches to the innermost operation running on the current thread. Called by the command
+    runners every time they start an external program.
+
+    Parameters:
+    - count (int): The number of processes launched.
+    """
+    if not _enabled:
+        return
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1].subprocesses += count
+
+
+@contextmanager
+def _measure(operation: str, item: Optional[str]) -> Iterator[_Span]:
+    span = _Span(operation, item)
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(span)
+    started = time.perf_counter()
+    try:
+        yield span
+    except BaseException as e:
+        span.outcome = f"error: {type(e).__name__}"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        stack.pop()
+        if stack:
+            stack[-1].subprocesses += span.subprocesses
+        record = {"operation": span.operation, "item": span.item, "outcome": span.outcome,
+                  "duration": round(duration, 6), "subprocesses": span.subprocesses, "time": time.time()}
+        with _lock:
+            _records.append(record)
+            _stats.setdefault(span.operation, _OperationStats()).add(record)
+            entry = (duration, next(_sequence), record)
+            if len(_slowest) < SLOWEST_KEPT:
+                heapq.heappush(_slowest, entry)
+            elif duration > _slowest[0][0]:
+                heapq.heapreplace(_slowest, entry)
+            if _sink is not None:
+                _sink.write(json.dumps(record) + "\n")
+
+
+def instrument(operation: str, item: Optional[str] = None):
+    """
+    Measures one probe or mutation: its duration, outcome and the number of processes it launched. Use it as a
+    context manager, optionally setting `span.outcome` (e.g. to 'skipped' or 'changed') inside the block. While
+    instrumentation is disabled, a shared no-op context is returned and nothing is recorded.
+
+    Parameters:
+    - operation (str): The operation type, such as 'sc.query' or 'fs.makedirs'.
+    - item (Optional[str]): The configuration item the operation concerns.
+
+    Returns:
+    - A context manager yielding the span of the operation.
+    """
+    if not _enabled:
+        return _NULL_CONTEXT
+    return _measure(operation, item)
+
+
+def instrumented(operation: str) -> Callable:
+    """
+    A decorator recording every call of the decorated function as an operation. The first positional argument, if
+    any, is recorded as the item.
+
+    Parameters:
+    - operation (str): The operation type.
+
+    Returns:
+    - Callable: The decorator.
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _measure(operation, str(args[0]) if args else None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Returns the value at the given fraction of the sorted values, using the nearest-rank method.
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def summarize(top: int = 5) -> str:
+    """
+    Builds the end-of-run summary: per operation type the count, p50, p95 and total duration and the number of
+    processes launched, followed by the slowest individual operations. The totals cover every record; the
+    percentiles are computed from a sample of at most `SAMPLE_SIZE` durations per operation type.
+
+    Parameters:
+    - top (int): The number of slowest operations to list, at most `SLOWEST_KEPT`.
+
+    Returns:
+    - str: The summary table.
+    """
+    with _lock:
+        stats = {name: (entry.count, entry.total, entry.subprocesses, entry.errors, list(entry.sample))
+                 for name, entry in _stats.items()}
+        slowest = [record for _, _, record in sorted(_slowest, reverse=True)[:top]]
+    if not stats:
+        return "No operations were recorded."
+
+    width = max(len(name) for name in stats)
+    lines = [f"{'operation':<{width}}  {'count':>6}  {'p50 ms':>9}  {'p95 ms':>9}  {'total ms':>10}  {'procs':>5}  "
+             f"errors"]
+    for name, (count, total, subprocesses, errors, sample) in sorted(stats.items(), key=lambda entry: -entry[1][1]):
+        lines.append(f"{name:<{width}}  {count:>6}  {percentile(sample, 0.5) * 1000:>9.1f}  "
+                     f"{percentile(sample, 0.95) * 1000:>9.1f}  {total * 1000:>10.1f}  {subprocesses:>5}  {errors}")
+    lines.append("Slowest operations:")
+    for record in slowest:
+        lines.append(f"  {record['duration'] * 1000:9.1f} ms  {record['operation']}  {record['item'] or ''}  "
+                     f"({record['outcome']})")
+    return "\n".join(lines)
+
+
+def log_summary() -> None:
+    """
+    Logs the end-of-run summary, if instrumentation is enabled.
+    """
+    if _enabled:
+        for line in summarize().splitlines():
+            logging.info(line)
@@ -0,0 +1,389 @@
+import fnmatch
+import hashlib
+import os
+import queue
+import re
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Pattern, Sequence, Set, Tuple
+
+from config_service import logging
+
+# '[...]' character classes are only recognized when a section opts in with 'matchBrackets', since Windows paths often
+# contain literal brackets, e.g. 'C:\\Games\\[Backup]'.
+PATTERN_CHARACTERS = "*?"
+RECURSIVE_SEGMENT = "**"
+DEFAULT_WORKERS = 4
+QUEUE_SIZE = 1024
+
+_FLAGS = re.IGNORECASE if os.name == "nt" else 0
+_DONE = object()
+
+
+def is_pattern(path: str, brackets: bool = False) -> bool:
+    """
+    Checks whether a configured path contains wildcards ('*', '?', '**' or, if enabled, '[...]') and has to be expanded
+    by walking the file system.
+
+    Parameters:
+    - path (str): The path as written in the configuration.
+    - brackets (bool): Whether a '[' followed by a closing ']' starts a character class; otherwise brackets are literal.
+
+    Returns:
+    - bool: True if the path is a pattern, False if it is a literal path.
+    """
+    if any(character in path for character in PATTERN_CHARACTERS):
+        return True
+    return brackets and re.search(r"\[[^\\/]*\]", path) is not None
+
+
+def translate(pattern: str, brackets: bool = False) -> str:
+    """
+    Translates a shell-style pattern into a regular expression like `fnmatch.translate`, treating brackets literally
+    unless character classes are enabled.
+    """
+    return fnmatch.translate(pattern if brackets else pattern.replace("[", "[[]"))
+
+
+def split_segments(path: str) -> List[str]:
+    """
+    Splits a path on both kinds of separators, dropping empty segments.
+    """
+    return [segment for segment in re.split(r"[\\/]+", path) if segment]
+
+
+def compile_segment(segment: str, brackets: bool = False) -> Optional[Pattern]:
+    """
+    Compiles one path segment into a regular expression, or returns None for the recursive '**' segment.
+    """
+    if segment == RECURSIVE_SEGMENT:
+        return None
+    return re.compile(translate(segment, brackets), _FLAGS)
+
+
+def relative_segments(root: str, path: str) -> Optional[List[str]]:
+    """
+    Returns the segments of `path` below `root`, or None if `path` is not `root` or below it. Both are compared in
+    normalized case.
+    """
+    root = os.path.normcase(os.path.normpath(root))
+    path = os.path.normcase(os.path.normpath(path))
+    if root == os.curdir:
+        return None if os.path.isabs(path) else split_segments(path)
+    if path == root:
+        return []
+    prefix = root if root.endswith(os.sep) else root + os.sep
+    return split_segments(path[len(prefix):]) if path.startswith(prefix) else None
+
+
+class PathPattern:
+    """
+    A compiled path pattern. The leading segments without wildcards form the root the walk starts from; the remaining
+    segments are matched one directory level at a time, where '*', '?' and, if enabled, '[...]' match within a single
+    name and '**' matches any number of directory levels, including none.
+
+    Parameters:
+    - pattern (str): The pattern, with environment variables already expanded.
+    - brackets (bool): Whether '[...]' is a character class rather than literal text.
+    """
+
+    def __init__(self, pattern: str, brackets: bool = False) -> None:
+        self.pattern = pattern
+        drive, rest = os.path.splitdrive(pattern)
+        segments = split_segments(rest)
+        literal_count = next((index for index, segment in enumerate(segments) if is_pattern(segment, brackets)),
+                             len(segments))
+        anchor = os.sep if rest[:1] in ("\\", "/") else ""
+        self.root = drive + anchor + os.sep.join(segments[:literal_count]) or os.curdir
+        self.segments = segments[literal_count:]
+        self.matchers = [compile_segment(segment, brackets) for segment in self.segments]
+
+    def closure(self, states: Iterable[int]) -> Set[int]:
+        """
+        Extends a set of segment positions with the positions reachable by letting '**' segments match nothing.
+        """
+        result = set()
+        pending = list(states)
+        while pending:
+            state = pending.pop()
+            if state in result:
+                continue
+            result.add(state)
+            if state < len(self.matchers) and self.matchers[state] is None:
+                pending.append(state + 1)
+        return result
+
+    def advance(self, states: Set[int], name: str) -> Set[int]:
+        """
+        Returns the segment positions reached after descending into an entry with the given name.
+        """
+        reached = set()
+        for state in states:
+            if state == len(self.matchers):
+                continue
+            matcher = self.matchers[state]
+            if matcher is None:
+                reached.add(state)
+            elif matcher.match(name):
+                reached.add(state + 1)
+        return self.closure(reached)
+
+    def matches(self, path: str, max_depth: Optional[int] = None,
+                excludes: List[Tuple[Pattern, bool]] = ()) -> bool:
+        """
+        Checks whether `walk_pattern` yields a path, given that it exists with the right type, by following the pattern
+        positions along the path's segments below the root instead of walking the file system.
+
+        Parameters:
+        - path (str): The path, spelled like the walk spells its matches.
+        - max_depth (Optional[int]): The maximum number of levels below the root the walk descends.
+        - excludes (List[Tuple[Pattern, bool]]): The exclude patterns, as returned by `compile_excludes`.
+
+        Returns:
+        - bool: True if the path matches the pattern.
+        """
+        segments = relative_segments(self.root, path)
+        if segments is None or (max_depth is not None and len(segments) > max_depth):
+            return False
+        states = self.closure({0})
+        current = self.root
+        for name in segments:
+            current = os.path.join(current, name)
+            states = self.advance(states, name)
+            if not states or is_excluded_entry(name, current, excludes):
+                return False
+        return len(self.matchers) in states
+
+
+def compile_excludes(patterns: Sequence[str], brackets: bool = False) -> List[Tuple[Pattern, bool]]:
+    """
+    Compiles exclude patterns. A pattern without a separator is matched against entry names, any other pattern against
+    full paths; either way a match prunes the entry and everything below it.
+
+    Parameters:
+    - patterns (Sequence[str]): The exclude patterns, which may contain environment variables.
+    - brackets (bool): Whether '[...]' is a character class rather than literal text.
+
+    Returns:
+    - List[Tuple[Pattern, bool]]: The compiled patterns, each with whether it is matched against full paths.
+    """
+    compiled = []
+    for pattern in patterns:
+        pattern = os.path.normpath(os.path.expandvars(pattern))
+        compiled.append((re.compile(translate(pattern, brackets), _FLAGS), len(split_segments(pattern)) > 1))
+    return compiled
+
+
+def is_excluded_entry(name: str, path: str, excludes: List[Tuple[Pattern, bool]]) -> bool:
+    return any(exclude.match(path if match_path else name) for exclude, match_path in excludes)
+
+
+def scan_pattern(compiled: PathPattern, max_depth: Optional[int], excludes: List[Tuple[Pattern, bool]],
+                 include_files: bool, include_directories: bool) -> Iterator[Tuple[os.DirEntry, bool]]:
+    """
+    Walks below the root of a compiled pattern and yields every entry that matches or is descended into, together with
+    whether it matches. See `walk_pattern`.
+    """
+    stack = [(compiled.root, compiled.closure({0}), 0)]
+    while stack:
+        directory, states, depth = stack.pop()
+        if max_depth is not None and depth >= max_depth:
+            continue
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    reached = compiled.advance(states, entry.name)
+                    if not reached or is_excluded_entry(entry.name, entry.path, excludes):
+                        continue
+                    try:
+                        is_directory = entry.is_dir(follow_symlinks=False) and not entry.is_symlink()
+                    except OSError:
+                        continue
+                    matched = (len(compiled.matchers) in reached
+                               and (include_directories if is_directory else include_files))
+                    descend = is_directory and any(state < len(compiled.matchers) for state in reached)
+                    if matched or descend:
+                        yield entry, matched
+                    if descend:
+                        stack.append((entry.path, reached, depth + 1))
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            logging.warning(f"Cannot read directory '{directory}' while expanding '{compiled.pattern}': {str(e)}. "
+                            f"Skipping...")
+
+
+def walk_pattern(pattern: str, max_depth: Optional[int] = None, exclude: Sequence[str] = (),
+                 include_files: bool = False, include_directories: bool = True,
+                 brackets: bool = False) -> Iterator[str]:
+    """
+    Lazily yields the paths matching a pattern. The walk starts at the pattern's literal root and reads every directory
+    with a single os.scandir call. Each directory is visited at most once, together with the set of pattern positions
+    that can still match below it, and subtrees no pattern position can match are never entered. Symbolic links and
+    junctions are not followed, and directories that cannot be read are logged and skipped.
+
+    Parameters:
+    - pattern (str): The pattern, which may contain environment variables.
+    - max_depth (Optional[int]): The maximum number of levels below the root to descend, or None for no limit.
+    - exclude (Sequence[str]): Patterns of entries to skip together with their subtrees.
+    - include_files (bool): Whether matching files are yielded.
+    - include_directories (bool): Whether matching directories are yielded.
+    - brackets (bool): Whether '[...]' is a character class rather than literal text.
+
+    Returns:
+    - Iterator[str]: The matching paths, in walk order.
+    """
+    compiled = PathPattern(os.path.expandvars(pattern), brackets)
+    if len(compiled.matchers) in compiled.closure({0}) and include_directories and os.path.isdir(compiled.root):
+        yield compiled.root
+    for entry, matched in scan_pattern(compiled, max_depth, compile_excludes(exclude, brackets), include_files,
+                                       include_directories):
+        if matched:
+            yield entry.path
+
+
+def pattern_fingerprint(pattern: str, max_depth: Optional[int] = None, exclude: Sequence[str] = (),
+                        include_files: bool = False, include_directories: bool = True, brackets: bool = False) -> str:
+    """
+    Returns a value that changes whenever the result of walking a pattern, or the attributes of a match, may have
+    changed: a digest of the modification time and file attributes of the root and of every match and directory the
+    walk enters. A new or removed match changes the modification time of a directory the walk enters. On Windows the
+    times and attributes come with the directory listing, so this costs the walk without any per-match call.
+
+    Parameters:
+    - pattern (str): The pattern, which may contain environment variables.
+    - max_depth, exclude, include_files, include_directories, brackets: See `walk_pattern`.
+
+    Returns:
+    - str: The hex digest.
+    """
+    compiled = PathPattern(os.path.expandvars(pattern), brackets)
+    digest = hashlib.sha256()
+    try:
+        stat_result = os.stat(compiled.root)
+        digest.update(f"{stat_result.st_mtime_ns}:{getattr(stat_result, 'st_file_attributes', 0)}\n".encode())
+    except OSError:
+        return "missing"
+    for entry, matched in scan_pattern(compiled, max_depth, compile_excludes(exclude, brackets), include_files,
+                                       include_directories):
+        try:
+            stat_result = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        digest.update(f"{entry.path}\0{int(matched)}:{stat_result.st_mtime_ns}:"
+                      f"{getattr(stat_result, 'st_file_attributes', 0)}\n".encode(errors="surrogatepass"))
+    return digest.hexdigest()
+
+
+def covering_patterns(compiled: List[PathPattern]) -> List[List[PathPattern]]:
+    """
+    Returns, for every pattern, the earlier patterns whose walk can reach paths below its root: those whose root is the
+    same, above it without a symbolic link in between, or below it.
+    """
+    covering = []
+    for index, pattern in enumerate(compiled):
+        earlier = []
+        for other in compiled[:index]:
+            below = relative_segments(other.root, pattern.root)
+            if below is not None:
+                linked = any(os.path.islink(os.path.join(other.root, *below[:count]))
+                             for count in range(1, len(below) + 1))
+                if not linked:
+                    earlier.append(other)
+            elif relative_segments(pattern.root, other.root) is not None:
+                earlier.append(other)
+        covering.append(earlier)
+    return covering
+
+
+def walk_patterns(patterns: Sequence[str], max_depth: Optional[int] = None, exclude: Sequence[str] = (),
+                  include_files: bool = False, include_directories: bool = True, brackets: bool = False,
+                  workers: int = DEFAULT_WORKERS) -> Iterator[str]:
+    """
+    Lazily yields the paths matching any of the patterns, walking the patterns in parallel threads. Matches are handed
+    over through a bounded queue as soon as they are found, so the consumer can act on them while the walk continues
+    and memory use does not grow with the size of the trees. A path matched by several patterns is yielded once, by the
+    first of them: a match is dropped if an earlier pattern whose root overlaps matches it too, which is decided from
+    the path alone, so no set of the paths already yielded is kept.
+
+    Parameters:
+    - patterns (Sequence[str]): The patterns, which may contain environment variables.
+    - max_depth (Optional[int]): The maximum number of levels below each pattern's root to descend.
+    - exclude (Sequence[str]): Patterns of entries to skip together with their subtrees.
+    - include_files (bool): Whether matching files are yielded.
+    - include_directories (bool): Whether matching directories are yielded.
+    - brackets (bool): Whether '[...]' is a character class rather than literal text.
+    - workers (int): The maximum number of patterns walked at the same time.
+
+    Returns:
+    - Iterator[str]: The matching paths, in the order they are found.
+    """
+    options: Dict[str, Any] = {"max_depth": max_depth, "exclude": exclude, "include_files": include_files,
+                               "include_directories": include_directories, "brackets": brackets}
+    covering = covering_patterns([PathPattern(os.path.expandvars(pattern), brackets) for pattern in patterns])
+    excludes = compile_excludes(exclude, brackets)
+
+    def is_first_match(index: int, path: str) -> bool:
+        return not any(other.matches(path, max_depth, excludes) for other in covering[index])
+
+    if len(patterns) <= 1 or workers <= 1:
+        for index, pattern in enumerate(patterns):
+            for path in walk_pattern(pattern, **options):
+                if is_first_match(index, path):
+                    yield path
+        return
+
+    matches: "queue.Queue[Any]" = queue.Queue(maxsize=QUEUE_SIZE)
+    pending = queue.Queue()
+    for index, pattern in enumerate(patterns):
+        pending.put((index, pattern))
+    stopped = threading.Event()
+
+    def walk_worker() -> None:
+        try:
+            while not stopped.is_set():
+                try:
+                    index, pattern = pending.get_nowait()
+                except queue.Empty:
+                    return
+                for path in walk_pattern(pattern, **options):
+                    if stopped.is_set():
+                        return
+                    if is_first_match(index, path):
+                        matches.put(path)
+        finally:
+            matches.put(_DONE)
+
+    threads = [threading.Thread(target=walk_worker, daemon=True) for _ in range(min(workers, len(patterns)))]
+    for thread in threads:
+        thread.start()
+    try:
+        running = len(threads)
+        while running:
+            path = matches.get()
+            if path is _DONE:
+                running -= 1
+            else:
+                yield path
+    finally:
+        stopped.set()
+        while any(thread.is_alive() for thread in threads):
+            try:
+                matches.get(timeout=0.05)
+            except queue.Empty:
+                pass
+
+
+def pattern_options(section: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reads the optional pattern settings of a configuration section: 'exclude', a list of patterns to skip,
+    'maxDepth', the maximum number of levels to descend below each pattern's root, and 'matchBrackets', whether
+    '[...]' in the paths is a character class rather than literal text.
+
+    Parameters:
+    - section (Dict[str, Any]): The configuration section.
+
+    Returns:
+    - Dict[str, Any]: The keyword arguments for `walk_patterns`.
+    """
+    return {"exclude": section.get("exclude", []), "max_depth": section.get("maxDepth"),
+            "brackets": section.get("matchBrackets", False)}
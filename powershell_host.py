@@ -0,0 +1,251 @@
+import atexit
+import queue
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, List, Optional, Set, Tuple
+
+from backend_registry import get_backend, register_backend, set_backend
+from command_runner import get_runner
+from config_service import logging
+from metrics import count_subprocess, instrument
+
+POWERSHELL_ARGV = ["powershell", "-NoProfile", "-NonInteractive", "-Command", "-"]
+DEFAULT_TIMEOUT = 120.0
+# The number of recent commands whose latency is kept; totals cover every command.
+LATENCY_HISTORY = 256
+
+POWERSHELL_TOOL = "powershell"
+
+PowerShellRunner = Callable[[str], str]
+
+
+class PowerShellSession:
+    """
+    A long-lived PowerShell process that executes commands sent over its standard input. Every command is wrapped in a
+    frame that catches terminating errors and ends with a unique sentinel line carrying the exit status, so the output
+    of each command can be separated from the next one without restarting the interpreter. The command is parsed
+    inside the frame, so a syntax error is caught like any other error and the sentinel is still written. The process
+    is started lazily, restarted transparently if it has exited, and killed when a command exceeds its timeout.
+
+    Parameters:
+    - argv (List[str]): The command line used to start the interpreter. Defaults to a non-interactive 'powershell'
+      reading commands from stdin; a stand-in interpreter speaking the same protocol can be used instead.
+    - timeout (float): The default per-command timeout in seconds.
+    """
+
+    def __init__(self, argv: Optional[List[str]] = None, timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.argv = list(argv or POWERSHELL_ARGV)
+        self.timeout = timeout
+        self.latencies: Deque[Tuple[str, float]] = deque(maxlen=LATENCY_HISTORY)
+        self.commands = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.restarts = 0
+        self._token = f"__WSS_{uuid.uuid4().hex}__"
+        self._process: Optional[subprocess.Popen] = None
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _start(self) -> None:
+        """
+        Starts the interpreter process together with a reader thread that forwards its output lines to a queue.
+        """
+        if self._process is not None:
+            self.restarts += 1
+            logging.warning(f"Restarting PowerShell session (restart #{self.restarts}).")
+        self._lines = queue.Queue()
+        count_subprocess()
+        self._process = subprocess.Popen(self.argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, text=True, encoding="utf-8", bufsize=1)
+        threading.Thread(target=self._read_output, args=(self._process, self._lines), daemon=True).start()
+        self._send("$ErrorActionPreference = 'Stop'; $ProgressPreference = 'SilentlyContinue'; "
+                   "[Console]::OutputEncoding = [Text.Encoding]::UTF8")
+
+    @staticmethod
+    def _read_output(process: subprocess.Popen, lines: "queue.Queue[Optional[str]]") -> None:
+        """
+        Reads the interpreter output line by line until the stream is closed, then signals the end with None.
+        """
+        for line in process.stdout:
+            lines.put(line.rstrip("\r\n"))
+        lines.put(None)
+
+    def _send(self, text: str) -> None:
+        self._process.stdin.write(text + "\n")
+        self._process.stdin.flush()
+
+    def _kill(self) -> None:
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+
+    def run(self, command: str, timeout: Optional[float] = None) -> str:
+        """
+        Executes a single-line PowerShell command in the session and returns its output.
+
+        Parameters:
+        - command (str): The PowerShell command to execute.
+        - timeout (Optional[float]): The timeout in seconds, or None to use the session default.
+
+        Returns:
+        - str: The standard output of the command.
+
+        Raises:
+        - subprocess.CalledProcessError: If the command raised an error or the interpreter exited while running it.
+        - subprocess.TimeoutExpired: If the command did not finish in time; the interpreter is killed and restarted
+          on the next call.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock, instrument("powershell.command", command.split(" ", 1)[0]):
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+
+            started = time.perf_counter()
+            deadline = started + timeout
+            output, errors = [], []
+            try:
+                script = command.replace("'", "''")
+                self._send(f"$global:__wssStatus = 0; try {{ . ([ScriptBlock]::Create('{script}')) }} catch "
+                           f"{{ Write-Output ('{self._token}ERR ' + $_); $global:__wssStatus = 1 }}; "
+                           f"Write-Output ('{self._token}END ' + $global:__wssStatus)")
+                while True:
+                    line = self._lines.get(timeout=max(deadline - time.perf_counter(), 0))
+                    if line is None:
+                        raise subprocess.CalledProcessError(self._process.wait(), command, "\n".join(output),
+                                                            "PowerShell session exited unexpectedly.")
+                    if line.startswith(f"{self._token}ERR "):
+                        errors.append(line[len(self._token) + 4:])
+                    elif line.startswith(f"{self._token}END "):
+                        status = int(line[len(self._token) + 4:].strip() or 0)
+                        break
+                    else:
+                        output.append(line)
+            except queue.Empty:
+                self._kill()
+                raise subprocess.TimeoutExpired(command, timeout, "\n".join(output))
+            except OSError as e:
+                self._kill()
+                raise subprocess.CalledProcessError(-1, command, "\n".join(output), str(e))
+            finally:
+                elapsed = time.perf_counter() - started
+                self.latencies.append((command, elapsed))
+                self.commands += 1
+                self.total_latency += elapsed
+                self.max_latency = max(self.max_latency, elapsed)
+                logging.debug(f"PowerShell command finished in {elapsed * 1000:.1f} ms: {command[:80]}")
+
+        stdout = "\n".join(output) + ("\n" if output else "")
+        if status != 0:
+            raise subprocess.CalledProcessError(status, command, stdout, "\n".join(errors))
+        return stdout
+
+    def close(self) -> None:
+        """
+        Asks the interpreter to exit and waits briefly for it, killing it if it does not stop in time.
+        """
+        with self._lock:
+            if self._process is None:
+                return
+            try:
+                if self._process.poll() is None:
+                    self._send("exit")
+                    self._process.stdin.close()
+                    self._process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self._kill()
+            self._process = None
+
+    def latency_summary(self) -> str:
+        """
+        Summarizes the latencies of every command run in the session.
+
+        Returns:
+        - str: A single line with the command count, total, mean and maximum latency in milliseconds.
+        """
+        if not self.commands:
+            return "No PowerShell commands were executed."
+        return (f"{self.commands} PowerShell command(s), total {self.total_latency * 1000:.1f} ms, "
+                f"mean {self.total_latency / self.commands * 1000:.1f} ms, max {self.max_latency * 1000:.1f} ms, "
+                f"{self.restarts} restart(s)")
+
+
+register_backend("powershell", "powershell", PowerShellSession, default=True)
+_read_only_commands: Set[str] = set()
+
+
+def get_session() -> PowerShellSession:
+    """
+    Returns the PowerShell session shared by all steps, creating it on first use. The session is closed automatically
+    when the interpreter exits.
+
+    Returns:
+    - PowerShellSession: The shared session.
+    """
+    return get_backend("powershell")
+
+
+def set_session(session: Optional[PowerShellSession]) -> None:
+    """
+    Replaces the shared session, closing the previous one. Used to point every PowerShell step at a different
+    interpreter, such as a stand-in used for testing on Linux.
+
+    Parameters:
+    - session (Optional[PowerShellSession]): The new shared session, or None to create a default one on next use.
+    """
+    previous = set_backend("powershell", session)
+    get_runner().cache.invalidate(POWERSHELL_TOOL)
+    if previous is not None and previous is not session:
+        previous.close()
+
+
+def close_session() -> None:
+    """
+    Closes the shared session, if one was started, and logs its latency summary.
+    """
+    session = set_backend("powershell", None)
+    if session is not None:
+        logging.debug(session.latency_summary())
+        session.close()
+
+
+atexit.register(close_session)
+
+
+def register_read_only_command(command: str) -> None:
+    """
+    Declares a PowerShell command as read-only, so `run_powershell` memoizes its output for the rest of the run.
+    Running any other command drops the memoized outputs, since it may have changed what they describe.
+
+    Parameters:
+    - command (str): The exact command text.
+    """
+    _read_only_commands.add(command)
+
+
+def run_powershell(command: str) -> str:
+    """
+    Runs a PowerShell command in the shared session and returns its standard output. The output of commands registered
+    with `register_read_only_command` is memoized in the shared command runner's result cache.
+
+    Parameters:
+    - command (str): The PowerShell command to execute.
+
+    Returns:
+    - str: The standard output of the command.
+
+    Raises:
+    - subprocess.CalledProcessError: If the command failed.
+    - subprocess.TimeoutExpired: If the command did not finish within the session timeout.
+    """
+    cache = get_runner().cache
+    if command not in _read_only_commands:
+        cache.invalidate(POWERSHELL_TOOL)
+        return get_session().run(command)
+    output = cache.get(POWERSHELL_TOOL, (command,))
+    if output is None:
+        output = get_session().run(command)
+        cache.put(POWERSHELL_TOOL, (command,), output)
+    return output
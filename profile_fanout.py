@@ -0,0 +1,392 @@
+import json
+import ntpath
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config_service import setup_logging, logging
+from registry_backend import HKEY_LOCAL_MACHINE, HKEY_USERS, MemoryRegistry, RegistryBackend, get_default_registry
+from state_cache import write_json_atomically
+from undo_journal import (UndoJournal, decode_value, encode_value, get_journal, merge_worker_journals, set_journal,
+                          worker_journal_path)
+
+DEFAULT_PROFILE_WORKERS = 4
+PROFILE_LIST_KEY = r"SOFTWARE\Microsoft\Windows NT\CurrentVersion\ProfileList"
+# Accounts created by users; the well-known SIDs (SYSTEM, LOCAL SERVICE, NETWORK SERVICE) have no interactive profile.
+USER_SID_PREFIX = "S-1-5-21-"
+# Directories under the profile root that are not user profiles.
+SYSTEM_PROFILES = {"public", "default", "default user", "all users", "defaultapppool"}
+PER_USER_STEPS = ("create_folders", "hide_folders", "set_locales")
+HIVE_FILE = "ntuser.json"
+PROFILE_VARIABLE = re.compile(r"%([^%]+)%")
+
+# The registry to use for one profile, the hive holding its settings and the key path of its root inside that hive.
+OpenedHive = Tuple[RegistryBackend, str, str]
+
+
+@dataclass(frozen=True)
+class Profile:
+    """
+    A user profile the per-user steps are applied to.
+
+    Attributes:
+    - name (str): The name of the profile directory, usually the user name.
+    - home (str): The profile directory, the value of %USERPROFILE% for that user.
+    - hive_root (Optional[str]): The key of the user's hive under HKU (the user's SID), or None if it is not loaded.
+    """
+    name: str
+    home: str
+    hive_root: Optional[str] = None
+
+
+@dataclass
+class ProfileReport:
+    """
+    The outcome of applying the per-user steps to one profile.
+
+    Attributes:
+    - profile (str): The profile name.
+    - outcomes (Dict[str, Dict[str, int]]): Per step, the number of items with each outcome, e.g. {'created': 3}.
+    - duration (float): Seconds spent on the profile.
+    - error (Optional[str]): The error that stopped the profile, or None.
+    """
+    profile: str
+    outcomes: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    duration: float = 0.0
+    error: Optional[str] = None
+
+
+def default_profile_root() -> str:
+    """
+    Returns the directory holding the user profiles, the parent of the current user's profile (e.g. 'C:\\Users').
+    """
+    return os.path.dirname(os.path.normpath(os.environ.get("USERPROFILE") or os.path.expanduser("~")))
+
+
+def profile_variables(profile: Profile) -> Dict[str, str]:
+    """
+    Returns the per-user environment variables of a profile, keyed by upper-case name.
+    """
+    return {
+        "USERPROFILE": profile.home,
+        "HOMEPATH": os.path.splitdrive(profile.home)[1],
+        "USERNAME": profile.name,
+        "APPDATA": os.path.join(profile.home, "AppData", "Roaming"),
+        "LOCALAPPDATA": os.path.join(profile.home, "AppData", "Local"),
+    }
+
+
+def expand_for_profile(text: str, variables: Dict[str, str]) -> str:
+    """
+    Expands a configured path for another user: the per-user %VARIABLES% are replaced case-insensitively with the
+    profile's values, and the remaining variables are expanded from the current environment.
+
+    Parameters:
+    - text (str): The path as written in the configuration, e.g. '%APPDATA%\\Tools'.
+    - variables (Dict[str, str]): The profile's variables, as returned by `profile_variables`.
+
+    Returns:
+    - str: The expanded path.
+    """
+    return os.path.expandvars(PROFILE_VARIABLE.sub(
+        lambda match: variables.get(match.group(1).upper(), match.group(0)), text))
+
+
+def profile_sections(sections: Dict[str, Dict[str, Any]], profile: Profile) -> Dict[str, Dict[str, Any]]:
+    """
+    Returns a copy of the per-user sections with every path and exclude pattern expanded for the given profile.
+    """
+    variables = profile_variables(profile)
+    expanded = {}
+    for step_name, section in sections.items():
+        section = dict(section)
+        for key in ("paths", "exclude"):
+            if key in section:
+                section[key] = [expand_for_profile(path, variables) if path else path for path in section[key]]
+        expanded[step_name] = section
+    return expanded
+
+
+class ProfileSource(ABC):
+    """
+    The interface used to discover the profiles the per-user steps are applied to.
+    """
+
+    @abstractmethod
+    def profiles(self) -> List[Profile]:
+        """
+        Returns the target profiles, ordered by name.
+        """
+        raise NotImplementedError
+
+
+class DirectoryProfileSource(ProfileSource):
+    """
+    Discovers profiles as the directories under a profile root, leaving out the shared and template profiles.
+
+    Parameters:
+    - profile_root (str): The directory holding the profiles, e.g. 'C:\\Users'.
+    - hive_roots (Optional[Dict[str, str]]): The key of each user's loaded hive under HKU, keyed by lower-case profile
+      name, as returned by `loaded_hive_roots`.
+    """
+
+    def __init__(self, profile_root: str, hive_roots: Optional[Dict[str, str]] = None) -> None:
+        self.profile_root = profile_root
+        self.hive_roots = {name.lower(): root for name, root in (hive_roots or {}).items()}
+
+    def profiles(self) -> List[Profile]:
+        profiles = []
+        with os.scandir(self.profile_root) as entries:
+            for entry in entries:
+                if (not entry.is_dir(follow_symlinks=False) or entry.name.lower() in SYSTEM_PROFILES
+                        or entry.name.startswith(".")):
+                    continue
+                profiles.append(Profile(entry.name, entry.path, self.hive_roots.get(entry.name.lower())))
+        return sorted(profiles, key=lambda profile: profile.name.lower())
+
+
+def loaded_hive_roots(registry: Optional[RegistryBackend] = None) -> Dict[str, str]:
+    """
+    Maps the profiles of user accounts to their hives under HKU, using the profile directories recorded in the
+    ProfileList key. Only hives that are currently loaded (the user is logged on, or the hive was loaded by an
+    administrator) are returned.
+
+    Parameters:
+    - registry (Optional[RegistryBackend]): The registry backend to use, by default the Windows registry.
+
+    Returns:
+    - Dict[str, str]: The SID of every loaded user hive, keyed by lower-case profile directory name.
+    """
+    registry = registry or get_default_registry()
+    loaded = {name.lower() for name in registry.list_subkeys(HKEY_USERS, "")}
+    roots = {}
+    for sid in registry.list_subkeys(HKEY_LOCAL_MACHINE, PROFILE_LIST_KEY):
+        if not sid.upper().startswith(USER_SID_PREFIX) or sid.lower() not in loaded:
+            continue
+        image_path = registry.read_values(HKEY_LOCAL_MACHINE, f"{PROFILE_LIST_KEY}\\{sid}").get("ProfileImagePath")
+        if image_path:
+            roots[ntpath.basename(os.path.expandvars(str(image_path[0])).rstrip("\\")).lower()] = sid
+    return roots
+
+
+class HiveAccess(ABC):
+    """
+    The interface used to reach the registry hive of a profile.
+    """
+
+    @abstractmethod
+    def open(self, profile: Profile) -> Optional[OpenedHive]:
+        """
+        Opens the hive of a profile.
+
+        Returns:
+        - Optional[OpenedHive]: The registry, hive and root key path to use, or None if the hive is not available.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def close(self, profile: Profile, registry: RegistryBackend) -> None:
+        """
+        Releases a hive returned by `open`, saving it if needed.
+        """
+        raise NotImplementedError
+
+
+class RegistryHiveAccess(HiveAccess):
+    """
+    Reaches the loaded hives under HKU through the default registry backend. Profiles whose hive is not loaded are
+    skipped; loading an offline NTUSER.DAT is left to the administrator.
+    """
+
+    def open(self, profile: Profile) -> Optional[OpenedHive]:
+        if profile.hive_root is None:
+            return None
+        return get_default_registry(), HKEY_USERS, profile.hive_root
+
+    def close(self, profile: Profile, registry: RegistryBackend) -> None:
+        pass
+
+
+class JsonHiveAccess(HiveAccess):
+    """
+    Keeps the hive of every profile as a JSON file inside the profile directory, mapping key paths to their values,
+    and serves it through a `MemoryRegistry`. It stands in for the real hives when the fan-out runs without Windows.
+
+    Parameters:
+    - file_name (str): The name of the hive file in every profile directory.
+    """
+
+    def __init__(self, file_name: str = HIVE_FILE) -> None:
+        self.file_name = file_name
+
+    def open(self, profile: Profile) -> Optional[OpenedHive]:
+        try:
+            with open(os.path.join(profile.home, self.file_name), "r", encoding="utf-8") as file:
+                keys = json.load(file)
+        except FileNotFoundError:
+            return None
+        return MemoryRegistry({(HKEY_USERS, key_path): {name: (decode_value(value), value_type)
+                                                        for name, (value, value_type) in values.items()}
+                               for key_path, values in keys.items()}), HKEY_USERS, ""
+
+    def close(self, profile: Profile, registry: RegistryBackend) -> None:
+        keys = {key_path: {name: [encode_value(value), value_type] for name, (value, value_type) in values.items()}
+                for (_, key_path), values in registry.keys.items()}
+        write_json_atomically(os.path.join(profile.home, self.file_name), keys)
+
+
+def count_outcomes(outcomes: Dict[str, str]) -> Dict[str, int]:
+    """
+    Counts the items of a step per outcome.
+    """
+    counts: Dict[str, int] = {}
+    for outcome in outcomes.values():
+        counts[outcome] = counts.get(outcome, 0) + 1
+    return counts
+
+
+def apply_to_profile(profile: Profile, sections: Dict[str, Dict[str, Any]], hive_access: HiveAccess) -> ProfileReport:
+    """
+    Applies the per-user steps to one profile: the folder steps with the profile's paths, and the locale settings to
+    the profile's hive. Runs in a worker process of `fan_out`.
+
+    Parameters:
+    - profile (Profile): The target profile.
+    - sections (Dict[str, Dict[str, Any]]): The validated sections of the per-user steps, keyed by step name.
+    - hive_access (HiveAccess): How the profile's hive is reached.
+
+    Returns:
+    - ProfileReport: The outcome counts of every step.
+    """
+    from create_folders import create_folders
+    from hide_folders import hide_folders
+    from path_patterns import pattern_options
+    from set_locales import KEY_PATH, modify_locale
+
+    started = time.perf_counter()
+    report = ProfileReport(profile.name)
+    sections = profile_sections(sections, profile)
+    try:
+        if "create_folders" in sections:
+            section = sections["create_folders"]
+            report.outcomes["create_folders"] = count_outcomes(create_folders(section["paths"], section["enabled"]))
+        if "hide_folders" in sections:
+            section = sections["hide_folders"]
+            report.outcomes["hide_folders"] = count_outcomes(
+                hide_folders(section["paths"], section["enabled"], **pattern_options(section)))
+        if "set_locales" in sections:
+            settings = sections["set_locales"]["formatOptions"]
+            opened = hive_access.open(profile)
+            if opened is None:
+                logging.warning(f"The registry hive of profile '{profile.name}' is not loaded. Skipping...")
+                report.outcomes["set_locales"] = {"no-hive": len(settings)}
+            else:
+                registry, hive, root = opened
+                try:
+                    changes = modify_locale(settings, sections["set_locales"]["enabled"], registry, hive,
+                                            f"{root}\\{KEY_PATH}" if root else KEY_PATH)
+                finally:
+                    hive_access.close(profile, registry)
+                report.outcomes["set_locales"] = ({"failed": len(settings)} if changes is None else
+                                                  {"changed": len(changes), "unchanged": len(settings) - len(changes)})
+    except Exception as e:
+        report.error = str(e)
+    finally:
+        # The worker process may exit without closing its journal, so the buffered records are written now.
+        get_journal().commit()
+    report.duration = time.perf_counter() - started
+    return report
+
+
+def initialize_worker(log_level: str, journal_path: Optional[str], run_id: Optional[str],
+                      setup: Optional[Callable[[], None]]) -> None:
+    """
+    Prepares a worker process: logging at the given console level, a journal of its own recording under the parent's
+    run, and an optional setup callable, e.g. one installing in-memory backends.
+    """
+    setup_logging(log_level)
+    set_journal(UndoJournal(worker_journal_path(journal_path), run_id) if journal_path else None)
+    if setup is not None:
+        setup()
+
+
+def fan_out(sections: Dict[str, Dict[str, Any]], profiles: List[Profile], hive_access: HiveAccess,
+            workers: int = DEFAULT_PROFILE_WORKERS, log_level: str = "WARNING", journal_path: Optional[str] = None,
+            run_id: Optional[str] = None, setup: Optional[Callable[[], None]] = None) -> List[ProfileReport]:
+    """
+    Applies the per-user steps to every profile on a pool of worker processes, so a slow or failing profile does not
+    hold up the others and the folder and registry work of different users runs in parallel.
+
+    Parameters:
+    - sections (Dict[str, Dict[str, Any]]): The validated sections of the per-user steps, keyed by step name.
+    - profiles (List[Profile]): The target profiles.
+    - hive_access (HiveAccess): How the hive of each profile is reached; it must be picklable.
+    - workers (int): The maximum number of profiles processed at the same time.
+    - log_level (str): The console logging level of the worker processes.
+    - journal_path (Optional[str]): The undo journal the changes are recorded in, or None for no journal. Every worker
+      writes its own file next to it, and the files are merged into it once the pool has shut down.
+    - run_id (Optional[str]): The run identifier the workers record their changes under.
+    - setup (Optional[Callable[[], None]]): A picklable callable run once in every worker process.
+
+    Returns:
+    - List[ProfileReport]: The report of every profile, in the order of `profiles`.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if not profiles:
+        return []
+    reports = []
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(profiles))), initializer=initialize_worker,
+                                 initargs=(log_level, journal_path, run_id, setup)) as executor:
+            futures = [executor.submit(apply_to_profile, profile, sections, hive_access) for profile in profiles]
+            for profile, future in zip(profiles, futures):
+                try:
+                    reports.append(future.result())
+                except Exception as e:
+                    reports.append(ProfileReport(profile.name, error=f"Worker failed: {str(e)}"))
+    finally:
+        if journal_path:
+            try:
+                merge_worker_journals(journal_path)
+            except OSError as e:
+                logging.error(f"Failed to merge the worker journals into '{journal_path}': {str(e)}")
+    return reports
+
+
+def format_counts(outcomes: Dict[str, Dict[str, int]]) -> str:
+    """
+    Formats the outcome counts of several steps, e.g. 'create_folders: 2 created, 1 exists; set_locales: 1 changed'.
+    """
+    return "; ".join(f"{step_name}: " + ", ".join(f"{count} {outcome}" for outcome, count in sorted(counts.items()))
+                     for step_name, counts in outcomes.items())
+
+
+def log_profile_report(reports: List[ProfileReport]) -> None:
+    """
+    Logs a table with the outcome counts of every step for every profile, followed by the totals across profiles.
+
+    Parameters:
+    - reports (List[ProfileReport]): The reports returned by `fan_out`.
+    """
+    if not reports:
+        logging.info("No user profiles were found.")
+        return
+    width = max(len(report.profile) for report in reports)
+    totals: Dict[str, Dict[str, int]] = {}
+    logging.info("Profile summary:")
+    for report in reports:
+        for step_name, counts in report.outcomes.items():
+            step_totals = totals.setdefault(step_name, {})
+            for outcome, count in counts.items():
+                step_totals[outcome] = step_totals.get(outcome, 0) + count
+        line = f"  {report.profile:<{width}}  took {report.duration * 1000:8.1f} ms  {format_counts(report.outcomes)}"
+        if report.error:
+            logging.error(f"{line}  FAILED: {report.error}")
+        else:
+            logging.info(line)
+    failed = sum(1 for report in reports if report.error)
+    logging.info(f"  {len(reports)} profile(s), {failed} failed. Totals: {format_counts(totals)}")
@@ -0,0 +1,202 @@
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from config_service import logging
+
+PROFILE_DIR = ".setup_profile"
+REPORT_VERSION = 1
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 25
+TRACEBACK_FRAMES = 8
+IMPORT_REPEATS = 3
+# The modules that can be run as scripts; their cold start is what a user waits for before anything happens.
+ENTRY_POINTS = ("setup_runner", "create_folders", "hide_folders", "set_locales", "set_services",
+                "set_registry_tweaks", "add_defender_exclusions")
+# cProfile hooks only the thread that enables it, unlike tracemalloc, so the reports say what they leave out.
+THREAD_NOTE = ("cProfile covers only the thread running each step: work a step hands to its own thread pool shows up "
+               "as time spent waiting for the pool, not as the functions the pool runs. Memory figures cover every "
+               "thread.")
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+_directory: Optional[str] = None
+_steps: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+
+
+def enable(directory: str = PROFILE_DIR) -> None:
+    """
+    Turns profiling on: every step wrapped in `profile_step` is run under cProfile and tracemalloc, and its reports
+    are written to `directory`. cProfile and tracemalloc are only imported here, so they cost nothing otherwise.
+
+    Parameters:
+    - directory (str): The directory the reports are written to; it is created if needed.
+    """
+    global _directory
+    import tracemalloc
+    os.makedirs(directory, exist_ok=True)
+    with _lock:
+        _steps.clear()
+        _directory = directory
+    tracemalloc.start(TRACEBACK_FRAMES)
+
+
+def disable() -> None:
+    """
+    Turns profiling off. The collected step summaries stay available until profiling is enabled again.
+    """
+    global _directory
+    import tracemalloc
+    with _lock:
+        _directory = None
+    tracemalloc.stop()
+
+
+def is_enabled() -> bool:
+    return _directory is not None
+
+
+@contextmanager
+def profile_step(name: str) -> Iterator[None]:
+    """
+    Profiles the enclosed block as one step when profiling is enabled, writing three reports named after the step:
+    the raw cProfile data ('<name>.prof', readable with pstats or snakeviz), the hottest functions by cumulative and
+    own time ('<name>.txt') and the allocation sites that grew the most ('<name>.alloc.txt'). tracemalloc traces every
+    thread, so steps are attributed correctly only when they run one at a time. cProfile only sees the calling thread,
+    so the functions a step runs on its own thread pool are missing from its hot function report (see THREAD_NOTE).
+
+    Parameters:
+    - name (str): The step name.
+    """
+    directory = _directory
+    if directory is None:
+        yield
+        return
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    # The snapshots and reports of the profiler itself are not part of the step.
+    own_files = [tracemalloc.Filter(False, module.__file__) for module in (tracemalloc, pstats, cProfile)]
+    profiler = cProfile.Profile()
+    before = tracemalloc.take_snapshot().filter_traces(own_files)
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        wall_time = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        growth = sorted((stat for stat in tracemalloc.take_snapshot().filter_traces(own_files).compare_to(
+            before, "lineno") if stat.size_diff > 0), key=lambda stat: stat.size_diff, reverse=True)
+        write_step_reports(directory, name, profiler, growth)
+        with _lock:
+            _steps[name] = {"wall_time": round(wall_time, 6), "peak_memory": peak,
+                            "allocated": sum(stat.size_diff for stat in growth)}
+
+
+def write_step_reports(directory: str, name: str, profiler: Any, growth: List[Any]) -> None:
+    """
+    Writes the cProfile data, the hot function report and the allocation report of one step.
+    """
+    import io
+    import pstats
+
+    profiler.dump_stats(os.path.join(directory, f"{name}.prof"))
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output).strip_dirs()
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP_FUNCTIONS)
+    with open(os.path.join(directory, f"{name}.txt"), "w", encoding="utf-8") as file:
+        file.write(f"{THREAD_NOTE}\n\n{output.getvalue()}")
+    with open(os.path.join(directory, f"{name}.alloc.txt"), "w", encoding="utf-8") as file:
+        for stat in growth[:TOP_ALLOCATIONS]:
+            file.write(f"{stat}\n")
+
+
+def parse_import_time(output: str, module: str) -> Optional[float]:
+    """
+    Extracts the cumulative import time of a top-level module, in seconds, from the output of 'python -X importtime'.
+    """
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match and match.group(4) == module and len(match.group(3)) <= 1:
+            return int(match.group(2)) / 1e6
+    return None
+
+
+def measure_startup(modules: List[str] = ENTRY_POINTS, repeats: int = IMPORT_REPEATS) -> Dict[str, Dict[str, float]]:
+    """
+    Measures the cold start of every module in a fresh interpreter: the cumulative time spent importing it, as
+    reported by 'python -X importtime', and the wall time of the whole process, interpreter start included. The best
+    of `repeats` runs is kept, since slower runs only add noise from the rest of the machine.
+
+    Parameters:
+    - modules (List[str]): The modules to import.
+    - repeats (int): The number of fresh interpreters started per module.
+
+    Returns:
+    - Dict[str, Dict[str, float]]: The 'import_time' and 'cold_start' of every module in seconds; modules that fail
+      to import are left out.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in modules:
+        import_times = []
+        cold_starts = []
+        for _ in range(max(1, repeats)):
+            started = time.perf_counter()
+            completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=root,
+                                       capture_output=True, text=True)
+            cold_starts.append(time.perf_counter() - started)
+            import_time = parse_import_time(completed.stderr, module) if completed.returncode == 0 else None
+            if import_time is None:
+                logging.warning(f"Failed to measure the import time of '{module}'. Skipping...")
+                break
+            import_times.append(import_time)
+        else:
+            results[module] = {"import_time": round(min(import_times), 6), "cold_start": round(min(cold_starts), 6)}
+    return results
+
+
+def write_report(startup: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Writes 'profile.json' with the wall time, peak memory and allocated bytes of every profiled step and, optionally,
+    the cold start of every entry point, and logs a summary. Both note that the hot function reports only cover the
+    thread running each step.
+
+    Parameters:
+    - startup (bool): Whether to measure the cold start of the entry points, which starts a few interpreters.
+
+    Returns:
+    - Optional[Dict[str, Any]]: The report, or None if profiling is disabled.
+    """
+    directory = _directory
+    if directory is None:
+        return None
+    with _lock:
+        steps = dict(_steps)
+    report = {"version": REPORT_VERSION, "created": time.time(), "python": platform.python_version(),
+              "notes": [THREAD_NOTE], "steps": steps, "startup": measure_startup() if startup else {}}
+    with open(os.path.join(directory, "profile.json"), "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+    logging.info(f"Profile written to '{directory}':")
+    for name, step in steps.items():
+        logging.info(f"  {name:<24} {step['wall_time'] * 1000:10.1f} ms  peak {step['peak_memory']:>10} B  "
+                     f"allocated {step['allocated']:>10} B")
+    for module, times in report["startup"].items():
+        logging.info(f"  import {module:<24} {times['import_time'] * 1000:8.1f} ms  "
+                     f"cold start {times['cold_start'] * 1000:8.1f} ms")
+    logging.info(THREAD_NOTE)
+    return report
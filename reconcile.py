@@ -0,0 +1,83 @@
+import fnmatch
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from config_service import logging
+from path_patterns import is_pattern
+
+
+class Allowlist:
+    """
+    The entries of a section that reconcile mode never removes, even though the configuration does not list them.
+    Entries are normalized like the items they are compared with; literal entries are looked up in a set and entries
+    with wildcards are matched with fnmatch, so an allowlist of a few patterns keeps every lookup cheap.
+
+    Parameters:
+    - entries (Iterable[str]): The allowlist as written in the configuration.
+    - normalize (Callable[[str], str]): Converts an entry to the normalized form of the items.
+    """
+
+    def __init__(self, entries: Iterable[str], normalize: Callable[[str], str]) -> None:
+        self.literals = set()
+        self.patterns = []
+        for entry in entries:
+            if not entry:
+                continue
+            if is_pattern(entry):
+                self.patterns.append(normalize(entry))
+            else:
+                self.literals.add(normalize(entry))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.literals or any(fnmatch.fnmatchcase(key, pattern) for pattern in self.patterns)
+
+
+def reconcile_sets(desired: Dict[str, Any], current: Dict[str, Any],
+                   allowlist: Allowlist) -> Tuple[List[Any], List[Any], List[Any]]:
+    """
+    Compares the desired and the current entries of a section, both keyed by their normalized form, as two set
+    differences computed with hash lookups, in time linear in the number of entries.
+
+    Parameters:
+    - desired (Dict[str, Any]): The configured entries.
+    - current (Dict[str, Any]): The entries currently present.
+    - allowlist (Allowlist): The entries never removed.
+
+    Returns:
+    - Tuple[List[Any], List[Any], List[Any]]: The desired entries that are missing, in configured order; the current
+      entries that are not configured and have to be removed; and those kept because of the allowlist.
+    """
+    missing = [value for key, value in desired.items() if key not in current]
+    removed, kept = [], []
+    for key, value in current.items():
+        if key not in desired:
+            (kept if key in allowlist else removed).append(value)
+    return missing, removed, kept
+
+
+def managed_items(records: Iterable[Dict[str, Any]], key: Callable[[Dict[str, Any]], str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Collects the items earlier runs changed from the journal records of one kind: for each item, the first record
+    since it was last released. A record marked 'pruned' was written when reconcile mode gave the item back, so the
+    item is no longer managed until a later run changes it again.
+
+    Parameters:
+    - records (Iterable[Dict[str, Any]]): The journal records of the runs that were not rolled back, oldest first.
+    - key (Callable[[Dict[str, Any]], str]): Returns the normalized identifier of the item a record belongs to.
+
+    Returns:
+    - Dict[str, Dict[str, Any]]: The first record of every managed item, keyed by the normalized identifier.
+    """
+    managed: Dict[str, Dict[str, Any]] = {}
+    for record in records:
+        if record.get("pruned"):
+            managed.pop(key(record), None)
+        else:
+            managed.setdefault(key(record), record)
+    return managed
+
+
+def log_reconcile(label: str, missing: int, removed: int, kept: int) -> None:
+    """
+    Logs the outcome of the set comparison of one section.
+    """
+    logging.info(f"Reconciling {label}: {missing} to add, {removed} to remove, {kept} kept by the allowlist.")
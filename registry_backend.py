@@ -0,0 +1,238 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from backend_registry import get_backend, register_backend, set_backend
+
+HKEY_CURRENT_USER = "HKCU"
+HKEY_LOCAL_MACHINE = "HKLM"
+HKEY_USERS = "HKU"
+
+# Registry value types, with the same numeric values as the winreg constants.
+REG_SZ = 1
+REG_EXPAND_SZ = 2
+REG_BINARY = 3
+REG_DWORD = 4
+REG_MULTI_SZ = 7
+REG_QWORD = 11
+
+HWND_BROADCAST = 0xFFFF
+WM_SETTINGCHANGE = 0x001A
+SMTO_ABORTIFHUNG = 0x0002
+
+# A registry value together with its type, as returned by winreg.QueryValueEx.
+RegistryValue = Tuple[Any, int]
+
+
+class RegistryBackend(ABC):
+    """
+    The interface used by the registry steps to read and write values. Keys are addressed by a hive name ('HKCU',
+    'HKLM') and a key path; every call opens the key once and handles all the values passed to it.
+    """
+
+    @abstractmethod
+    def read_values(self, hive: str, key_path: str) -> Dict[str, RegistryValue]:
+        """
+        Reads every value under a key in a single enumeration pass.
+
+        Returns:
+        - Dict[str, RegistryValue]: The values keyed by value name.
+
+        Raises:
+        - FileNotFoundError: If the key does not exist.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_values(self, hive: str, key_path: str, values: Dict[str, RegistryValue], create: bool = False,
+                     delete: Iterable[str] = ()) -> None:
+        """
+        Writes the given values under a key, and deletes the named ones, opening the key once for all of them.
+
+        Parameters:
+        - create (bool): Whether to create the key (and its missing parents) if it does not exist.
+        - delete (Iterable[str]): The names of values to delete; names that do not exist are ignored.
+
+        Raises:
+        - FileNotFoundError: If the key does not exist and `create` is False.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_subkeys(self, hive: str, key_path: str) -> List[str]:
+        """
+        Returns the names of the direct subkeys of a key; an empty key path lists the hive's top-level keys.
+
+        Raises:
+        - FileNotFoundError: If the key does not exist.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def key_last_write(self, hive: str, key_path: str) -> int:
+        """
+        Returns the last write time of a key as an opaque integer that changes whenever a value under it is written.
+
+        Raises:
+        - FileNotFoundError: If the key does not exist.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def broadcast_setting_change(self, area: str) -> None:
+        """
+        Notifies running applications that the settings of the given area (e.g. 'intl') have changed.
+        """
+        raise NotImplementedError
+
+
+class WinRegistry(RegistryBackend):
+    """
+    A registry backend using the winreg module and a WM_SETTINGCHANGE broadcast through user32. The Windows modules are
+    imported on first use.
+    """
+
+    def __init__(self) -> None:
+        import winreg
+        self._winreg = winreg
+        self._hives = {HKEY_CURRENT_USER: winreg.HKEY_CURRENT_USER, HKEY_LOCAL_MACHINE: winreg.HKEY_LOCAL_MACHINE,
+                       HKEY_USERS: winreg.HKEY_USERS}
+
+    def read_values(self, hive: str, key_path: str) -> Dict[str, RegistryValue]:
+        reg = self._winreg
+        values = {}
+        with reg.OpenKey(self._hives[hive], key_path, 0, reg.KEY_READ) as key:
+            _, value_count, _ = reg.QueryInfoKey(key)
+            for index in range(value_count):
+                name, value, value_type = reg.EnumValue(key, index)
+                values[name] = (value, value_type)
+        return values
+
+    def write_values(self, hive: str, key_path: str, values: Dict[str, RegistryValue], create: bool = False,
+                     delete: Iterable[str] = ()) -> None:
+        reg = self._winreg
+        open_key = reg.CreateKeyEx if create else reg.OpenKey
+        with open_key(self._hives[hive], key_path, 0, reg.KEY_WRITE) as key:
+            for name, (value, value_type) in values.items():
+                reg.SetValueEx(key, name, 0, value_type, value)
+            for name in delete:
+                try:
+                    reg.DeleteValue(key, name)
+                except FileNotFoundError:
+                    pass
+
+    def list_subkeys(self, hive: str, key_path: str) -> List[str]:
+        reg = self._winreg
+        with reg.OpenKey(self._hives[hive], key_path, 0, reg.KEY_READ) as key:
+            return [reg.EnumKey(key, index) for index in range(reg.QueryInfoKey(key)[0])]
+
+    def key_last_write(self, hive: str, key_path: str) -> int:
+        reg = self._winreg
+        with reg.OpenKey(self._hives[hive], key_path, 0, reg.KEY_READ) as key:
+            return reg.QueryInfoKey(key)[2]
+
+    def broadcast_setting_change(self, area: str) -> None:
+        import ctypes
+        from ctypes import wintypes
+        result = wintypes.DWORD()
+        ctypes.windll.user32.SendMessageTimeoutW(HWND_BROADCAST, WM_SETTINGCHANGE, 0, area, SMTO_ABORTIFHUNG, 5000,
+                                                 ctypes.byref(result))
+
+
+class MemoryRegistry(RegistryBackend):
+    """
+    An in-memory registry backend for running the registry steps without Windows. Key paths and value names are
+    case-insensitive like the real registry, and a value keeps the spelling it was created with. Every key open, value
+    read and value write is counted, and an optional latency is added to every key open to model the cost of a real
+    registry call.
+
+    Parameters:
+    - keys (Dict[Tuple[str, str], Dict[str, RegistryValue]]): The initial values keyed by (hive, key path).
+    - latency (float): Seconds added to every key open.
+    """
+
+    def __init__(self, keys: Dict[Tuple[str, str], Dict[str, RegistryValue]] = None, latency: float = 0.0) -> None:
+        self.keys = {(hive, path.lower()): dict(values) for (hive, path), values in (keys or {}).items()}
+        self.latency = latency
+        self.opens = 0
+        self.reads = 0
+        self.writes = 0
+        self.broadcasts = []
+        self.last_writes: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def _open(self, hive: str, key_path: str, create: bool = False) -> Dict[str, RegistryValue]:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.opens += 1
+            if create:
+                self.keys.setdefault((hive, key_path.lower()), {})
+            key = self.keys.get((hive, key_path.lower()))
+        if key is None:
+            raise FileNotFoundError(f"The registry key '{hive}\\{key_path}' does not exist.")
+        return key
+
+    def read_values(self, hive: str, key_path: str) -> Dict[str, RegistryValue]:
+        key = self._open(hive, key_path)
+        with self._lock:
+            self.reads += len(key)
+            return dict(key)
+
+    def write_values(self, hive: str, key_path: str, values: Dict[str, RegistryValue], create: bool = False,
+                     delete: Iterable[str] = ()) -> None:
+        key = self._open(hive, key_path, create)
+        with self._lock:
+            self.writes += len(values)
+            stored = {name.lower(): name for name in key}
+            for name, value in values.items():
+                key[stored.setdefault(name.lower(), name)] = value
+            for name in delete:
+                key.pop(stored.get(name.lower(), name), None)
+            self.last_writes[(hive, key_path.lower())] = time.time_ns()
+
+    def list_subkeys(self, hive: str, key_path: str) -> List[str]:
+        # Keys are only stored when they hold values, so a key also exists if any key below it does.
+        path = key_path.strip("\\").lower()
+        prefix = path + "\\" if path else ""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.opens += 1
+            names = {stored[len(prefix):].split("\\")[0] for stored_hive, stored in self.keys
+                     if stored_hive == hive and stored.startswith(prefix) and len(stored) > len(prefix)}
+            if path and not names and (hive, path) not in self.keys:
+                raise FileNotFoundError(f"The registry key '{hive}\\{key_path}' does not exist.")
+        return sorted(names)
+
+    def key_last_write(self, hive: str, key_path: str) -> int:
+        self._open(hive, key_path)
+        with self._lock:
+            return self.last_writes.get((hive, key_path.lower()), 0)
+
+    def broadcast_setting_change(self, area: str) -> None:
+        with self._lock:
+            self.broadcasts.append(area)
+
+
+register_backend("registry", "windows", WinRegistry, default=True)
+register_backend("registry", "memory", MemoryRegistry)
+
+
+def get_default_registry() -> RegistryBackend:
+    """
+    Returns the registry backend used by the registry steps when none is given explicitly, creating the selected
+    backend, by default the Windows registry, on first use.
+    """
+    return get_backend("registry")
+
+
+def set_default_registry(registry: Optional[RegistryBackend]) -> None:
+    """
+    Replaces the default registry backend, for example with a `MemoryRegistry` to run the registry steps on Linux.
+
+    Parameters:
+    - registry (Optional[RegistryBackend]): The new default backend, or None to use the selected backend again.
+    """
+    set_backend("registry", registry)
@@ -0,0 +1,293 @@
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from config_service import logging
+from metrics import instrument
+from registry_backend import RegistryBackend, RegistryValue, get_default_registry
+from undo_journal import JOURNAL_FILE, UndoJournal, decode_value, merge_worker_journals, read_journal
+
+DEFAULT_WORKERS = 8
+LOCALE_KEY = ("HKCU", r"Control Panel\International")
+SETTING_CHANGE_AREA = "intl"
+
+KeyId = Tuple[str, str]
+
+
+@dataclass
+class UndoPlan:
+    """
+    The state to restore, collected from the journal records of the runs being rolled back. Where an item was changed
+    more than once, the state it had before the first change is kept.
+
+    Attributes:
+    - registry (Dict[KeyId, Dict[str, Optional[RegistryValue]]]): Per key, the values to restore; None deletes a value
+      that did not exist.
+    - startup_types (Dict[str, str]): The startup types to restore, keyed by service name.
+    - statuses (Dict[str, Tuple[str, str]]): The status each service had and the action that changed it.
+    - attributes (Dict[str, int]): The file attributes to restore, keyed by path.
+    - directories (List[str]): The directories to remove, most recently created first.
+    - defender (Dict[str, List[str]]): The exclusions to remove, keyed by preference property.
+    - removed_exclusions (Dict[str, List[str]]): The exclusions reconcile mode removed, to add back, keyed by
+      preference property.
+    """
+    registry: Dict[KeyId, Dict[str, Optional[RegistryValue]]] = field(default_factory=dict)
+    startup_types: Dict[str, str] = field(default_factory=dict)
+    statuses: Dict[str, Tuple[str, str]] = field(default_factory=dict)
+    attributes: Dict[str, int] = field(default_factory=dict)
+    directories: List[str] = field(default_factory=list)
+    defender: Dict[str, List[str]] = field(default_factory=dict)
+    removed_exclusions: Dict[str, List[str]] = field(default_factory=dict)
+
+
+def select_runs(records: List[Dict[str, Any]], run: str) -> List[str]:
+    """
+    Determines which runs of the journal to roll back; runs that were already rolled back are never selected again.
+
+    Parameters:
+    - records (List[Dict[str, Any]]): The journal records.
+    - run (str): 'last' for the most recent run, 'all' for every run, or the identifier of one run.
+
+    Returns:
+    - List[str]: The identifiers of the selected runs, oldest first.
+    """
+    rolled_back = {record.get("target") for record in records if record.get("kind") == "rollback"}
+    runs = list(dict.fromkeys(record.get("run") for record in records if record.get("kind") != "rollback"))
+    runs = [run_id for run_id in runs if run_id not in rolled_back]
+    if run == "all":
+        return runs
+    if run == "last":
+        return runs[-1:]
+    return [run_id for run_id in runs if run_id == run]
+
+
+def collect_undo(records: List[Dict[str, Any]], runs: Iterable[str]) -> UndoPlan:
+    """
+    Walks the records of the selected runs from newest to oldest and collects the state to restore.
+
+    Parameters:
+    - records (List[Dict[str, Any]]): The journal records.
+    - runs (Iterable[str]): The runs to roll back.
+
+    Returns:
+    - UndoPlan: The state to restore, grouped by backend.
+    """
+    selected = set(runs)
+    plan = UndoPlan()
+    seen_directories: Set[str] = set()
+    exclusions: Dict[Tuple[str, str], str] = {}
+    for record in reversed(records):
+        if record.get("run") not in selected:
+            continue
+        kind = record.get("kind")
+        if kind == "registry":
+            previous = record["previous"]
+            plan.registry.setdefault((record["hive"], record["key"]), {})[record["name"]] = \
+                None if previous is None else (decode_value(previous[0]), previous[1])
+        elif kind == "startup_type":
+            plan.startup_types[record["name"]] = record["previous"]
+        elif kind == "status":
+            plan.statuses[record["name"]] = (record["previous"], record["action"])
+        elif kind == "attributes":
+            plan.attributes[record["path"]] = record["previous"]
+        elif kind == "directory" and record["path"] not in seen_directories:
+            seen_directories.add(record["path"])
+            plan.directories.append(record["path"])
+        elif kind in ("defender", "defender_removed"):
+            exclusions[(record["property"], record["value"])] = kind
+    for (property_name, value), kind in exclusions.items():
+        target = plan.defender if kind == "defender" else plan.removed_exclusions
+        target.setdefault(property_name, []).append(value)
+    return plan
+
+
+def undo_action(previous: str, action: str) -> Optional[str]:
+    """
+    Returns the service control action that brings a service back to the status it had before `action` was applied,
+    or None if that status cannot be reached with a control action.
+    """
+    if previous == "stopped":
+        return "stop"
+    if previous == "paused":
+        return "pause"
+    if previous == "running":
+        return "resume" if action == "pause" else "start"
+    return None
+
+
+def remove_defender_exclusions(exclusions: Dict[str, List[str]]) -> None:
+    """
+    Removes the added exclusions with one 'Remove-MpPreference' call per preference property.
+    """
+    change_defender_exclusions(exclusions, "Remove", "Removed")
+
+
+def restore_defender_exclusions(exclusions: Dict[str, List[str]]) -> None:
+    """
+    Adds back the exclusions reconcile mode removed with one 'Add-MpPreference' call per preference property.
+    """
+    change_defender_exclusions(exclusions, "Add", "Restored")
+
+
+def change_defender_exclusions(exclusions: Dict[str, List[str]], verb: str, past: str) -> None:
+    """
+    Runs one '<verb>-MpPreference' call per preference property with all of its values.
+    """
+    from add_defender_exclusions import describe_error, quote_powershell_literal
+    from powershell_host import run_powershell
+
+    for property_name, values in exclusions.items():
+        cmd = f"{verb}-MpPreference -{property_name} " + ",".join(quote_powershell_literal(value) for value in values)
+        try:
+            with instrument(f"defender.{verb.lower()}", property_name):
+                run_powershell(cmd)
+            logging.info(f"{past} {len(values)} {property_name} exclusion(s).")
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            logging.error(f"Failed to {verb.lower()} {property_name} exclusions: {', '.join(values)}. "
+                          f"Error: {describe_error(e)}")
+
+
+def restore_registry(keys: Dict[KeyId, Dict[str, Optional[RegistryValue]]],
+                     registry: Optional[RegistryBackend] = None) -> None:
+    """
+    Restores the previous registry values with one write per key, deleting the values that did not exist before, and
+    broadcasts a setting change if the locale key was restored.
+    """
+    registry = registry or get_default_registry()
+    for (hive, key_path), values in keys.items():
+        restored = {name: value for name, value in values.items() if value is not None}
+        deleted = [name for name, value in values.items() if value is None]
+        try:
+            with instrument("registry.write", f"{hive}\\{key_path}"):
+                registry.write_values(hive, key_path, restored, delete=deleted)
+            logging.info(f"Restored {len(restored)} and deleted {len(deleted)} value(s) under '{hive}\\{key_path}'.")
+        except OSError as e:
+            logging.error(f"Failed to restore the registry values under '{hive}\\{key_path}': {str(e)}")
+    if any((hive, key_path.lower()) == (LOCALE_KEY[0], LOCALE_KEY[1].lower()) for hive, key_path in keys):
+        registry.broadcast_setting_change(SETTING_CHANGE_AREA)
+
+
+def restore_services(startup_types: Dict[str, str], statuses: Dict[str, Tuple[str, str]],
+                     workers: int = DEFAULT_WORKERS) -> None:
+    """
+    Restores the previous startup types concurrently, then the previous statuses in dependency order, waiting for
+    every state change like the service step does.
+    """
+    from service_control import CONTROL_TARGET_STATUS, ServiceControlError
+    from set_services import get_default_controller, order_state_changes, wait_for_service_status
+
+    controller = get_default_controller()
+
+    def restore_startup_type(name: str) -> None:
+        try:
+            controller.set_startup_type(name, startup_types[name])
+            logging.info(f"Restored the startup type of {name} to '{startup_types[name]}'.")
+        except ServiceControlError as e:
+            logging.error(f"Failed to restore the startup type of {name}. Error: {e}")
+
+    actions = {}
+    for name, (previous, action) in statuses.items():
+        undo = undo_action(previous, action)
+        if undo is None:
+            logging.warning(f"Cannot restore service {name} to status '{previous}'. Skipping...")
+            continue
+        actions[name] = undo
+
+    def restore_status(name: str) -> None:
+        try:
+            controller.control(name, actions[name])
+            if wait_for_service_status(name, CONTROL_TARGET_STATUS[actions[name]], controller=controller):
+                logging.info(f"Restored service {name} to status '{CONTROL_TARGET_STATUS[actions[name]]}'.")
+            else:
+                logging.error(f"Failed to restore service {name} to status '{CONTROL_TARGET_STATUS[actions[name]]}'.")
+        except ServiceControlError as e:
+            logging.error(f"Failed to restore the status of {name}. Error: {e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(restore_startup_type, startup_types))
+        if actions:
+            for wave in order_state_changes(actions, controller):
+                list(executor.map(restore_status, wave))
+
+
+def restore_attributes(attributes: Dict[str, int]) -> None:
+    """
+    Restores the previous attributes of every changed path.
+    """
+    from fs_engine import get_attribute_backend
+
+    backend = get_attribute_backend()
+    for path, previous in attributes.items():
+        try:
+            with instrument("fs.set_attributes", path):
+                backend.set_attributes(path, previous)
+            logging.info(f"Restored the attributes of '{path}'.")
+        except OSError as e:
+            logging.error(f"Failed to restore the attributes of '{path}': {str(e)}")
+
+
+def remove_directories(directories: List[str]) -> None:
+    """
+    Removes the created directories, most recently created first. Directories that are no longer empty are kept.
+    """
+    for path in directories:
+        try:
+            os.rmdir(path)
+            logging.info(f"Removed directory '{path}'.")
+        except FileNotFoundError:
+            logging.info(f"Directory '{path}' no longer exists. Skipping...")
+        except OSError as e:
+            logging.warning(f"Directory '{path}' was not removed: {str(e)}. Skipping...")
+
+
+def rollback(file_path: str = JOURNAL_FILE, run: str = "last", workers: int = DEFAULT_WORKERS) -> bool:
+    """
+    Rolls back one or more runs recorded in the undo journal. The records are replayed in reverse and grouped by
+    backend, so every registry key is opened once, every preference property needs one 'Remove-MpPreference' call and
+    services are restored concurrently in dependency order; nothing is probed beforehand. Defender exclusions are
+    removed first and the ones reconcile mode removed are added back, then registry values, services and folder
+    attributes are restored, and created folders are removed last. The runs are then marked as rolled back in the
+    journal.
+
+    Parameters:
+    - file_path (str): The journal file.
+    - run (str): 'last' for the most recent run, 'all' for every run, or the identifier of one run.
+    - workers (int): The maximum number of services restored at the same time.
+
+    Returns:
+    - bool: True if there was something to roll back, otherwise False.
+    """
+    try:
+        merge_worker_journals(file_path)
+        records = list(read_journal(file_path))
+    except OSError as e:
+        logging.error(f"Failed to read the journal '{file_path}': {str(e)}")
+        return False
+
+    runs = select_runs(records, run)
+    if not runs:
+        logging.info(f"No run matching '{run}' to roll back in '{file_path}'.")
+        return False
+    logging.info(f"Rolling back run(s) {', '.join(runs)}...")
+
+    plan = collect_undo(records, runs)
+    if plan.defender:
+        remove_defender_exclusions(plan.defender)
+    if plan.removed_exclusions:
+        restore_defender_exclusions(plan.removed_exclusions)
+    if plan.registry:
+        restore_registry(plan.registry)
+    if plan.startup_types or plan.statuses:
+        restore_services(plan.startup_types, plan.statuses, workers)
+    if plan.attributes:
+        restore_attributes(plan.attributes)
+    if plan.directories:
+        remove_directories(plan.directories)
+
+    journal = UndoJournal(file_path)
+    for run_id in runs:
+        journal.record("rollback", target=run_id)
+    journal.close()
+    return True
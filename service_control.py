@@ -0,0 +1,495 @@
+import os
+import subprocess
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from backend_registry import register_backend
+from command_runner import run_command
+from metrics import instrument
+
+StatusListener = Callable[[str], None]
+
+SC_CONTROL_VERBS = {"start": "start", "stop": "stop", "pause": "pause", "resume": "continue"}
+
+CONTROL_TARGET_STATUS = {"start": "running", "stop": "stopped", "pause": "paused", "resume": "running"}
+
+# 'sc' verbs that do not change anything, so they neither drop memoized results nor need care when retried.
+SC_READ_ONLY_VERBS = frozenset({"query", "queryex", "qc", "enumdepend"})
+# Read-only verbs whose output only changes through other 'sc' commands, so it can be memoized until the next one. The
+# status reported by 'query' also changes on its own while a service starts or stops; ServiceSnapshotCache caches it.
+SC_MEMOIZED_VERBS = frozenset({"qc", "enumdepend"})
+# Exit statuses of 'sc' worth retrying: ERROR_SERVICE_DATABASE_LOCKED and ERROR_SERVICE_CANNOT_ACCEPT_CTRL.
+SC_TRANSIENT_EXIT_CODES = frozenset({1055, 1061})
+
+
+class ServiceControlError(Exception):
+    """
+    Raised when a service controller fails to query or modify a service.
+    """
+
+
+class ServiceController(ABC):
+    """
+    The interface used by `set_services` to query and modify Windows services. Implementations map the simplified
+    startup types ('auto', 'delayed-auto', 'demand', 'disabled') and statuses ('running', 'stopped', 'paused') used by
+    the scripts to their own backend. Queries return 'unknown' when the state cannot be determined; modifications raise
+    `ServiceControlError` on failure.
+    """
+
+    @abstractmethod
+    def query_startup_type(self, name: str) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def query_status(self, name: str) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def query_dependencies(self, name: str) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def is_pausable(self, name: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_startup_type(self, name: str, startup_type: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def control(self, name: str, action: str) -> None:
+        raise NotImplementedError
+
+    def list_services(self) -> List[str]:
+        """
+        Returns the name of every installed service, spelled the way the Service Control Manager stores it. Backends
+        that cannot enumerate services return an empty list.
+        """
+        return []
+
+    def preload(self, names: List[str]) -> None:
+        """
+        Gives the backend a chance to load the state of all the given services at once before they are queried one by
+        one. Backends without a bulk query do nothing.
+        """
+
+    def invalidate(self, name: str) -> None:
+        """
+        Discards any cached status of the service so the next status query observes its current state. Called
+        before every poll while waiting for a state change. Backends without a cache do nothing.
+        """
+
+    def add_status_listener(self, name: str, listener: StatusListener) -> Callable[[], None]:
+        """
+        Registers a callback invoked with the new status whenever the backend observes a status change of the
+        service. Backends without change notifications accept the listener and never call it.
+
+        Returns:
+        - Callable[[], None]: A function removing the listener again.
+        """
+        return lambda: None
+
+    def close(self) -> None:
+        """
+        Releases the handles the backend keeps open. Backends without open handles do nothing.
+        """
+
+
+@dataclass(frozen=True)
+class ServiceSnapshot:
+    """
+    The parsed state of one service: its startup type and status in the simplified form used by the scripts, the
+    controls it currently accepts (e.g. 'STOPPABLE', 'PAUSABLE') and the names of the services it depends on.
+    """
+    name: str
+    startup_type: str
+    status: str
+    accepted_controls: FrozenSet[str]
+    dependencies: Tuple[str, ...]
+
+
+def run_sc(args: List[str]) -> str:
+    """
+    Runs the 'sc' command line tool with the given arguments through the shared command runner and returns its output.
+    Every call has a timeout after which 'sc' is killed, and configuration queries are memoized until the next command
+    that may change them. Only queries are retried after a timeout or a transient failure: a start, stop or 'config'
+    that timed out may still have gone through, and sending it again would fail, e.g. with 1056 for a second start.
+
+    Parameters:
+    - args (List[str]): The arguments passed to 'sc'.
+
+    Returns:
+    - str: The standard output of the command.
+
+    Raises:
+    - subprocess.CalledProcessError: If 'sc' exits with a non-zero status.
+    - subprocess.TimeoutExpired: If 'sc' did not finish in time, even after retrying.
+    """
+    with instrument(f"sc.{args[0]}", args[1] if len(args) == 2 else None):
+        read_only = args[0] in SC_READ_ONLY_VERBS
+        return run_command(["sc"] + args, read_only=read_only, retries=None if read_only else 0,
+                           transient_codes=SC_TRANSIENT_EXIT_CODES, memoize=args[0] in SC_MEMOIZED_VERBS)
+
+
+def parse_sc_fields(output: str) -> List[Dict[str, List[str]]]:
+    """
+    Splits the output of 'sc query' or 'sc qc' into one record per service. Every record maps a field name such as
+    'STATE' or 'DEPENDENCIES' to its values; continuation lines (a value without a field name, or a parenthesized list
+    of accepted controls) are appended to the previous field.
+
+    Parameters:
+    - output (str): The output of the 'sc' command.
+
+    Returns:
+    - List[Dict[str, List[str]]]: One field mapping per 'SERVICE_NAME' block.
+    """
+    records: List[Dict[str, List[str]]] = []
+    field_name = None
+    for line in output.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        key, separator, value = stripped.partition(":")
+        key = key.strip()
+        if separator and key == "SERVICE_NAME":
+            records.append({})
+            field_name = key
+        elif not records:
+            continue
+        elif separator and key and " " not in key:
+            field_name = key
+        elif separator and not key:
+            pass
+        else:
+            value = stripped
+        if field_name is not None and value.strip():
+            records[-1].setdefault(field_name, []).append(value.strip())
+    return records
+
+
+def parse_startup_type(start_type: str) -> str:
+    """
+    Maps an 'sc qc' START_TYPE value, such as '2   AUTO_START  (DELAYED)', to a simplified startup type.
+    """
+    words = start_type.replace("(", " ").replace(")", " ").split()
+    if "AUTO_START" in words:
+        return "delayed-auto" if "DELAYED" in words else "auto"
+    return {"DEMAND_START": "demand", "DISABLED": "disabled", "BOOT_START": "boot",
+            "SYSTEM_START": "system"}.get(next((word for word in words if not word.isdigit()), ""), "unknown")
+
+
+def parse_status(state: List[str]) -> Tuple[str, FrozenSet[str]]:
+    """
+    Maps the STATE lines of 'sc query', such as ['4  RUNNING', '(STOPPABLE, NOT_PAUSABLE, ACCEPTS_SHUTDOWN)'], to a
+    simplified status and the set of accepted controls.
+    """
+    words = state[0].split() if state else []
+    status = next((word.lower() for word in words if not word.isdigit()), "unknown")
+    controls = frozenset(control.strip() for line in state[1:] for control in line.strip("()").split(",")
+                         if control.strip())
+    return status, controls
+
+
+class ServiceSnapshotCache:
+    """
+    Caches the parsed 'sc query' and 'sc qc' output of every service for the duration of a run, so each command runs
+    at most once per service until the service is modified. The status half of a snapshot comes from 'sc query' and
+    the configuration half from 'sc qc'; they are cached and invalidated separately. `load_all_statuses` fills the
+    status half for every service with a single 'sc query' process.
+
+    Parameters:
+    - runner (Callable[[List[str]], str]): The callable used to run 'sc' with a list of arguments.
+    """
+
+    def __init__(self, runner: Callable[[List[str]], str] = run_sc) -> None:
+        self.runner = runner
+        self._statuses: Dict[str, Tuple[str, FrozenSet[str]]] = {}
+        self._configs: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+        self.names: List[str] = []
+        self._lock = threading.Lock()
+
+    def load_all_statuses(self) -> int:
+        """
+        Queries the status of every service in one 'sc query type= service state= all' call and caches the results
+        along with the service names.
+
+        Returns:
+        - int: The number of services loaded, or 0 if the query failed.
+        """
+        try:
+            output = self.runner(["query", "type=", "service", "state=", "all", "bufsize=", "262144"])
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            return 0
+        records = parse_sc_fields(output)
+        statuses = {record["SERVICE_NAME"][0].lower(): parse_status(record.get("STATE", [])) for record in records}
+        with self._lock:
+            self._statuses.update(statuses)
+            self.names = [record["SERVICE_NAME"][0] for record in records]
+        return len(statuses)
+
+    def _status(self, name: str) -> Tuple[str, FrozenSet[str]]:
+        with self._lock:
+            cached = self._statuses.get(name.lower())
+        if cached is not None:
+            return cached
+        try:
+            records = parse_sc_fields(self.runner(["query", name]))
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            return "unknown", frozenset()
+        status = parse_status(records[0].get("STATE", [])) if records else ("unknown", frozenset())
+        with self._lock:
+            self._statuses[name.lower()] = status
+        return status
+
+    def _config(self, name: str) -> Tuple[str, Tuple[str, ...]]:
+        with self._lock:
+            cached = self._configs.get(name.lower())
+        if cached is not None:
+            return cached
+        try:
+            records = parse_sc_fields(self.runner(["qc", name]))
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            return "unknown", ()
+        if not records:
+            return "unknown", ()
+        start_type = records[0].get("START_TYPE", [""])
+        config = parse_startup_type(" ".join(start_type)), tuple(records[0].get("DEPENDENCIES", []))
+        with self._lock:
+            self._configs[name.lower()] = config
+        return config
+
+    def get(self, name: str) -> ServiceSnapshot:
+        """
+        Returns the snapshot of a service, running 'sc query' and 'sc qc' only for the halves not cached yet.
+        """
+        startup_type, dependencies = self._config(name)
+        status, controls = self._status(name)
+        return ServiceSnapshot(name, startup_type, status, controls, dependencies)
+
+    def status(self, name: str) -> Tuple[str, FrozenSet[str]]:
+        """
+        Returns the cached status and accepted controls of a service, querying them if needed.
+        """
+        return self._status(name)
+
+    def config(self, name: str) -> Tuple[str, Tuple[str, ...]]:
+        """
+        Returns the cached startup type and dependencies of a service, querying them if needed.
+        """
+        return self._config(name)
+
+    def invalidate(self, name: str, status: bool = True, config: bool = True) -> None:
+        """
+        Drops the cached status and/or configuration of a service after it has been modified.
+        """
+        with self._lock:
+            if status:
+                self._statuses.pop(name.lower(), None)
+            if config:
+                self._configs.pop(name.lower(), None)
+
+
+class ScServiceController(ServiceController):
+    """
+    A service controller that uses the 'sc' command line tool. Query results are parsed once into snapshots and cached
+    per run; each modification invalidates only the part of the snapshot it affects.
+
+    Parameters:
+    - runner (Callable[[List[str]], str]): The callable used to run 'sc' with a list of arguments.
+    """
+
+    def __init__(self, runner: Callable[[List[str]], str] = run_sc) -> None:
+        self.runner = runner
+        self.snapshots = ServiceSnapshotCache(runner)
+
+    def list_services(self) -> List[str]:
+        if not self.snapshots.names:
+            self.snapshots.load_all_statuses()
+        return list(self.snapshots.names)
+
+    def preload(self, names: List[str]) -> None:
+        self.snapshots.load_all_statuses()
+
+    def invalidate(self, name: str) -> None:
+        self.snapshots.invalidate(name, config=False)
+
+    def query_startup_type(self, name: str) -> str:
+        return self.snapshots.config(name)[0]
+
+    def query_status(self, name: str) -> str:
+        return self.snapshots.status(name)[0]
+
+    def query_dependencies(self, name: str) -> List[str]:
+        return list(self.snapshots.config(name)[1])
+
+    def is_pausable(self, name: str) -> bool:
+        return "PAUSABLE" in self.snapshots.status(name)[1]
+
+    def set_startup_type(self, name: str, startup_type: str) -> None:
+        try:
+            self.runner(["config", name, "start=", startup_type])
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            raise ServiceControlError(e.output.strip() if e.output else str(e)) from e
+        finally:
+            self.snapshots.invalidate(name, status=False)
+
+    def control(self, name: str, action: str) -> None:
+        try:
+            self.runner([SC_CONTROL_VERBS[action], name])
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            raise ServiceControlError(str(e)) from e
+        finally:
+            self.snapshots.invalidate(name, config=False)
+
+
+def create_service_controller(backend: str = "auto", read_only: bool = False) -> ServiceController:
+    """
+    Creates the service controller for the given backend name. 'native' calls the Service Control Manager API
+    directly, 'sc' launches the 'sc' tool, and 'auto' uses the native backend on Windows and falls back to 'sc' if it
+    cannot be initialized.
+
+    Parameters:
+    - backend (str): The backend name: 'auto', 'native' or 'sc'.
+    - read_only (bool): Whether the native backend opens services with query access only.
+
+    Returns:
+    - ServiceController: The new controller.
+
+    Raises:
+    - ValueError: If the backend name is unknown.
+    """
+    if backend == "sc":
+        return ScServiceController()
+    if backend not in ("auto", "native"):
+        raise ValueError(f"Unknown service backend '{backend}'. Known backends: auto, native, sc.")
+    if backend == "auto" and os.name != "nt":
+        return ScServiceController()
+    try:
+        from service_control_native import NativeServiceController
+        return NativeServiceController(read_only=read_only)
+    except (ImportError, OSError, AttributeError, ServiceControlError):
+        if backend == "native":
+            raise
+        return ScServiceController()
+
+
+register_backend("services", "auto", create_service_controller, default=True)
+register_backend("services", "native", lambda: create_service_controller("native"))
+register_backend("services", "sc", ScServiceController)
+# Variants for the modes that only query services, such as planning and inventories.
+register_backend("services", "auto-read-only", lambda: create_service_controller("auto", read_only=True))
+register_backend("services", "native-read-only", lambda: create_service_controller("native", read_only=True))
+register_backend("services", "sc-read-only", ScServiceController)
+
+
+class SimulatedService:
+    """
+    The state of one service in a `SimulatedServiceController`.
+    """
+
+    def __init__(self, startup_type: str = "demand", status: str = "stopped", dependencies: Optional[List[str]] = None,
+                 pausable: bool = False) -> None:
+        self.startup_type = startup_type
+        self.status = status
+        self.dependencies = list(dependencies or [])
+        self.pausable = pausable
+
+
+class SimulatedServiceController(ServiceController):
+    """
+    An in-memory service controller for running the service engine without Windows. State changes complete after a
+    configurable latency on a timer thread and notify status listeners, like a real service reporting its new state.
+    Starting a service whose dependencies are not running, or stopping one whose dependents are still running, fails
+    the same way the Service Control Manager would reject it. Every call is counted in `calls`.
+
+    Parameters:
+    - services (Dict[str, SimulatedService]): The simulated services keyed by name.
+    - start_latency (float): Seconds a start or resume takes to complete.
+    - stop_latency (float): Seconds a stop or pause takes to complete.
+    - query_latency (float): Seconds every query or configuration change takes.
+    """
+
+    def __init__(self, services: Dict[str, SimulatedService], start_latency: float = 0.0, stop_latency: float = 0.0,
+                 query_latency: float = 0.0) -> None:
+        self.services = services
+        self.start_latency = start_latency
+        self.stop_latency = stop_latency
+        self.query_latency = query_latency
+        self.calls: Dict[str, int] = {}
+        self._listeners: Dict[str, List[StatusListener]] = {}
+        self._lock = threading.RLock()
+
+    def _service(self, operation: str, name: str) -> Optional[SimulatedService]:
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.query_latency:
+            threading.Event().wait(self.query_latency)
+        return self.services.get(name)
+
+    def list_services(self) -> List[str]:
+        return list(self.services)
+
+    def query_startup_type(self, name: str) -> str:
+        service = self._service("query_startup_type", name)
+        return service.startup_type if service else "unknown"
+
+    def query_status(self, name: str) -> str:
+        service = self._service("query_status", name)
+        return service.status if service else "unknown"
+
+    def query_dependencies(self, name: str) -> List[str]:
+        service = self._service("query_dependencies", name)
+        return list(service.dependencies) if service else []
+
+    def is_pausable(self, name: str) -> bool:
+        service = self._service("is_pausable", name)
+        return bool(service and service.pausable)
+
+    def set_startup_type(self, name: str, startup_type: str) -> None:
+        service = self._service("set_startup_type", name)
+        if service is None:
+            raise ServiceControlError(f"The specified service '{name}' does not exist.")
+        service.startup_type = startup_type
+
+    def control(self, name: str, action: str) -> None:
+        service = self._service("control", name)
+        if service is None:
+            raise ServiceControlError(f"The specified service '{name}' does not exist.")
+        with self._lock:
+            if action == "start":
+                if service.startup_type == "disabled":
+                    raise ServiceControlError(f"The service '{name}' is disabled.")
+                stopped = [dependency for dependency in service.dependencies
+                           if self.services.get(dependency) is None or self.services[dependency].status != "running"]
+                if stopped:
+                    raise ServiceControlError(f"A dependency of '{name}' is not running: {', '.join(stopped)}.")
+            elif action == "stop":
+                running = [other for other, state in self.services.items()
+                           if name in state.dependencies and state.status != "stopped"]
+                if running:
+                    raise ServiceControlError(f"Dependent services of '{name}' are running: {', '.join(running)}.")
+            elif action in ("pause", "resume") and not service.pausable:
+                raise ServiceControlError(f"The service '{name}' cannot accept pause or resume requests.")
+        latency = self.start_latency if action in ("start", "resume") else self.stop_latency
+        timer = threading.Timer(latency, self._complete, args=(name, CONTROL_TARGET_STATUS[action]))
+        timer.daemon = True
+        timer.start()
+
+    def _complete(self, name: str, status: str) -> None:
+        with self._lock:
+            self.services[name].status = status
+            listeners = list(self._listeners.get(name, []))
+        for listener in listeners:
+            listener(status)
+
+    def add_status_listener(self, name: str, listener: StatusListener) -> Callable[[], None]:
+        with self._lock:
+            self._listeners.setdefault(name, []).append(listener)
+
+        def remove() -> None:
+            with self._lock:
+                if listener in self._listeners.get(name, []):
+                    self._listeners[name].remove(listener)
+        return remove
@@ -0,0 +1,505 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from metrics import instrument
+from service_control import ServiceControlError, ServiceController
+
+SC_MANAGER_CONNECT = 0x0001
+SC_MANAGER_ENUMERATE_SERVICE = 0x0004
+
+SERVICE_QUERY_CONFIG = 0x0001
+SERVICE_CHANGE_CONFIG = 0x0002
+SERVICE_QUERY_STATUS = 0x0004
+SERVICE_START = 0x0010
+SERVICE_STOP = 0x0020
+SERVICE_PAUSE_CONTINUE = 0x0040
+SERVICE_ACCESS = (SERVICE_QUERY_CONFIG | SERVICE_CHANGE_CONFIG | SERVICE_QUERY_STATUS | SERVICE_START | SERVICE_STOP
+                  | SERVICE_PAUSE_CONTINUE)
+SERVICE_READ_ACCESS = SERVICE_QUERY_CONFIG | SERVICE_QUERY_STATUS
+
+SERVICE_NO_CHANGE = 0xFFFFFFFF
+SERVICE_WIN32 = 0x00000030
+SERVICE_STATE_ALL = 0x00000003
+SC_ENUM_PROCESS_INFO = 0
+SC_STATUS_PROCESS_INFO = 0
+SERVICE_CONFIG_DELAYED_AUTO_START_INFO = 3
+ERROR_INSUFFICIENT_BUFFER = 122
+ERROR_MORE_DATA = 234
+
+SERVICE_CONTROL_STOP = 0x00000001
+SERVICE_CONTROL_PAUSE = 0x00000002
+SERVICE_CONTROL_CONTINUE = 0x00000003
+SERVICE_ACCEPT_STOP = 0x00000001
+SERVICE_ACCEPT_PAUSE_CONTINUE = 0x00000002
+
+START_TYPES = {0: "boot", 1: "system", 2: "auto", 3: "demand", 4: "disabled"}
+START_TYPE_CODES = {"auto": 2, "delayed-auto": 2, "demand": 3, "disabled": 4}
+STATES = {1: "stopped", 2: "start_pending", 3: "stop_pending", 4: "running", 5: "continue_pending",
+          6: "pause_pending", 7: "paused"}
+CONTROL_CODES = {"stop": SERVICE_CONTROL_STOP, "pause": SERVICE_CONTROL_PAUSE, "resume": SERVICE_CONTROL_CONTINUE}
+
+# (name, state code, accepted controls bit mask), as returned by EnumServicesStatusEx.
+ServiceStatusEntry = Tuple[str, int, int]
+
+
+class ScmApi(ABC):
+    """
+    The subset of the advapi32 Service Control Manager API used by `NativeServiceController`. Handles are opaque
+    values returned by `open_manager` and `open_service` and released with `close`. Failures raise
+    `ServiceControlError`.
+    """
+
+    @abstractmethod
+    def open_manager(self) -> object:
+        raise NotImplementedError
+
+    @abstractmethod
+    def open_service(self, manager: object, name: str, access: int = SERVICE_ACCESS) -> object:
+        raise NotImplementedError
+
+    @abstractmethod
+    def close(self, handle: object) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def enum_services(self, manager: object) -> List[ServiceStatusEntry]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def query_config(self, service: object) -> Tuple[int, List[str]]:
+        """
+        Returns the start type code and the dependencies of a service (QueryServiceConfig).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def query_delayed_auto_start(self, service: object) -> bool:
+        """
+        Returns whether an automatic service is delayed (QueryServiceConfig2).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def query_status(self, service: object) -> Tuple[int, int]:
+        """
+        Returns the state code and the accepted controls bit mask of a service (QueryServiceStatusEx).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def change_start_type(self, service: object, start_type: int, delayed: bool) -> None:
+        """
+        Changes the start type and the delayed auto-start flag (ChangeServiceConfig and ChangeServiceConfig2).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def start(self, service: object) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def control(self, service: object, code: int) -> None:
+        raise NotImplementedError
+
+
+class Advapi32Api(ScmApi):
+    """
+    The Service Control Manager API called through ctypes. The Windows modules are loaded when the object is created.
+    """
+
+    def __init__(self) -> None:
+        import ctypes
+        from ctypes import wintypes
+
+        class ServiceStatus(ctypes.Structure):
+            _fields_ = [("dwServiceType", wintypes.DWORD), ("dwCurrentState", wintypes.DWORD),
+                        ("dwControlsAccepted", wintypes.DWORD), ("dwWin32ExitCode", wintypes.DWORD),
+                        ("dwServiceSpecificExitCode", wintypes.DWORD), ("dwCheckPoint", wintypes.DWORD),
+                        ("dwWaitHint", wintypes.DWORD)]
+
+        class ServiceStatusProcess(ctypes.Structure):
+            _fields_ = ServiceStatus._fields_ + [("dwProcessId", wintypes.DWORD), ("dwServiceFlags", wintypes.DWORD)]
+
+        class EnumServiceStatusProcess(ctypes.Structure):
+            _fields_ = [("lpServiceName", wintypes.LPWSTR), ("lpDisplayName", wintypes.LPWSTR),
+                        ("ServiceStatusProcess", ServiceStatusProcess)]
+
+        class QueryServiceConfig(ctypes.Structure):
+            _fields_ = [("dwServiceType", wintypes.DWORD), ("dwStartType", wintypes.DWORD),
+                        ("dwErrorControl", wintypes.DWORD), ("lpBinaryPathName", wintypes.LPWSTR),
+                        ("lpLoadOrderGroup", wintypes.LPWSTR), ("dwTagId", wintypes.DWORD),
+                        ("lpDependencies", ctypes.c_void_p), ("lpServiceStartName", wintypes.LPWSTR),
+                        ("lpDisplayName", wintypes.LPWSTR)]
+
+        class DelayedAutoStartInfo(ctypes.Structure):
+            _fields_ = [("fDelayedAutostart", wintypes.BOOL)]
+
+        self._ctypes = ctypes
+        self._wintypes = wintypes
+        self._advapi32 = ctypes.WinDLL("advapi32", use_last_error=True)
+        self._advapi32.OpenSCManagerW.restype = ctypes.c_void_p
+        self._advapi32.OpenServiceW.restype = ctypes.c_void_p
+        self._advapi32.OpenServiceW.argtypes = [ctypes.c_void_p, wintypes.LPCWSTR, wintypes.DWORD]
+        self._advapi32.CloseServiceHandle.argtypes = [ctypes.c_void_p]
+        self._advapi32.ChangeServiceConfigW.argtypes = [ctypes.c_void_p, wintypes.DWORD, wintypes.DWORD,
+                                                        wintypes.DWORD, wintypes.LPCWSTR, wintypes.LPCWSTR,
+                                                        ctypes.c_void_p, wintypes.LPCWSTR, wintypes.LPCWSTR,
+                                                        wintypes.LPCWSTR, wintypes.LPCWSTR]
+        self.ServiceStatus = ServiceStatus
+        self.ServiceStatusProcess = ServiceStatusProcess
+        self.EnumServiceStatusProcess = EnumServiceStatusProcess
+        self.QueryServiceConfig = QueryServiceConfig
+        self.DelayedAutoStartInfo = DelayedAutoStartInfo
+
+    def _check(self, result: int, operation: str) -> int:
+        if not result:
+            raise ServiceControlError(f"{operation} failed: {self._ctypes.WinError(self._ctypes.get_last_error())}")
+        return result
+
+    def _query_buffer(self, function, handle: object, *args: object) -> object:
+        """
+        Calls a variable-size query function twice: once to learn the required size and once with a large enough
+        buffer.
+        """
+        ctypes = self._ctypes
+        needed = self._wintypes.DWORD(0)
+        size = 4096
+        while True:
+            buffer = ctypes.create_string_buffer(size)
+            if function(ctypes.c_void_p(handle), *args, buffer, size, ctypes.byref(needed)):
+                return buffer
+            error = ctypes.get_last_error()
+            if error not in (ERROR_INSUFFICIENT_BUFFER, ERROR_MORE_DATA) or needed.value <= size:
+                raise ServiceControlError(f"{function.__name__} failed: {ctypes.WinError(error)}")
+            size = needed.value
+
+    def open_manager(self) -> object:
+        return self._check(self._advapi32.OpenSCManagerW(None, None,
+                                                         SC_MANAGER_CONNECT | SC_MANAGER_ENUMERATE_SERVICE),
+                           "OpenSCManager")
+
+    def open_service(self, manager: object, name: str, access: int = SERVICE_ACCESS) -> object:
+        return self._check(self._advapi32.OpenServiceW(manager, name, access), f"OpenService({name})")
+
+    def close(self, handle: object) -> None:
+        self._advapi32.CloseServiceHandle(handle)
+
+    def enum_services(self, manager: object) -> List[ServiceStatusEntry]:
+        ctypes, wintypes = self._ctypes, self._wintypes
+        needed, returned, resume = wintypes.DWORD(0), wintypes.DWORD(0), wintypes.DWORD(0)
+        entries = []
+        size = 256 * 1024
+        while True:
+            buffer = ctypes.create_string_buffer(size)
+            succeeded = self._advapi32.EnumServicesStatusExW(
+                ctypes.c_void_p(manager), SC_ENUM_PROCESS_INFO, SERVICE_WIN32, SERVICE_STATE_ALL, buffer, size,
+                ctypes.byref(needed), ctypes.byref(returned), ctypes.byref(resume), None)
+            error = ctypes.get_last_error()
+            if not succeeded and error != ERROR_MORE_DATA:
+                raise ServiceControlError(f"EnumServicesStatusEx failed: {ctypes.WinError(error)}")
+            array = ctypes.cast(buffer, ctypes.POINTER(self.EnumServiceStatusProcess))
+            for index in range(returned.value):
+                status = array[index].ServiceStatusProcess
+                entries.append((array[index].lpServiceName, status.dwCurrentState, status.dwControlsAccepted))
+            if succeeded:
+                return entries
+            size = max(size, needed.value)
+
+    def query_config(self, service: object) -> Tuple[int, List[str]]:
+        ctypes = self._ctypes
+        buffer = self._query_buffer(self._advapi32.QueryServiceConfigW, service)
+        config = ctypes.cast(buffer, ctypes.POINTER(self.QueryServiceConfig)).contents
+        dependencies = []
+        address = config.lpDependencies
+        while address:
+            dependency = ctypes.wstring_at(address)
+            if not dependency:
+                break
+            dependencies.append(dependency)
+            address += (len(dependency) + 1) * ctypes.sizeof(ctypes.c_wchar)
+        return config.dwStartType, dependencies
+
+    def query_delayed_auto_start(self, service: object) -> bool:
+        ctypes = self._ctypes
+        buffer = self._query_buffer(self._advapi32.QueryServiceConfig2W, service,
+                                    SERVICE_CONFIG_DELAYED_AUTO_START_INFO)
+        return bool(ctypes.cast(buffer, ctypes.POINTER(self.DelayedAutoStartInfo)).contents.fDelayedAutostart)
+
+    def query_status(self, service: object) -> Tuple[int, int]:
+        ctypes = self._ctypes
+        buffer = self._query_buffer(self._advapi32.QueryServiceStatusEx, service, SC_STATUS_PROCESS_INFO)
+        status = ctypes.cast(buffer, ctypes.POINTER(self.ServiceStatusProcess)).contents
+        return status.dwCurrentState, status.dwControlsAccepted
+
+    def change_start_type(self, service: object, start_type: int, delayed: bool) -> None:
+        ctypes = self._ctypes
+        self._check(self._advapi32.ChangeServiceConfigW(
+            ctypes.c_void_p(service), SERVICE_NO_CHANGE, start_type, SERVICE_NO_CHANGE, None, None, None, None, None,
+            None, None), "ChangeServiceConfig")
+        if start_type == START_TYPE_CODES["auto"]:
+            info = self.DelayedAutoStartInfo(delayed)
+            self._check(self._advapi32.ChangeServiceConfig2W(ctypes.c_void_p(service),
+                                                             SERVICE_CONFIG_DELAYED_AUTO_START_INFO,
+                                                             ctypes.byref(info)), "ChangeServiceConfig2")
+
+    def start(self, service: object) -> None:
+        self._check(self._advapi32.StartServiceW(self._ctypes.c_void_p(service), 0, None), "StartService")
+
+    def control(self, service: object, code: int) -> None:
+        status = self.ServiceStatus()
+        self._check(self._advapi32.ControlService(self._ctypes.c_void_p(service), code, self._ctypes.byref(status)),
+                    "ControlService")
+
+
+class SimulatedScmApi(ScmApi):
+    """
+    A pure-Python Service Control Manager for running and benchmarking the native backend without Windows. Services
+    move through the pending states and settle after a configurable latency, which is evaluated lazily when their
+    status is queried. Every API call and every open handle is counted.
+
+    Parameters:
+    - services (Dict[str, Dict]): The simulated services keyed by name, each with optional 'start_type' (code),
+      'delayed', 'state' (code), 'dependencies' and 'pausable' entries.
+    - transition_latency (float): Seconds a start, stop, pause or resume takes to complete.
+    - call_latency (float): Seconds added to every API call.
+    """
+
+    def __init__(self, services: Dict[str, Dict], transition_latency: float = 0.0, call_latency: float = 0.0) -> None:
+        self.services = {name.lower(): {"name": name, "start_type": 3, "delayed": False, "state": 1,
+                                        "dependencies": [], "pausable": False, **service}
+                         for name, service in services.items()}
+        self.transition_latency = transition_latency
+        self.call_latency = call_latency
+        self.calls: Dict[str, int] = {}
+        self.open_handles = 0
+        self._pending: Dict[str, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def _call(self, operation: str) -> None:
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.call_latency:
+            time.sleep(self.call_latency)
+
+    def _settle(self, key: str) -> None:
+        pending = self._pending.get(key)
+        if pending is not None and time.monotonic() >= pending[0]:
+            self.services[key]["state"] = pending[1]
+            del self._pending[key]
+
+    def _transition(self, key: str, pending_state: int, final_state: int) -> None:
+        with self._lock:
+            self.services[key]["state"] = pending_state
+            self._pending[key] = (time.monotonic() + self.transition_latency, final_state)
+
+    def open_manager(self) -> object:
+        self._call("OpenSCManager")
+        with self._lock:
+            self.open_handles += 1
+        return "scm"
+
+    def open_service(self, manager: object, name: str, access: int = SERVICE_ACCESS) -> object:
+        self._call("OpenService")
+        if name.lower() not in self.services:
+            raise ServiceControlError(f"OpenService({name}) failed: The specified service does not exist.")
+        with self._lock:
+            self.open_handles += 1
+        return name.lower()
+
+    def close(self, handle: object) -> None:
+        self._call("CloseServiceHandle")
+        with self._lock:
+            self.open_handles -= 1
+
+    def enum_services(self, manager: object) -> List[ServiceStatusEntry]:
+        self._call("EnumServicesStatusEx")
+        with self._lock:
+            for key in list(self._pending):
+                self._settle(key)
+            return [(service["name"], service["state"], self._accepted(service)) for service in self.services.values()]
+
+    @staticmethod
+    def _accepted(service: Dict) -> int:
+        if service["state"] not in (4, 7):
+            return 0
+        return SERVICE_ACCEPT_STOP | (SERVICE_ACCEPT_PAUSE_CONTINUE if service["pausable"] else 0)
+
+    def query_config(self, service: object) -> Tuple[int, List[str]]:
+        self._call("QueryServiceConfig")
+        return self.services[service]["start_type"], list(self.services[service]["dependencies"])
+
+    def query_delayed_auto_start(self, service: object) -> bool:
+        self._call("QueryServiceConfig2")
+        return self.services[service]["delayed"]
+
+    def query_status(self, service: object) -> Tuple[int, int]:
+        self._call("QueryServiceStatusEx")
+        with self._lock:
+            self._settle(service)
+            state = self.services[service]
+            return state["state"], self._accepted(state)
+
+    def change_start_type(self, service: object, start_type: int, delayed: bool) -> None:
+        self._call("ChangeServiceConfig")
+        with self._lock:
+            self.services[service]["start_type"] = start_type
+            self.services[service]["delayed"] = delayed and start_type == 2
+
+    def start(self, service: object) -> None:
+        self._call("StartService")
+        with self._lock:
+            self._settle(service)
+            state = self.services[service]
+            if state["start_type"] == 4:
+                raise ServiceControlError("StartService failed: The service cannot be started because it is disabled.")
+            if state["state"] != 1:
+                raise ServiceControlError("StartService failed: An instance of the service is already running.")
+        self._transition(service, 2, 4)
+
+    def control(self, service: object, code: int) -> None:
+        self._call("ControlService")
+        with self._lock:
+            self._settle(service)
+            state = self.services[service]
+            if not self._accepted(state):
+                raise ServiceControlError("ControlService failed: The service has not been started.")
+            if code in (SERVICE_CONTROL_PAUSE, SERVICE_CONTROL_CONTINUE) and not state["pausable"]:
+                raise ServiceControlError("ControlService failed: The requested control is not valid for this "
+                                          "service.")
+        if code == SERVICE_CONTROL_STOP:
+            self._transition(service, 3, 1)
+        elif code == SERVICE_CONTROL_PAUSE:
+            self._transition(service, 6, 7)
+        else:
+            self._transition(service, 5, 4)
+
+
+class NativeServiceController(ServiceController):
+    """
+    A service controller calling the Service Control Manager directly instead of launching 'sc'. It opens one SCM
+    handle per run, keeps every service handle it opens in a pool until `close` is called, and reads start types and
+    states as numbers instead of parsing text. `preload` loads the status of every service with a single
+    EnumServicesStatusEx call; cached statuses are dropped whenever a service is modified or waited on.
+
+    Parameters:
+    - api (Optional[ScmApi]): The API implementation, by default advapi32 through ctypes.
+    - read_only (bool): Whether service handles are opened with query access only, for planning and inventories;
+      modifications then fail with an access denied error.
+    """
+
+    def __init__(self, api: Optional[ScmApi] = None, read_only: bool = False) -> None:
+        self.api = api or Advapi32Api()
+        self.access = SERVICE_READ_ACCESS if read_only else SERVICE_ACCESS
+        self._manager = self.api.open_manager()
+        self._handles: Dict[str, object] = {}
+        self._statuses: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def _handle(self, name: str) -> object:
+        key = name.lower()
+        with self._lock:
+            handle = self._handles.get(key)
+        if handle is None:
+            handle = self.api.open_service(self._manager, name, self.access)
+            with self._lock:
+                existing = self._handles.setdefault(key, handle)
+            if existing is not handle:
+                self.api.close(handle)
+                handle = existing
+        return handle
+
+    def _status(self, name: str) -> Tuple[int, int]:
+        with self._lock:
+            cached = self._statuses.get(name.lower())
+        if cached is not None:
+            return cached
+        with instrument("scm.query_status", name):
+            status = self.api.query_status(self._handle(name))
+        with self._lock:
+            self._statuses[name.lower()] = status
+        return status
+
+    def list_services(self) -> List[str]:
+        try:
+            with instrument("scm.enum_services"):
+                entries = self.api.enum_services(self._manager)
+        except ServiceControlError:
+            return []
+        with self._lock:
+            self._statuses.update({name.lower(): (state, accepted) for name, state, accepted in entries})
+        return [name for name, _, _ in entries]
+
+    def preload(self, names: List[str]) -> None:
+        try:
+            with instrument("scm.enum_services"):
+                entries = self.api.enum_services(self._manager)
+        except ServiceControlError:
+            return
+        with self._lock:
+            self._statuses.update({name.lower(): (state, accepted) for name, state, accepted in entries})
+
+    def invalidate(self, name: str) -> None:
+        with self._lock:
+            self._statuses.pop(name.lower(), None)
+
+    def query_startup_type(self, name: str) -> str:
+        try:
+            with instrument("scm.query_config", name):
+                handle = self._handle(name)
+                start_type, _ = self.api.query_config(handle)
+                if start_type == START_TYPE_CODES["auto"] and self.api.query_delayed_auto_start(handle):
+                    return "delayed-auto"
+        except ServiceControlError:
+            return "unknown"
+        return START_TYPES.get(start_type, "unknown")
+
+    def query_status(self, name: str) -> str:
+        try:
+            return STATES.get(self._status(name)[0], "unknown")
+        except ServiceControlError:
+            return "unknown"
+
+    def query_dependencies(self, name: str) -> List[str]:
+        try:
+            with instrument("scm.query_config", name):
+                return [dependency for dependency in self.api.query_config(self._handle(name))[1]
+                        if not dependency.startswith("+")]
+        except ServiceControlError:
+            return []
+
+    def is_pausable(self, name: str) -> bool:
+        try:
+            return bool(self._status(name)[1] & SERVICE_ACCEPT_PAUSE_CONTINUE)
+        except ServiceControlError:
+            return False
+
+    def set_startup_type(self, name: str, startup_type: str) -> None:
+        if startup_type not in START_TYPE_CODES:
+            raise ServiceControlError(f"Unsupported startup type '{startup_type}'.")
+        with instrument("scm.change_config", name):
+            self.api.change_start_type(self._handle(name), START_TYPE_CODES[startup_type],
+                                       startup_type == "delayed-auto")
+
+    def control(self, name: str, action: str) -> None:
+        try:
+            with instrument(f"scm.{action}", name):
+                if action == "start":
+                    self.api.start(self._handle(name))
+                else:
+                    self.api.control(self._handle(name), CONTROL_CODES[action])
+        finally:
+            self.invalidate(name)
+
+    def close(self) -> None:
+        """
+        Closes every pooled service handle and the SCM handle. Further calls do nothing.
+        """
+        with self._lock:
+            handles, self._handles = list(self._handles.values()), {}
+            manager, self._manager = self._manager, None
+        for handle in handles:
+            self.api.close(handle)
+        if manager is not None:
+            self.api.close(manager)
@@ -1,59 +1,179 @@
-import winreg as reg
+from typing import Any, Dict, List, Optional
 
+from change_plan import PlannedChange, parse_module_arguments, print_plan
+from checkpoint import get_checkpoint
 from config_service import setup_logging, read_config_file, validate_config_section, logging
+from metrics import instrument
+from registry_backend import HKEY_CURRENT_USER, REG_SZ, RegistryBackend, RegistryValue, get_default_registry
+from undo_journal import record_registry_values
 
 CONFIG_FILE = "config.json"
 KEY_PATH = r"Control Panel\International"
+SETTING_CHANGE_AREA = "intl"
 
 
-def modify_locale(settings: dict, enabled: bool) -> None:
+def compute_locale_changes(settings: dict, current_values: Dict[str, RegistryValue]) -> Dict[str, RegistryValue]:
     """
-    Modifies Windows registry settings for locale configurations if `enabled` is True. It updates each registry setting
-    specified in `settings` to its corresponding new value, provided the setting is enabled within the `settings` dict.
-    The function logs the outcome of each attempt to modify a registry setting, including cases where the setting
-    already matches the desired value, where the modification is successful, and where the setting does not exist or
-    an error occurs during modification. This ensures only necessary changes are applied and maintains a record of
-    actions taken.
+    Compares the configured locale settings with the values currently stored in the registry and returns only the
+    values that have to be written. Settings that are disabled, already set to the desired value or missing from the
+    registry are logged and left out.
+
+    Parameters:
+    - settings (dict): A dictionary of registry settings to modify, with each setting having a sub-dictionary that
+      specifies whether it is enabled and what the new value should be.
+    - current_values (Dict[str, RegistryValue]): The values currently stored under the locale key.
+
+    Returns:
+    - Dict[str, RegistryValue]: The values to write, keyed by registry value name.
+    """
+    changes = {}
+    for setting, setting_info in settings.items():
+        if not setting_info.get('enabled', False):
+            logging.info(f"Registry setting '{setting}' is disabled in configuration. Skipping...")
+            continue
+
+        new_value = setting_info.get('value')
+        if setting not in current_values:
+            logging.info(f"Registry setting '{setting}' does not exist. Skipping...")
+            continue
+        if current_values[setting][0] == new_value:
+            logging.info(f"Registry setting '{setting}' already set to '{new_value}'. Skipping...")
+            continue
+        changes[setting] = (new_value, REG_SZ)
+    return changes
+
+
+def modify_locale(settings: dict, enabled: bool, registry: Optional[RegistryBackend] = None,
+                  hive: str = HKEY_CURRENT_USER, key_path: str = KEY_PATH) -> Optional[Dict[str, RegistryValue]]:
+    """
+    Modifies Windows registry settings for locale configurations if `enabled` is True. It reads every value under the
+    locale key in one pass, computes which of the enabled settings in `settings` differ from their desired values, and
+    writes only those, followed by a single WM_SETTINGCHANGE broadcast so running applications pick up the change.
+    The function logs the outcome for each setting, including cases where the setting already matches the desired
+    value, where the modification is successful, and where the setting does not exist or an error occurs during
+    modification.
 
     Parameters:
     - settings (dict): A dictionary of registry settings to modify, with each setting having a sub-dictionary that
       specifies whether it is enabled and what the new value should be.
     - enabled (bool): If False, registry modification is skipped, and a log entry is made indicating this feature is
     disabled.
+    - registry (Optional[RegistryBackend]): The registry backend to use, by default the Windows registry.
+    - hive (str): The hive holding the locale key; another user's settings live under HKU.
+    - key_path (str): The path of the locale key, e.g. 'S-1-5-21-...\\Control Panel\\International' under HKU.
+
+    Returns:
+    - Optional[Dict[str, RegistryValue]]: The values that were written, keyed by registry value name, or None if the
+      registry could not be read or written.
     """
     if not enabled:
         logging.info("Locale modification is skipped as it's disabled by configuration.")
-        return
+        return {}
 
     try:
-        with reg.OpenKey(reg.HKEY_CURRENT_USER, KEY_PATH, 0, reg.KEY_WRITE | reg.KEY_READ) as key:
-            for setting, setting_info in settings.items():
-                if not setting_info.get('enabled', False):
-                    logging.info(f"Registry setting '{setting}' is disabled in configuration. Skipping...")
-                    continue
-
-                new_value = setting_info.get('value')
-                try:
-                    current_value, _ = reg.QueryValueEx(key, setting)
-                    if current_value == new_value:
-                        logging.info(f"Registry setting '{setting}' already set to '{new_value}'. Skipping...")
-                        continue
-                    else:
-                        reg.SetValueEx(key, setting, 0, reg.REG_SZ, new_value)
-                        logging.info(f"Registry setting '{setting}' changed to '{new_value}'.")
-                except FileNotFoundError:
-                    logging.info(f"Registry setting '{setting}' does not exist. Skipping...")
-
+        registry = registry or get_default_registry()
+        with instrument("registry.read", key_path):
+            current_values = registry.read_values(hive, key_path)
+        changes = compute_locale_changes(settings, current_values)
+        if not changes:
+            return {}
+        record_registry_values(hive, key_path, changes, current_values)
+        with instrument("registry.write", key_path):
+            registry.write_values(hive, key_path, changes)
+        for setting, (new_value, _) in changes.items():
+            logging.info(f"Registry setting '{setting}' changed to '{new_value}'.")
+        # Only the sessions of the current user pick up a broadcast.
+        if hive == HKEY_CURRENT_USER:
+            with instrument("registry.broadcast", SETTING_CHANGE_AREA):
+                registry.broadcast_setting_change(SETTING_CHANGE_AREA)
+        return changes
     except Exception as e:
         logging.error(f"Failed to modify registry: {str(e)}")
+        return None
+
+
+def plan_step(section: Dict[str, Any], registry: Optional[RegistryBackend] = None) -> List[PlannedChange]:
+    """
+    Determines, without writing to the registry, which of the enabled locale settings differ from their desired value.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'localeSettings' section of the configuration.
+    - registry (Optional[RegistryBackend]): The registry backend to use, by default the Windows registry.
+
+    Returns:
+    - List[PlannedChange]: One 'set' change per registry value that would be written.
+    """
+    current_values = (registry or get_default_registry()).read_values(HKEY_CURRENT_USER, KEY_PATH)
+    changes = compute_locale_changes(section["formatOptions"], current_values)
+    return [PlannedChange("set_locales", setting, "set", current_values[setting][0], new_value)
+            for setting, (new_value, _) in changes.items()]
+
+
+def state_validator(setting: str, registry: Optional[RegistryBackend] = None) -> Optional[str]:
+    """
+    Returns a cheap validator for the state cache: the last write time of the locale key, which changes whenever any
+    locale value is modified.
+
+    Parameters:
+    - setting (str): The name of the registry value.
+    - registry (Optional[RegistryBackend]): The registry backend to use, by default the Windows registry.
+
+    Returns:
+    - Optional[str]: The validator value, or None if the key cannot be read.
+    """
+    try:
+        return str((registry or get_default_registry()).key_last_write(HKEY_CURRENT_USER, KEY_PATH))
+    except (OSError, ImportError):
+        return None
+
+
+def inventory_step(section: Dict[str, Any], registry: Optional[RegistryBackend] = None) -> Dict[str, Any]:
+    """
+    Captures the current value of each enabled locale setting with a single read of the locale key.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'localeSettings' section of the configuration.
+    - registry (Optional[RegistryBackend]): The registry backend to use, by default the Windows registry.
+
+    Returns:
+    - Dict[str, Any]: The current values, or None for values that do not exist, keyed by registry value name.
+    """
+    current_values = (registry or get_default_registry()).read_values(HKEY_CURRENT_USER, KEY_PATH)
+    return {setting: current_values[setting][0] if setting in current_values else None
+            for setting, setting_info in section["formatOptions"].items() if setting_info.get('enabled', False)}
+
+
+def desired_step(section: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the configured value of each enabled locale setting, keyed by registry value name.
+    """
+    return {setting: setting_info.get('value') for setting, setting_info in section["formatOptions"].items()
+            if setting_info.get('enabled', False)}
+
+
+def run_step(section: Dict[str, Any]) -> None:
+    """
+    Runs this module as a step of the unified setup runner, applying the configured locale settings from the already
+    validated 'localeSettings' section. The settings are written as one batch, so they are marked as completed in the
+    run's checkpoint together once the batch succeeded.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'localeSettings' section of the configuration.
+    """
+    if modify_locale(section["formatOptions"], section["enabled"]) is not None:
+        checkpoint = get_checkpoint()
+        for setting, setting_info in section["formatOptions"].items():
+            checkpoint.complete("set_locales", [setting],
+                                setting_info.get('value') if setting_info.get('enabled', False) else None)
 
 
 def main() -> None:
     """
     Executes the main functionality of the script which includes setting up logging, reading the configuration file,
     validating the 'localeSettings' configuration section, and conditionally modifying locales based on the
-    configuration.
+    configuration. With '--plan', only prints the changes it would make.
     """
+    args = parse_module_arguments("Applies the 'localeSettings' section of the configuration.")
     setup_logging()
     config_data = read_config_file(CONFIG_FILE)
 
@@ -69,6 +189,10 @@ def main() -> None:
         logging.error("The 'localeSettings' section in the configuration is invalid.")
         return
 
+    if args.plan:
+        print_plan(config_data["localeSettings"], plan_step)
+        return
+
     modify_locale(config_data["localeSettings"]["formatOptions"], config_data["localeSettings"]["enabled"])
 
 
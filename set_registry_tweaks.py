@@ -0,0 +1,398 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from change_plan import PlannedChange, item_id, parse_module_arguments, print_plan
+from checkpoint import get_checkpoint
+from config_service import setup_logging, read_config_file, validate_config_section, logging
+from metrics import instrument
+from registry_backend import (HKEY_CURRENT_USER, HKEY_LOCAL_MACHINE, REG_BINARY, REG_DWORD, REG_EXPAND_SZ, REG_MULTI_SZ,
+                              REG_QWORD, REG_SZ, RegistryBackend, RegistryValue, get_default_registry)
+from undo_journal import record_registry_values
+
+CONFIG_FILE = "config.json"
+DEFAULT_WORKERS = 8
+
+HIVES = {
+    "HKCU": HKEY_CURRENT_USER,
+    "HKEY_CURRENT_USER": HKEY_CURRENT_USER,
+    "HKLM": HKEY_LOCAL_MACHINE,
+    "HKEY_LOCAL_MACHINE": HKEY_LOCAL_MACHINE
+}
+
+VALUE_TYPES = {
+    "SZ": REG_SZ,
+    "EXPAND_SZ": REG_EXPAND_SZ,
+    "DWORD": REG_DWORD,
+    "QWORD": REG_QWORD,
+    "MULTI_SZ": REG_MULTI_SZ,
+    "BINARY": REG_BINARY
+}
+
+INTEGER_LIMITS = {REG_DWORD: 0xFFFFFFFF, REG_QWORD: 0xFFFFFFFFFFFFFFFF}
+
+# A registry key, identified by its hive and key path.
+KeyId = Tuple[str, str]
+
+
+def convert_value(value_type: int, value: Any) -> Any:
+    """
+    Converts a configured value to the Python representation winreg uses for its type: an int for DWORD and QWORD, a
+    list of strings for MULTI_SZ, bytes for BINARY (configured as a hex string such as '01 a0 ff' or a list of byte
+    values) and a string otherwise.
+
+    Parameters:
+    - value_type (int): The registry value type.
+    - value (Any): The value as written in the configuration.
+
+    Returns:
+    - Any: The converted value.
+
+    Raises:
+    - ValueError: If the value does not fit the type.
+    """
+    if value_type in INTEGER_LIMITS:
+        if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= INTEGER_LIMITS[value_type]:
+            raise ValueError(f"expected an integer between 0 and {INTEGER_LIMITS[value_type]}, got {value!r}")
+        return value
+    if value_type == REG_MULTI_SZ:
+        if not isinstance(value, list) or not all(isinstance(entry, str) for entry in value):
+            raise ValueError(f"expected a list of strings, got {value!r}")
+        return value
+    if value_type == REG_BINARY:
+        if isinstance(value, str):
+            return bytes.fromhex(value)
+        if isinstance(value, list) and all(isinstance(entry, int) and 0 <= entry <= 255 for entry in value):
+            return bytes(value)
+        raise ValueError(f"expected a hex string or a list of byte values, got {value!r}")
+    if not isinstance(value, str):
+        raise ValueError(f"expected a string, got {value!r}")
+    return value
+
+
+def parse_tweak(tweak: Dict[str, Any]) -> Tuple[KeyId, str, RegistryValue]:
+    """
+    Validates one configured tweak and converts it to the key, value name and typed value it describes.
+
+    Parameters:
+    - tweak (Dict[str, Any]): The tweak, with 'hive', 'key', 'name', 'type' and 'value' keys.
+
+    Returns:
+    - Tuple[KeyId, str, RegistryValue]: The (hive, key path) pair, the value name and the (value, type) pair.
+
+    Raises:
+    - ValueError: If the tweak is incomplete or its value does not fit its type.
+    """
+    hive = HIVES.get(str(tweak.get('hive', '')).upper())
+    if hive is None:
+        raise ValueError(f"unknown hive {tweak.get('hive')!r}")
+    key_path = tweak.get('key')
+    name = tweak.get('name')
+    if not isinstance(key_path, str) or not key_path.strip("\\") or not isinstance(name, str):
+        raise ValueError("'key' and 'name' must be strings")
+    type_name = str(tweak.get('type', '')).upper()
+    value_type = VALUE_TYPES.get(type_name[4:] if type_name.startswith("REG_") else type_name)
+    if value_type is None:
+        raise ValueError(f"unknown value type {tweak.get('type')!r}")
+    return (hive, key_path.strip("\\")), name, (convert_value(value_type, tweak.get('value')), value_type)
+
+
+def group_tweaks(tweaks: List[Dict[str, Any]]) -> Dict[KeyId, Dict[str, RegistryValue]]:
+    """
+    Groups the enabled, valid tweaks by registry key, sorted by hive and key path, so each key is opened once for all
+    of its values. Key paths and value names are compared case-insensitively like the registry does. Disabled and
+    invalid tweaks are logged and left out; when the same value is configured twice, the later entry wins.
+
+    Parameters:
+    - tweaks (List[Dict[str, Any]]): The configured tweaks.
+
+    Returns:
+    - Dict[KeyId, Dict[str, RegistryValue]]: The desired values per key, keyed by value name.
+    """
+    groups: Dict[Tuple[str, str], Tuple[KeyId, Dict[str, RegistryValue]]] = {}
+    for tweak in tweaks:
+        if not tweak.get('enabled', True):
+            logging.info(f"Registry tweak '{item_id(tweak)}' is disabled in configuration. Skipping...")
+            continue
+        try:
+            key, name, value = parse_tweak(tweak)
+        except ValueError as e:
+            logging.error(f"Invalid registry tweak '{item_id(tweak)}': {str(e)}. Skipping...")
+            continue
+        _, values = groups.setdefault((key[0], key[1].lower()), (key, {}))
+        for configured in [configured for configured in values if configured.lower() == name.lower()]:
+            del values[configured]
+        values[name] = value
+    return {key: values for _, (key, values) in sorted(groups.items())}
+
+
+def tweak_ids_by_key(tweaks: List[Dict[str, Any]]) -> Dict[Tuple[str, str], List[Tuple[str, str]]]:
+    """
+    Returns the identifiers and value names of the configured tweaks keyed like `group_tweaks` groups their values, by
+    hive and lower-cased key path, so the tweaks of a key can be marked as completed once the key is written. The value
+    name is returned alongside the identifier because a value name may itself contain backslashes.
+
+    Parameters:
+    - tweaks (List[Dict[str, Any]]): The configured tweaks.
+
+    Returns:
+    - Dict[Tuple[str, str], List[Tuple[str, str]]]: The (tweak identifier, value name) pairs per key.
+    """
+    ids: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+    for tweak in tweaks:
+        hive = HIVES.get(str(tweak.get('hive', '')).upper())
+        key_path, name = tweak.get('key'), tweak.get('name')
+        if hive is not None and isinstance(key_path, str) and isinstance(name, str):
+            ids.setdefault((hive, key_path.strip("\\").lower()), []).append((item_id(tweak), name))
+    return ids
+
+
+def compute_key_changes(key: KeyId, desired: Dict[str, RegistryValue],
+                        current: Dict[str, RegistryValue]) -> Dict[str, RegistryValue]:
+    """
+    Compares the desired values of a key with its current values and returns the ones that have to be written: values
+    that are missing, differ or have a different type. Value names are matched case-insensitively, and a value that
+    already exists is returned under its existing spelling, so it is overwritten and journaled rather than duplicated.
+
+    Parameters:
+    - key (KeyId): The key, used for logging.
+    - desired (Dict[str, RegistryValue]): The desired values keyed by value name.
+    - current (Dict[str, RegistryValue]): The values currently stored under the key.
+
+    Returns:
+    - Dict[str, RegistryValue]: The values to write.
+    """
+    existing = {name.lower(): name for name in current}
+    changes = {}
+    for name, value in desired.items():
+        name = existing.get(name.lower(), name)
+        if current.get(name) == value:
+            logging.info(f"Registry value '{key[0]}\\{key[1]}\\{name}' already set to {value[0]!r}. Skipping...")
+            continue
+        changes[name] = value
+    return changes
+
+
+def read_key(registry: RegistryBackend, key: KeyId) -> Optional[Dict[str, RegistryValue]]:
+    """
+    Reads every value of a key in one enumeration, returning None if the key does not exist.
+    """
+    try:
+        with instrument("registry.read", f"{key[0]}\\{key[1]}"):
+            return registry.read_values(*key)
+    except FileNotFoundError:
+        return None
+
+
+def apply_key(registry: RegistryBackend, key: KeyId, desired: Dict[str, RegistryValue]) -> bool:
+    """
+    Applies the desired values of one key: one read of all its values, then one write of the ones that differ,
+    creating the key if it does not exist. Errors are logged and do not affect other keys.
+
+    Parameters:
+    - registry (RegistryBackend): The registry backend.
+    - key (KeyId): The key.
+    - desired (Dict[str, RegistryValue]): The desired values keyed by value name.
+
+    Returns:
+    - bool: True if the key holds the desired values afterwards, False if reading or writing it failed.
+    """
+    try:
+        current = read_key(registry, key)
+        changes = compute_key_changes(key, desired, current or {})
+        if not changes:
+            return True
+        record_registry_values(key[0], key[1], changes, current or {})
+        with instrument("registry.write", f"{key[0]}\\{key[1]}"):
+            registry.write_values(key[0], key[1], changes, create=current is None)
+        for name, (value, _) in changes.items():
+            logging.info(f"Registry value '{key[0]}\\{key[1]}\\{name}' changed to {value!r}.")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to apply registry tweaks under '{key[0]}\\{key[1]}': {str(e)}")
+        return False
+
+
+def apply_registry_tweaks(tweaks: List[Dict[str, Any]], enabled: bool, registry: Optional[RegistryBackend] = None,
+                          workers: int = DEFAULT_WORKERS) -> None:
+    """
+    Applies registry tweaks if `enabled` is True. The tweaks are grouped by key, every key is opened once to read all
+    of its values in a single enumeration and once more to write only the values that differ, and independent keys,
+    in either hive, are processed concurrently. The function logs the outcome for each value, including values that
+    already match and errors. The tweaks of every key that was applied are marked as completed in the run's
+    checkpoint.
+
+    Parameters:
+    - tweaks (List[Dict[str, Any]]): The configured tweaks, each with a 'hive' ('HKCU' or 'HKLM'), 'key', 'name',
+      'type' ('SZ', 'EXPAND_SZ', 'DWORD', 'QWORD', 'MULTI_SZ' or 'BINARY') and 'value', and an optional 'enabled' flag.
+    - enabled (bool): If False, the tweaks are skipped, and a log entry is made indicating this feature is disabled.
+    - registry (Optional[RegistryBackend]): The registry backend to use, by default the Windows registry.
+    - workers (int): The maximum number of keys processed at the same time.
+    """
+    if not enabled:
+        logging.info("Registry tweaks are skipped as they're disabled by configuration.")
+        return
+
+    groups = group_tweaks(tweaks)
+    if not groups:
+        return
+    registry = registry or get_default_registry()
+    checkpoint = get_checkpoint()
+    ids = tweak_ids_by_key(tweaks)
+
+    def apply(key: KeyId, desired: Dict[str, RegistryValue]) -> None:
+        if apply_key(registry, key, desired):
+            values = {name.lower(): value for name, value in desired.items()}
+            for tweak_id, name in ids.get((key[0], key[1].lower()), []):
+                value = values.get(name.lower())
+                checkpoint.complete("set_registry_tweaks", [tweak_id], describe_value(value[0]) if value else None)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(groups)))) as executor:
+        list(executor.map(lambda entry: apply(*entry), groups.items()))
+
+
+def describe_value(value: Any) -> Any:
+    """
+    Returns a JSON-serializable form of a registry value, writing binary data as a hex string.
+    """
+    return value.hex(" ") if isinstance(value, bytes) else value
+
+
+def plan_step(section: Dict[str, Any], registry: Optional[RegistryBackend] = None) -> List[PlannedChange]:
+    """
+    Determines, without writing to the registry, which of the enabled tweaks differ from their desired value. Every
+    key is read once.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'registryTweaks' section of the configuration.
+    - registry (Optional[RegistryBackend]): The registry backend to use, by default the Windows registry.
+
+    Returns:
+    - List[PlannedChange]: One 'set' change per registry value that would be written.
+    """
+    registry = registry or get_default_registry()
+    identifiers = {}
+    for tweak in section["tweaks"]:
+        try:
+            (hive, key_path), name, _ = parse_tweak(tweak)
+        except ValueError:
+            continue
+        identifiers[(hive, key_path.lower(), name.lower())] = item_id(tweak)
+
+    changes = []
+    for key, desired in group_tweaks(section["tweaks"]).items():
+        current = read_key(registry, key) or {}
+        for name, (value, _) in compute_key_changes(key, desired, current).items():
+            current_value = current[name][0] if name in current else None
+            tweak_id = identifiers[(key[0], key[1].lower(), name.lower())]
+            changes.append(PlannedChange("set_registry_tweaks", tweak_id, "set", describe_value(current_value),
+                                         describe_value(value)))
+    return changes
+
+
+def state_validator(tweak_id: str, registry: Optional[RegistryBackend] = None) -> Optional[str]:
+    """
+    Returns a cheap validator for the state cache: the last write time of the key holding the tweaked value.
+
+    Parameters:
+    - tweak_id (str): The identifier of the tweak, 'hive\\key path\\value name'.
+    - registry (Optional[RegistryBackend]): The registry backend to use, by default the Windows registry.
+
+    Returns:
+    - Optional[str]: The validator value, or 'missing' if the key does not exist, or None if it cannot be read.
+    """
+    hive, _, rest = tweak_id.partition("\\")
+    key_path = rest.rpartition("\\")[0]
+    try:
+        return str((registry or get_default_registry()).key_last_write(HIVES.get(hive.upper(), hive), key_path))
+    except FileNotFoundError:
+        return "missing"
+    except (OSError, ImportError):
+        return None
+
+
+def inventory_step(section: Dict[str, Any], registry: Optional[RegistryBackend] = None) -> Dict[str, Any]:
+    """
+    Captures the current value and type of each enabled, valid tweak. Every key is read once.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'registryTweaks' section of the configuration.
+    - registry (Optional[RegistryBackend]): The registry backend to use, by default the Windows registry.
+
+    Returns:
+    - Dict[str, Any]: The [value, type] pair, or None for values that do not exist, keyed by tweak identifier.
+    """
+    registry = registry or get_default_registry()
+    keys: Dict[KeyId, Optional[Dict[str, RegistryValue]]] = {}
+    states = {}
+    for tweak in section["tweaks"]:
+        if not tweak.get('enabled', True):
+            continue
+        try:
+            (hive, key_path), name, _ = parse_tweak(tweak)
+        except ValueError:
+            continue
+        if (hive, key_path.lower()) not in keys:
+            keys[(hive, key_path.lower())] = read_key(registry, (hive, key_path))
+        current = (keys[(hive, key_path.lower())] or {}).get(name)
+        states[item_id(tweak)] = None if current is None else [describe_value(current[0]), current[1]]
+    return states
+
+
+def desired_step(section: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the configured value and type of each enabled, valid tweak, in the form `inventory_step` reports them.
+    """
+    desired = {}
+    for tweak in section["tweaks"]:
+        if not tweak.get('enabled', True):
+            continue
+        try:
+            _, _, (value, value_type) = parse_tweak(tweak)
+        except ValueError:
+            continue
+        desired[item_id(tweak)] = [describe_value(value), value_type]
+    return desired
+
+
+def run_step(section: Dict[str, Any]) -> None:
+    """
+    Runs this module as a step of the unified setup runner, applying the configured tweaks from the already validated
+    'registryTweaks' section.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'registryTweaks' section of the configuration.
+    """
+    apply_registry_tweaks(section["tweaks"], section["enabled"])
+
+
+def main() -> None:
+    """
+    Executes the main functionality of the script which includes setting up logging, reading the configuration file,
+    validating the 'registryTweaks' configuration section, and conditionally applying the tweaks based on the
+    configuration. With '--plan', only prints the changes it would make.
+    """
+    args = parse_module_arguments("Applies the 'registryTweaks' section of the configuration.")
+    setup_logging()
+    config_data = read_config_file(CONFIG_FILE)
+
+    if not config_data:
+        logging.error("Failed to read the configuration file.")
+        return
+
+    registry_tweaks_keys = [
+        {'key': 'enabled', 'type': bool},
+        {'key': 'tweaks', 'type': list}
+    ]
+    if not validate_config_section(config_data.get("registryTweaks", {}), registry_tweaks_keys):
+        logging.error("The 'registryTweaks' section in the configuration is invalid.")
+        return
+
+    if args.plan:
+        print_plan(config_data["registryTweaks"], plan_step)
+        return
+
+    apply_registry_tweaks(config_data["registryTweaks"]["tweaks"], config_data["registryTweaks"]["enabled"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,117 +1,191 @@
-import subprocess
+import threading
 import time
-from typing import List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
+from backend_registry import get_backend, select_backend, set_backend
+from change_plan import PlannedChange, parse_module_arguments, print_plan
+from checkpoint import get_checkpoint
 from config_service import setup_logging, read_config_file, validate_config_section, logging
+from metrics import instrumented
+from reconcile import Allowlist, log_reconcile, managed_items, reconcile_sets
+from registry_backend import HKEY_LOCAL_MACHINE, RegistryBackend, get_default_registry
+from service_control import CONTROL_TARGET_STATUS, ScServiceController, ServiceControlError, ServiceController
+from undo_journal import get_journal, read_active_records
 
 CONFIG_FILE = "config.json"
+DEFAULT_WORKERS = 8
+# The key holding the configuration of every service, including its 'Start' and 'DelayedAutostart' values.
+SERVICES_KEY = r"SYSTEM\CurrentControlSet\Services"
 
+SC_STARTUP_TYPES = {
+    "Automatic": "auto",
+    "Manual": "demand",
+    "Disabled": "disabled",
+    "Automatic (Delayed Start)": "delayed-auto"
+}
 
-def query_service_startup_type(service_name: str) -> str:
+
+def select_service_backend(backend: str, read_only: bool = False) -> None:
+    """
+    Selects the backend ('auto', 'native' or 'sc') used by every function of this module that is not given an
+    explicit controller, closing the controller created so far. The new controller is created on first use.
+
+    Parameters:
+    - backend (str): The backend name, see `service_control.create_service_controller`.
+    - read_only (bool): Whether the controller only needs to query services, so it opens them with query access.
+    """
+    previous = select_backend("services", f"{backend}-read-only" if read_only else backend)
+    if previous is not None:
+        previous.close()
+
+
+def set_default_controller(controller: Optional[ServiceController]) -> None:
+    """
+    Replaces the controller used by every function of this module that is not given an explicit controller, for
+    example with a `SimulatedServiceController` to run the service engine on Linux. The replaced controller is closed.
+
+    Parameters:
+    - controller (Optional[ServiceController]): The new default controller, or None to create one for the selected
+      backend on next use.
+    """
+    previous = set_backend("services", controller)
+    if previous is not None and previous is not controller:
+        previous.close()
+
+
+def close_default_controller() -> None:
+    """
+    Closes the default controller, if one was created, releasing its Service Control Manager handles. A new one is
+    created on next use.
+    """
+    set_default_controller(None)
+
+
+def get_default_controller() -> ServiceController:
+    """
+    Returns the controller used when no explicit controller is given, creating it for the selected backend on first
+    use.
     """
-    Queries the startup type of Windows service using the 'sc qc' command and returns the service startup type.
-    The function maps the output to simplified keywords like 'auto', 'demand', 'disabled', and 'delayed-auto'. If the
-    command fails, it returns 'unknown'.
+    return get_backend("services")
+
+
+def query_service_startup_type(service_name: str, controller: Optional[ServiceController] = None) -> str:
+    """
+    Queries the startup type of Windows service and returns the service startup type. The startup type is reported
+    with simplified keywords like 'auto', 'demand', 'disabled', and 'delayed-auto'. If the query fails, it returns
+    'unknown'.
 
     Parameters:
     - service_name (str): The name of the service to query.
+    - controller (Optional[ServiceController]): The service backend to use, by default the selected backend.
 
     Returns:
     - str: The startup type of the service.
     """
-    try:
-        output = subprocess.check_output(["sc", "qc", service_name], text=True)
-        if "AUTO_START" in output:
-            return "auto"
-        elif "DEMAND_START" in output:
-            return "demand"
-        elif "DISABLED" in output:
-            return "disabled"
-        elif "DELAYED_AUTO_START" in output:
-            return "delayed-auto"
-    except subprocess.CalledProcessError:
-        return "unknown"
+    return (controller or get_default_controller()).query_startup_type(service_name)
 
 
-def query_service_status(service_name: str) -> str:
+def query_service_status(service_name: str, controller: Optional[ServiceController] = None) -> str:
     """
-    Queries the current status of a Windows service using the 'sc query' command. The function returns the service
-    status such as 'running', 'stopped', or 'paused'. If the command execution fails, it returns 'unknown'.
+    Queries the current status of a Windows service. The function returns the service status such as 'running',
+    'stopped', or 'paused'. If the query fails, it returns 'unknown'.
 
     Parameters:
     - service_name (str): The name of the service to query.
+    - controller (Optional[ServiceController]): The service backend to use, by default the selected backend.
 
     Returns:
     - str: The current status of the service.
     """
-    try:
-        output = subprocess.check_output(["sc", "query", service_name], text=True)
-        if "RUNNING" in output:
-            return "running"
-        elif "STOPPED" in output:
-            return "stopped"
-        elif "PAUSED" in output:
-            return "paused"
-    except subprocess.CalledProcessError:
-        return "unknown"
+    return (controller or get_default_controller()).query_status(service_name)
 
 
-def wait_for_service_status(service_name: str, target_status: str, timeout: int = 30) -> bool:
+@instrumented("service.wait")
+def wait_for_service_status(service_name: str, target_status: str, timeout: float = 30,
+                            controller: Optional[ServiceController] = None, initial_delay: float = 0.05,
+                            max_delay: float = 2.0) -> bool:
     """
-    Waits for a service to reach a specific status within a given timeout period. The function periodically checks the
-    service status and returns True if the service reaches the target status within the timeout, otherwise return False.
+    Waits for a service to reach a specific status within a given timeout period. The status is polled with an
+    exponentially growing delay, starting at `initial_delay` and capped at `max_delay`, so fast transitions are noticed
+    almost immediately. If the controller reports status changes through a listener, the wait is woken up as soon as
+    the service changes instead of sleeping out the delay. Returns True if the service reaches the target status within
+    the timeout, otherwise returns False.
 
     Parameters:
     - service_name (str): The name of the service.
     - target_status (str): The desired status to wait for ('running', 'stopped', 'paused').
-    - timeout (int): The maximum time in seconds to wait for the service to reach the target status.
+    - timeout (float): The maximum time in seconds to wait for the service to reach the target status.
+    - controller (Optional[ServiceController]): The service backend to use, by default the selected backend.
+    - initial_delay (float): The delay in seconds before the second status query.
+    - max_delay (float): The longest delay in seconds between two status queries.
 
     Returns:
     - bool: True if the service reaches the target status within the timeout, otherwise False.
     """
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        current_status = query_service_status(service_name)
-        if current_status == target_status:
-            return True
-        time.sleep(2)
-    return False
-
-
-def change_service_startup_type(name: str, startup_type: str) -> None:
+    controller = controller or get_default_controller()
+    changed = threading.Event()
+    remove_listener = controller.add_status_listener(service_name, lambda status: changed.set())
+    try:
+        deadline = time.monotonic() + timeout
+        delay = initial_delay
+        while True:
+            controller.invalidate(service_name)
+            if controller.query_status(service_name) == target_status:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            changed.wait(min(delay, remaining))
+            changed.clear()
+            delay = min(delay * 2, max_delay)
+    finally:
+        remove_listener()
+
+
+@instrumented("service.startup_type")
+def change_service_startup_type(name: str, startup_type: str, controller: Optional[ServiceController] = None) -> bool:
     """
-    Changes the startup type of Windows service using the 'sc config' command. The function first checks if the
-    requested startup type is valid and then modifies the service if its current startup type differs from the requested
-    one. Logs the outcome of each modification attempt.
+    Changes the startup type of Windows service. The function first checks if the requested startup type is valid and
+    then modifies the service if its current startup type differs from the requested one. Logs the outcome of each
+    modification attempt.
 
     Parameters:
     - name (str): The name of the service.
     - startup_type (str): The desired startup type ('Automatic', 'Manual', 'Disabled', 'Automatic (Delayed Start)').
+    - controller (Optional[ServiceController]): The service backend to use, by default the selected backend.
+
+    Returns:
+    - bool: True if the service has the desired startup type afterwards.
     """
-    sc_startup_type = {
-        "Automatic": "auto",
-        "Manual": "demand",
-        "Disabled": "disabled",
-        "Automatic (Delayed Start)": "delayed-auto"
-    }.get(startup_type)
+    controller = controller or get_default_controller()
+    sc_startup_type = SC_STARTUP_TYPES.get(startup_type)
 
     if sc_startup_type is None:
         logging.error(f"Invalid startup type '{startup_type}' for service '{name}'.")
-        return
+        return False
 
-    current_startup_type = query_service_startup_type(name)
+    current_startup_type = controller.query_startup_type(name)
     if sc_startup_type == current_startup_type:
         logging.info(f"Service {name} is already in the desired startup type: {startup_type}. Skipping...")
-        return
+        return True
 
+    journal = get_journal()
+    journal.record("startup_type", name=name, previous=current_startup_type)
+    journal.commit()
     try:
-        subprocess.check_output(["sc", "config", name, "start=", sc_startup_type], text=True, stderr=subprocess.DEVNULL)
+        controller.set_startup_type(name, sc_startup_type)
         logging.info(f"Successfully changed startup type for {name} to {startup_type}.")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to change startup type for {name}. Error: {e.output}")
+        return True
+    except ServiceControlError as e:
+        logging.error(f"Failed to change startup type for {name}. Error: {e}")
+        return False
 
 
-def handle_service_state(name: str, desired_state: str) -> None:
+@instrumented("service.state")
+def handle_service_state(name: str, desired_state: str, controller: Optional[ServiceController] = None,
+                         timeout: float = 30) -> bool:
     """
     Handles the state of a Windows service based on the desired action ('start', 'stop', 'pause', 'resume').
     It first validates the desired state, checks the current state of the service, and proceeds with the state change
@@ -121,79 +195,420 @@ def handle_service_state(name: str, desired_state: str) -> None:
     Parameters:
     - name (str): The name of the service.
     - desired_state (str): The desired action for the service ('start', 'stop', 'pause', 'resume').
+    - controller (Optional[ServiceController]): The service backend to use, by default the selected backend.
+    - timeout (float): The maximum time in seconds to wait for the service to reach the desired state.
+
+    Returns:
+    - bool: True if the service is in the desired state afterwards.
     """
-    desired_state_map = {"start": "running", "stop": "stopped", "pause": "paused", "resume": "running"}
-    target_status = desired_state_map.get(desired_state)
+    controller = controller or get_default_controller()
+    target_status = CONTROL_TARGET_STATUS.get(desired_state)
 
     if not target_status:
         logging.error(f"Invalid desired state '{desired_state}' for service '{name}'. Skipping...")
-        return
+        return False
 
-    current_status = query_service_status(name)
+    current_status = controller.query_status(name)
     if current_status == target_status:
         logging.info(f"Service {name} is already in the desired status: {desired_state}. Skipping...")
-        return
+        return True
 
-    pause_supported = False
-    resume_supported = False
-    output = subprocess.check_output(["sc", "qc", name], text=True)
-    if "PAUSABLE" in output:
-        pause_supported = True
-    if "RESUME_PENDING" in output:
-        resume_supported = True
+    if desired_state in ("pause", "resume") and not controller.is_pausable(name):
+        logging.error(f"{desired_state.capitalize()} operation is not supported for service '{name}'. Skipping...")
+        return False
 
-    if desired_state == "pause" and not pause_supported:
-        logging.error(f"Pause operation is not supported for service '{name}'. Skipping...")
-        return
-    elif desired_state == "resume" and not resume_supported:
-        logging.error(f"Resume operation is not supported for service '{name}'. Skipping...")
-        return
-
-    startup_type = query_service_startup_type(name)
+    startup_type = controller.query_startup_type(name)
     if startup_type == "disabled" and desired_state == "start":
         logging.error(f"Cannot start service '{name}' because its startup type is Disabled. Skipping...")
-        return
+        return False
 
+    journal = get_journal()
+    journal.record("status", name=name, previous=current_status, action=desired_state)
+    journal.commit()
     try:
-        subprocess.run(["sc", desired_state, name], check=True, text=True, stdout=subprocess.DEVNULL,
-                       stderr=subprocess.DEVNULL)
-        if wait_for_service_status(name, target_status):
+        controller.control(name, desired_state)
+        if wait_for_service_status(name, target_status, timeout, controller):
             logging.info(f"Service {name} successfully changed to {desired_state}.")
-        else:
-            logging.error(f"Failed to change the status of {name} to {desired_state}.")
-    except subprocess.CalledProcessError as e:
+            return True
+        logging.error(f"Failed to change the status of {name} to {desired_state}.")
+    except ServiceControlError as e:
         logging.error(f"Error while attempting to change the state of {name} to {desired_state}: {e}")
+    return False
+
+
+def order_state_changes(desired_states: Dict[str, str], controller: ServiceController) -> List[List[str]]:
+    """
+    Groups the services whose state should change into waves that can run concurrently. A service being started comes
+    after the configured services it depends on, and a service being stopped or paused comes before the configured
+    services it depends on, so the Service Control Manager never has to reject a change because of a dependency.
+
+    Parameters:
+    - desired_states (Dict[str, str]): The desired action for every configured service, keyed by service name.
+    - controller (ServiceController): The service backend used to look up dependencies.
+
+    Returns:
+    - List[List[str]]: The service names grouped into waves, in the order the waves must run.
+    """
+    names = list(desired_states)
+    lowered = {name.lower(): name for name in names}
+    with ThreadPoolExecutor(max_workers=DEFAULT_WORKERS) as executor:
+        dependencies = dict(zip(names, executor.map(controller.query_dependencies, names)))
+
+    predecessors = {name: set() for name in names}
+    for name in names:
+        for dependency in dependencies[name]:
+            other = lowered.get(dependency.lower())
+            if other is None or other == name:
+                continue
+            if desired_states[name] in ("start", "resume") and desired_states[other] in ("start", "resume"):
+                predecessors[name].add(other)
+            elif desired_states[name] in ("stop", "pause") and desired_states[other] in ("stop", "pause"):
+                predecessors[other].add(name)
+
+    # Kahn's algorithm: a service is placed once all of its predecessors are, one wave after the latest of them.
+    successors: Dict[str, List[str]] = {name: [] for name in names}
+    for name in names:
+        for other in predecessors[name]:
+            successors[other].append(name)
+    unplaced = {name: len(predecessors[name]) for name in names}
+    levels = {name: 0 for name in names if not unplaced[name]}
+    ready = deque(levels)
+    while ready:
+        name = ready.popleft()
+        for successor in successors[name]:
+            levels[successor] = max(levels.get(successor, 0), levels[name] + 1)
+            unplaced[successor] -= 1
+            if not unplaced[successor]:
+                ready.append(successor)
+    cyclic = [name for name in names if unplaced[name]]
+    if cyclic:
+        logging.error(f"Circular dependency detected between the services {', '.join(cyclic)}. Changing them last.")
+        last = max((levels[name] for name in names if not unplaced[name]), default=-1) + 1
+        levels.update((name, last) for name in cyclic)
+
+    waves: List[List[str]] = []
+    for name in names:
+        level = levels[name]
+        while len(waves) <= level:
+            waves.append([])
+        waves[level].append(name)
+    return waves
+
+
+def modify_windows_services(services_list: List[dict], enabled: bool, controller: Optional[ServiceController] = None,
+                            max_workers: int = DEFAULT_WORKERS) -> None:
+    """
+    Modifies the startup type and the current state (start, stop, pause, resume) of the configured Windows services.
+    Startup types are changed for all services concurrently, then the state changes run concurrently in dependency
+    order, each one waiting to confirm the change and logging the outcome. At most `max_workers` services are handled
+    at the same time. A service is marked as completed in the run's checkpoint once it has both its startup type and
+    its state.
+
+    Parameters:
+    - services_list (List[dict]): The configured services, each with a 'name', a 'startupType' and a 'serviceStatus'
+      key and an optional 'enabled' flag.
+    - enabled (bool): If False, service modification is skipped, and a log entry is made indicating it's disabled.
+    - controller (Optional[ServiceController]): The service backend to use, by default the selected backend.
+    - max_workers (int): The maximum number of services modified at the same time.
+    """
+    if not enabled:
+        logging.info("Service modification is skipped as it's disabled by configuration.")
+        return
+
+    controller = controller or get_default_controller()
+    checkpoint = get_checkpoint()
+    services = []
+    for service in services_list:
+        if not service.get("enabled", True):
+            logging.info(f"Service '{service.get('name')}' is disabled in configuration. Skipping...")
+            continue
+        services.append(service)
+    controller.preload([service.get("name") for service in services])
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        startup_types_set = dict(zip(
+            [service.get("name") for service in services],
+            executor.map(lambda service: change_service_startup_type(service.get("name"), service.get("startupType"),
+                                                                     controller), services)))
+
+        desired_states = {service.get("name"): service.get("serviceStatus").lower() for service in services}
+        startup_types = {service.get("name"): SC_STARTUP_TYPES.get(service.get("startupType")) for service in services}
+
+        def change_state(name: str) -> None:
+            if handle_service_state(name, desired_states[name], controller) and startup_types_set[name]:
+                checkpoint.complete("set_services", [name], {"startupType": startup_types[name],
+                                                             "status": CONTROL_TARGET_STATUS[desired_states[name]]})
+
+        for wave in order_state_changes(desired_states, controller):
+            list(executor.map(change_state, wave))
+
+
+def resolve_service_names(names: Iterable[str], controller: ServiceController) -> Dict[str, str]:
+    """
+    Resolves configured service names, which Windows compares case-insensitively, to the spelling the Service Control
+    Manager stores, with a single enumeration of the installed services. Names the backend does not list are kept as
+    written.
+
+    Parameters:
+    - names (Iterable[str]): The configured service names.
+    - controller (ServiceController): The service backend.
+
+    Returns:
+    - Dict[str, str]: The resolved name keyed by the configured name.
+    """
+    installed = {name.lower(): name for name in controller.list_services()}
+    return {name: installed.get(name.lower(), name) for name in names}
 
 
-def modify_windows_services(services_list: List[dict], enabled: bool) -> None:
+def unmanaged_services(configured: Iterable[str], allowlist: Sequence[str],
+                       journal_path: Optional[str]) -> Tuple[Dict[str, str], int]:
     """
-       Modifies the current state of a Windows service (start, stop, pause, resume) using the 'sc' command. The function
-       first validates the requested state, checks the current state, and proceeds with the state change if necessary.
-       It waits to confirm the state change and logs the outcome.
+    Finds the services whose startup type earlier runs changed, according to the undo journal, that are no longer
+    configured, along with the startup type each one had before the first change.
 
-       Parameters:
-       - name (str): The name of the service.
-       - desired_state (str): The desired state action ('start', 'stop', 'pause', 'resume').
-       """
+    Parameters:
+    - configured (Iterable[str]): The resolved names of every configured service.
+    - allowlist (Sequence[str]): Services whose startup type is never restored; wildcards are allowed.
+    - journal_path (Optional[str]): The undo journal file.
+
+    Returns:
+    - Tuple[Dict[str, str], int]: The startup type to restore keyed by service name, and the number of services kept
+      because of the allowlist.
+
+    Raises:
+    - OSError: If the journal cannot be read.
+    """
+    managed = managed_items(read_active_records(journal_path, {"startup_type"}), lambda record: record["name"].lower())
+    _, removed, kept = reconcile_sets({name.lower(): name for name in configured}, managed,
+                                      Allowlist(allowlist, str.lower))
+    return {record["name"]: record["previous"] for record in removed}, len(kept)
+
+
+def restore_startup_type(name: str, startup_type: str, controller: ServiceController) -> None:
+    """
+    Gives a service that is no longer configured back the startup type it had before this tool first changed it. The
+    change is recorded as 'pruned', so the service is no longer treated as managed.
+    """
+    if startup_type not in SC_STARTUP_TYPES.values():
+        logging.info(f"Service {name} had no known startup type before it was changed. Skipping...")
+        return
+    current_startup_type = controller.query_startup_type(name)
+    if current_startup_type == startup_type:
+        logging.info(f"Service {name} is already in its original startup type: {startup_type}. Skipping...")
+        return
+
+    journal = get_journal()
+    journal.record("startup_type", name=name, previous=current_startup_type, pruned=True)
+    journal.commit()
+    try:
+        controller.set_startup_type(name, startup_type)
+        logging.info(f"Restored the startup type of {name}, which is no longer configured, to '{startup_type}'.")
+    except ServiceControlError as e:
+        logging.error(f"Failed to restore the startup type of {name}. Error: {e}")
+
+
+def reconcile_services(services_list: List[dict], enabled: bool, allowlist: Sequence[str] = (),
+                       controller: Optional[ServiceController] = None, max_workers: int = DEFAULT_WORKERS) -> None:
+    """
+    Makes the managed services match the configuration. Configured names are resolved to the names the Service Control
+    Manager uses and duplicates are dropped, the configured services are modified like `modify_windows_services`, and
+    every service whose startup type earlier runs changed but which is no longer configured gets its original startup
+    type back, unless it is on the allowlist. Statuses of such services are left alone.
+
+    Parameters:
+    - services_list (List[dict]): The configured services.
+    - enabled (bool): If False, no service is modified or restored.
+    - allowlist (Sequence[str]): Services whose startup type is never restored; wildcards are allowed.
+    - controller (Optional[ServiceController]): The service backend to use, by default the selected backend.
+    - max_workers (int): The maximum number of services modified at the same time.
+    """
     if not enabled:
         logging.info("Service modification is skipped as it's disabled by configuration.")
         return
 
+    controller = controller or get_default_controller()
+    resolved = resolve_service_names([service.get("name") for service in services_list], controller)
+    services: Dict[str, dict] = {}
     for service in services_list:
-        name = service.get("name")
-        startup_type = service.get("startupType")
-        desired_state = service.get("serviceStatus").lower()
+        name = resolved[service.get("name")]
+        if name.lower() in services:
+            logging.warning(f"Service '{name}' is configured more than once. Skipping...")
+            continue
+        services[name.lower()] = {**service, "name": name}
+    modify_windows_services(list(services.values()), True, controller, max_workers)
+
+    journal_path = get_journal().file_path
+    if not journal_path:
+        logging.warning("Restoring services that are no longer configured needs the undo journal. Skipping...")
+        return
+    try:
+        removed, kept = unmanaged_services([service["name"] for service in services.values()], allowlist, journal_path)
+    except OSError as e:
+        logging.error(f"Failed to read the journal '{journal_path}': {str(e)}")
+        return
+    log_reconcile("services", 0, len(removed), kept)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        list(executor.map(lambda name: restore_startup_type(name, removed[name], controller), removed))
+
+
+def plan_service(service: dict, controller: ServiceController) -> List[PlannedChange]:
+    """
+    Determines the startup type and state changes a single configured service would need.
+    """
+    name = service.get("name")
+    changes = []
+    sc_startup_type = SC_STARTUP_TYPES.get(service.get("startupType"))
+    current_startup_type = controller.query_startup_type(name)
+    if sc_startup_type is not None and sc_startup_type != current_startup_type:
+        changes.append(PlannedChange("set_services", name, "set_startup_type", current_startup_type, sc_startup_type))
+    desired_state = service.get("serviceStatus", "").lower()
+    target_status = CONTROL_TARGET_STATUS.get(desired_state)
+    current_status = controller.query_status(name)
+    if target_status is not None and target_status != current_status:
+        changes.append(PlannedChange("set_services", name, desired_state, current_status, target_status))
+    return changes
+
+
+def plan_step(section: Dict[str, Any], controller: Optional[ServiceController] = None) -> List[PlannedChange]:
+    """
+    Determines, without modifying any service, which startup type and state changes the enabled services in the
+    'servicesSettings' section would need. Services are probed concurrently.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'servicesSettings' section of the configuration.
+    - controller (Optional[ServiceController]): The service backend to use, by default the selected backend.
+
+    Returns:
+    - List[PlannedChange]: The pending changes, at most one startup type and one state change per service.
+    """
+    controller = controller or get_default_controller()
+    services = [service for service in section["services"] if service.get("enabled", True)]
+    controller.preload([service.get("name") for service in services])
+    with ThreadPoolExecutor(max_workers=DEFAULT_WORKERS) as executor:
+        return [change for changes in executor.map(lambda service: plan_service(service, controller), services)
+                for change in changes]
 
-        change_service_startup_type(name, startup_type)
-        handle_service_state(name, desired_state)
+
+def state_validator(name: str, controller: Optional[ServiceController] = None,
+                    registry: Optional[RegistryBackend] = None) -> Optional[str]:
+    """
+    Returns a cheap validator for the state cache: the last write time of the service's registry key, which changes
+    with its startup type, followed by its status if the backend can query it without launching a process, so a
+    reconfigured or, with the native backend, a stopped service invalidates its record.
+
+    Parameters:
+    - name (str): The name of the service.
+    - controller (Optional[ServiceController]): The service backend to use, by default the selected backend.
+    - registry (Optional[RegistryBackend]): The registry backend to use, by default the Windows registry.
+
+    Returns:
+    - Optional[str]: The validator value, or 'missing' if the service does not exist, or None if it cannot be read.
+    """
+    try:
+        registry = registry or get_default_registry()
+        last_write = str(registry.key_last_write(HKEY_LOCAL_MACHINE, f"{SERVICES_KEY}\\{name}"))
+    except FileNotFoundError:
+        return "missing"
+    except (OSError, ImportError):
+        return None
+    controller = controller or get_default_controller()
+    if isinstance(controller, ScServiceController):
+        return last_write
+    return f"{last_write}:{controller.query_status(name)}"
+
+
+def inventory_step(section: Dict[str, Any],
+                   controller: Optional[ServiceController] = None) -> Dict[str, Dict[str, str]]:
+    """
+    Captures the startup type and status of each enabled service in the 'servicesSettings' section. Services are
+    probed concurrently.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'servicesSettings' section of the configuration.
+    - controller (Optional[ServiceController]): The service backend to use, by default the selected backend.
+
+    Returns:
+    - Dict[str, Dict[str, str]]: The 'startupType' and 'status' of every service, keyed by service name.
+    """
+    controller = controller or get_default_controller()
+    names = list(dict.fromkeys(service.get("name") for service in section["services"] if service.get("enabled", True)))
+    controller.preload(names)
+
+    def probe(name: str) -> Dict[str, str]:
+        return {"startupType": controller.query_startup_type(name), "status": controller.query_status(name)}
+
+    with ThreadPoolExecutor(max_workers=DEFAULT_WORKERS) as executor:
+        return dict(zip(names, executor.map(probe, names)))
+
+
+def desired_step(section: Dict[str, Any]) -> Dict[str, Dict[str, str]]:
+    """
+    Returns the configured startup type and status of each enabled service, in the terms `inventory_step` reports
+    them. A setting the step does not manage, such as an unknown status, is left out.
+    """
+    desired = {}
+    for service in section["services"]:
+        if not service.get("enabled", True):
+            continue
+        state = {"startupType": SC_STARTUP_TYPES.get(service.get("startupType")),
+                 "status": CONTROL_TARGET_STATUS.get(service.get("serviceStatus", "").lower())}
+        desired[service.get("name")] = {name: value for name, value in state.items() if value is not None}
+    return desired
+
+
+def plan_reconcile_step(section: Dict[str, Any],
+                        controller: Optional[ServiceController] = None) -> List[PlannedChange]:
+    """
+    Determines, without modifying any service, which services reconcile mode would give their original startup type
+    back because they are no longer configured.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'servicesSettings' section of the configuration.
+    - controller (Optional[ServiceController]): The service backend to use, by default the selected backend.
+
+    Returns:
+    - List[PlannedChange]: One 'set_startup_type' change per service to restore.
+    """
+    controller = controller or get_default_controller()
+    resolved = resolve_service_names([service.get("name") for service in section["services"]], controller)
+    removed, _ = unmanaged_services(resolved.values(), section.get("allowlist", []), get_journal().file_path)
+    changes = []
+    for name, startup_type in removed.items():
+        current_startup_type = controller.query_startup_type(name)
+        if startup_type in SC_STARTUP_TYPES.values() and startup_type != current_startup_type:
+            changes.append(PlannedChange("set_services", name, "set_startup_type", current_startup_type, startup_type))
+    return changes
+
+
+def reconcile_step(section: Dict[str, Any]) -> None:
+    """
+    Runs this module as a step of the unified setup runner in reconcile mode, applying the configured service settings
+    and restoring the startup type of the services that are no longer configured.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'servicesSettings' section of the configuration.
+    """
+    reconcile_services(section["services"], section["enabled"], section.get("allowlist", []))
+
+
+def run_step(section: Dict[str, Any]) -> None:
+    """
+    Runs this module as a step of the unified setup runner, applying the configured service settings from the already
+    validated 'servicesSettings' section.
+
+    Parameters:
+    - section (Dict[str, Any]): The 'servicesSettings' section of the configuration.
+    """
+    modify_windows_services(section["services"], section["enabled"])
 
 
 def main() -> None:
     """
     Executes the main functionality of the script which includes setting up logging, reading the configuration file,
     validating the 'servicesSettings' configuration section, and conditionally modifying services startup type and
-    status based on the configuration.
+    status based on the configuration. With '--plan', only prints the changes it would make.
     """
+    args = parse_module_arguments("Applies the 'servicesSettings' section of the configuration.")
     setup_logging()
     config_data = read_config_file(CONFIG_FILE)
 
@@ -209,6 +624,14 @@ def main() -> None:
         logging.error("The 'servicesSettings' section in the configuration is invalid.")
         return
 
+    if args.plan:
+        select_service_backend("auto", read_only=True)
+        try:
+            print_plan(config_data["servicesSettings"], plan_step)
+        finally:
+            close_default_controller()
+        return
+
     modify_windows_services(config_data["servicesSettings"]["services"], config_data["servicesSettings"]["enabled"])
 
 
@@ -0,0 +1,741 @@
+import argparse
+import importlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import metrics
+import profiling
+from checkpoint import CHECKPOINT_FILE, Checkpoint, get_checkpoint, load_checkpoint, set_checkpoint
+from change_plan import (PlannedChange, format_changes, item_id, read_plan, restrict_section, section_items,
+                         write_plan)
+from config_schema import CONFIG_CACHE_FILE, load_config, report_errors
+from config_service import setup_logging, validate_config_section, logging
+from profile_fanout import DEFAULT_PROFILE_WORKERS, PER_USER_STEPS, default_profile_root
+from state_cache import DEFAULT_TTL, STATE_FILE, StateCache, fingerprint
+from step_scheduler import Resource, ScheduledTask, ScheduleReport, run_tasks
+from undo_journal import JOURNAL_FILE, UndoJournal, new_run_id, set_journal
+from watch_mode import DEFAULT_DEBOUNCE, DEFAULT_DRIFT_INTERVAL, DEFAULT_POLL_INTERVAL, watch
+
+CONFIG_FILE = "config.json"
+DEFAULT_WORKERS = 4
+LOCALE_KEY = r"HKCU\Control Panel\International"
+
+StepResources = Tuple[FrozenSet[Resource], FrozenSet[Resource]]
+
+
+def path_resource(path: str) -> Resource:
+    """
+    Builds the resource for a configured path, expanding environment variables and normalizing it so that the same
+    folder written in different ways is recognized as one resource.
+
+    Parameters:
+    - path (str): The path as written in the configuration.
+
+    Returns:
+    - Resource: The ("path", normalized path) resource.
+    """
+    return "path", os.path.normcase(os.path.normpath(os.path.expandvars(path)))
+
+
+def create_folders_resources(section: Dict[str, Any]) -> StepResources:
+    return frozenset(), frozenset(path_resource(path) for path in section["paths"] if path)
+
+
+def hide_folders_resources(section: Dict[str, Any]) -> StepResources:
+    paths = [path_resource(path) for path in section["paths"] if path]
+    return frozenset(paths), frozenset(("attributes", key) for _, key in paths)
+
+
+def set_locales_resources(section: Dict[str, Any]) -> StepResources:
+    return frozenset(), frozenset(("registry", f"{LOCALE_KEY}\\{name}".lower()) for name in section["formatOptions"])
+
+
+def set_services_resources(section: Dict[str, Any]) -> StepResources:
+    return frozenset(), frozenset(("service", str(service.get("name")).lower()) for service in section["services"])
+
+
+def set_registry_tweaks_resources(section: Dict[str, Any]) -> StepResources:
+    return frozenset(), frozenset(("registry", item_id(tweak).lower()) for tweak in section["tweaks"])
+
+
+def add_defender_exclusions_resources(section: Dict[str, Any]) -> StepResources:
+    exclusions = section["exclusions"]
+    inputs = frozenset(path_resource(exclusion["path"]) for exclusion in exclusions
+                       if exclusion.get("type") in ("Folder", "File") and exclusion.get("path"))
+    outputs = frozenset(("defender", f"{exclusion.get('type')}:{exclusion.get('path')}".lower())
+                        for exclusion in exclusions)
+    return inputs, outputs
+
+
+@dataclass(frozen=True)
+class SetupStep:
+    """
+    Describes one step of the setup: the module implementing it, the configuration section it reads, the keys that
+    section must contain and a function declaring the resources the step reads and modifies for a given section. The
+    module is imported only when the step runs, so platform-specific modules are not loaded for steps that are skipped.
+    """
+    name: str
+    module: str
+    section: str
+    required_keys: List[Dict[str, Any]]
+    resources: Callable[[Dict[str, Any]], StepResources]
+
+    def load(self, attribute: str, default: Any = None) -> Any:
+        """
+        Imports the step module and returns one of its functions: `run_step` applies the step to its section,
+        `plan_step` computes its pending changes without modifying anything, and the optional `state_validator`
+        returns a cheap validator value for one configuration item, with the keyword arguments the optional
+        `validator_options` derives from the section. Steps that can remove what the configuration no longer lists
+        also define `reconcile_step` and `plan_reconcile_step`.
+
+        Parameters:
+        - attribute (str): The name of the function.
+        - default (Any): The value returned if the module does not define the function.
+
+        Returns:
+        - Any: The function, or `default`.
+        """
+        return getattr(importlib.import_module(self.module), attribute, default)
+
+
+STEPS = (
+    SetupStep("create_folders", "create_folders", "createFolders",
+              [{'key': 'enabled', 'type': bool}, {'key': 'paths', 'type': list}],
+              create_folders_resources),
+    SetupStep("hide_folders", "hide_folders", "hideFolders",
+              [{'key': 'enabled', 'type': bool}, {'key': 'paths', 'type': list}],
+              hide_folders_resources),
+    SetupStep("set_locales", "set_locales", "localeSettings",
+              [{'key': 'enabled', 'type': bool}, {'key': 'formatOptions', 'type': dict}],
+              set_locales_resources),
+    SetupStep("set_services", "set_services", "servicesSettings",
+              [{'key': 'enabled', 'type': bool}, {'key': 'services', 'type': list}],
+              set_services_resources),
+    SetupStep("set_registry_tweaks", "set_registry_tweaks", "registryTweaks",
+              [{'key': 'enabled', 'type': bool}, {'key': 'tweaks', 'type': list}],
+              set_registry_tweaks_resources),
+    SetupStep("add_defender_exclusions", "add_defender_exclusions", "excludeFromDefender",
+              [{'key': 'enabled', 'type': bool}, {'key': 'exclusions', 'type': list}],
+              add_defender_exclusions_resources),
+)
+
+STEP_NAMES = [step.name for step in STEPS]
+
+
+def parse_step_names(values: Optional[List[str]]) -> List[str]:
+    """
+    Flattens the values given to a repeatable, comma-separated step option and checks that every name is known.
+
+    Parameters:
+    - values (Optional[List[str]]): The raw option values, e.g. ["create_folders,hide_folders", "set_locales"].
+
+    Returns:
+    - List[str]: The individual step names.
+
+    Raises:
+    - ValueError: If a name does not match any known step.
+    """
+    names = [name.strip() for value in values or [] for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in STEP_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown step(s): {', '.join(unknown)}. Known steps: {', '.join(STEP_NAMES)}.")
+    return names
+
+
+def build_step_plan(config_data: Dict[str, Any], only: List[str], skip: List[str]) -> Optional[List[SetupStep]]:
+    """
+    Selects the steps to run and validates their configuration sections. A step is selected when it is listed in
+    `only` (or `only` is empty), is not listed in `skip` and its section is enabled. All selected sections are
+    validated before anything runs, so a bad section is reported before any change is made.
+
+    Parameters:
+    - config_data (Dict[str, Any]): The parsed configuration file.
+    - only (List[str]): The step names to restrict the run to, or an empty list for all steps.
+    - skip (List[str]): The step names to leave out.
+
+    Returns:
+    - Optional[List[SetupStep]]: The steps to run in order, or None if any selected section is invalid.
+    """
+    plan = []
+    valid = True
+    for step in STEPS:
+        if (only and step.name not in only) or step.name in skip:
+            logging.info(f"Step '{step.name}' is not selected. Skipping...")
+            continue
+        section = config_data.get(step.section, {})
+        if not validate_config_section(section, step.required_keys):
+            logging.error(f"The '{step.section}' section in the configuration is invalid.")
+            valid = False
+            continue
+        if not section["enabled"]:
+            logging.info(f"Step '{step.name}' is disabled by configuration. Skipping...")
+            continue
+        plan.append(step)
+    return plan if valid else None
+
+
+def load_step_plan(config_path: str, only: List[str], skip: List[str],
+                   cache_file: Optional[str] = CONFIG_CACHE_FILE) -> Optional[Tuple[List[SetupStep], Dict[str, Any]]]:
+    """
+    Loads the configuration file through the compiled schema and selects the steps to run. Every error in the sections
+    of the selected steps is logged with its JSON path before anything runs.
+
+    Parameters:
+    - config_path (str): The configuration file.
+    - only (List[str]): The step names to restrict the run to, or an empty list for all steps.
+    - skip (List[str]): The step names to leave out.
+    - cache_file (Optional[str]): The compiled configuration cache, or None to always parse and validate.
+
+    Returns:
+    - Optional[Tuple[List[SetupStep], Dict[str, Any]]]: The steps to run and the parsed configuration, or None if the
+      file cannot be read or a selected section is invalid.
+    """
+    compiled = load_config(config_path, cache_file)
+    if compiled is None:
+        logging.error("Failed to read the configuration file.")
+        return None
+    plan = build_step_plan(compiled.data, only, skip)
+    if plan is None or report_errors(compiled, [step.section for step in plan]):
+        logging.error("The configuration is invalid. No steps were run.")
+        return None
+    return plan, compiled.data
+
+
+def make_step_action(step: SetupStep, section: Dict[str, Any], reconcile: bool = False) -> Callable[[], None]:
+    """
+    Binds a step to its configuration section, importing the step module when the returned action is called. In
+    reconcile mode, steps that define `reconcile_step` run it instead of `run_step`. The items the step marked as
+    completed are written to the checkpoint when it ends.
+    """
+    def action() -> None:
+        logging.info(f"Running step '{step.name}'...")
+        run = (reconcile and step.load("reconcile_step")) or step.load("run_step")
+        try:
+            with metrics.instrument("step", step.name), profiling.profile_step(step.name):
+                run(section)
+        finally:
+            get_checkpoint().flush()
+    return action
+
+
+def run_steps(plan: List[SetupStep], config_data: Dict[str, Any], workers: int = DEFAULT_WORKERS,
+              reconcile: bool = False) -> ScheduleReport:
+    """
+    Runs the planned steps in the current interpreter. The dependencies between steps are derived from the resources
+    each one declares, and independent steps run concurrently on up to `workers` threads. An unexpected error in one
+    step is logged and does not prevent the remaining steps from running.
+
+    Parameters:
+    - plan (List[SetupStep]): The steps to run, as returned by `build_step_plan`.
+    - config_data (Dict[str, Any]): The parsed configuration file.
+    - workers (int): The maximum number of steps running at the same time; 1 runs them serially in plan order.
+    - reconcile (bool): Whether the steps also remove what the configuration no longer lists.
+
+    Returns:
+    - ScheduleReport: The duration and outcome of every step and the overall timings.
+    """
+    tasks = []
+    for step in plan:
+        section = config_data[step.section]
+        inputs, outputs = step.resources(section)
+        tasks.append(ScheduledTask(step.name, make_step_action(step, section, reconcile), inputs, outputs))
+    return run_tasks(tasks, workers)
+
+
+def collect_changes(plan: List[SetupStep], config_data: Dict[str, Any], workers: int = DEFAULT_WORKERS,
+                    reconcile: bool = False) -> List[PlannedChange]:
+    """
+    Runs the read-only probes of the planned steps concurrently and collects the changes they would make. Nothing is
+    modified. A step whose probe fails is logged and contributes no changes.
+
+    Parameters:
+    - plan (List[SetupStep]): The steps to probe, as returned by `build_step_plan`.
+    - config_data (Dict[str, Any]): The parsed configuration file.
+    - workers (int): The maximum number of steps probed at the same time.
+    - reconcile (bool): Whether to also collect the removals of reconcile mode.
+
+    Returns:
+    - List[PlannedChange]: The pending changes of all steps, in plan order.
+    """
+    def probe(step: SetupStep) -> List[PlannedChange]:
+        try:
+            changes = step.load("plan_step")(config_data[step.section])
+            plan_reconcile = reconcile and step.load("plan_reconcile_step")
+            return changes + plan_reconcile(config_data[step.section]) if plan_reconcile else changes
+        except Exception as e:
+            logging.error(f"Failed to plan step '{step.name}': {str(e)}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return [change for changes in executor.map(probe, plan) for change in changes]
+
+
+def restrict_to_plan(plan: List[SetupStep], config_data: Dict[str, Any],
+                     changes: List[PlannedChange]) -> Tuple[List[SetupStep], Dict[str, Any]]:
+    """
+    Limits a run to the items listed in a previously computed plan. Steps without planned changes are dropped, and the
+    sections of the remaining steps only keep the planned items, so applying a plan touches nothing else.
+
+    Parameters:
+    - plan (List[SetupStep]): The steps selected by `build_step_plan`.
+    - config_data (Dict[str, Any]): The parsed configuration file.
+    - changes (List[PlannedChange]): The changes read from the plan file.
+
+    Returns:
+    - Tuple[List[SetupStep], Dict[str, Any]]: The remaining steps and a configuration with the restricted sections.
+    """
+    planned_items: Dict[str, set] = {}
+    for change in changes:
+        planned_items.setdefault(change.step, set()).add(change.item)
+
+    restricted_plan = []
+    restricted_config = dict(config_data)
+    for step in plan:
+        items = planned_items.get(step.name)
+        if not items:
+            logging.info(f"Step '{step.name}' has no planned changes. Skipping...")
+            continue
+        restricted_config[step.section] = restrict_section(step.section, config_data[step.section], items)
+        restricted_plan.append(step)
+    return restricted_plan, restricted_config
+
+
+def item_validators(step: SetupStep, items: Dict[str, Any], section: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """
+    Computes the cheap state cache validator of every item of a step, passing it the keyword arguments the optional
+    `validator_options` of the step derives from its section. Steps without a validator yield None for every item,
+    leaving the TTL as the only expiry.
+    """
+    validator = step.load("state_validator")
+    if validator is None:
+        return {key: None for key in items}
+    options = step.load("validator_options", lambda section: {})(section)
+    return {key: validator(key, **options) for key in items}
+
+
+def skip_converged(plan: List[SetupStep], config_data: Dict[str, Any],
+                   cache: StateCache) -> Tuple[List[SetupStep], Dict[str, Any]]:
+    """
+    Removes the items the state cache records as converged, so they are neither probed nor applied. Steps left without
+    items are dropped from the plan.
+
+    Parameters:
+    - plan (List[SetupStep]): The steps selected by `build_step_plan`.
+    - config_data (Dict[str, Any]): The parsed configuration file.
+    - cache (StateCache): The loaded state cache.
+
+    Returns:
+    - Tuple[List[SetupStep], Dict[str, Any]]: The remaining steps and a configuration with the restricted sections.
+    """
+    remaining_plan = []
+    remaining_config = dict(config_data)
+    for step in plan:
+        items = section_items(step.section, config_data[step.section])
+        validators = item_validators(step, items, config_data[step.section])
+        pending = {key for key, item in items.items()
+                   if not cache.is_converged(step.name, key, item, validators[key])}
+        if not pending:
+            logging.info(f"Step '{step.name}' is converged according to the state cache. Skipping...")
+            continue
+        if len(pending) < len(items):
+            logging.info(f"Step '{step.name}': skipping {len(items) - len(pending)} converged item(s).")
+        remaining_config[step.section] = restrict_section(step.section, config_data[step.section], pending)
+        remaining_plan.append(step)
+    return remaining_plan, remaining_config
+
+
+def skip_completed(plan: List[SetupStep], config_data: Dict[str, Any],
+                   checkpoint: Checkpoint) -> Tuple[List[SetupStep], Dict[str, Any]]:
+    """
+    Removes the items an interrupted run marked as completed in its checkpoint, so they are neither probed nor applied
+    again. Steps left without items are dropped from the plan.
+
+    Parameters:
+    - plan (List[SetupStep]): The steps selected by `build_step_plan`.
+    - config_data (Dict[str, Any]): The parsed configuration file.
+    - checkpoint (Checkpoint): The checkpoint of the interrupted run.
+
+    Returns:
+    - Tuple[List[SetupStep], Dict[str, Any]]: The remaining steps and a configuration with the restricted sections.
+    """
+    remaining_plan = []
+    remaining_config = dict(config_data)
+    for step in plan:
+        items = section_items(step.section, config_data[step.section])
+        completed = checkpoint.completed(step.name)
+        pending = {key for key in items if key not in completed}
+        if not pending:
+            logging.info(f"Step '{step.name}' was completed by the interrupted run. Skipping...")
+            continue
+        if len(pending) < len(items):
+            logging.info(f"Step '{step.name}': skipping {len(items) - len(pending)} completed item(s).")
+        remaining_config[step.section] = restrict_section(step.section, config_data[step.section], pending)
+        remaining_plan.append(step)
+    return remaining_plan, remaining_config
+
+
+def is_completed(plan: List[SetupStep], config_data: Dict[str, Any], checkpoint: Checkpoint) -> bool:
+    """
+    Checks whether every item of the planned steps is marked as completed in the checkpoint, by this run or by the
+    interrupted one it resumed.
+    """
+    for step in plan:
+        completed = checkpoint.completed(step.name)
+        if any(key not in completed for key in section_items(step.section, config_data[step.section])):
+            return False
+    return True
+
+
+def record_converged(plan: List[SetupStep], config_data: Dict[str, Any], cache: StateCache,
+                     checkpoint: Optional[Checkpoint]) -> None:
+    """
+    Records every item the steps that just ran completed as converged, together with the actual state the step
+    observed while applying it, so nothing is probed again. Items that were not completed, for example because
+    applying them failed, are removed from the cache so the next run handles them.
+
+    Parameters:
+    - plan (List[SetupStep]): The steps that ran.
+    - config_data (Dict[str, Any]): The configuration the steps ran with.
+    - cache (StateCache): The state cache to update.
+    - checkpoint (Optional[Checkpoint]): The checkpoint the steps marked their completed items in, or None if the run
+      had none, in which case the cache is left unchanged.
+    """
+    if checkpoint is None:
+        return
+    for step in plan:
+        observed = checkpoint.observed(step.name)
+        items = section_items(step.section, config_data[step.section])
+        validators = item_validators(step, items, config_data[step.section])
+        for key, item in items.items():
+            if key in observed:
+                cache.record(step.name, key, item, observed[key], validators[key])
+            else:
+                cache.forget(step.name, key)
+
+
+def apply_steps(plan: List[SetupStep], config_data: Dict[str, Any], workers: int = DEFAULT_WORKERS,
+                journal_path: Optional[str] = JOURNAL_FILE, run_id: Optional[str] = None,
+                reconcile: bool = False, checkpoint: Optional[Checkpoint] = None) -> None:
+    """
+    Runs the planned steps with every change recorded in the undo journal and every completed item marked in the
+    checkpoint, and logs the timing summary.
+
+    Parameters:
+    - plan (List[SetupStep]): The steps to run.
+    - config_data (Dict[str, Any]): The configuration the steps run with.
+    - workers (int): The maximum number of steps running at the same time.
+    - journal_path (Optional[str]): The undo journal file, or None to run without a journal.
+    - run_id (Optional[str]): The run identifier recorded in the journal, by default a new one.
+    - reconcile (bool): Whether the steps also remove what the configuration no longer lists.
+    - checkpoint (Optional[Checkpoint]): The checkpoint the steps mark their completed items in, or None for none.
+    """
+    if journal_path:
+        set_journal(UndoJournal(journal_path, run_id))
+    set_checkpoint(checkpoint)
+    try:
+        log_timing_summary(run_steps(plan, config_data, workers, reconcile))
+    finally:
+        set_checkpoint(None)
+        set_journal(None)
+
+
+def apply_to_all_profiles(plan: List[SetupStep], config_data: Dict[str, Any], profile_root: str, workers: int,
+                          log_level: str, journal_path: Optional[str], run_id: Optional[str]) -> List[SetupStep]:
+    """
+    Applies the per-user steps of the plan to every user profile under the profile root on a pool of worker
+    processes, and logs the per-profile report. On Windows, the locale settings reach the hive of each logged-on user
+    under HKU; profiles without a loaded hive are reported and skipped.
+
+    Parameters:
+    - plan (List[SetupStep]): The steps selected by `build_step_plan`.
+    - config_data (Dict[str, Any]): The parsed configuration file.
+    - profile_root (str): The directory holding the user profiles.
+    - workers (int): The maximum number of profiles processed at the same time.
+    - log_level (str): The console logging level of the worker processes.
+    - journal_path (Optional[str]): The undo journal the workers record their changes in, or None for no journal.
+    - run_id (Optional[str]): The run identifier the workers record their changes under.
+
+    Returns:
+    - List[SetupStep]: The remaining machine-wide steps.
+    """
+    from profile_fanout import (DirectoryProfileSource, RegistryHiveAccess, fan_out, loaded_hive_roots,
+                                log_profile_report)
+
+    per_user = {step.name: config_data[step.section] for step in plan if step.name in PER_USER_STEPS}
+    if not per_user:
+        return plan
+    hive_roots = {}
+    if "set_locales" in per_user:
+        try:
+            hive_roots = loaded_hive_roots()
+        except (ImportError, OSError) as e:
+            logging.warning(f"Failed to list the loaded user hives: {str(e)}")
+    try:
+        profiles = DirectoryProfileSource(profile_root, hive_roots).profiles()
+    except OSError as e:
+        logging.error(f"Failed to list the user profiles under '{profile_root}': {str(e)}")
+        profiles = []
+    logging.info(f"Applying {', '.join(per_user)} to {len(profiles)} user profile(s) under '{profile_root}'...")
+    with metrics.instrument("step", "profile_fanout"), profiling.profile_step("profile_fanout"):
+        log_profile_report(fan_out(per_user, profiles, RegistryHiveAccess(), workers, log_level, journal_path, run_id))
+    return [step for step in plan if step.name not in PER_USER_STEPS]
+
+
+def log_timing_summary(report: ScheduleReport) -> None:
+    """
+    Logs a table with the start offset, duration and outcome of every executed step, followed by the wall time, the
+    serial total and the critical path through the step dependencies.
+
+    Parameters:
+    - report (ScheduleReport): The report returned by `run_steps`.
+    """
+    if not report.results:
+        logging.info("No steps were run.")
+        return
+    width = max(len(result.name) for result in report.results)
+    logging.info("Step timing summary:")
+    for result in sorted(report.results, key=lambda entry: entry.started):
+        outcome = "ok" if result.succeeded else "FAILED"
+        logging.info(f"  {result.name:<{width}}  started at {result.started * 1000:8.1f} ms  "
+                     f"took {result.duration * 1000:10.1f} ms  {outcome}")
+    logging.info(f"  Wall time: {report.wall_time * 1000:.1f} ms, serial total: {report.serial_time * 1000:.1f} ms, "
+                 f"critical path: {report.critical_path_time * 1000:.1f} ms ({' -> '.join(report.critical_path)})")
+
+
+def parse_arguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parses the command line of the setup runner.
+
+    Parameters:
+    - argv (Optional[List[str]]): The arguments to parse, or None to use sys.argv.
+
+    Returns:
+    - argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Runs every enabled Windows setup step in a single process.")
+    parser.add_argument("--config", default=CONFIG_FILE, help="Path to the configuration file.")
+    parser.add_argument("--config-cache", default=CONFIG_CACHE_FILE,
+                        help="Path to the cache of the parsed and validated configuration.")
+    parser.add_argument("--no-config-cache", action="store_true",
+                        help="Always parse and validate the configuration file instead of using the cache.")
+    parser.add_argument("--only", action="append", metavar="STEPS",
+                        help=f"Comma-separated steps to run exclusively. Known steps: {', '.join(STEP_NAMES)}.")
+    parser.add_argument("--skip", action="append", metavar="STEPS", help="Comma-separated steps to leave out.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Maximum number of independent steps to run concurrently.")
+    parser.add_argument("--plan", action="store_true",
+                        help="Only print the changes the selected steps would make, without applying them.")
+    parser.add_argument("--plan-output", metavar="FILE", help="With --plan, also write the changes to a JSON file.")
+    parser.add_argument("--apply-plan", metavar="FILE",
+                        help="Apply only the changes listed in a plan file written by --plan-output.")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="Also remove what the configuration does not list: Defender exclusions, and folders "
+                             "hidden or service startup types changed by earlier runs, except allowlisted entries.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip the items an interrupted run completed, as recorded in the checkpoint, if the "
+                             "configuration has not changed since.")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE,
+                        help="Path to the checkpoint file that records the items every run completes.")
+    parser.add_argument("--force", action="store_true",
+                        help="Ignore the state cache and probe every item, even if it was recently converged.")
+    parser.add_argument("--state-file", default=STATE_FILE, help="Path to the state cache file.")
+    parser.add_argument("--state-ttl", type=float, default=DEFAULT_TTL,
+                        help="Seconds a converged item is trusted without probing it again.")
+    parser.add_argument("--service-backend", choices=("auto", "native", "sc"), default="auto",
+                        help="How services are controlled: through the Service Control Manager API ('native'), the "
+                             "'sc' tool, or the native API with a fallback to 'sc' ('auto').")
+    parser.add_argument("--metrics", nargs="?", const="", metavar="FILE",
+                        help="Record the duration, outcome and process launches of every probe and mutation, print a "
+                             "summary at the end and optionally append the records to a JSON-lines file.")
+    parser.add_argument("--profile", nargs="?", const=profiling.PROFILE_DIR, metavar="DIR",
+                        help="Run the steps one at a time under cProfile and tracemalloc, write per-step hot function "
+                             "and allocation reports to a directory, and measure the cold start of every entry point. "
+                             "Hot functions only cover the thread running each step, not the step's own thread pools.")
+    parser.add_argument("--journal", default=JOURNAL_FILE,
+                        help="Path to the undo journal that records the previous state of everything a run changes.")
+    parser.add_argument("--no-journal", action="store_true", help="Do not record the changes in the undo journal.")
+    parser.add_argument("--rollback", nargs="?", const="last", metavar="RUN",
+                        help="Undo the changes recorded in the journal instead of running the steps: the last run "
+                             "(default), 'all' runs, or the run with the given identifier.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running: apply added or changed items whenever the configuration file changes, and "
+                             "re-apply items that drifted from the configuration.")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="With --watch, seconds between two checks of the configuration file.")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE,
+                        help="With --watch, seconds the configuration file must stay unchanged before it is reloaded.")
+    parser.add_argument("--drift-interval", type=float, default=DEFAULT_DRIFT_INTERVAL,
+                        help="With --watch, seconds between two drift checks; 0 disables them.")
+    parser.add_argument("--inventory", metavar="FILE",
+                        help="Capture the actual state of every configured item of the selected steps into a snapshot "
+                             "file, without changing anything.")
+    parser.add_argument("--diff", nargs="+", metavar="SNAPSHOT",
+                        help="Compare snapshot files written by --inventory with the configuration, or with the "
+                             "--diff-base snapshot, without changing anything.")
+    parser.add_argument("--diff-base", metavar="SNAPSHOT", help="With --diff, the snapshot to compare against.")
+    parser.add_argument("--all-profiles", action="store_true",
+                        help=f"Apply the per-user steps ({', '.join(PER_USER_STEPS)}) to every user profile under "
+                             "the profile root instead of only the current user.")
+    parser.add_argument("--profile-root", default=default_profile_root(),
+                        help="With --all-profiles, the directory holding the user profiles.")
+    parser.add_argument("--profile-workers", type=int, default=DEFAULT_PROFILE_WORKERS,
+                        help="With --all-profiles, the maximum number of profiles processed at the same time.")
+    parser.add_argument("--log-level", default="INFO", help="The logging level of the console.")
+    parser.add_argument("--log-file", metavar="FILE", help="Also write the log to a rotating file.")
+    parser.add_argument("--log-file-level", help="The logging level of the log file, by default the console level.")
+    parser.add_argument("--log-json", action="store_true", help="Write the log file as JSON lines.")
+    parser.add_argument("--no-aggregate", action="store_true",
+                        help="Print every 'already set' and 'Skipping...' message on the console instead of counting "
+                             "them and printing a summary at the end.")
+    return parser.parse_args(argv)
+
+
+def run_mode(args: argparse.Namespace, only: List[str], skip: List[str]) -> None:
+    """
+    Runs the mode selected on the command line: a rollback, a snapshot diff or inventory, watch mode, a plan, or
+    applying the steps. Called by `main` once logging, metrics and profiling are set up, which tears them down again
+    however the mode ends.
+
+    Parameters:
+    - args (argparse.Namespace): The parsed command line.
+    - only (List[str]): The step names to restrict the run to, or an empty list for all steps.
+    - skip (List[str]): The step names to leave out.
+    """
+    read_only = bool(args.plan or args.inventory or args.diff)
+    importlib.import_module("set_services").select_service_backend(args.service_backend, read_only)
+
+    if args.rollback:
+        importlib.import_module("rollback").rollback(args.journal, args.rollback, args.workers)
+        return
+
+    if args.diff and args.diff_base:
+        importlib.import_module("inventory").diff_snapshots(args.diff, baseline=args.diff_base)
+        return
+
+    if args.all_profiles and (args.watch or args.plan or args.apply_plan):
+        logging.error("--all-profiles cannot be combined with --watch, --plan or --apply-plan.")
+        return
+    if args.reconcile and (args.watch or args.apply_plan or args.all_profiles):
+        logging.error("--reconcile cannot be combined with --watch, --apply-plan or --all-profiles.")
+        return
+    if args.resume and (args.watch or args.apply_plan or args.reconcile):
+        logging.error("--resume cannot be combined with --watch, --apply-plan or --reconcile.")
+        return
+
+    config_cache = None if args.no_config_cache else args.config_cache
+    if args.watch:
+        watch(args.config, lambda: load_step_plan(args.config, only, skip, config_cache),
+              lambda plan, data: apply_steps(plan, data, args.workers, None if args.no_journal else args.journal),
+              lambda plan, data: collect_changes(plan, data, args.workers), restrict_to_plan,
+              args.poll_interval, args.debounce, args.drift_interval)
+        return
+
+    loaded = load_step_plan(args.config, only, skip, config_cache)
+    if loaded is None:
+        return
+    plan, config_data = loaded
+    journal_path = None if args.no_journal else args.journal
+    run_id = new_run_id()
+    config_hash = fingerprint(config_data)
+
+    if args.inventory or args.diff:
+        inventory = importlib.import_module("inventory")
+        if args.inventory:
+            records = inventory.capture_inventory(plan, config_data, args.workers)
+            inventory.write_snapshot(args.inventory, records)
+            logging.info(f"Snapshot with {len(records)} item(s) written to '{args.inventory}'.")
+        if args.diff:
+            inventory.diff_snapshots(args.diff, desired=inventory.desired_records(plan, config_data))
+        return
+
+    if args.all_profiles:
+        plan = apply_to_all_profiles(plan, config_data, args.profile_root, args.profile_workers, args.log_level,
+                                     journal_path, run_id)
+
+    # Reconcile runs compare whole sections, so their items are not marked and cannot be resumed.
+    checkpoint = None if args.reconcile else (args.resume and load_checkpoint(args.checkpoint, config_hash)) or \
+        Checkpoint(args.checkpoint, config_hash)
+    if args.resume and checkpoint is not None:
+        plan, config_data = skip_completed(plan, config_data, checkpoint)
+
+    if args.plan:
+        # The reconcile probes look up what earlier runs changed in the journal; planning never writes to it.
+        if args.reconcile and journal_path:
+            set_journal(UndoJournal(journal_path, run_id))
+        try:
+            changes = collect_changes(plan, config_data, args.workers, args.reconcile)
+        finally:
+            set_journal(None)
+        print(format_changes(changes))
+        if args.plan_output:
+            write_plan(args.plan_output, changes)
+            logging.info(f"Plan with {len(changes)} change(s) written to '{args.plan_output}'.")
+        return
+
+    if args.apply_plan:
+        try:
+            changes = read_plan(args.apply_plan)
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to read the plan file: {str(e)}")
+            return
+        plan, config_data = restrict_to_plan(plan, config_data, changes)
+
+    cache = StateCache(args.state_file, args.state_ttl)
+    # Reconciling needs every configured item, or the converged ones would look unmanaged.
+    if not args.force and not args.reconcile:
+        cache.load()
+        plan, config_data = skip_converged(plan, config_data, cache)
+
+    apply_steps(plan, config_data, args.workers, journal_path, run_id, args.reconcile, checkpoint)
+    if checkpoint is not None and is_completed(plan, config_data, checkpoint):
+        checkpoint.discard()
+
+    record_converged(plan, config_data, cache, checkpoint)
+    try:
+        cache.save()
+    except OSError as e:
+        logging.warning(f"Failed to write the state cache '{args.state_file}': {str(e)}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Executes the main functionality of the runner which includes setting up logging, metrics and profiling as
+    requested, and running the mode selected on the command line, by default reading and validating the configuration
+    file and applying its enabled sections as steps. The options are described in `parse_arguments`.
+
+    Parameters:
+    - argv (Optional[List[str]]): The command line arguments, or None to use sys.argv.
+    """
+    args = parse_arguments(argv)
+    setup_logging(args.log_level, args.log_file, args.log_file_level, args.log_json, aggregate=not args.no_aggregate)
+
+    try:
+        only = parse_step_names(args.only)
+        skip = parse_step_names(args.skip)
+    except ValueError as e:
+        logging.error(str(e))
+        return
+
+    if args.metrics is not None:
+        metrics.enable(args.metrics or None)
+    if args.profile is not None:
+        profiling.enable(args.profile)
+        if args.workers != 1:
+            logging.info("Profiling runs the steps one at a time.")
+            args.workers = 1
+
+    try:
+        run_mode(args, only, skip)
+    finally:
+        importlib.import_module("set_services").close_default_controller()
+        metrics.log_summary()
+        metrics.disable()
+        if profiling.is_enabled():
+            profiling.write_report()
+            profiling.disable()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from config_service import logging
+
+STATE_FILE = ".setup_state.json"
+STATE_VERSION = 1
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def fingerprint(value: Any) -> str:
+    """
+    Computes a short, stable fingerprint of a configuration item's desired value.
+
+    Parameters:
+    - value (Any): The configuration item, which must be JSON-serializable.
+
+    Returns:
+    - str: A hexadecimal digest that changes whenever the item changes.
+    """
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def write_json_atomically(file_path: str, data: Any) -> None:
+    """
+    Writes JSON data to a temporary file next to the target and renames it over the target, so readers and later runs
+    never see a partially written file.
+
+    Parameters:
+    - file_path (str): The path of the file to write.
+    - data (Any): The JSON-serializable data.
+    """
+    write_bytes_atomically(file_path, json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+def write_bytes_atomically(file_path: str, content: bytes) -> None:
+    """
+    Writes bytes to a temporary file next to the target and renames it over the target.
+
+    Parameters:
+    - file_path (str): The path of the file to write.
+    - content (bytes): The file content.
+    """
+    import tempfile
+    directory = os.path.dirname(os.path.abspath(file_path))
+    descriptor, temp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(content)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class StateCache:
+    """
+    Remembers, for every configuration item of every step, the fingerprint of its desired value, the state last
+    observed after it converged, a cheap validator value (such as a directory modification time or a registry key's
+    last write time) and when it was recorded. An item is considered converged, and can be skipped without probing,
+    while its fingerprint and validator are unchanged and the record is younger than the TTL.
+
+    Parameters:
+    - file_path (str): The JSON file the cache is stored in.
+    - ttl (float): The number of seconds a record stays valid.
+    - clock (Callable[[], float]): The time source, replaceable for testing.
+    """
+
+    def __init__(self, file_path: str = STATE_FILE, ttl: float = DEFAULT_TTL,
+                 clock: Callable[[], float] = time.time) -> None:
+        self.file_path = file_path
+        self.ttl = ttl
+        self.clock = clock
+        self.entries: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Loads the cache from its file. A missing, unreadable or outdated file leaves the cache empty.
+        """
+        try:
+            with open(self.file_path, "r") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable state cache '{self.file_path}': {str(e)}")
+            return
+        if isinstance(data, dict) and data.get("version") == STATE_VERSION:
+            self.entries = data.get("steps", {})
+
+    def save(self) -> None:
+        """
+        Writes the cache to its file atomically.
+        """
+        with self._lock:
+            data = {"version": STATE_VERSION, "steps": self.entries}
+            write_json_atomically(self.file_path, data)
+
+    def is_converged(self, step: str, item_key: str, item: Any, validator: Optional[str]) -> bool:
+        """
+        Checks whether an item was recorded as converged with the same desired value and validator within the TTL.
+
+        Parameters:
+        - step (str): The name of the step.
+        - item_key (str): The identifier of the item within the step.
+        - item (Any): The configured item.
+        - validator (Optional[str]): The item's current validator value, or None if the step has no cheap validator.
+
+        Returns:
+        - bool: True if the item can be skipped, False if it has to be probed.
+        """
+        with self._lock:
+            entry = self.entries.get(step, {}).get(item_key)
+        if entry is None:
+            return False
+        return (entry.get("fingerprint") == fingerprint(item) and entry.get("validator") == validator
+                and self.clock() - entry.get("recorded", 0) < self.ttl)
+
+    def record(self, step: str, item_key: str, item: Any, observed: Any, validator: Optional[str]) -> None:
+        """
+        Records an item as converged.
+
+        Parameters:
+        - step (str): The name of the step.
+        - item_key (str): The identifier of the item within the step.
+        - item (Any): The configured item.
+        - observed (Any): The actual state observed for the item.
+        - validator (Optional[str]): The item's validator value after it converged.
+        """
+        with self._lock:
+            self.entries.setdefault(step, {})[item_key] = {
+                "fingerprint": fingerprint(item),
+                "observed": observed,
+                "validator": validator,
+                "recorded": self.clock(),
+            }
+
+    def forget(self, step: str, item_key: str) -> None:
+        """
+        Removes the record of an item, so it is probed again on the next run.
+        """
+        with self._lock:
+            self.entries.get(step, {}).pop(item_key, None)
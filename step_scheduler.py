@@ -0,0 +1,214 @@
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, List, Set, Tuple
+
+from config_service import logging
+
+# A resource touched by a task, as a (kind, key) pair such as ("path", "c:\\games") or ("service", "xboxnetapisvc").
+Resource = Tuple[str, str]
+
+PATH_SEPARATORS = ("\\", "/")
+
+
+@dataclass
+class ScheduledTask:
+    """
+    A unit of work together with the resources it reads (inputs) and modifies (outputs).
+    """
+    name: str
+    action: Callable[[], None]
+    inputs: FrozenSet[Resource] = frozenset()
+    outputs: FrozenSet[Resource] = frozenset()
+
+
+@dataclass
+class TaskResult:
+    """
+    The outcome of a single executed task, with its start time relative to the start of the schedule.
+    """
+    name: str
+    duration: float
+    succeeded: bool
+    started: float = 0.0
+
+
+@dataclass
+class ScheduleReport:
+    """
+    The results of a scheduled run together with its wall time, the serial total of all task durations and the length
+    of the critical path through the dependency graph.
+    """
+    results: List[TaskResult] = field(default_factory=list)
+    wall_time: float = 0.0
+    serial_time: float = 0.0
+    critical_path_time: float = 0.0
+    critical_path: List[str] = field(default_factory=list)
+
+
+def resources_overlap(first: Resource, second: Resource) -> bool:
+    """
+    Checks whether two resources refer to the same thing. Path resources also overlap when one path is an ancestor of
+    the other, so that creating 'C:\\Games' is ordered before hiding 'C:\\Games\\Steam'.
+
+    Parameters:
+    - first (Resource): The first resource.
+    - second (Resource): The second resource.
+
+    Returns:
+    - bool: True if the resources overlap, False otherwise.
+    """
+    if first[0] != second[0]:
+        return False
+    if first[1] == second[1]:
+        return True
+    if first[0] != "path":
+        return False
+    shorter, longer = sorted((first[1], second[1]), key=len)
+    return longer.startswith(shorter) and (shorter.endswith(PATH_SEPARATORS) or longer[len(shorter)] in PATH_SEPARATORS)
+
+
+def path_segments(path: str) -> Tuple[str, ...]:
+    """
+    Splits a path resource key on both kinds of separators, dropping empty segments.
+    """
+    return tuple(segment for segment in re.split(r"[\\/]+", path) if segment)
+
+
+class ResourceIndex:
+    """
+    A set of resources indexed for overlap checks: the segments of every path, and every proper prefix of them. A path
+    overlaps the set if it, one of its ancestors or one of its descendants is in it, which takes one hash lookup per
+    path level instead of a comparison with every path of the set.
+
+    Parameters:
+    - resources (FrozenSet[Resource]): The resources.
+    """
+
+    def __init__(self, resources: FrozenSet[Resource]) -> None:
+        self.resources = resources
+        self.paths: Set[Tuple[str, ...]] = set()
+        self.ancestors: Set[Tuple[str, ...]] = set()
+        for kind, key in resources:
+            if kind == "path":
+                segments = path_segments(key)
+                self.paths.add(segments)
+                self.ancestors.update(segments[:length] for length in range(1, len(segments)))
+
+    def contains_related(self, segments: Tuple[str, ...]) -> bool:
+        """
+        Checks whether the path with the given segments, an ancestor or a descendant of it is in the set.
+        """
+        return (segments in self.paths or segments in self.ancestors
+                or any(segments[:length] in self.paths for length in range(1, len(segments))))
+
+    def overlaps(self, other: "ResourceIndex") -> bool:
+        """
+        Checks whether any resource of this set overlaps any resource of the other set.
+        """
+        if self.resources & other.resources:
+            return True
+        smaller, larger = sorted((self, other), key=lambda index: len(index.paths))
+        return any(larger.contains_related(segments) for segments in smaller.paths)
+
+
+def sets_overlap(first: FrozenSet[Resource], second: FrozenSet[Resource]) -> bool:
+    """
+    Checks whether any resource of the first set overlaps any resource of the second set.
+    """
+    return ResourceIndex(first).overlaps(ResourceIndex(second))
+
+
+def build_dependency_graph(tasks: List[ScheduledTask]) -> Dict[str, Set[str]]:
+    """
+    Derives the dependencies between tasks from their declared resources. A task depends on every earlier task that
+    writes something it reads, reads something it writes, or writes the same thing, so conflicting tasks keep their
+    listed order while independent ones may run concurrently. Because edges only point to earlier tasks, the graph is
+    always acyclic.
+
+    Parameters:
+    - tasks (List[ScheduledTask]): The tasks in their preferred serial order.
+
+    Returns:
+    - Dict[str, Set[str]]: A mapping of every task name to the names of the tasks it depends on.
+    """
+    dependencies = {task.name: set() for task in tasks}
+    inputs = [ResourceIndex(task.inputs) for task in tasks]
+    outputs = [ResourceIndex(task.outputs) for task in tasks]
+    for index, task in enumerate(tasks):
+        for earlier in range(index):
+            if (outputs[earlier].overlaps(inputs[index]) or inputs[earlier].overlaps(outputs[index])
+                    or outputs[earlier].overlaps(outputs[index])):
+                dependencies[task.name].add(tasks[earlier].name)
+    return dependencies
+
+
+def find_critical_path(results: List[TaskResult], dependencies: Dict[str, Set[str]]) -> Tuple[float, List[str]]:
+    """
+    Computes the longest chain of dependent tasks, weighted by their measured durations. This is the shortest wall time
+    the schedule could reach with unlimited workers.
+
+    Parameters:
+    - results (List[TaskResult]): The executed tasks in dependency order.
+    - dependencies (Dict[str, Set[str]]): The dependency graph returned by `build_dependency_graph`.
+
+    Returns:
+    - Tuple[float, List[str]]: The length of the critical path in seconds and the task names along it.
+    """
+    durations = {result.name: result.duration for result in results}
+    longest: Dict[str, Tuple[float, List[str]]] = {}
+    for result in results:
+        before = max((longest[name] for name in dependencies.get(result.name, ()) if name in longest),
+                     key=lambda entry: entry[0], default=(0.0, []))
+        longest[result.name] = (before[0] + durations[result.name], before[1] + [result.name])
+    return max(longest.values(), key=lambda entry: entry[0], default=(0.0, []))
+
+
+def run_tasks(tasks: List[ScheduledTask], max_workers: int = 4) -> ScheduleReport:
+    """
+    Runs tasks on a thread pool, starting each one as soon as all of its dependencies have finished. Ready tasks are
+    submitted in their listed order, so a single worker reproduces the serial order. An exception raised by a task is
+    logged and recorded as a failure; tasks depending on it still run, as each step handles missing prerequisites
+    itself.
+
+    Parameters:
+    - tasks (List[ScheduledTask]): The tasks in their preferred serial order.
+    - max_workers (int): The maximum number of tasks running at the same time.
+
+    Returns:
+    - ScheduleReport: The per-task results and the wall, serial and critical-path times.
+    """
+    dependencies = build_dependency_graph(tasks)
+    remaining = {name: set(names) for name, names in dependencies.items()}
+    pending = list(tasks)
+    report = ScheduleReport()
+    schedule_started = time.perf_counter()
+
+    def execute(task: ScheduledTask) -> TaskResult:
+        started = time.perf_counter()
+        succeeded = True
+        try:
+            task.action()
+        except Exception as e:
+            logging.error(f"Step '{task.name}' failed: {str(e)}")
+            succeeded = False
+        return TaskResult(task.name, time.perf_counter() - started, succeeded, started - schedule_started)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        running: Dict[Future, str] = {}
+        while pending or running:
+            for task in [task for task in pending if not remaining[task.name]]:
+                pending.remove(task)
+                running[executor.submit(execute, task)] = task.name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                finished = running.pop(future)
+                report.results.append(future.result())
+                for names in remaining.values():
+                    names.discard(finished)
+
+    report.wall_time = time.perf_counter() - schedule_started
+    report.serial_time = sum(result.duration for result in report.results)
+    report.critical_path_time, report.critical_path = find_critical_path(report.results, dependencies)
+    return report
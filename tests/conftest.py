@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root and are imported as top-level modules, like the scripts import each other.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkpoint import set_checkpoint  # noqa: E402
+from undo_journal import set_journal  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def isolated_state():
+    """
+    Resets the journal and checkpoint singletons after every test, so a test that installs one does not leak it.
+    """
+    yield
+    set_journal(None)
+    set_checkpoint(None)
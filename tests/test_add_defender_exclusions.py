@@ -0,0 +1,111 @@
+import os
+import subprocess
+
+from add_defender_exclusions import (SNAPSHOT_CMDLET, compute_missing_exclusions, normalize_exclusion,
+                                     process_exclusions, read_exclusion_snapshot)
+from checkpoint import Checkpoint, set_checkpoint
+
+import pytest
+
+CURRENT = {"ExclusionPath": ["C:\\Games\\"], "ExclusionExtension": ["iso"], "ExclusionProcess": ["Game.exe"]}
+
+
+class FakeDefender:
+    """
+    Answers the snapshot command from a dictionary of current exclusions and records every other command, failing
+    the ones that mention `fail`.
+    """
+
+    def __init__(self, current=None, fail=None):
+        self.current = current or {}
+        self.fail = fail
+        self.commands = []
+
+    def __call__(self, command):
+        self.commands.append(command)
+        if command == SNAPSHOT_CMDLET:
+            return "".join(f"{name}\t{value}\n" for name, values in self.current.items() for value in values)
+        if self.fail and self.fail in command:
+            raise subprocess.CalledProcessError(1, command, "", "Access denied")
+        return ""
+
+
+def snapshot():
+    return read_exclusion_snapshot(FakeDefender(CURRENT))
+
+
+def exclusion(exclusion_type, path):
+    return {"type": exclusion_type, "path": path}
+
+
+@pytest.mark.parametrize("property_name, value, expected", [
+    ("ExclusionPath", "C:/Games/./Steam/", "c:\\games\\steam"),
+    ("ExclusionExtension", "*.ISO", "iso"),
+    ("ExclusionProcess", "Game.EXE", "game.exe"),
+    ("ExclusionProcess", "C:/Tools/app.exe", "c:\\tools\\app.exe"),
+])
+def test_normalize_exclusion(property_name, value, expected):
+    assert normalize_exclusion(property_name, value) == expected
+
+
+def test_snapshot_is_read_with_one_command():
+    runner = FakeDefender(CURRENT)
+    assert read_exclusion_snapshot(runner) == {"ExclusionPath": {"c:\\games"}, "ExclusionExtension": {"iso"},
+                                               "ExclusionProcess": {"game.exe"}}
+    assert runner.commands == [SNAPSHOT_CMDLET]
+
+
+def test_missing_exclusions_ignore_spelling_and_duplicates():
+    missing = compute_missing_exclusions([
+        exclusion("Folder", "c:\\games"),
+        exclusion("FileType", ".ISO"),
+        exclusion("Process", "game.exe"),
+        exclusion("Folder", "C:\\Repos"),
+        exclusion("Folder", "c:/repos/"),
+        exclusion("File", "C:\\Tools\\tool.exe"),
+        exclusion("FileType", "*.vhdx"),
+        exclusion("Registry", "HKLM\\Software"),
+    ], snapshot())
+    assert missing == {"ExclusionPath": ["C:\\Repos", "C:\\Tools\\tool.exe"], "ExclusionExtension": ["*.vhdx"]}
+
+
+def test_wildcard_entries_are_expanded_by_type(tmp_path):
+    for name in ("Steam", "Riot"):
+        (tmp_path / name).mkdir()
+    (tmp_path / "Steam" / "game.exe").write_text("")
+
+    missing = compute_missing_exclusions([exclusion("Folder", os.path.join(str(tmp_path), "*")),
+                                          exclusion("File", os.path.join(str(tmp_path), "*", "*.exe"))], snapshot())
+    assert sorted(missing["ExclusionPath"]) == sorted(os.path.join(str(tmp_path), *parts) for parts in (
+        ("Riot",), ("Steam",), ("Steam", "game.exe")))
+
+
+def test_missing_exclusions_are_added_with_one_command_per_type(tmp_path):
+    runner = FakeDefender(CURRENT)
+    process_exclusions({"enabled": True, "exclusions": [
+        exclusion("Folder", "C:\\Games"),
+        exclusion("Folder", "C:\\Repos"),
+        exclusion("Folder", "C:\\Bob's Files"),
+        exclusion("FileType", ".vhdx"),
+        exclusion("FileType", ".iso"),
+    ]}, runner)
+    assert runner.commands == [
+        SNAPSHOT_CMDLET,
+        "Add-MpPreference -ExclusionPath 'C:\\Repos','C:\\Bob''s Files'",
+        "Add-MpPreference -ExclusionExtension '.vhdx'",
+    ]
+
+
+def test_a_failed_batch_leaves_its_exclusions_unfinished(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"), "hash")
+    set_checkpoint(checkpoint)
+    process_exclusions({"enabled": True, "exclusions": [
+        exclusion("Folder", "C:\\Repos"), exclusion("Process", "new.exe"), exclusion("FileType", ".iso")]},
+        FakeDefender(CURRENT, fail="ExclusionProcess"))
+    assert checkpoint.completed("add_defender_exclusions") == {"Folder:C:\\Repos", "FileType:.iso"}
+
+
+def test_nothing_runs_when_disabled():
+    runner = FakeDefender(CURRENT)
+    process_exclusions({"enabled": False, "exclusions": [exclusion("Folder", "C:\\Repos")]}, runner)
+    assert runner.commands == []
@@ -0,0 +1,72 @@
+import json
+import os
+
+from checkpoint import CHECKPOINT_VERSION, Checkpoint, load_checkpoint, set_checkpoint
+from create_folders import create_folders
+from setup_runner import STEPS, is_completed, skip_completed
+
+CREATE_FOLDERS = next(step for step in STEPS if step.name == "create_folders")
+
+
+def test_markers_survive_a_reload_for_the_same_configuration(tmp_path):
+    file_path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(file_path, "hash-1")
+    checkpoint.complete("create_folders", ["a", "b"], "directory")
+    checkpoint.close()
+
+    resumed = load_checkpoint(file_path, "hash-1")
+    assert resumed.completed("create_folders") == {"a", "b"}
+    assert resumed.completed("hide_folders") == set()
+    # The observed state belongs to the run that applied the items and is not carried over.
+    assert checkpoint.observed("create_folders") == {"a": "directory", "b": "directory"}
+    assert resumed.observed("create_folders") == {}
+
+
+def test_a_checkpoint_for_another_configuration_is_ignored(tmp_path):
+    file_path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(file_path, "hash-1")
+    checkpoint.complete("create_folders", ["a"])
+    checkpoint.close()
+
+    assert load_checkpoint(file_path, "hash-2") is None
+
+
+def test_missing_unreadable_and_unsupported_files_are_ignored(tmp_path):
+    file_path = tmp_path / "checkpoint.json"
+    assert load_checkpoint(str(file_path), "hash-1") is None
+
+    file_path.write_text("{not json")
+    assert load_checkpoint(str(file_path), "hash-1") is None
+
+    file_path.write_text(json.dumps({"version": CHECKPOINT_VERSION + 1, "config": "hash-1", "completed": {}}))
+    assert load_checkpoint(str(file_path), "hash-1") is None
+
+
+def test_discard_removes_the_file_and_stops_writes(tmp_path):
+    file_path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(file_path, "hash-1")
+    checkpoint.flush()
+    assert os.path.exists(file_path)
+
+    checkpoint.discard()
+    checkpoint.close()
+    assert not os.path.exists(file_path)
+
+
+def test_a_resumed_run_skips_the_completed_folders(tmp_path):
+    paths = [str(tmp_path / "a"), str(tmp_path / "b")]
+    config_data = {"createFolders": {"enabled": True, "paths": paths}}
+    file_path = str(tmp_path / "checkpoint.json")
+    set_checkpoint(Checkpoint(file_path, "hash-1"))
+    create_folders(paths[:1], True)
+    set_checkpoint(None)
+
+    resumed = load_checkpoint(file_path, "hash-1")
+    plan, restricted = skip_completed([CREATE_FOLDERS], config_data, resumed)
+    assert plan == [CREATE_FOLDERS]
+    assert restricted["createFolders"]["paths"] == paths[1:]
+    assert not is_completed([CREATE_FOLDERS], config_data, resumed)
+
+    resumed.complete("create_folders", paths[1:])
+    assert skip_completed([CREATE_FOLDERS], config_data, resumed)[0] == []
+    assert is_completed([CREATE_FOLDERS], config_data, resumed)
@@ -0,0 +1,114 @@
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import command_runner
+from command_runner import CommandRunner, run_command, set_runner, tool_name
+
+import pytest
+
+PYTHON = sys.executable
+TOOL = tool_name([PYTHON])
+# Marks itself as running in a directory, waits, and prints how many commands were running at that moment.
+CONCURRENT = ("import os, sys, time; path = os.path.join(sys.argv[1], str(os.getpid())); open(path, 'w').close(); "
+              "time.sleep(0.2); print(len(os.listdir(sys.argv[1]))); os.remove(path)")
+# Appends a line to a file and exits with the status given for that attempt, e.g. '3,0' fails once with status 3.
+COUNTED = ("import sys; file = open(sys.argv[1], 'a+'); file.write('x'); file.seek(0); attempt = len(file.read()); "
+           "codes = sys.argv[2].split(','); sys.exit(int(codes[min(attempt, len(codes)) - 1]))")
+
+
+def python(code, *arguments):
+    return [PYTHON, "-c", code, *map(str, arguments)]
+
+
+def launches(counter):
+    return len(counter.read_text()) if counter.exists() else 0
+
+
+@pytest.fixture
+def runner():
+    runner = CommandRunner(global_limit=8, tool_limits={}, timeout=10.0, retries=0, backoff=0.01)
+    yield runner
+    runner.close()
+
+
+@pytest.mark.parametrize("global_limit, tool_limits, cap", [(2, {}, 2), (8, {TOOL: 1}, 1)])
+def test_concurrency_caps(tmp_path, global_limit, tool_limits, cap):
+    runner = CommandRunner(global_limit=global_limit, tool_limits=tool_limits)
+    try:
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(executor.map(lambda _: runner.run(python(CONCURRENT, tmp_path)), range(6)))
+    finally:
+        runner.close()
+    assert all(result.returncode == 0 for result in results)
+    assert max(int(result.stdout) for result in results) <= cap
+
+
+def test_timeout_kills_the_process(runner):
+    started = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired) as raised:
+        runner.run(python("import time; time.sleep(30)"), timeout=0.2)
+    assert time.monotonic() - started < 5
+    assert raised.value.launches == 1
+
+
+def test_timeouts_are_retried(runner):
+    with pytest.raises(subprocess.TimeoutExpired) as raised:
+        runner.run(python("import time; time.sleep(30)"), timeout=0.2, retries=1)
+    assert raised.value.launches == 2
+
+
+def test_transient_statuses_are_retried_with_jittered_backoff(tmp_path, runner, monkeypatch):
+    jitter = []
+    monkeypatch.setattr(command_runner.random, "uniform", lambda low, high: jitter.append((low, high)) or high)
+    counter = tmp_path / "counter"
+
+    result = runner.run(python(COUNTED, counter, "3,3,0"), retries=2, transient_codes=[3])
+    assert (result.returncode, result.launches, launches(counter)) == (0, 3, 3)
+    assert jitter == [(0.5, 1.5)] * 2
+
+    counter.unlink()
+    result = runner.run(python(COUNTED, counter, "3"), retries=1, transient_codes=[3])
+    assert (result.returncode, result.launches) == (3, 2)
+    counter.unlink()
+    assert runner.run(python(COUNTED, counter, "4,0"), retries=1, transient_codes=[3]).returncode == 4
+
+
+def test_read_only_results_are_memoized_until_the_tool_changes_state(tmp_path, runner):
+    counter = tmp_path / "counter"
+    command = python(COUNTED, counter, "0")
+
+    assert runner.run(command, read_only=True).launches == 1
+    assert runner.run(command, read_only=True).launches == 0
+    assert runner.run(command, read_only=True, memoize=False).launches == 1
+    assert runner.run(command, read_only=True).launches == 0
+    runner.run(python("pass"))
+    assert runner.run(command, read_only=True).launches == 1
+    assert launches(counter) == 3
+
+
+def test_failed_read_only_results_are_not_memoized(tmp_path, runner):
+    counter = tmp_path / "counter"
+    command = python(COUNTED, counter, "1")
+    assert [runner.run(command, read_only=True).launches for _ in range(2)] == [1, 1]
+
+
+def test_concurrent_identical_reads_share_one_process(tmp_path, runner):
+    counter = tmp_path / "counter"
+    command = python(COUNTED + "; import time; time.sleep(0.3)", counter, "0")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: runner.run(command, read_only=True), range(4)))
+    assert sorted(result.launches for result in results) == [0, 0, 0, 1]
+    assert launches(counter) == 1
+
+
+def test_run_command_raises_on_failure(runner):
+    set_runner(runner)
+    try:
+        assert run_command(python("print('out')")) == "out\n"
+        with pytest.raises(subprocess.CalledProcessError) as raised:
+            run_command(python("import sys; sys.stderr.write('err'); sys.exit(2)"))
+        assert (raised.value.returncode, raised.value.stderr) == (2, "err")
+    finally:
+        set_runner(None)
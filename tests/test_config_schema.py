@@ -0,0 +1,113 @@
+import copy
+import json
+import os
+
+from config_schema import (FolderSection, compile_config, decode_records, encode_records, load_config,
+                           report_errors)
+
+import pytest
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.json")
+
+
+@pytest.fixture
+def config_data():
+    with open(CONFIG_FILE, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def test_shipped_configuration_is_valid(config_data):
+    compiled = compile_config(config_data)
+    assert compiled.errors == {}
+    assert set(compiled.sections) == set(config_data)
+
+
+def test_errors_name_the_json_path_and_keep_other_sections(config_data):
+    data = copy.deepcopy(config_data)
+    del data["createFolders"]
+    data["hideFolders"]["enabled"] = "yes"
+    data["hideFolders"]["maxDepth"] = -1
+    data["servicesSettings"]["services"] = [{"name": "Svc", "startupType": "Automatic"}]
+    data["localeSettings"]["formatOptions"] = {"s Date": {"value": 1}}
+
+    compiled = compile_config(data)
+    assert compiled.errors == {
+        "createFolders": ["$.createFolders: missing section"],
+        "hideFolders": ["$.hideFolders.enabled: expected a boolean, got str 'yes'",
+                        "$.hideFolders.maxDepth: expected at least 0, got -1"],
+        "localeSettings": ["$.localeSettings.formatOptions['s Date'].value: expected a string, got int 1"],
+        "servicesSettings": ["$.servicesSettings.services[0]: missing required key 'serviceStatus'"],
+    }
+    assert set(compiled.sections) == {"excludeFromDefender", "registryTweaks"}
+
+
+def test_choices_are_matched_exactly_unless_the_step_normalizes_them(config_data):
+    data = copy.deepcopy(config_data)
+    data["servicesSettings"]["services"] = [{"name": "Svc", "startupType": "automatic", "serviceStatus": "START"}]
+    data["excludeFromDefender"]["exclusions"] = [{"type": "folder", "path": "C:\\Games"}]
+    data["registryTweaks"]["tweaks"] = [{"hive": "hkcu", "key": "Software\\Example", "name": "Value",
+                                         "type": "reg_dword", "value": 1}]
+
+    compiled = compile_config(data)
+    assert compiled.errors["servicesSettings"] == [
+        "$.servicesSettings.services[0].startupType: expected one of Automatic, Manual, Disabled, "
+        "Automatic (Delayed Start), got 'automatic'"]
+    assert compiled.errors["excludeFromDefender"] == [
+        "$.excludeFromDefender.exclusions[0].type: expected one of Folder, File, FileType, Process, got 'folder'"]
+    tweak = compiled.sections["registryTweaks"].tweaks[0]
+    assert (tweak.hive, tweak.value_type) == ("HKCU", 4)
+
+
+def test_tweak_values_are_checked_against_their_type(config_data):
+    data = copy.deepcopy(config_data)
+    data["registryTweaks"]["tweaks"] = [{"hive": "HKCU", "key": "Software\\Example", "name": "Value",
+                                         "type": "DWORD", "value": "one"}]
+
+    errors = compile_config(data).errors["registryTweaks"]
+    assert len(errors) == 1 and errors[0].startswith("$.registryTweaks.tweaks[0]: ")
+
+
+def test_report_errors_only_reports_the_used_sections(config_data):
+    data = copy.deepcopy(config_data)
+    data["createFolders"]["paths"] = "C:\\Games"
+    compiled = compile_config(data)
+    assert report_errors(compiled, ["createFolders"])
+    assert not report_errors(compiled, ["hideFolders"])
+
+
+def test_records_round_trip_through_the_cache_encoding(config_data):
+    sections = compile_config(config_data).sections
+    assert decode_records(json.loads(json.dumps(encode_records(sections)))) == sections
+    values = {"data": b"\x00\xff", "pair": (1, 2)}
+    assert decode_records(encode_records(values)) == values
+
+
+@pytest.mark.parametrize("value, message", [
+    ({"record": "Popen", "fields": {"args": "calc"}}, "unknown record type 'Popen'"),
+    ({"__class__": "FolderSection"}, "unexpected cached value"),
+])
+def test_decode_records_rejects_unknown_values(value, message):
+    with pytest.raises(ValueError, match=message):
+        decode_records(value)
+
+
+def test_load_config_uses_and_ignores_the_cache(tmp_path, config_data):
+    config_file, cache_file = str(tmp_path / "config.json"), str(tmp_path / "cache.json")
+    with open(config_file, "w", encoding="utf-8") as file:
+        json.dump(config_data, file)
+
+    first = load_config(config_file, cache_file)
+    assert os.path.exists(cache_file)
+    assert load_config(config_file, cache_file).sections == first.sections
+
+    with open(cache_file, "w", encoding="utf-8") as file:
+        json.dump({"key": "stale", "sections": {}, "errors": {}}, file)
+    assert load_config(config_file, cache_file).sections == first.sections
+    assert isinstance(first.sections["createFolders"], FolderSection)
+
+
+def test_load_config_rejects_unreadable_files(tmp_path):
+    (tmp_path / "list.json").write_text("[]")
+    (tmp_path / "broken.json").write_text("{")
+    for name in ("list.json", "broken.json", "missing.json"):
+        assert load_config(str(tmp_path / name), None) is None
@@ -0,0 +1,71 @@
+import os
+
+from fs_engine import (FILE_ATTRIBUTE_DIRECTORY, FILE_ATTRIBUTE_HIDDEN, FILE_ATTRIBUTE_READONLY,
+                       FILE_ATTRIBUTE_SYSTEM, MemoryAttributeBackend, create_directories, group_by_root,
+                       hide_directories, hide_directory, normalize_path, unhide_directory)
+
+
+def test_hiding_adds_the_hidden_bit_to_the_existing_ones(tmp_path):
+    folder = str(tmp_path)
+    initial = FILE_ATTRIBUTE_DIRECTORY | FILE_ATTRIBUTE_READONLY | FILE_ATTRIBUTE_SYSTEM
+    backend = MemoryAttributeBackend({folder: initial})
+
+    assert hide_directory(folder, backend) == "hidden"
+    assert backend.attributes[normalize_path(folder)] == initial | FILE_ATTRIBUTE_HIDDEN
+    assert (backend.reads, backend.writes) == (1, 1)
+
+    assert hide_directory(folder, backend) == "already-hidden"
+    assert (backend.reads, backend.writes) == (2, 1)
+
+
+def test_unhiding_clears_only_the_hidden_bit(tmp_path):
+    folder = str(tmp_path)
+    backend = MemoryAttributeBackend({folder: FILE_ATTRIBUTE_DIRECTORY | FILE_ATTRIBUTE_READONLY
+                                      | FILE_ATTRIBUTE_HIDDEN})
+
+    assert unhide_directory(folder, backend) == "unhidden"
+    assert backend.attributes[normalize_path(folder)] == FILE_ATTRIBUTE_DIRECTORY | FILE_ATTRIBUTE_READONLY
+    assert unhide_directory(folder, backend) == "already-visible"
+    assert backend.writes == 1
+
+
+def test_missing_directories_are_reported_without_writes(tmp_path):
+    backend = MemoryAttributeBackend()
+    assert hide_directory(str(tmp_path / "absent"), backend) == "missing"
+    assert unhide_directory(str(tmp_path / "absent"), backend) == "missing"
+    assert backend.writes == 0
+
+
+def test_hide_directories_deduplicates_and_reports_completed_paths(tmp_path, monkeypatch):
+    for name in ("one", "two"):
+        (tmp_path / name).mkdir()
+    monkeypatch.setenv("SETUP_TEST_ROOT", str(tmp_path))
+    backend = MemoryAttributeBackend()
+    done = []
+
+    paths = [os.path.join("$SETUP_TEST_ROOT", "one"), str(tmp_path / "one"), str(tmp_path / "two"),
+             str(tmp_path / "three")]
+    outcomes = hide_directories(paths, backend, workers=2, on_done=done.append)
+
+    assert outcomes == {str(tmp_path / "one"): "hidden", str(tmp_path / "two"): "hidden",
+                        str(tmp_path / "three"): "missing"}
+    assert sorted(done) == [str(tmp_path / "one"), str(tmp_path / "two")]
+    assert backend.writes == 2
+
+
+def test_create_directories_creates_shared_parents_once(tmp_path):
+    paths = [str(tmp_path / "a" / "b"), str(tmp_path / "a" / "c"), str(tmp_path / "d"), str(tmp_path / "d")]
+
+    outcomes = create_directories(paths, workers=2)
+
+    assert outcomes == {paths[0]: "created", paths[1]: "created", paths[2]: "created"}
+    assert all(os.path.isdir(path) for path in paths)
+    assert create_directories(paths) == {paths[0]: "exists", paths[1]: "exists", paths[2]: "exists"}
+
+
+def test_group_by_root_keeps_subtrees_together_parents_first(tmp_path):
+    paths = [str(tmp_path / "a" / "b"), str(tmp_path / "d"), str(tmp_path / "a")]
+
+    groups = group_by_root(paths)
+
+    assert sorted(groups) == sorted([[str(tmp_path / "a"), str(tmp_path / "a" / "b")], [str(tmp_path / "d")]])
@@ -0,0 +1,73 @@
+import json
+
+from inventory import Difference, diff_records, diff_snapshots, read_snapshot, satisfies, write_snapshot
+
+import pytest
+
+BASELINE = [
+    ("create_folders", "c:\\games", "exists"),
+    ("set_services", "Svc", {"startupType": "auto", "status": "running"}),
+    ("set_services", "Telemetry", {"startupType": "disabled", "status": "stopped"}),
+]
+CURRENT = [
+    ("create_folders", "c:\\games", "exists"),
+    ("create_folders", "c:\\tools", "exists"),
+    ("set_services", "Svc", {"startupType": "demand", "status": "running"}),
+]
+
+
+def test_snapshot_round_trips_through_a_file(tmp_path):
+    snapshot = str(tmp_path / "host.jsonl")
+    write_snapshot(snapshot, BASELINE)
+
+    with open(snapshot, "r", encoding="utf-8") as file:
+        header = json.loads(file.readline())
+    assert header["version"] == 1 and header["records"] == 3
+    assert [tuple(record) for record in read_snapshot(snapshot)] == BASELINE
+    assert [record[1] for record in read_snapshot(snapshot, {"set_services"})] == ["Svc", "Telemetry"]
+
+
+@pytest.mark.parametrize("content, message", [
+    ("", "is not a version 1 snapshot"),
+    ('{"version": 2}\n', "is not a version 1 snapshot"),
+    ('{"version": 1}\n["a", "x", 1]\nnot json\n', "Invalid record on line 3"),
+    ('{"version": 1}\n["a", "x"]\n', "Invalid record on line 2"),
+    ('{"version": 1}\n["b", "x", 1]\n["a", "x", 1]\n', "not sorted at line 3"),
+])
+def test_read_snapshot_rejects_invalid_files(tmp_path, content, message):
+    snapshot = tmp_path / "bad.jsonl"
+    snapshot.write_text(content)
+    with pytest.raises(ValueError, match=message):
+        list(read_snapshot(str(snapshot)))
+
+
+def test_diff_records_merges_sorted_streams():
+    assert list(diff_records(BASELINE, CURRENT)) == [
+        Difference("create_folders", "c:\\tools", "added", None, "exists"),
+        Difference("set_services", "Svc", "changed", BASELINE[1][2], CURRENT[2][2]),
+        Difference("set_services", "Telemetry", "removed", BASELINE[2][2], None),
+    ]
+    assert list(diff_records(iter(BASELINE), iter(BASELINE))) == []
+    assert [difference.change for difference in diff_records([], CURRENT)] == ["added"] * 3
+
+
+def test_satisfies_compares_only_the_desired_settings():
+    actual = {"startupType": "auto", "status": "running"}
+    assert satisfies(actual, {"startupType": "auto"})
+    assert not satisfies(actual, {"status": "stopped"})
+    assert satisfies("exists", "exists") and not satisfies("missing", "exists")
+    desired = [("set_services", "Svc", {"status": "running"})]
+    assert list(diff_records([CURRENT[2]], desired, satisfies)) == []
+
+
+def test_diff_snapshots_counts_differences_and_skips_unreadable_files(tmp_path, capsys):
+    baseline, current, broken = (str(tmp_path / name) for name in ("baseline.jsonl", "current.jsonl", "broken.jsonl"))
+    write_snapshot(baseline, BASELINE)
+    write_snapshot(current, CURRENT)
+    (tmp_path / "broken.jsonl").write_text("not a snapshot\n")
+
+    assert diff_snapshots([current, broken, str(tmp_path / "missing.jsonl")], baseline=baseline) == 3
+    assert "3 difference(s)." in capsys.readouterr().out
+
+    desired = [("set_services", "Svc", {"startupType": "auto"})]
+    assert diff_snapshots([current], desired=desired) == 1
@@ -0,0 +1,10 @@
+from metrics import percentile
+
+
+def test_percentile_uses_the_nearest_rank():
+    assert percentile(list(range(1, 101)), 0.95) == 95
+    assert percentile(list(range(20, 0, -1)), 0.95) == 19
+    assert percentile(list(range(1, 101)), 0.5) == 50
+    assert percentile([3.0, 1.0], 0.5) == 1.0
+    assert percentile([7.0], 0.0) == 7.0
+    assert percentile([1.0, 2.0], 1.0) == 2.0
@@ -0,0 +1,117 @@
+import os
+
+from path_patterns import (PathPattern, covering_patterns, is_pattern, pattern_fingerprint, pattern_options,
+                           walk_pattern, walk_patterns)
+
+import pytest
+
+DIRECTORIES = ["Games/Steam/steamapps/common", "Games/Steam/node_modules/cache", "Games/Riot/Config", "Games/[Backup]",
+               "Games/B", "Other/deep/a/b/c"]
+FILES = ["Games/Steam/config.vdf", "Games/Riot/Config/game.cfg"]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for directory in DIRECTORIES:
+        (tmp_path / directory).mkdir(parents=True)
+    for file in FILES:
+        (tmp_path / file).write_text("")
+    return tmp_path
+
+
+def walk(root, pattern, **options):
+    """
+    Walks a pattern written with '/' below `root` and returns the matches relative to it, sorted.
+    """
+    return sorted(os.path.relpath(path, root) for path in walk_pattern(os.path.join(str(root), pattern), **options))
+
+
+def test_is_pattern_treats_brackets_literally_unless_enabled():
+    assert is_pattern("C:\\Games\\*") and is_pattern("C:\\Games\\Steam?") and is_pattern("C:\\**\\Saves")
+    assert not is_pattern("C:\\Games\\[Backup]")
+    assert is_pattern("C:\\Games\\[Backup]", brackets=True)
+    assert not is_pattern("C:\\Games\\[Backup", brackets=True)
+
+
+def test_pattern_root_is_the_literal_prefix():
+    pattern = PathPattern(os.path.join(os.sep, "Games", "[Backup]", "*", "Saves"))
+    assert pattern.root == os.path.join(os.sep, "Games", "[Backup]")
+    assert pattern.segments == ["*", "Saves"]
+
+
+def test_recursive_segments_match_any_number_of_levels(tree):
+    assert walk(tree, "**/common") == ["Games/Steam/steamapps/common"]
+    assert walk(tree, "Games/**/Config") == ["Games/Riot/Config"]
+    assert walk(tree, "Other/**") == ["Other", "Other/deep", "Other/deep/a", "Other/deep/a/b", "Other/deep/a/b/c"]
+
+
+def test_files_and_directories_are_selected_separately(tree):
+    assert walk(tree, "Games/Steam/*") == ["Games/Steam/node_modules", "Games/Steam/steamapps"]
+    assert walk(tree, "Games/**/*.*", include_files=True, include_directories=False) == [
+        "Games/Riot/Config/game.cfg", "Games/Steam/config.vdf"]
+
+
+def test_brackets_are_literal_unless_enabled(tree):
+    assert walk(tree, "Games/[B*") == ["Games/[Backup]"]
+    assert walk(tree, "Games/[B]*") == []
+    assert walk(tree, "Games/[B]*", brackets=True) == ["Games/B"]
+    assert walk(tree, "Games/[[]B*", brackets=True) == ["Games/[Backup]"]
+
+
+def test_subtrees_that_cannot_match_are_not_entered(tree, monkeypatch):
+    scanned = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: scanned.append(os.path.relpath(path, tree)) or scandir(path))
+
+    assert walk(tree, "*/Steam") == ["Games/Steam"]
+    assert sorted(scanned) == [".", "Games", "Other"]
+
+
+def test_max_depth_limits_the_levels_below_the_root(tree):
+    assert walk(tree, "**", max_depth=1) == [".", "Games", "Other"]
+    assert walk(tree, "Other/**", max_depth=2) == ["Other", "Other/deep", "Other/deep/a"]
+    assert walk(tree, "**/common", max_depth=3) == []
+
+
+def test_excludes_prune_by_name_or_by_path(tree):
+    assert walk(tree, "Games/Steam/**", exclude=["node_*"]) == [
+        "Games/Steam", "Games/Steam/steamapps", "Games/Steam/steamapps/common"]
+    excluded = os.path.join(str(tree), "Games", "Riot")
+    assert "Games/Riot/Config" not in walk(tree, "Games/**", exclude=[excluded])
+    assert "Games/Steam" in walk(tree, "Games/**", exclude=[excluded])
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_walk_patterns_yields_every_match_once(tree, workers):
+    patterns = [os.path.join(str(tree), pattern) for pattern in ("Games/**", "Games/Steam/*", "Other/*", "*")]
+    found = [os.path.relpath(path, tree) for path in walk_patterns(patterns, workers=workers)]
+    expected = {path for pattern in ("Games/**", "Games/Steam/*", "Other/*", "*") for path in walk(tree, pattern)}
+    assert len(found) == len(set(found))
+    assert set(found) == expected
+
+
+def test_covering_patterns_relate_overlapping_roots(tree):
+    (tree / "Link").symlink_to(tree / "Games")
+    games, steam, other, everything, linked = (PathPattern(os.path.join(str(tree), pattern)) for pattern in (
+        "Games/**", "Games/Steam/*", "Other/*", "*", "Link/Steam/*"))
+
+    covering = covering_patterns([games, steam, other, everything, linked])
+    assert covering[:4] == [[], [games], [], [games, steam, other]]
+    # Below a symbolic link the earlier walks never descend, so the linked pattern is not covered by '*'.
+    assert covering[4] == []
+
+
+def test_fingerprint_changes_when_a_match_appears(tree):
+    pattern = os.path.join(str(tree), "Games", "*")
+    before = pattern_fingerprint(pattern)
+    assert pattern_fingerprint(pattern) == before
+    (tree / "Games" / "New").mkdir()
+    os.utime(tree / "Games", ns=(0, 0))
+    assert pattern_fingerprint(pattern) != before
+    assert pattern_fingerprint(os.path.join(str(tree), "Missing", "*")) == "missing"
+
+
+def test_pattern_options_reads_the_section_settings():
+    assert pattern_options({}) == {"exclude": [], "max_depth": None, "brackets": False}
+    assert pattern_options({"exclude": ["tmp"], "maxDepth": 2, "matchBrackets": True}) == {
+        "exclude": ["tmp"], "max_depth": 2, "brackets": True}
@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+
+import powershell_host
+from add_defender_exclusions import SNAPSHOT_CMDLET
+from powershell_host import PowerShellSession
+
+import pytest
+
+FAKE_POWERSHELL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks",
+                               "fake_powershell.py")
+
+
+@pytest.fixture
+def session():
+    session = PowerShellSession([sys.executable, FAKE_POWERSHELL], timeout=10.0)
+    yield session
+    session.close()
+
+
+def test_output_is_framed_per_command(session):
+    assert session.run("Add-MpPreference -ExclusionPath 'C:\\Games', 'C:\\Bob''s Tools'") == ""
+    assert session.run("Add-MpPreference -ExclusionExtension '.iso'") == ""
+    assert session.run(SNAPSHOT_CMDLET) == ("ExclusionPath\tC:\\Games\nExclusionPath\tC:\\Bob's Tools\n"
+                                            "ExclusionExtension\t.iso\n")
+    assert session.run("Set-Location C:\\") == ""
+    assert session.restarts == 0
+
+
+def test_errors_raise_with_the_error_output_and_keep_the_session(session):
+    with pytest.raises(subprocess.CalledProcessError) as raised:
+        session.run("throw 'Access denied'")
+    assert (raised.value.returncode, raised.value.stderr) == (1, "Access denied")
+    assert session.run("Set-Location C:\\") == ""
+    assert session.restarts == 0
+
+
+def test_a_command_exceeding_its_timeout_kills_the_interpreter(session):
+    session.run("Set-Location C:\\")
+    process = session._process
+    with pytest.raises(subprocess.TimeoutExpired):
+        session.run("Start-Sleep -Seconds 30", timeout=0.3)
+    assert process.poll() is not None
+
+    assert session.run("Set-Location C:\\") == ""
+    assert session.restarts == 1
+
+
+def test_the_interpreter_is_restarted_after_a_crash(session):
+    session.run("Add-MpPreference -ExclusionProcess 'game.exe'")
+    with pytest.raises(subprocess.CalledProcessError) as raised:
+        session.run("Stop-Process -Id $PID")
+    assert raised.value.stderr == "PowerShell session exited unexpectedly."
+
+    # The restarted interpreter starts with an empty preference store.
+    assert session.run(SNAPSHOT_CMDLET) == ""
+    assert session.restarts == 1
+
+
+def test_latencies_cover_every_command_and_keep_a_bounded_history(monkeypatch):
+    monkeypatch.setattr(powershell_host, "LATENCY_HISTORY", 2)
+    monkeypatch.setenv("FAKE_POWERSHELL_LATENCY", "0.05")
+    session = PowerShellSession([sys.executable, FAKE_POWERSHELL])
+    assert session.latency_summary() == "No PowerShell commands were executed."
+    try:
+        for index in range(3):
+            session.run(f"Set-Location C:\\{index}")
+    finally:
+        session.close()
+
+    assert [command for command, _ in session.latencies] == ["Set-Location C:\\1", "Set-Location C:\\2"]
+    assert session.commands == 3
+    assert 0.15 <= session.total_latency and 0.05 <= session.max_latency <= session.total_latency
+    assert session.latency_summary().startswith("3 PowerShell command(s), total ")
+    assert session.latency_summary().endswith(", 0 restart(s)")
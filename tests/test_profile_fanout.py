@@ -0,0 +1,117 @@
+import json
+import os
+
+from fs_engine import FILE_ATTRIBUTE_HIDDEN, MemoryAttributeBackend, set_attribute_backend
+from profile_fanout import (HIVE_FILE, DirectoryProfileSource, JsonHiveAccess, Profile, apply_to_profile, fan_out,
+                            profile_sections)
+from registry_backend import REG_SZ
+from set_locales import KEY_PATH
+from undo_journal import read_journal
+
+import pytest
+
+SECTIONS = {
+    "create_folders": {"enabled": True, "paths": [r"%USERPROFILE%/Games", r"%APPDATA%/Tools"]},
+    "hide_folders": {"enabled": True, "paths": [r"%USERPROFILE%/Games"]},
+    "set_locales": {"enabled": True, "formatOptions": {"sShortDate": {"enabled": True, "value": "yyyy-MM-dd"},
+                                                       "sTimeFormat": {"enabled": True, "value": "HH:mm:ss"}}},
+}
+
+
+def use_memory_attributes() -> None:
+    """
+    Installs an in-memory attribute backend in a worker process.
+    """
+    set_attribute_backend(MemoryAttributeBackend())
+
+
+def make_profile(root, name: str, with_hive: bool = True) -> Profile:
+    """
+    Creates a profile directory, with a hive file holding the locale key unless `with_hive` is False.
+    """
+    home = root / name
+    home.mkdir()
+    if with_hive:
+        (home / HIVE_FILE).write_text(json.dumps({KEY_PATH: {"sShortDate": ["M/d/yyyy", REG_SZ],
+                                                             "sTimeFormat": ["HH:mm:ss", REG_SZ]}}))
+    return Profile(name, str(home))
+
+
+def read_locale_key(profile: Profile) -> dict:
+    """
+    Returns the values of the locale key saved in a profile's hive file; key paths are stored in lower case.
+    """
+    with open(os.path.join(profile.home, HIVE_FILE), "r", encoding="utf-8") as file:
+        return json.load(file)[KEY_PATH.lower()]
+
+
+@pytest.fixture
+def attributes():
+    backend = MemoryAttributeBackend()
+    set_attribute_backend(backend)
+    yield backend
+    set_attribute_backend(None)
+
+
+def test_profile_sections_expands_per_user_variables_case_insensitively():
+    profile = Profile("alice", os.path.join("home", "alice"))
+    sections = profile_sections({"create_folders": {"enabled": True, "paths": ["%userprofile%/a", "%AppData%/b", ""]},
+                                 "set_locales": {"enabled": True, "formatOptions": {}}}, profile)
+    assert sections["create_folders"]["paths"] == [os.path.join("home", "alice") + "/a",
+                                                   os.path.join("home", "alice", "AppData", "Roaming") + "/b", ""]
+    assert sections["set_locales"] == {"enabled": True, "formatOptions": {}}
+
+
+def test_directory_profile_source_skips_shared_and_hidden_profiles(tmp_path):
+    for name in ("bob", "Alice", "Public", "Default User", ".cache"):
+        (tmp_path / name).mkdir()
+    (tmp_path / "desktop.ini").write_text("")
+
+    profiles = DirectoryProfileSource(str(tmp_path), {"ALICE": "S-1-5-21-1"}).profiles()
+    assert [(profile.name, profile.hive_root) for profile in profiles] == [("Alice", "S-1-5-21-1"), ("bob", None)]
+
+
+def test_apply_to_profile_runs_every_per_user_step(tmp_path, attributes):
+    profile = make_profile(tmp_path, "alice")
+
+    report = apply_to_profile(profile, SECTIONS, JsonHiveAccess())
+    assert report.error is None
+    assert report.outcomes == {"create_folders": {"created": 2}, "hide_folders": {"hidden": 1},
+                               "set_locales": {"changed": 1, "unchanged": 1}}
+    games = os.path.join(profile.home, "Games")
+    assert os.path.isdir(os.path.join(profile.home, "AppData", "Roaming", "Tools"))
+    assert attributes.get_attributes(games) & FILE_ATTRIBUTE_HIDDEN
+    assert read_locale_key(profile)["sShortDate"] == ["yyyy-MM-dd", REG_SZ]
+
+
+def test_apply_to_profile_skips_the_locale_step_without_a_hive(tmp_path, attributes):
+    profile = make_profile(tmp_path, "bob", with_hive=False)
+
+    report = apply_to_profile(profile, {"set_locales": SECTIONS["set_locales"]}, JsonHiveAccess())
+    assert report.outcomes == {"set_locales": {"no-hive": 2}}
+    assert not os.path.exists(os.path.join(profile.home, HIVE_FILE))
+
+
+def test_fan_out_reports_every_profile_and_merges_the_worker_journals(tmp_path):
+    profiles_root = tmp_path / "Users"
+    profiles_root.mkdir()
+    profiles = [make_profile(profiles_root, "alice"), make_profile(profiles_root, "bob", with_hive=False),
+                make_profile(profiles_root, "carol")]
+    journal_path = str(tmp_path / "journal.jsonl")
+
+    reports = fan_out(SECTIONS, profiles, JsonHiveAccess(), workers=2, journal_path=journal_path, run_id="run-1",
+                      setup=use_memory_attributes)
+    assert [report.profile for report in reports] == ["alice", "bob", "carol"]
+    assert all(report.error is None for report in reports)
+    assert reports[1].outcomes["set_locales"] == {"no-hive": 2}
+    assert read_locale_key(profiles[2])["sShortDate"] == ["yyyy-MM-dd", REG_SZ]
+
+    records = list(read_journal(journal_path))
+    assert {record["run"] for record in records} == {"run-1"}
+    assert sum(1 for record in records if record["kind"] == "directory") == 12
+    assert sum(1 for record in records if record["kind"] == "registry") == 2
+    assert sorted(os.listdir(tmp_path)) == ["Users", "journal.jsonl"]
+
+
+def test_fan_out_without_profiles_starts_no_workers():
+    assert fan_out(SECTIONS, [], JsonHiveAccess()) == []
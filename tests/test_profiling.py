@@ -0,0 +1,25 @@
+import json
+import threading
+
+import profiling
+
+
+def test_reports_say_that_only_the_step_thread_is_profiled(tmp_path):
+    directory = str(tmp_path / "profile")
+    profiling.enable(directory)
+    try:
+        with profiling.profile_step("threads"):
+            worker = threading.Thread(target=sum, args=(range(1000),))
+            worker.start()
+            worker.join()
+        report = profiling.write_report(startup=False)
+    finally:
+        profiling.disable()
+
+    assert report["notes"] == [profiling.THREAD_NOTE]
+    assert set(report["steps"]) == {"threads"}
+    with open(tmp_path / "profile" / "profile.json", encoding="utf-8") as file:
+        assert json.load(file)["notes"] == [profiling.THREAD_NOTE]
+    with open(tmp_path / "profile" / "threads.txt", encoding="utf-8") as file:
+        assert file.readline().strip() == profiling.THREAD_NOTE
+    assert (tmp_path / "profile" / "threads.prof").exists()
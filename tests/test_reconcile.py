@@ -0,0 +1,59 @@
+from add_defender_exclusions import compute_exclusion_changes
+from reconcile import Allowlist, managed_items, reconcile_sets
+
+
+def test_allowlist_matches_literals_and_patterns_after_normalizing():
+    allowlist = Allowlist(["C:\\Keep", "", "C:\\Tools\\*", "*.LOG"], str.lower)
+
+    assert allowlist.literals == {"c:\\keep"}
+    assert "c:\\keep" in allowlist
+    assert "c:\\tools\\bin" in allowlist
+    assert "debug.log" in allowlist
+    assert "c:\\keeper" not in allowlist
+    assert "C:\\Keep" not in allowlist
+
+
+def test_reconcile_sets_splits_the_differences():
+    desired = {"a": "A", "b": "B", "c": "C"}
+    current = {"b": "B", "x": "X", "y": "Y", "tmp1": "Tmp1"}
+
+    missing, removed, kept = reconcile_sets(desired, current, Allowlist(["y", "tmp*"], str.lower))
+
+    assert missing == ["A", "C"]
+    assert removed == ["X"]
+    assert kept == ["Y", "Tmp1"]
+
+
+def test_reconcile_sets_with_matching_sets_changes_nothing():
+    entries = {"a": "A"}
+    assert reconcile_sets(entries, dict(entries), Allowlist([], str.lower)) == ([], [], [])
+
+
+def test_managed_items_keeps_the_first_record_until_it_is_pruned():
+    records = [
+        {"path": "C:\\A", "previous": 1},
+        {"path": "c:\\a", "previous": 2},
+        {"path": "C:\\B", "previous": 1},
+        {"path": "C:\\B", "pruned": True},
+        {"path": "C:\\C", "previous": 1},
+        {"path": "C:\\C", "pruned": True},
+        {"path": "C:\\C", "previous": 3},
+    ]
+
+    managed = managed_items(records, lambda record: record["path"].lower())
+
+    assert managed == {"c:\\a": {"path": "C:\\A", "previous": 1}, "c:\\c": {"path": "C:\\C", "previous": 3}}
+
+
+def test_defender_allowlist_is_normalized_per_property():
+    state = {"ExclusionPath": {"c:\\games": "C:\\Games\\", "c:\\vendor\\agent": "C:\\Vendor\\Agent",
+                               "c:\\old": "C:\\Old"},
+             "ExclusionExtension": {"iso": "iso", "tmp": "tmp"},
+             "ExclusionProcess": {}}
+    exclusions = [{"type": "Folder", "path": "C:\\Games"}, {"type": "FileType", "path": "*.vhdx"}]
+
+    missing, removed, kept = compute_exclusion_changes(exclusions, state, ["C:/Vendor/*", ".TMP"])
+
+    assert missing == {"ExclusionPath": [], "ExclusionExtension": ["*.vhdx"], "ExclusionProcess": []}
+    assert removed == {"ExclusionPath": ["C:\\Old"], "ExclusionExtension": ["iso"], "ExclusionProcess": []}
+    assert kept == 2
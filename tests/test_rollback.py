@@ -0,0 +1,115 @@
+import json
+import os
+
+from create_folders import create_folders
+from fs_engine import FILE_ATTRIBUTE_HIDDEN, MemoryAttributeBackend, set_attribute_backend
+from hide_folders import hide_folders
+from registry_backend import HKEY_CURRENT_USER, REG_BINARY, REG_DWORD, MemoryRegistry, set_default_registry
+from rollback import collect_undo, rollback, select_runs
+from service_control import SimulatedService, SimulatedServiceController
+from set_registry_tweaks import apply_registry_tweaks
+from set_services import modify_windows_services, set_default_controller
+from undo_journal import (UndoJournal, merge_worker_journals, read_journal, record_registry_values, set_journal,
+                          worker_journal_path)
+
+import pytest
+
+KEY = r"Software\Example"
+
+
+@pytest.fixture
+def backends():
+    """
+    Installs in-memory registry, attribute and service backends as the defaults, and removes them afterwards.
+    """
+    registry = MemoryRegistry({(HKEY_CURRENT_USER, KEY): {"Existing": (0, REG_DWORD)}})
+    attributes = MemoryAttributeBackend()
+    services = SimulatedServiceController({"Svc": SimulatedService("demand", "stopped")})
+    set_default_registry(registry)
+    set_attribute_backend(attributes)
+    set_default_controller(services)
+    yield registry, attributes, services
+    set_default_registry(None)
+    set_attribute_backend(None)
+    set_default_controller(None)
+
+
+def test_journal_commits_records_as_json_lines(tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    set_journal(UndoJournal(journal_path, "run-1"))
+    record_registry_values("HKCU", KEY, ["Value"], {"Value": (b"\x01", REG_BINARY)})
+    set_journal(None)
+
+    records = list(read_journal(journal_path))
+    assert records == [{"run": "run-1", "kind": "registry", "hive": "HKCU", "key": KEY, "name": "Value",
+                        "previous": [{"hex": "01"}, REG_BINARY]}]
+
+
+def test_read_journal_ignores_a_truncated_last_line(tmp_path):
+    journal_path = tmp_path / "journal.jsonl"
+    journal_path.write_text(json.dumps({"run": "run-1", "kind": "directory", "path": "a"}) + "\n{\"run\": \"ru")
+    assert [record["path"] for record in read_journal(str(journal_path))] == ["a"]
+
+
+def test_merge_worker_journals_appends_complete_lines_and_removes_the_parts(tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    with open(journal_path, "w") as file:
+        file.write(json.dumps({"run": "run-1", "kind": "directory", "path": "main"}) + "\n")
+    for pid, path in ((1, "first"), (2, "second")):
+        with open(worker_journal_path(journal_path, pid), "w") as file:
+            file.write(json.dumps({"run": "run-1", "kind": "directory", "path": path}) + "\n{\"partial")
+
+    assert merge_worker_journals(journal_path) == 2
+    assert [record["path"] for record in read_journal(journal_path)] == ["main", "first", "second"]
+    assert sorted(os.listdir(tmp_path)) == ["journal.jsonl"]
+
+
+def test_select_runs_skips_runs_already_rolled_back():
+    records = [{"run": "a", "kind": "directory"}, {"run": "b", "kind": "directory"}, {"run": "c", "kind": "directory"},
+               {"run": "r", "kind": "rollback", "target": "c"}]
+    assert select_runs(records, "last") == ["b"]
+    assert select_runs(records, "all") == ["a", "b"]
+    assert select_runs(records, "a") == ["a"]
+    assert select_runs(records, "c") == []
+
+
+def test_collect_undo_keeps_the_state_before_the_first_change():
+    records = [
+        {"run": "a", "kind": "registry", "hive": "HKCU", "key": KEY, "name": "Value", "previous": None},
+        {"run": "b", "kind": "registry", "hive": "HKCU", "key": KEY, "name": "Value", "previous": [1, REG_DWORD]},
+        {"run": "a", "kind": "startup_type", "name": "Svc", "previous": "demand"},
+        {"run": "b", "kind": "startup_type", "name": "Svc", "previous": "auto"},
+        {"run": "a", "kind": "directory", "path": "outer"},
+        {"run": "b", "kind": "directory", "path": "inner"},
+        {"run": "b", "kind": "defender", "property": "ExclusionPath", "value": "C:\\Games"},
+    ]
+    plan = collect_undo(records, ["a", "b"])
+    assert plan.registry == {("HKCU", KEY): {"Value": None}}
+    assert plan.startup_types == {"Svc": "demand"}
+    assert plan.directories == ["inner", "outer"]
+    assert plan.defender == {"ExclusionPath": ["C:\\Games"]}
+
+
+def test_rollback_restores_every_backend(tmp_path, backends):
+    registry, attributes, services = backends
+    journal_path = str(tmp_path / "journal.jsonl")
+    folder = str(tmp_path / "created" / "nested")
+    set_journal(UndoJournal(journal_path))
+
+    apply_registry_tweaks([{"hive": "HKCU", "key": KEY, "name": "Existing", "type": "DWORD", "value": 1},
+                           {"hive": "HKCU", "key": KEY, "name": "Added", "type": "DWORD", "value": 2}], True)
+    create_folders([folder], True)
+    hide_folders([folder], True)
+    modify_windows_services([{"name": "Svc", "startupType": "Automatic", "serviceStatus": "start"}], True)
+    set_journal(None)
+
+    assert registry.keys[(HKEY_CURRENT_USER, KEY.lower())] == {"Existing": (1, REG_DWORD), "Added": (2, REG_DWORD)}
+    assert attributes.get_attributes(folder) & FILE_ATTRIBUTE_HIDDEN
+    assert (services.services["Svc"].startup_type, services.services["Svc"].status) == ("auto", "running")
+
+    assert rollback(journal_path)
+    assert registry.keys[(HKEY_CURRENT_USER, KEY.lower())] == {"Existing": (0, REG_DWORD)}
+    assert not os.path.exists(folder)
+    assert not os.path.exists(os.path.dirname(folder))
+    assert (services.services["Svc"].startup_type, services.services["Svc"].status) == ("demand", "stopped")
+    assert not rollback(journal_path)
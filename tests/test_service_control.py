@@ -0,0 +1,200 @@
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from service_control import (ScServiceController, ServiceControlError, parse_sc_fields, parse_startup_type,
+                             parse_status)
+from service_control_native import SERVICE_ACCESS, SERVICE_READ_ACCESS, NativeServiceController, SimulatedScmApi
+from set_services import get_default_controller, set_default_controller
+
+import pytest
+
+QC_OUTPUT = """[SC] QueryServiceConfig SUCCESS
+
+SERVICE_NAME: wuauserv
+        TYPE               : 20  WIN32_SHARE_PROCESS
+        START_TYPE         : 2   AUTO_START  (DELAYED)
+        ERROR_CONTROL      : 1   NORMAL
+        BINARY_PATH_NAME   : C:\\WINDOWS\\system32\\svchost.exe -k netsvcs -p
+        LOAD_ORDER_GROUP   :
+        TAG                : 0
+        DISPLAY_NAME       : Windows Update
+        DEPENDENCIES       : rpcss
+                           : tcpip
+        SERVICE_START_NAME : LocalSystem
+"""
+QUERY_OUTPUT = """
+SERVICE_NAME: Spooler
+DISPLAY_NAME: Print Spooler
+        TYPE               : 110  WIN32_OWN_PROCESS  (interactive)
+        STATE              : 4  RUNNING
+                                (STOPPABLE, NOT_PAUSABLE, ACCEPTS_SHUTDOWN)
+        WIN32_EXIT_CODE    : 0  (0x0)
+        SERVICE_EXIT_CODE  : 0  (0x0)
+        CHECKPOINT         : 0x0
+        WAIT_HINT          : 0x0
+
+SERVICE_NAME: wuauserv
+DISPLAY_NAME: Windows Update
+        TYPE               : 20  WIN32_SHARE_PROCESS
+        STATE              : 1  STOPPED
+        WIN32_EXIT_CODE    : 0  (0x0)
+"""
+
+
+class FakeSc:
+    """
+    Answers 'sc' calls from canned outputs keyed by the argument list, counting every call.
+    """
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.calls = []
+
+    def __call__(self, args):
+        self.calls.append(args)
+        output = self.outputs.get(tuple(args))
+        if output is None:
+            raise subprocess.CalledProcessError(1060, ["sc"] + args, "The specified service does not exist.")
+        return output
+
+
+@pytest.mark.parametrize("start_type, expected", [
+    ("2   AUTO_START  (DELAYED)", "delayed-auto"),
+    ("2   AUTO_START", "auto"),
+    ("3   DEMAND_START", "demand"),
+    ("4   DISABLED", "disabled"),
+    ("", "unknown"),
+])
+def test_parse_startup_type(start_type, expected):
+    assert parse_startup_type(start_type) == expected
+
+
+def test_parse_sc_fields_keeps_continuation_lines():
+    record, = parse_sc_fields(QC_OUTPUT)
+    assert record["START_TYPE"] == ["2   AUTO_START  (DELAYED)"]
+    assert record["DEPENDENCIES"] == ["rpcss", "tcpip"]
+    assert record["BINARY_PATH_NAME"] == ["C:\\WINDOWS\\system32\\svchost.exe -k netsvcs -p"]
+    assert "LOAD_ORDER_GROUP" not in record
+
+
+def test_parse_status_reads_the_accepted_controls():
+    spooler, wuauserv = parse_sc_fields(QUERY_OUTPUT)
+    assert parse_status(spooler["STATE"]) == ("running", {"STOPPABLE", "NOT_PAUSABLE", "ACCEPTS_SHUTDOWN"})
+    assert parse_status(wuauserv["STATE"]) == ("stopped", frozenset())
+    assert parse_status([]) == ("unknown", frozenset())
+
+
+def test_sc_controller_caches_snapshots_until_a_change():
+    sc = FakeSc({("qc", "wuauserv"): QC_OUTPUT, ("query", "wuauserv"): QUERY_OUTPUT.split("\n\n")[1],
+                 ("config", "wuauserv", "start=", "demand"): "", ("start", "wuauserv"): ""})
+    controller = ScServiceController(sc)
+
+    assert controller.query_startup_type("wuauserv") == "delayed-auto"
+    assert controller.query_dependencies("wuauserv") == ["rpcss", "tcpip"]
+    assert controller.query_status("wuauserv") == "stopped"
+    assert not controller.is_pausable("wuauserv")
+    assert [args[0] for args in sc.calls] == ["qc", "query"]
+
+    controller.set_startup_type("wuauserv", "demand")
+    controller.query_status("wuauserv")
+    controller.control("wuauserv", "start")
+    controller.query_startup_type("wuauserv")
+    assert [args[0] for args in sc.calls] == ["qc", "query", "config", "start", "qc"]
+
+
+def test_sc_controller_reports_failures():
+    controller = ScServiceController(FakeSc({}))
+    assert controller.query_startup_type("missing") == "unknown"
+    assert controller.query_status("missing") == "unknown"
+    with pytest.raises(ServiceControlError):
+        controller.set_startup_type("missing", "auto")
+    with pytest.raises(ServiceControlError):
+        controller.control("missing", "stop")
+
+
+def test_sc_controller_loads_every_status_in_one_call():
+    sc = FakeSc({("query", "type=", "service", "state=", "all", "bufsize=", "262144"): QUERY_OUTPUT})
+    controller = ScServiceController(sc)
+    assert controller.list_services() == ["Spooler", "wuauserv"]
+    assert controller.query_status("SPOOLER") == "running"
+    assert controller.query_status("wuauserv") == "stopped"
+    assert len(sc.calls) == 1
+
+
+@pytest.fixture
+def scm():
+    return SimulatedScmApi({
+        "Spooler": {"start_type": 2, "state": 4, "pausable": True, "dependencies": ["RPCSS", "+Network"]},
+        "wuauserv": {"start_type": 2, "delayed": True},
+        "Fax": {"start_type": 4},
+    })
+
+
+def test_native_controller_queries_services(scm):
+    controller = NativeServiceController(scm)
+    assert [controller.query_startup_type(name) for name in ("Spooler", "wuauserv", "Fax", "Missing")] == [
+        "auto", "delayed-auto", "disabled", "unknown"]
+    assert controller.query_dependencies("Spooler") == ["RPCSS"]
+    assert (controller.query_status("spooler"), controller.is_pausable("Spooler")) == ("running", True)
+    assert (controller.query_status("wuauserv"), controller.is_pausable("wuauserv")) == ("stopped", False)
+    assert controller.query_status("Missing") == "unknown"
+    controller.close()
+
+
+def test_native_controller_changes_services(scm):
+    controller = NativeServiceController(scm)
+    controller.set_startup_type("Spooler", "delayed-auto")
+    assert controller.query_startup_type("Spooler") == "delayed-auto"
+    controller.set_startup_type("Spooler", "auto")
+    assert controller.query_startup_type("Spooler") == "auto"
+    with pytest.raises(ServiceControlError):
+        controller.set_startup_type("Spooler", "boot")
+
+    controller.control("Spooler", "stop")
+    assert controller.query_status("Spooler") == "stopped"
+    controller.control("wuauserv", "start")
+    assert controller.query_status("wuauserv") == "running"
+    with pytest.raises(ServiceControlError, match="disabled"):
+        controller.control("Fax", "start")
+    controller.close()
+
+
+def test_native_controller_pools_service_handles(scm):
+    controller = NativeServiceController(scm)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda index: controller.query_startup_type(["Spooler", "wuauserv"][index % 2]), range(32)))
+    controller.query_status("Spooler")
+    # The manager and one handle per service stay open, however many threads raced to open them.
+    assert scm.open_handles == 3
+    assert scm.calls["OpenSCManager"] == 1
+
+    controller.close()
+    assert scm.open_handles == 0
+    closes = scm.calls["CloseServiceHandle"]
+    controller.close()
+    assert scm.calls["CloseServiceHandle"] == closes
+
+
+def test_native_controller_preloads_statuses_in_one_call(scm):
+    controller = NativeServiceController(scm)
+    controller.preload(["Spooler", "wuauserv"])
+    statuses = [controller.query_status(name) for name in ("Spooler", "wuauserv", "Fax")]
+    assert statuses == ["running", "stopped", "stopped"]
+    assert scm.calls["EnumServicesStatusEx"] == 1
+    assert "QueryServiceStatusEx" not in scm.calls
+    controller.close()
+
+
+def test_native_controller_opens_read_only_handles(scm):
+    for read_only, access in ((False, SERVICE_ACCESS), (True, SERVICE_READ_ACCESS)):
+        controller = NativeServiceController(scm, read_only=read_only)
+        assert controller.access == access
+        controller.close()
+
+
+def test_replacing_the_default_controller_closes_it(scm):
+    set_default_controller(NativeServiceController(scm))
+    get_default_controller().query_status("Spooler")
+    assert scm.open_handles == 2
+    set_default_controller(None)
+    assert scm.open_handles == 0
@@ -0,0 +1,53 @@
+from registry_backend import HKEY_CURRENT_USER, HKEY_USERS, REG_SZ, MemoryRegistry
+from set_locales import KEY_PATH, SETTING_CHANGE_AREA, compute_locale_changes, modify_locale, plan_step
+
+CURRENT = {"sShortDate": ("M/d/yyyy", REG_SZ), "sTimeFormat": ("h:mm:ss tt", REG_SZ), "iFirstDayOfWeek": ("6", REG_SZ)}
+SETTINGS = {
+    "sShortDate": {"enabled": True, "value": "yyyy-MM-dd"},
+    "sTimeFormat": {"enabled": True, "value": "h:mm:ss tt"},
+    "iFirstDayOfWeek": {"enabled": False, "value": "0"},
+    "sMissing": {"enabled": True, "value": "x"},
+}
+
+
+def test_only_enabled_existing_and_differing_settings_change():
+    assert compute_locale_changes(SETTINGS, CURRENT) == {"sShortDate": ("yyyy-MM-dd", REG_SZ)}
+
+
+def test_changes_are_written_in_one_batch_and_broadcast_once():
+    registry = MemoryRegistry({(HKEY_CURRENT_USER, KEY_PATH): CURRENT})
+    settings = dict(SETTINGS, iFirstDayOfWeek={"enabled": True, "value": "0"})
+
+    assert modify_locale(settings, True, registry) == {"sShortDate": ("yyyy-MM-dd", REG_SZ),
+                                                       "iFirstDayOfWeek": ("0", REG_SZ)}
+    assert (registry.opens, registry.writes) == (2, 2)
+    assert registry.broadcasts == [SETTING_CHANGE_AREA]
+    assert registry.read_values(HKEY_CURRENT_USER, KEY_PATH)["iFirstDayOfWeek"] == ("0", REG_SZ)
+
+    registry.opens = 0
+    assert modify_locale(settings, True, registry) == {}
+    assert registry.opens == 1
+    assert registry.broadcasts == [SETTING_CHANGE_AREA]
+
+
+def test_another_users_hive_is_not_broadcast():
+    key_path = f"S-1-5-21-1000\\{KEY_PATH}"
+    registry = MemoryRegistry({(HKEY_USERS, key_path): CURRENT})
+    assert modify_locale(SETTINGS, True, registry, HKEY_USERS, key_path) == {"sShortDate": ("yyyy-MM-dd", REG_SZ)}
+    assert registry.broadcasts == []
+
+
+def test_failures_and_disabled_sections():
+    registry = MemoryRegistry()
+    assert modify_locale(SETTINGS, True, registry) is None
+    registry.opens = 0
+    assert modify_locale(SETTINGS, False, registry) == {}
+    assert registry.opens == 0
+
+
+def test_plan_step_reports_the_current_and_desired_values():
+    registry = MemoryRegistry({(HKEY_CURRENT_USER, KEY_PATH): CURRENT})
+    changes = plan_step({"enabled": True, "formatOptions": SETTINGS}, registry)
+    assert [(change.item, change.current, change.desired) for change in changes] == [
+        ("sShortDate", "M/d/yyyy", "yyyy-MM-dd")]
+    assert registry.writes == 0
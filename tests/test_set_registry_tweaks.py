@@ -0,0 +1,128 @@
+import pytest
+
+from checkpoint import Checkpoint, set_checkpoint
+from registry_backend import (HKEY_CURRENT_USER, HKEY_LOCAL_MACHINE, REG_BINARY, REG_DWORD, REG_MULTI_SZ, REG_QWORD,
+                              REG_SZ, MemoryRegistry)
+from set_registry_tweaks import apply_registry_tweaks, convert_value, group_tweaks, parse_tweak, plan_step
+from undo_journal import UndoJournal, read_journal, set_journal
+
+KEY = r"Software\Example"
+
+
+def tweak(name, value, type_name="DWORD", hive="HKCU", key=KEY, **extra):
+    return {"hive": hive, "key": key, "name": name, "type": type_name, "value": value, **extra}
+
+
+@pytest.mark.parametrize("value_type, value, expected", [
+    (REG_DWORD, 1, 1),
+    (REG_QWORD, 2 ** 40, 2 ** 40),
+    (REG_MULTI_SZ, ["a", "b"], ["a", "b"]),
+    (REG_BINARY, "01 a0 ff", b"\x01\xa0\xff"),
+    (REG_BINARY, [1, 160, 255], b"\x01\xa0\xff"),
+    (REG_SZ, "text", "text"),
+])
+def test_convert_value(value_type, value, expected):
+    assert convert_value(value_type, value) == expected
+
+
+@pytest.mark.parametrize("value_type, value", [
+    (REG_DWORD, True),
+    (REG_DWORD, -1),
+    (REG_DWORD, 2 ** 32),
+    (REG_DWORD, "1"),
+    (REG_MULTI_SZ, "a"),
+    (REG_BINARY, [256]),
+    (REG_SZ, 1),
+])
+def test_convert_value_rejects_mismatched_values(value_type, value):
+    with pytest.raises(ValueError):
+        convert_value(value_type, value)
+
+
+def test_parse_tweak_accepts_long_hive_names_and_reg_prefixes():
+    key, name, value = parse_tweak(tweak("Flag", 1, "REG_DWORD", hive="hkey_local_machine", key="\\" + KEY + "\\"))
+    assert key == (HKEY_LOCAL_MACHINE, KEY)
+    assert name == "Flag"
+    assert value == (1, REG_DWORD)
+
+
+@pytest.mark.parametrize("entry", [
+    tweak("Flag", 1, hive="HKCR"),
+    tweak("Flag", 1, "WORD"),
+    tweak("Flag", 1, key="\\"),
+    {"hive": "HKCU", "key": KEY, "type": "DWORD", "value": 1},
+])
+def test_parse_tweak_rejects_invalid_entries(entry):
+    with pytest.raises(ValueError):
+        parse_tweak(entry)
+
+
+def test_group_tweaks_groups_by_key_case_insensitively():
+    groups = group_tweaks([
+        tweak("B", 1, hive="HKLM"),
+        tweak("A", 1),
+        tweak("A", 2, key=KEY.upper()),
+        tweak("C", "x", "SZ"),
+    ])
+    assert list(groups) == [(HKEY_CURRENT_USER, KEY), (HKEY_LOCAL_MACHINE, KEY)]
+    assert groups[(HKEY_CURRENT_USER, KEY)] == {"A": (2, REG_DWORD), "C": ("x", REG_SZ)}
+
+
+def test_group_tweaks_merges_value_names_case_insensitively():
+    groups = group_tweaks([tweak("HideFileExt", 1), tweak("hidefileext", 0)])
+    assert groups == {(HKEY_CURRENT_USER, KEY): {"hidefileext": (0, REG_DWORD)}}
+
+
+def test_group_tweaks_skips_disabled_and_invalid_tweaks():
+    groups = group_tweaks([tweak("Off", 1, enabled=False), tweak("Bad", "1"), tweak("On", 1)])
+    assert groups == {(HKEY_CURRENT_USER, KEY): {"On": (1, REG_DWORD)}}
+
+
+def test_apply_registry_tweaks_writes_only_differing_values():
+    registry = MemoryRegistry({(HKEY_CURRENT_USER, KEY): {"Same": (1, REG_DWORD), "Other": ("x", REG_SZ)}})
+    apply_registry_tweaks([tweak("Same", 1), tweak("Changed", 2), tweak("Other", "y", "SZ")], True, registry)
+    assert registry.keys[(HKEY_CURRENT_USER, KEY.lower())] == {
+        "Same": (1, REG_DWORD), "Changed": (2, REG_DWORD), "Other": ("y", REG_SZ)}
+    assert registry.writes == 2
+    assert registry.opens == 2
+
+
+def test_apply_registry_tweaks_creates_missing_keys_and_skips_converged_ones():
+    registry = MemoryRegistry()
+    apply_registry_tweaks([tweak("Flag", 1, hive="HKLM")], True, registry)
+    assert registry.keys[(HKEY_LOCAL_MACHINE, KEY.lower())] == {"Flag": (1, REG_DWORD)}
+
+    registry.writes = 0
+    apply_registry_tweaks([tweak("Flag", 1, hive="HKLM")], True, registry)
+    assert registry.writes == 0
+
+
+def test_apply_registry_tweaks_does_nothing_when_disabled():
+    registry = MemoryRegistry()
+    apply_registry_tweaks([tweak("Flag", 1)], False, registry)
+    assert registry.keys == {}
+    assert registry.opens == 0
+
+
+def test_apply_registry_tweaks_matches_value_names_case_insensitively(tmp_path):
+    registry = MemoryRegistry({(HKEY_CURRENT_USER, KEY): {"HideFileExt": (1, REG_DWORD)}})
+    journal_path = str(tmp_path / "journal.jsonl")
+    set_journal(UndoJournal(journal_path))
+
+    assert [change.current for change in plan_step({"tweaks": [tweak("hidefileext", 0)]}, registry)] == [1]
+    apply_registry_tweaks([tweak("hidefileext", 0)], True, registry)
+    set_journal(None)
+    assert registry.keys[(HKEY_CURRENT_USER, KEY.lower())] == {"HideFileExt": (0, REG_DWORD)}
+    assert [(record["name"], record["previous"]) for record in read_journal(journal_path)] == [
+        ("HideFileExt", [1, REG_DWORD])]
+
+    registry.writes = 0
+    apply_registry_tweaks([tweak("hidefileext", 0)], True, registry)
+    assert registry.writes == 0
+
+
+def test_apply_registry_tweaks_records_values_whose_names_contain_backslashes(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"), "hash")
+    set_checkpoint(checkpoint)
+    apply_registry_tweaks([tweak("Path\\Name", "x", "SZ")], True, MemoryRegistry())
+    assert list(checkpoint.observed("set_registry_tweaks").values()) == ["x"]
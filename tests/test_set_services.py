@@ -0,0 +1,81 @@
+import logging
+import time
+
+from service_control import SimulatedService, SimulatedServiceController
+from set_services import modify_windows_services, order_state_changes, wait_for_service_status
+
+
+def chain(status):
+    """
+    Returns a controller with three services depending on each other, App -> Middle -> Base, and an unrelated one.
+    """
+    return SimulatedServiceController({
+        "Base": SimulatedService(status=status),
+        "Middle": SimulatedService(status=status, dependencies=["Base"]),
+        "App": SimulatedService(status=status, dependencies=["Middle"]),
+        "Other": SimulatedService(status=status),
+    })
+
+
+def test_starts_follow_their_dependencies():
+    waves = order_state_changes({"App": "start", "Middle": "start", "Base": "start", "Other": "start"},
+                                chain("stopped"))
+    assert waves == [["Base", "Other"], ["Middle"], ["App"]]
+
+
+def test_stops_precede_their_dependencies():
+    waves = order_state_changes({"Base": "stop", "Middle": "stop", "App": "stop", "Other": "stop"}, chain("running"))
+    assert waves == [["App", "Other"], ["Middle"], ["Base"]]
+
+
+def test_dependencies_are_matched_case_insensitively():
+    controller = SimulatedServiceController({"Base": SimulatedService(),
+                                             "App": SimulatedService(dependencies=["BASE"])})
+    assert order_state_changes({"App": "start", "Base": "start"}, controller) == [["Base"], ["App"]]
+
+
+def test_opposite_changes_are_not_ordered():
+    assert order_state_changes({"App": "stop", "Middle": "start"}, chain("stopped")) == [["App", "Middle"]]
+
+
+def test_circular_dependencies_are_changed_last(caplog):
+    controller = SimulatedServiceController({
+        "A": SimulatedService(dependencies=["B"]),
+        "B": SimulatedService(dependencies=["A"]),
+        "C": SimulatedService(),
+        "D": SimulatedService(dependencies=["C"]),
+    })
+    with caplog.at_level(logging.ERROR):
+        waves = order_state_changes({"A": "start", "B": "start", "C": "start", "D": "start"}, controller)
+    assert waves == [["C"], ["D"], ["A", "B"]]
+    assert "Circular dependency detected between the services A, B" in caplog.text
+
+
+def test_wait_is_woken_by_status_changes():
+    controller = SimulatedServiceController({"Svc": SimulatedService()}, start_latency=0.1)
+    controller.control("Svc", "start")
+    started = time.monotonic()
+    assert wait_for_service_status("Svc", "running", timeout=10, controller=controller, initial_delay=5, max_delay=5)
+    assert time.monotonic() - started < 2
+
+
+def test_wait_gives_up_after_the_timeout():
+    controller = SimulatedServiceController({"Svc": SimulatedService()})
+    started = time.monotonic()
+    assert not wait_for_service_status("Svc", "running", timeout=0.2, controller=controller, initial_delay=0.01)
+    assert 0.2 <= time.monotonic() - started < 2
+    assert controller.calls["query_status"] > 2
+
+
+def test_modify_windows_services_applies_dependent_changes_in_order():
+    controller = chain("stopped")
+    controller.start_latency = 0.02
+    modify_windows_services([{"name": name, "startupType": "Automatic", "serviceStatus": "Start"}
+                             for name in ("App", "Middle", "Base", "Other")], True, controller)
+    assert {name: (service.startup_type, service.status) for name, service in controller.services.items()} == {
+        name: ("auto", "running") for name in ("Base", "Middle", "App", "Other")}
+
+    modify_windows_services([{"name": name, "startupType": "Manual", "serviceStatus": "stop"}
+                             for name in ("Base", "Middle", "App")], True, controller)
+    assert [controller.services[name].status for name in ("Base", "Middle", "App", "Other")] == [
+        "stopped", "stopped", "stopped", "running"]
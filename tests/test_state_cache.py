@@ -0,0 +1,83 @@
+import json
+
+from setup_runner import STEPS, skip_converged
+from state_cache import STATE_VERSION, StateCache, fingerprint
+
+CREATE_FOLDERS = next(step for step in STEPS if step.name == "create_folders")
+
+
+class Clock:
+    """
+    A manually advanced time source.
+    """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_records_expire_after_the_ttl():
+    clock = Clock()
+    cache = StateCache("unused.json", ttl=60, clock=clock)
+    cache.record("step", "item", {"value": 1}, "observed", "v1")
+
+    clock.now += 59
+    assert cache.is_converged("step", "item", {"value": 1}, "v1")
+    clock.now += 1
+    assert not cache.is_converged("step", "item", {"value": 1}, "v1")
+
+
+def test_changed_item_or_validator_invalidates_the_record():
+    cache = StateCache("unused.json", clock=Clock())
+    cache.record("step", "item", {"value": 1}, "observed", "v1")
+
+    assert cache.is_converged("step", "item", {"value": 1}, "v1")
+    assert not cache.is_converged("step", "item", {"value": 2}, "v1")
+    assert not cache.is_converged("step", "item", {"value": 1}, "v2")
+    assert not cache.is_converged("step", "other", {"value": 1}, "v1")
+
+    cache.forget("step", "item")
+    assert not cache.is_converged("step", "item", {"value": 1}, "v1")
+
+
+def test_save_and_load_round_trip_and_ignore_other_versions(tmp_path):
+    file_path = str(tmp_path / "state.json")
+    cache = StateCache(file_path, clock=Clock())
+    cache.record("step", "item", [1, 2], {"observed": True}, None)
+    cache.save()
+
+    loaded = StateCache(file_path, clock=Clock())
+    loaded.load()
+    assert loaded.entries == {"step": {"item": {"fingerprint": fingerprint([1, 2]), "observed": {"observed": True},
+                                                "validator": None, "recorded": 1000.0}}}
+    assert loaded.is_converged("step", "item", [1, 2], None)
+
+    (tmp_path / "state.json").write_text(json.dumps({"version": STATE_VERSION + 1, "steps": loaded.entries}))
+    outdated = StateCache(file_path)
+    outdated.load()
+    assert outdated.entries == {}
+
+    (tmp_path / "state.json").write_text("{not json")
+    unreadable = StateCache(file_path)
+    unreadable.load()
+    assert unreadable.entries == {}
+
+
+def test_skip_converged_uses_the_directory_validator(tmp_path):
+    present, absent = str(tmp_path / "present"), str(tmp_path / "absent")
+    (tmp_path / "present").mkdir()
+    config_data = {"createFolders": {"enabled": True, "paths": [present, absent]}}
+    validator = CREATE_FOLDERS.load("state_validator")
+    cache = StateCache("unused.json", clock=Clock())
+    cache.record("create_folders", present, present, "directory", validator(present))
+    cache.record("create_folders", absent, absent, "directory", "recorded while it existed")
+
+    plan, restricted = skip_converged([CREATE_FOLDERS], config_data, cache)
+
+    assert plan == [CREATE_FOLDERS]
+    assert restricted["createFolders"]["paths"] == [absent]
+
+    cache.record("create_folders", absent, absent, "directory", validator(absent))
+    assert skip_converged([CREATE_FOLDERS], config_data, cache)[0] == []
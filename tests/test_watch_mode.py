@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+
+from setup_runner import STEPS
+from watch_mode import ConfigWatcher, changed_items, incremental_plan
+
+CREATE_FOLDERS, HIDE_FOLDERS = (next(step for step in STEPS if step.name == name)
+                                for name in ("create_folders", "hide_folders"))
+
+
+def test_a_burst_of_writes_is_reported_once_after_the_debounce(tmp_path):
+    file_path = tmp_path / "config.json"
+    file_path.write_text("{}")
+    watcher = ConfigWatcher(str(file_path), poll_interval=0.01, debounce=0.2)
+    last_write = []
+
+    def write_in_steps() -> None:
+        for content in ("{", '{"a"', '{"a": 1}'):
+            file_path.write_text(content)
+            last_write.append(time.monotonic())
+            time.sleep(0.05)
+
+    writer = threading.Thread(target=write_in_steps)
+    writer.start()
+    assert watcher.wait_for_change(5, threading.Event())
+    writer.join()
+
+    assert time.monotonic() - last_write[-1] >= 0.2
+    assert not watcher.wait_for_change(0.3, threading.Event())
+
+
+def test_a_change_that_is_reverted_before_it_settles_is_not_reported(tmp_path):
+    file_path = tmp_path / "config.json"
+    file_path.write_text("{}")
+    original = os.stat(file_path).st_mtime_ns
+    watcher = ConfigWatcher(str(file_path), poll_interval=0.01, debounce=0.2)
+
+    def edit_and_revert() -> None:
+        time.sleep(0.05)
+        file_path.write_text("[]")
+        time.sleep(0.05)
+        file_path.write_text("{}")
+        os.utime(file_path, ns=(original, original))
+
+    editor = threading.Thread(target=edit_and_revert)
+    editor.start()
+    assert not watcher.wait_for_change(0.5, threading.Event())
+    editor.join()
+
+
+def test_stop_ends_the_wait(tmp_path):
+    file_path = tmp_path / "config.json"
+    file_path.write_text("{}")
+    stop = threading.Event()
+    stop.set()
+    assert not ConfigWatcher(str(file_path), poll_interval=0.01).wait_for_change(5, stop)
+
+
+def test_changed_items_reports_added_and_changed_items_only():
+    previous = {"enabled": True, "paths": ["a", "b", "c"]}
+    assert changed_items("createFolders", previous, {"enabled": True, "paths": ["a", "c", "d"]}) == {"d"}
+    assert changed_items("createFolders", previous, dict(previous)) == set()
+
+    tweaks = {"enabled": True, "tweaks": [{"hive": "HKCU", "key": "K", "name": "A", "type": "REG_DWORD", "value": 1}]}
+    changed = {"enabled": True, "tweaks": [dict(tweaks["tweaks"][0], value=2)]}
+    assert changed_items("registryTweaks", tweaks, changed) == {"HKCU\\K\\A"}
+
+
+def test_changed_items_applies_everything_after_section_wide_changes():
+    previous = {"enabled": False, "paths": ["a"]}
+    assert changed_items("createFolders", None, previous) is None
+    assert changed_items("createFolders", previous, {"enabled": True, "paths": ["a"]}) is None
+
+
+def test_incremental_plan_restricts_steps_to_their_changes():
+    previous_config = {"createFolders": {"enabled": True, "paths": ["a"]},
+                       "hideFolders": {"enabled": True, "paths": ["a"]}}
+    config_data = {"createFolders": {"enabled": True, "paths": ["a", "b"]},
+                   "hideFolders": {"enabled": True, "paths": ["a"]}}
+
+    plan, restricted = incremental_plan([CREATE_FOLDERS, HIDE_FOLDERS], previous_config, [CREATE_FOLDERS, HIDE_FOLDERS],
+                                        config_data)
+    assert plan == [CREATE_FOLDERS]
+    assert restricted["createFolders"]["paths"] == ["b"]
+
+    plan, restricted = incremental_plan([CREATE_FOLDERS, HIDE_FOLDERS], previous_config, [CREATE_FOLDERS], config_data)
+    assert plan == [CREATE_FOLDERS, HIDE_FOLDERS]
+    assert restricted["hideFolders"]["paths"] == ["a"]
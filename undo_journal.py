@@ -0,0 +1,261 @@
+import glob
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from config_service import logging
+
+JOURNAL_FILE = ".setup_journal.jsonl"
+# Buffered records are written and synced at the latest when this many are pending.
+BATCH_SIZE = 256
+
+
+def encode_value(value: Any) -> Any:
+    """
+    Makes a registry value JSON-serializable; binary data is stored as a hex string tagged with 'hex'.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return {"hex": bytes(value).hex()}
+    return value
+
+
+def decode_value(value: Any) -> Any:
+    """
+    Reverses `encode_value`.
+    """
+    if isinstance(value, dict) and set(value) == {"hex"}:
+        return bytes.fromhex(value["hex"])
+    return value
+
+
+def new_run_id() -> str:
+    """
+    Returns a new run identifier derived from the time and process id.
+    """
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+
+
+class UndoJournal:
+    """
+    An append-only journal of the state every mutation replaced, one compact JSON object per line, so a run can be
+    rolled back later without probing anything. Records are buffered in memory and written together by `commit`,
+    which flushes and fsyncs the file once for the whole batch. Mutations that can only be undone from their record
+    commit it before they write; when several threads commit at the same time, one fsync covers all their records.
+    Created folders and changed folder attributes are committed once per group of folders, so a crash can at worst
+    leave a few of them out of the journal.
+
+    Parameters:
+    - file_path (str): The journal file, created on first use.
+    - run_id (Optional[str]): The identifier stored with every record of this run, by default derived from the time
+      and process id.
+    """
+
+    def __init__(self, file_path: str = JOURNAL_FILE, run_id: Optional[str] = None) -> None:
+        self.file_path = file_path
+        self.run_id = run_id or new_run_id()
+        self._pending: List[str] = []
+        self._recorded = 0
+        self._committed = 0
+        self._file = None
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+
+    def record(self, kind: str, **fields: Any) -> None:
+        """
+        Buffers one record. See `rollback.py` for the fields each kind of record carries.
+
+        Parameters:
+        - kind (str): The kind of change, e.g. 'registry', 'startup_type', 'status', 'attributes', 'directory',
+          'defender' or 'defender_removed'.
+        - fields (Any): The identity of the changed item and the state it had before the change.
+        """
+        line = json.dumps({"run": self.run_id, "kind": kind, **fields}, separators=(",", ":"))
+        with self._lock:
+            self._pending.append(line)
+            self._recorded += 1
+            full = len(self._pending) >= BATCH_SIZE
+        if full:
+            self.commit()
+
+    def commit(self) -> None:
+        """
+        Writes every buffered record and makes it durable with a single fsync. Returns immediately if the records of
+        the calling thread were already committed by another thread.
+        """
+        with self._lock:
+            target = self._recorded
+        with self._commit_lock:
+            if self._committed >= target:
+                return
+            with self._lock:
+                lines, self._pending = self._pending, []
+                recorded = self._recorded
+            if self._file is None:
+                self._file = open(self.file_path, "a", encoding="utf-8")
+            self._file.write("".join(line + "\n" for line in lines))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._committed = recorded
+
+    def close(self) -> None:
+        """
+        Commits the remaining records and closes the file.
+        """
+        self.commit()
+        with self._commit_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class _NullJournal:
+    """
+    The journal in effect while journaling is disabled; records are discarded.
+    """
+    file_path = None
+
+    def record(self, kind: str, **fields: Any) -> None:
+        pass
+
+    def commit(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+_NULL_JOURNAL = _NullJournal()
+_journal = _NULL_JOURNAL
+
+
+def get_journal():
+    """
+    Returns the journal the mutating functions record into: the one passed to `set_journal`, or a journal that discards
+    every record.
+    """
+    return _journal
+
+
+def set_journal(journal: Optional[UndoJournal]) -> None:
+    """
+    Replaces the active journal, closing the previous one.
+
+    Parameters:
+    - journal (Optional[UndoJournal]): The new journal, or None to stop journaling.
+    """
+    global _journal
+    previous, _journal = _journal, journal or _NULL_JOURNAL
+    if previous is not _journal:
+        previous.close()
+
+
+def record_registry_values(hive: str, key_path: str, names: Iterable[str], current_values: Dict[str, Any]) -> None:
+    """
+    Records and commits the values a registry write is about to replace; a value missing from `current_values` is
+    recorded with no previous value, so rolling back deletes it.
+
+    Parameters:
+    - hive (str): The hive of the key.
+    - key_path (str): The key path.
+    - names (Iterable[str]): The names of the values about to be written.
+    - current_values (Dict[str, Any]): The values currently stored under the key, as (value, type) pairs.
+    """
+    journal = get_journal()
+    for name in names:
+        previous = current_values.get(name)
+        journal.record("registry", hive=hive, key=key_path, name=name,
+                       previous=None if previous is None else [encode_value(previous[0]), previous[1]])
+    journal.commit()
+
+
+def worker_journal_path(file_path: str, pid: Optional[int] = None) -> str:
+    """
+    Returns the journal file of one worker process. Appending to a shared file is not atomic across processes on
+    Windows, so every worker process of a run writes its own file, and `merge_worker_journals` appends them to the
+    main journal afterwards.
+
+    Parameters:
+    - file_path (str): The main journal file.
+    - pid (Optional[int]): The process id of the worker, by default the current process.
+    """
+    return f"{file_path}.worker-{os.getpid() if pid is None else pid}"
+
+
+def merge_worker_journals(file_path: str) -> int:
+    """
+    Appends the records of every worker journal of `file_path` to it with a single fsync and removes the worker
+    journals. Worker journals left behind by an interrupted run are merged by the next call, so their records are not
+    lost; a truncated last line is dropped like `read_journal` would ignore it.
+
+    Parameters:
+    - file_path (str): The main journal file.
+
+    Returns:
+    - int: The number of worker journals merged.
+    """
+    parts = sorted(glob.glob(glob.escape(file_path) + ".worker-*"))
+    if not parts:
+        return 0
+    with open(file_path, "a", encoding="utf-8") as target:
+        for part in parts:
+            with open(part, "r", encoding="utf-8") as source:
+                content = source.read()
+            target.write(content[:content.rfind("\n") + 1])
+        target.flush()
+        os.fsync(target.fileno())
+    for part in parts:
+        os.remove(part)
+    return len(parts)
+
+
+def read_journal(file_path: str = JOURNAL_FILE) -> Iterator[Dict[str, Any]]:
+    """
+    Reads the records of a journal file in the order they were written. A truncated last line, left behind by a crash
+    during a write, is logged and ignored.
+
+    Parameters:
+    - file_path (str): The journal file.
+
+    Returns:
+    - Iterator[Dict[str, Any]]: The records.
+
+    Raises:
+    - OSError: If the file cannot be read.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.warning(f"Ignoring the unreadable line {number} of the journal '{file_path}'.")
+
+
+def read_active_records(file_path: Optional[str], kinds: Set[str]) -> List[Dict[str, Any]]:
+    """
+    Reads the records of the given kinds that belong to runs which were not rolled back, oldest first. A missing
+    journal has no records.
+
+    Parameters:
+    - file_path (Optional[str]): The journal file, or None if journaling is disabled.
+    - kinds (Set[str]): The kinds of records to return, e.g. {'attributes'}.
+
+    Returns:
+    - List[Dict[str, Any]]: The records.
+
+    Raises:
+    - OSError: If the file exists but cannot be read.
+    """
+    if not file_path or not os.path.exists(file_path):
+        return []
+    records = []
+    rolled_back = set()
+    for record in read_journal(file_path):
+        if record.get("kind") == "rollback":
+            rolled_back.add(record.get("target"))
+        elif record.get("kind") in kinds:
+            records.append(record)
+    return [record for record in records if record.get("run") not in rolled_back]
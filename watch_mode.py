@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from change_plan import SECTION_ITEMS, restrict_section, section_items
+from command_runner import get_runner
+from config_service import logging
+from state_cache import fingerprint
+
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_DEBOUNCE = 1.0
+DEFAULT_DRIFT_INTERVAL = 15 * 60
+# The tools whose memoized results each step reads, keyed by step name.
+STEP_TOOLS = {"set_services": ("sc",), "add_defender_exclusions": ("powershell",)}
+
+FileStamp = Optional[Tuple[int, int]]
+# Applies a list of steps to a configuration; supplied by the setup runner.
+StepApplier = Callable[[List[Any], Dict[str, Any]], None]
+# Reads and validates the configuration file and selects its steps, returning None if it is invalid.
+ConfigLoader = Callable[[], Optional[Tuple[List[Any], Dict[str, Any]]]]
+
+
+def file_stamp(file_path: str) -> FileStamp:
+    """
+    Returns the modification time and size of a file, or None if it cannot be read.
+    """
+    try:
+        result = os.stat(file_path)
+    except OSError:
+        return None
+    return result.st_mtime_ns, result.st_size
+
+
+class ConfigWatcher:
+    """
+    Detects changes to a file by polling its modification time and size, which works on every platform and file
+    system. A change is reported once the file has stayed unchanged for the debounce period, so an editor or a copy
+    that writes the file in several steps triggers a single reload.
+
+    Parameters:
+    - file_path (str): The file to watch.
+    - poll_interval (float): Seconds between two polls.
+    - debounce (float): Seconds the file must stay unchanged before a change is reported.
+    """
+
+    def __init__(self, file_path: str, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 debounce: float = DEFAULT_DEBOUNCE) -> None:
+        self.file_path = file_path
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._stamp = file_stamp(file_path)
+
+    def wait_for_change(self, timeout: float, stop: threading.Event) -> bool:
+        """
+        Polls the file until it has changed and settled, the timeout expires or `stop` is set.
+
+        Returns:
+        - bool: True if the file changed, False on timeout or stop.
+        """
+        deadline = time.monotonic() + timeout
+        pending: FileStamp = self._stamp
+        settled_at: Optional[float] = None
+        while not stop.is_set():
+            stamp = file_stamp(self.file_path)
+            now = time.monotonic()
+            if stamp != pending:
+                pending, settled_at = stamp, now + self.debounce
+            if settled_at is not None and now >= settled_at:
+                settled_at = None
+                if pending != self._stamp:
+                    self._stamp = pending
+                    return True
+            if settled_at is None and now >= deadline:
+                return False
+            stop.wait(min(self.poll_interval, self.debounce) if settled_at is not None else self.poll_interval)
+        return False
+
+
+def changed_items(section_name: str, previous: Optional[Dict[str, Any]],
+                  current: Dict[str, Any]) -> Optional[Set[str]]:
+    """
+    Compares two versions of a configuration section at the item level.
+
+    Parameters:
+    - section_name (str): The name of the section, e.g. 'createFolders'.
+    - previous (Optional[Dict[str, Any]]): The section as last applied, or None if it was not applied.
+    - current (Dict[str, Any]): The new section.
+
+    Returns:
+    - Optional[Set[str]]: The identifiers of the added or changed items, or None if every item must be applied
+      because the section was not applied before or one of its section-wide settings changed.
+    """
+    key = SECTION_ITEMS[section_name]
+    if previous is None or ({name: value for name, value in previous.items() if name != key}
+                            != {name: value for name, value in current.items() if name != key}):
+        return None
+    before = {item: fingerprint(value) for item, value in section_items(section_name, previous).items()}
+    return {item for item, value in section_items(section_name, current).items()
+            if before.get(item) != fingerprint(value)}
+
+
+def incremental_plan(plan: List[Any], previous_config: Dict[str, Any], previous_plan: List[Any],
+                     config_data: Dict[str, Any]) -> Tuple[List[Any], Dict[str, Any]]:
+    """
+    Restricts the steps of a new configuration to the items that were added or changed since the previous one.
+    Removed items are left as they are.
+
+    Parameters:
+    - plan (List[Any]): The steps selected for the new configuration.
+    - previous_config (Dict[str, Any]): The configuration applied last.
+    - previous_plan (List[Any]): The steps applied last.
+    - config_data (Dict[str, Any]): The new configuration.
+
+    Returns:
+    - Tuple[List[Any], Dict[str, Any]]: The steps with changes and a configuration with the restricted sections.
+    """
+    applied = {step.name for step in previous_plan}
+    restricted_plan = []
+    restricted_config = dict(config_data)
+    for step in plan:
+        previous = previous_config.get(step.section) if step.name in applied else None
+        items = changed_items(step.section, previous, config_data[step.section])
+        if items is None:
+            restricted_plan.append(step)
+            continue
+        if not items:
+            continue
+        logging.info(f"Step '{step.name}': {len(items)} added or changed item(s).")
+        restricted_config[step.section] = restrict_section(step.section, config_data[step.section], items)
+        restricted_plan.append(step)
+    return restricted_plan, restricted_config
+
+
+def refresh_backends(plan: List[Any], config_data: Dict[str, Any]) -> None:
+    """
+    Drops the results memoized for the given steps and items, so the next probe sees changes made outside this process,
+    while keeping the backends themselves (the PowerShell session, the Service Control Manager connection, the
+    registry backend) open. Results of other tools, such as the Defender snapshot when only services changed, stay
+    memoized.
+
+    Parameters:
+    - plan (List[Any]): The steps about to be probed or applied.
+    - config_data (Dict[str, Any]): The configuration they run with, possibly restricted to some items.
+    """
+    cache = get_runner().cache
+    for step in plan:
+        for tool in STEP_TOOLS.get(step.name, ()):
+            cache.invalidate(tool)
+    if any(step.name == "set_services" for step in plan):
+        from set_services import get_default_controller
+        controller = get_default_controller()
+        for service in config_data["servicesSettings"]["services"]:
+            controller.invalidate(service.get("name"))
+
+
+def watch(config_path: str, load: ConfigLoader, apply: StepApplier,
+          collect: Callable[[List[Any], Dict[str, Any]], List[Any]],
+          restrict: Callable[[List[Any], Dict[str, Any], List[Any]], Tuple[List[Any], Dict[str, Any]]],
+          poll_interval: float = DEFAULT_POLL_INTERVAL, debounce: float = DEFAULT_DEBOUNCE,
+          drift_interval: float = DEFAULT_DRIFT_INTERVAL, stop: Optional[threading.Event] = None) -> None:
+    """
+    Applies the configuration once, then keeps running: whenever the configuration file changes, it is parsed and
+    validated, compared with the previous version item by item, and only the added or changed items are applied. An
+    invalid file is reported and ignored until it is fixed. Every `drift_interval` seconds the current configuration is
+    probed and the items that drifted from their desired state are applied again. The backends stay open between
+    cycles; a drift check drops every memoized result of the planned steps, a configuration change only those of the
+    steps with added or changed items.
+
+    Parameters:
+    - config_path (str): The configuration file.
+    - load (ConfigLoader): Reads and validates the configuration file and selects its steps.
+    - apply (StepApplier): Applies steps to a configuration.
+    - collect (Callable): Probes steps and returns their pending changes.
+    - restrict (Callable): Restricts steps and configuration to a list of pending changes.
+    - poll_interval (float): Seconds between two polls of the configuration file.
+    - debounce (float): Seconds the file must stay unchanged before it is reloaded.
+    - drift_interval (float): Seconds between two drift checks; 0 disables them.
+    - stop (Optional[threading.Event]): Set to end the loop, e.g. from another thread.
+    """
+    stop = stop or threading.Event()
+    watcher = ConfigWatcher(config_path, poll_interval, debounce)
+    loaded = load()
+    if loaded is None:
+        logging.error("The configuration is invalid. Waiting for a valid configuration...")
+        plan, config_data = [], {}
+    else:
+        plan, config_data = loaded
+        apply(plan, config_data)
+
+    next_drift_check = time.monotonic() + drift_interval
+    logging.info(f"Watching '{config_path}' for changes...")
+    try:
+        while not stop.is_set():
+            timeout = max(0.0, next_drift_check - time.monotonic()) if drift_interval > 0 else poll_interval
+            if watcher.wait_for_change(timeout, stop):
+                logging.info(f"Configuration file '{config_path}' changed. Reloading...")
+                loaded = load()
+                if loaded is None:
+                    logging.error("The changed configuration is invalid. Keeping the previous one.")
+                    continue
+                new_plan, new_config = loaded
+                changed_plan, changed_config = incremental_plan(new_plan, config_data, plan, new_config)
+                if changed_plan:
+                    refresh_backends(changed_plan, changed_config)
+                    apply(changed_plan, changed_config)
+                else:
+                    logging.info("No added or changed items.")
+                config_data, plan = new_config, new_plan
+            elif drift_interval > 0 and time.monotonic() >= next_drift_check and not stop.is_set():
+                logging.info("Checking for drift...")
+                refresh_backends(plan, config_data)
+                changes = collect(plan, config_data)
+                if changes:
+                    logging.info(f"{len(changes)} item(s) drifted from the configuration. Applying...")
+                    apply(*restrict(plan, config_data, changes))
+                next_drift_check = time.monotonic() + drift_interval
+    except KeyboardInterrupt:
+        pass
+    logging.info("Stopped watching.")